@@ -3,13 +3,14 @@
 #  Copyright (c) 2019. All rights reserved.
 
 import logging
+import weakref
 from enum import Enum
 from typing import Union, Dict
 
 import numpy as np
 
-from openspectra.utils import LogHelper, OpenSpectraDataTypes, OpenSpectraProperties, Logger
-from openspectra.openspectra_file import LinearImageStretch, ValueStretch, PercentageStretch
+from openspectra.utils import LogHelper, OpenSpectraDataTypes, OpenSpectraProperties, Logger, MemoryAccountant
+from openspectra.openspectra_file import LinearImageStretch, ValueStretch, PercentageStretch, BandSummary
 
 
 class Band(Enum):
@@ -71,22 +72,34 @@ class BandImageAdjuster(ImageAdjuster):
     __LOG:Logger = LogHelper.logger("BandImageAdjuster")
 
     def __init__(self, band:np.ndarray, data_ignore_value:Union[int, float]=None,
-            default_stretch:LinearImageStretch=None):
+            default_stretch:LinearImageStretch=None, summary:BandSummary=None, overview:np.ndarray=None,
+            owner:str=None):
+        """If a summary of the band is supplied percentage stretches are taken from its
+        histogram instead of from the band's data.  If a reduced resolution overview of the band
+        is supplied and OverviewStretch in openspectra.properties is True they're estimated from
+        the overview instead.  The adjusted data is made when it's first used, it's counted by
+        the MemoryAccountant under owner and may be released and rebuilt when next used.  It's
+        released on the thread that owns the images when the accountant has a dispatcher"""
 
         self.__band = band
         self.__data_ignore_vale = data_ignore_value
+        self.__summary = summary
+        self.__overview = overview if OpenSpectraProperties.get_property("OverviewStretch", False) else None
+        self.__owner = owner if owner is not None else "unknown"
+        self.__accounting_key:int = None
+
         self.__type = self.__band.dtype
         self.__image_data = None
         self.__low_cutoff = 0
         self.__high_cutoff = 0
 
-        # Do the initial stretch
+        # Do the initial stretch, it's applied when the adjusted data is first used
         self.__default_stretch = default_stretch
         self.__do_default_stretch()
-        self.adjust()
 
         BandImageAdjuster.__LOG.debug("type: {0}", self.__type)
-        BandImageAdjuster.__LOG.debug("min: {0}, max: {1}", self.__band.min(), self.__band.max())
+        if BandImageAdjuster.__LOG.isEnabledFor(logging.DEBUG):
+            BandImageAdjuster.__LOG.debug("min: {0}, max: {1}", self.__band.min(), self.__band.max())
 
     def __do_default_stretch(self):
         if self.__default_stretch is not None:
@@ -107,7 +120,16 @@ class BandImageAdjuster(ImageAdjuster):
         self.__updated = True
 
     def adjusted_data(self) -> np.ndarray:
-        return self.__image_data
+        image_data = self.__image_data
+        if image_data is None or self.__updated:
+            # not made yet or released by the MemoryAccountant, rebuild it
+            self.__updated = True
+            self.__adjust()
+            image_data = self.__image_data
+        else:
+            MemoryAccountant().touch(self.__accounting_key)
+
+        return image_data
 
     def reset_stretch(self, band:Band=None):
         """band is ignore here if passed"""
@@ -115,8 +137,11 @@ class BandImageAdjuster(ImageAdjuster):
 
     def adjust_by_percentage(self, lower:Union[int, float], upper:Union[int, float], band:Band=None):
         """band is ignore here if passed"""
-        if self.__type in OpenSpectraDataTypes.Ints:
-            self.__low_cutoff, self.__high_cutoff = np.percentile(self.__band, (lower, upper))
+        if self.__summary is not None and self.__summary.valid_count() > 0:
+            self.__low_cutoff, self.__high_cutoff = self.__summary.percentile((lower, upper))
+            self.__updated = True
+        elif self.__type in OpenSpectraDataTypes.Ints:
+            self.__low_cutoff, self.__high_cutoff = np.percentile(self.__stretch_data(), (lower, upper))
             self.__updated = True
         elif self.__type in OpenSpectraDataTypes.Floats:
             self.__calculate_float_cutoffs(lower, upper)
@@ -149,6 +174,9 @@ class BandImageAdjuster(ImageAdjuster):
         self.__updated = True
 
     def adjust(self):
+        self.__adjust()
+
+    def __adjust(self):
         if self.__updated:
             BandImageAdjuster.__LOG.debug("low cutoff: {0}, high cutoff: {1}, data ignore value: {2}",
                 self.low_cutoff(), self.high_cutoff(), self.__data_ignore_vale)
@@ -186,6 +214,7 @@ class BandImageAdjuster(ImageAdjuster):
 
             self.__image_data = masked_band.astype("uint8")
             self.__updated = False
+            self.__account()
 
     def is_updated(self, band:Band=None) -> bool:
         """Returns true if the image parameters have been updated but adjust()
@@ -194,25 +223,50 @@ class BandImageAdjuster(ImageAdjuster):
 
     def __calculate_float_cutoffs(self, lower:Union[int, float], upper:Union[int, float]):
         nbins = OpenSpectraProperties.get_property("FloatBins", 512)
-        min = self.__band.min()
-        max = self.__band.max()
+        data = self.__stretch_data()
+        min = data.min()
+        max = data.max()
 
         # scale to generate histogram data
-        hist_scaled = np.floor((self.__band - min)/(max - min) * (nbins - 1))
+        hist_scaled = np.floor((data - min)/(max - min) * (nbins - 1))
         scaled_low_cut, scaled_high_cut = np.percentile(hist_scaled, (lower, upper))
 
         self.__low_cutoff = (scaled_low_cut / (nbins - 1) * (max - min)) + min
         self.__high_cutoff = (scaled_high_cut / (nbins - 1) * (max - min)) + min
 
+    def __stretch_data(self) -> np.ndarray:
+        return self.__overview if self.__overview is not None else self.__band
+
+    def __account(self):
+        accountant = MemoryAccountant()
+        if self.__accounting_key is not None and accountant.is_registered(self.__accounting_key):
+            accountant.resize(self.__accounting_key, self.__image_data.nbytes)
+        else:
+            adjuster = weakref.ref(self)
+            self.__accounting_key = accountant.register(self.__owner, "adjusted image",
+                self.__image_data.nbytes, lambda: BandImageAdjuster.__release(adjuster), self, True)
+
+    @staticmethod
+    def __release(adjuster:"weakref.ref"):
+        adjuster = adjuster()
+        if adjuster is not None:
+            adjuster.__image_data = None
+
 
 class RGBImageAdjuster(ImageAdjuster):
 
     def __init__(self, red: np.ndarray, green: np.ndarray, blue: np.ndarray,
             red_default_stretch:LinearImageStretch=None, green_default_stretch:LinearImageStretch=None,
-            blue_default_stretch:LinearImageStretch=None, data_ignore_value:Union[int, float]=None):
-        self.__adjusted_bands = {Band.RED: BandImageAdjuster(red, data_ignore_value, red_default_stretch),
-                                 Band.GREEN: BandImageAdjuster(green, data_ignore_value, green_default_stretch),
-                                 Band.BLUE: BandImageAdjuster(blue, data_ignore_value, blue_default_stretch)}
+            blue_default_stretch:LinearImageStretch=None, data_ignore_value:Union[int, float]=None,
+            red_summary:BandSummary=None, green_summary:BandSummary=None, blue_summary:BandSummary=None,
+            red_overview:np.ndarray=None, green_overview:np.ndarray=None, blue_overview:np.ndarray=None,
+            owner:str=None):
+        self.__adjusted_bands = {Band.RED: BandImageAdjuster(red, data_ignore_value, red_default_stretch,
+                                     red_summary, red_overview, owner),
+                                 Band.GREEN: BandImageAdjuster(green, data_ignore_value, green_default_stretch,
+                                     green_summary, green_overview, owner),
+                                 Band.BLUE: BandImageAdjuster(blue, data_ignore_value, blue_default_stretch,
+                                     blue_summary, blue_overview, owner)}
 
     def _adjusted_data(self, band:Band) -> np.ndarray:
         return self.__adjusted_bands[band].adjusted_data()
@@ -305,7 +359,7 @@ class BandDescriptor:
 
     def __init__(self, file_name:str, band_name:str, wavelength_label:str,
             bad_band:bool=False, data_ignore_value:Union[int, float]=None,
-            default_stretch:LinearImageStretch=None):
+            default_stretch:LinearImageStretch=None, summary:BandSummary=None):
         self.__file_name = file_name
         self.__band_name = band_name
         self.__wavelength_label = wavelength_label
@@ -315,6 +369,7 @@ class BandDescriptor:
         self.__is_bad = bad_band
         self.__data_ignore_value = data_ignore_value
         self.__default_stretch = default_stretch
+        self.__summary = summary
 
     def file_name(self) -> str:
         return self.__file_name
@@ -340,6 +395,10 @@ class BandDescriptor:
     def default_stretch(self) -> LinearImageStretch:
         return self.__default_stretch
 
+    def summary(self) -> BandSummary:
+        """Returns the band's statistics from the file's BandStatisticsFile or None"""
+        return self.__summary
+
 
 class Image(ImageAdjuster):
 
@@ -361,24 +420,35 @@ class Image(ImageAdjuster):
     def descriptor(self) -> BandDescriptor:
         pass
 
+    def overview(self) -> "Image":
+        """Returns a reduced resolution copy of this image with the same stretch
+        for displaying it scaled down or None if it doesn't have one"""
+        pass
+
 
 class GreyscaleImage(Image, BandImageAdjuster):
     """An 8-bit 8-bit grayscale image"""
 
-    def __init__(self, band:np.ndarray, band_descriptor:BandDescriptor):
-        super().__init__(band, band_descriptor.data_ignore_value(), band_descriptor.default_stretch())
+    def __init__(self, band:np.ndarray, band_descriptor:BandDescriptor, overview:np.ndarray=None):
+        """overview is an optional reduced resolution copy of band, see OpenSpectraFile.overview_image.
+        The full resolution image is only stretched when image_data is called"""
+        super().__init__(band, band_descriptor.data_ignore_value(), band_descriptor.default_stretch(),
+            band_descriptor.summary(), overview, band_descriptor.file_name())
         self.__band = band
         self.__band_descriptor = band_descriptor
+        self.__overview = overview
 
     def adjusted_data(self) -> np.ndarray:
         """Do not call this method, it's an unfortunate consequence of needing
         it to be public on BandImageAdjuster for use by RGBImageAdjuster"""
         raise NotImplementedError("Do not call GreyscaleImage.adjusted_data(), use GreyscaleImage.image_data() instead")
 
+    def adjust(self):
+        """The new stretch is applied the next time image_data is called"""
+        pass
+
     def image_data(self, band:Band=None) -> np.ndarray:
         """band is ignored here if passed"""
-        if self.is_updated():
-            self.adjust()
         return super().adjusted_data()
 
     # Warning returns view of the original data
@@ -387,10 +457,10 @@ class GreyscaleImage(Image, BandImageAdjuster):
         return self.__band
 
     def image_shape(self) -> (int, int):
-        return self.image_data().shape
+        return self.__band.shape
 
     def bytes_per_line(self) -> int:
-        return self.image_data().shape[1]
+        return self.__band.shape[1]
 
     def label(self, band:Band=None) -> str:
         """band is ignored here if passed"""
@@ -399,6 +469,14 @@ class GreyscaleImage(Image, BandImageAdjuster):
     def descriptor(self) -> BandDescriptor:
         return self.__band_descriptor
 
+    def overview(self) -> "GreyscaleImage":
+        if self.__overview is None:
+            return None
+
+        image = GreyscaleImage(self.__overview, self.__band_descriptor)
+        image.adjust_by_value(self.low_cutoff(), self.high_cutoff())
+        return image
+
 
 # this is definately not thread safe
 class RGBImage(Image, RGBImageAdjuster):
@@ -411,12 +489,25 @@ class RGBImage(Image, RGBImageAdjuster):
     __GREEN_SHIFT = 256
 
     def __init__(self, red:np.ndarray, green:np.ndarray, blue:np.ndarray,
-            red_descriptor:BandDescriptor, green_descriptor:BandDescriptor, blue_descriptor:BandDescriptor):
+            red_descriptor:BandDescriptor, green_descriptor:BandDescriptor, blue_descriptor:BandDescriptor,
+            red_overview:np.ndarray=None, green_overview:np.ndarray=None, blue_overview:np.ndarray=None):
+        """The overviews are optional reduced resolution copies of the bands, all three are needed to use them"""
         if not ((red.size == green.size == blue.size) and
                 (red.shape == green.shape == blue.shape)):
             raise ValueError("All bands must have the same size and shape")
+
+        self.__overviews = None
+        if red_overview is not None and green_overview is not None and blue_overview is not None:
+            if not (red_overview.shape == green_overview.shape == blue_overview.shape):
+                raise ValueError("All overviews must have the same shape")
+            self.__overviews = {Band.RED: red_overview, Band.GREEN: green_overview, Band.BLUE: blue_overview}
+        else:
+            red_overview = green_overview = blue_overview = None
+
         super().__init__(red, green, blue, red_descriptor.default_stretch(), green_descriptor.default_stretch(),
-            blue_descriptor.default_stretch(), red_descriptor.data_ignore_value())
+            blue_descriptor.default_stretch(), red_descriptor.data_ignore_value(),
+            red_descriptor.summary(), green_descriptor.summary(), blue_descriptor.summary(),
+            red_overview, green_overview, blue_overview, red_descriptor.file_name())
 
         self.__descriptors = {Band.RED: red_descriptor,
                          Band.GREEN: green_descriptor,
@@ -432,27 +523,20 @@ class RGBImage(Image, RGBImageAdjuster):
         if self.__label is not None: self.__label = self.__label.strip()
 
         self.__bands = {Band.RED: red, Band.GREEN: green, Band.BLUE: blue}
-        self.__high_bytes = np.full(red.shape, RGBImage.__HIGH_BYTE, np.uint32)
-
-        self.__calculate_image()
+        self.__owner = red_descriptor.file_name()
+        self.__accounting_key:int = None
 
-        if RGBImage.__LOG.isEnabledFor(logging.DEBUG):
-            np.set_printoptions(8, formatter={'int_kind': '{:02x}'.format})
-            RGBImage.__LOG.debug("{0}", self.__image_data)
-            RGBImage.__LOG.debug("height: {0}", self.__image_data.shape[0])
-            RGBImage.__LOG.debug("width: {0}", self.__image_data.shape[1])
-            RGBImage.__LOG.debug("size: {0}", self.__image_data.size)
-            np.set_printoptions()
+        # the image is calculated when image_data is first called
+        self.__image_data:np.ndarray = None
 
     def adjust(self):
-        if super().is_updated():
-            super().adjust()
-            self.__calculate_image()
+        """The new stretch is applied the next time image_data is called"""
+        pass
 
     def image_data(self, band:Band=None) -> np.ndarray:
         """If band is None returns all three bands as a single image data set
         If band is supplied returns the adjusted image data for that band"""
-        if super().is_updated():
+        if self.__image_data is None or super().is_updated():
             super().adjust()
             self.__calculate_image()
 
@@ -468,10 +552,10 @@ class RGBImage(Image, RGBImageAdjuster):
         return self.__bands[band]
 
     def image_shape(self) -> (int, int):
-        return self.__image_data.shape
+        return self.__bands[Band.RED].shape
 
     def bytes_per_line(self) -> int:
-        return self.__image_data.shape[1] * 4
+        return self.__bands[Band.RED].shape[1] * 4
 
     def descriptor(self, band:Band=None) -> Union[BandDescriptor, Dict[Band, BandDescriptor]]:
         if band is None:
@@ -485,8 +569,43 @@ class RGBImage(Image, RGBImageAdjuster):
         else:
             return self.__labels[band]
 
+    def overview(self) -> "RGBImage":
+        if self.__overviews is None:
+            return None
+
+        image = RGBImage(self.__overviews[Band.RED], self.__overviews[Band.GREEN], self.__overviews[Band.BLUE],
+            self.__descriptors[Band.RED], self.__descriptors[Band.GREEN], self.__descriptors[Band.BLUE])
+        for band in (Band.RED, Band.GREEN, Band.BLUE):
+            image.adjust_by_value(self.low_cutoff(band), self.high_cutoff(band), band)
+        return image
+
     def __calculate_image(self):
-        self.__image_data = self.__high_bytes + \
+        # the alpha byte broadcasts rather than taking a full size array of its own
+        self.__image_data = np.uint32(RGBImage.__HIGH_BYTE) + \
                             self._adjusted_data(Band.RED).astype(np.uint32) * RGBImage.__RED_SHIFT + \
                             self._adjusted_data(Band.GREEN).astype(np.uint32) * RGBImage.__GREEN_SHIFT + \
                             self._adjusted_data(Band.BLUE).astype(np.uint32)
+        self.__account()
+
+        if RGBImage.__LOG.isEnabledFor(logging.DEBUG):
+            np.set_printoptions(8, formatter={'int_kind': '{:02x}'.format})
+            RGBImage.__LOG.debug("{0}", self.__image_data)
+            RGBImage.__LOG.debug("height: {0}", self.__image_data.shape[0])
+            RGBImage.__LOG.debug("width: {0}", self.__image_data.shape[1])
+            RGBImage.__LOG.debug("size: {0}", self.__image_data.size)
+            np.set_printoptions()
+
+    def __account(self):
+        accountant = MemoryAccountant()
+        if self.__accounting_key is not None and accountant.is_registered(self.__accounting_key):
+            accountant.resize(self.__accounting_key, self.__image_data.nbytes)
+        else:
+            image = weakref.ref(self)
+            self.__accounting_key = accountant.register(self.__owner, "image",
+                self.__image_data.nbytes, lambda: RGBImage.__release(image), self, True)
+
+    @staticmethod
+    def __release(image:"weakref.ref"):
+        image = image()
+        if image is not None:
+            image.__image_data = None
@@ -2,16 +2,22 @@
 #  Last modified 1/21/19 6:29 PM
 #  Copyright (c) 2019. All rights reserved.
 
+import math
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from io import TextIOBase
-from typing import Union, List, Tuple, Dict
+from typing import Union, List, Tuple, Dict, Callable
 
 import numpy as np
 from numpy import ma
 
 from openspectra.image import Image, GreyscaleImage, RGBImage, Band, BandDescriptor
 from openspectra.openspectra_file import OpenSpectraFile, OpenSpectraHeader, LinearImageStretch, \
-    MutableOpenSpectraHeader
-from openspectra.utils import OpenSpectraDataTypes, OpenSpectraProperties, Logger, LogHelper
+    MutableOpenSpectraHeader, AccessHint, OpenSpectraFileFactory, ShadowFile, ChunkedContainer, OpenSpectraHeaderError, \
+    BandStatisticsFile, BandSummary, OverviewFile, OpenSpectraFileWriter
+from openspectra.utils import OpenSpectraDataTypes, OpenSpectraProperties, Logger, LogHelper, MemoryAccountant
 
 
 class RegionOfInterest:
@@ -177,9 +183,12 @@ class HistogramPlotData(PlotData):
     def __init__(self, x_data:np.ndarray, y_data:np.ndarray, bins:int,
             x_label:str=None, y_label:str=None, title:str=None, color:str= "b",
             line_style:str= "-", legend:str=None,
-            lower_limit:Union[int, float]=None, upper_limit:Union[int, float]=None):
+            lower_limit:Union[int, float]=None, upper_limit:Union[int, float]=None, weights:np.ndarray=None):
+        """y_data is the data to count in bins, if weights is given each item in y_data
+        is counted weights times, used to plot a histogram that has already been counted"""
         super().__init__(x_data, y_data, x_label, y_label, title, color, line_style, legend)
         self.bins = bins
+        self.weights = weights
         self.__lower_limit = lower_limit
         self.__upper_limit = upper_limit
 
@@ -289,7 +298,9 @@ class OpenSpectraBandTools:
         return Bands(self.__clean_data(self.__file.bands(lines, samples)), self.__file.header().band_labels())
 
     def band_statistics(self, lines:Union[int, tuple, np.ndarray], samples:Union[int, tuple, np.ndarray]) -> BandStatistics:
-        return BandStatistics(self.__clean_data(self.__file.bands(lines, samples)))
+        band_stats = BandStatistics(self.__clean_data(self.__file.bands(lines, samples)))
+        MemoryAccountant().register(self.__file.name(), "band statistics", band_stats.bands().nbytes, holder=band_stats)
+        return band_stats
 
     def statistics_plot(self, lines:Union[int, tuple, np.ndarray], samples:Union[int, tuple, np.ndarray],
             title:str=None) -> BandStaticsPlotData:
@@ -313,9 +324,11 @@ class OpenSpectraBandTools:
         is_bad_band = bad_bands is not None and bad_bands[band_index]
         data_ignore_val = header.data_ignore_value()
         default_stretch: LinearImageStretch = header.default_stretch()
+        statistics = self.__file.statistics()
 
         return BandDescriptor(self.__file.name(), band_label[0], band_label[1],
-            is_bad_band, data_ignore_val, default_stretch)
+            is_bad_band, data_ignore_val, default_stretch,
+            statistics.band(band_index) if statistics is not None else None)
 
     def __clean_data(self, bands:np.ndarray) -> np.ndarray:
         result = bands
@@ -456,20 +469,159 @@ class OpenSpectraRegionTools:
 
 
 class OpenSpectraImageTools:
-    """A class for creating Images from OpenSpectra files.
+    """A class for creating Images from OpenSpectra files.  If fit_size, the (width, height)
+    images will be fitted to when displayed scaled down, is supplied images carry an overview
+    of their bands reduced to fill it when the bands are larger, see OpenSpectraFile.overview_image.
+    If the file doesn't have an overview file yet one is built in the background the first time
+    it's needed unless BuildOverviews in openspectra.properties is False.
     Note: all indexes are expected to be zero based."""
 
-    def __init__(self, file:OpenSpectraFile):
+    __LOG:Logger = LogHelper.logger("OpenSpectraImageTools")
+
+    def __init__(self, file:OpenSpectraFile, fit_size:Tuple[int, int]=None):
         self.__file = file
+        self.__fit_size = fit_size
+        self.__overview_builder:OverviewBuilder = None
+        self.__overview_lock = threading.Lock()
+
+        # greyscale images made ahead of time by prefetch_greyscale_image
+        self.__prefetched:Dict[int, GreyscaleImage] = dict()
+        self.__prefetch_lock = threading.Lock()
 
     def greyscale_image(self, band:int, band_descriptor:BandDescriptor) -> GreyscaleImage:
-        return GreyscaleImage(self.__file.raw_image(band), band_descriptor)
+        with self.__prefetch_lock:
+            image = self.__prefetched.pop(band, None)
+
+        if image is not None:
+            return image
+
+        return GreyscaleImage(self.__file.raw_image(band), band_descriptor, self.__overview(band))
+
+    def prefetch_greyscale_image(self, band:int, band_descriptor:BandDescriptor):
+        """Make the greyscale image for band now and hold it until greyscale_image asks
+        for it or it's discarded, see discard_prefetched"""
+        with self.__prefetch_lock:
+            if band in self.__prefetched:
+                return
+
+        image = GreyscaleImage(self.__file.raw_image(band), band_descriptor, self.__overview(band))
+        with self.__prefetch_lock:
+            self.__prefetched.setdefault(band, image)
+
+    def discard_prefetched(self, keep:List[int]=None):
+        """Drop the prefetched images for every band not in keep"""
+        keep = set() if keep is None else set(keep)
+        with self.__prefetch_lock:
+            for band in [band for band in self.__prefetched if band not in keep]:
+                del self.__prefetched[band]
+
+    def prefetched_bands(self) -> List[int]:
+        with self.__prefetch_lock:
+            return sorted(self.__prefetched.keys())
 
     def rgb_image(self, red:int, green:int, blue:int,
             red_descriptor:BandDescriptor, green_descriptor:BandDescriptor, blue_descriptor:BandDescriptor) -> RGBImage:
         # Access each band seperately so we get views of the data for efficiency
         return RGBImage(self.__file.raw_image(red), self.__file.raw_image(green),
-            self.__file.raw_image(blue), red_descriptor, green_descriptor, blue_descriptor)
+            self.__file.raw_image(blue), red_descriptor, green_descriptor, blue_descriptor,
+            self.__overview(red), self.__overview(green), self.__overview(blue))
+
+    def overview_builder(self) -> "OverviewBuilder":
+        """Returns the builder of the file's overviews if one was started or None"""
+        return self.__overview_builder
+
+    def __overview(self, band:int) -> np.ndarray:
+        if self.__fit_size is not None:
+            overview, factor = self.__file.overview_image(band, self.__fit_size[0], self.__fit_size[1])
+            if factor > 1:
+                if self.__file.overviews() is None:
+                    self.__build_overviews()
+                return overview
+
+        return None
+
+    def __build_overviews(self):
+        with self.__overview_lock:
+            if self.__overview_builder is not None or not OpenSpectraProperties.get_property("BuildOverviews", True):
+                return
+
+            # down to levels that fit the size images are fitted to
+            min_size = min(OpenSpectraProperties.get_property("OverviewMinSize", 256), min(self.__fit_size))
+            self.__overview_builder = OverviewBuilder(str(self.__file.path()), self.__file, min_size=min_size)
+
+        OpenSpectraImageTools.__LOG.info("Building overviews for {0} in the background", self.__file.name())
+        self.__overview_builder.start()
+
+
+class BandPrefetcher:
+    """Warms the bands either side of the one being looked at, nearest first, so stepping
+    through the bands doesn't wait on cold reads.  The raw data is always warmed, see
+    OpenSpectraFile.prefetch_band, when image_tools is supplied the greyscale images are
+    made ahead of time too, see OpenSpectraImageTools.prefetch_greyscale_image.  start is
+    called as the band changes and run does the work, usually on a worker thread, stopping
+    as soon as a later start or cancel makes it stale.  radius defaults to PrefetchBands
+    in openspectra.properties and is limited to what the file's cache can hold alongside
+    the band being looked at, see OpenSpectraFile.prefetch_limit"""
+
+    __LOG:Logger = LogHelper.logger("BandPrefetcher")
+
+    def __init__(self, file:OpenSpectraFile, image_tools:OpenSpectraImageTools=None, radius:int=None):
+        self.__file = file
+        self.__image_tools = image_tools
+        self.__band_tools = OpenSpectraBandTools(file) if image_tools is not None else None
+
+        self.__radius = radius
+        if self.__radius is None:
+            self.__radius = OpenSpectraProperties.get_property("PrefetchBands", 3)
+
+        self.__generation = 0
+        self.__lock = threading.Lock()
+
+    def bands_around(self, band:int) -> List[int]:
+        band_count = self.__file.header().band_count()
+        bands = list()
+        for distance in range(1, self.__radius + 1):
+            bands.extend(neighbour for neighbour in (band + distance, band - distance) if 0 <= neighbour < band_count)
+
+        return bands[:self.__file.prefetch_limit()]
+
+    def start(self, band:int) -> int:
+        """Make any prefetch that's running stale and return the generation to pass to run"""
+        with self.__lock:
+            self.__generation += 1
+            generation = self.__generation
+
+        if self.__image_tools is not None:
+            self.__image_tools.discard_prefetched(self.bands_around(band) + [band])
+
+        return generation
+
+    def cancel(self):
+        with self.__lock:
+            self.__generation += 1
+
+        if self.__image_tools is not None:
+            self.__image_tools.discard_prefetched()
+
+    def is_current(self, generation:int) -> bool:
+        with self.__lock:
+            return generation == self.__generation
+
+    def run(self, band:int, generation:int) -> List[int]:
+        """Warm the bands around band, returns the bands warmed before it was done or stale"""
+        warmed = list()
+        for neighbour in self.bands_around(band):
+            if not self.is_current(generation):
+                BandPrefetcher.__LOG.debug("Prefetch around band {0} of {1} is stale, stopping", band, self.__file.name())
+                break
+
+            self.__file.prefetch_band(neighbour)
+            if self.__image_tools is not None and self.is_current(generation):
+                self.__image_tools.prefetch_greyscale_image(neighbour, self.__band_tools.band_descriptor(neighbour))
+
+            warmed.append(neighbour)
+
+        return warmed
 
 
 class OpenSpectraHistogramTools:
@@ -492,14 +644,20 @@ class OpenSpectraHistogramTools:
         if self.__type == "rgb" and band is None:
             raise ValueError("band argument is required when image is RGB")
 
-        raw_data = self.__image.raw_data(band)
-        plot_data = OpenSpectraHistogramTools.__get_hist_data(raw_data)
+        descriptor = self.__image.descriptor(band) if self.__type == "rgb" else self.__image.descriptor()
+        if descriptor.summary() is not None and descriptor.summary().valid_count() > 0:
+            plot_data = OpenSpectraHistogramTools.__get_summary_hist_data(descriptor.summary())
+        else:
+            raw_data = self.__image.raw_data(band)
+            plot_data = OpenSpectraHistogramTools.__get_hist_data(raw_data)
+
         plot_data.x_label = "Magnitude"
         plot_data.y_label = "Count  "
         plot_data.title = "Raw " + self.__image.label(band)
         plot_data.color = "r"
         plot_data.set_lower_limit(self.__image.low_cutoff(band))
         plot_data.set_upper_limit(self.__image.high_cutoff(band))
+        self.__account(plot_data, descriptor)
         return plot_data
 
     def adjusted_histogram(self, band:Band=None) -> HistogramPlotData:
@@ -513,8 +671,23 @@ class OpenSpectraHistogramTools:
         plot_data.y_label = "Count"
         plot_data.title = "Adjusted " + self.__image.label(band)
         plot_data.color = "b"
+        self.__account(plot_data, self.__image.descriptor(band) if self.__type == "rgb" else self.__image.descriptor())
         return plot_data
 
+    @staticmethod
+    def __account(plot_data:HistogramPlotData, descriptor:BandDescriptor):
+        size = sum(np.asarray(data).nbytes for data in (plot_data.y_data, plot_data.weights) if data is not None)
+        MemoryAccountant().register(descriptor.file_name(), "histogram", size, holder=plot_data)
+
+    @staticmethod
+    def __get_summary_hist_data(summary:BandSummary) -> HistogramPlotData:
+        # plot the counted bins from the band's minimum to its maximum
+        counts, edges = summary.histogram()
+        used = np.flatnonzero(counts)
+        counts = counts[used[0]:used[-1] + 1]
+        edges = edges[used[0]:used[-1] + 2]
+        return HistogramPlotData((edges[0], edges[-1]), (edges[:-1] + edges[1:]) / 2, bins=edges, weights=counts)
+
     @staticmethod
     def __get_hist_data(data:np.ndarray) -> HistogramPlotData:
         type = data.dtype
@@ -613,6 +786,7 @@ class SubCubeTools:
 
         self.__sub_cube:np.ndarray = None
         self.__sub_cube_header:MutableOpenSpectraHeader = None
+        self.__is_streaming:bool = False
 
     def __validate(self):
         """treat a None value as include the full range"""
@@ -741,6 +915,9 @@ class SubCubeTools:
     def __create_header(self):
         self.__sub_cube_header = MutableOpenSpectraHeader(os_header=self.__source_header)
         self.__sub_cube_header.set_interleave(self.__interleave)
+
+        # the sub cube data is always in native byte order
+        self.__sub_cube_header.set_byte_order(OpenSpectraHeader.NATIVE_BYTE_ORDER)
         self.__sub_cube_header.set_lines(max(self.__lines) - min(self.__lines))
         self.__sub_cube_header.set_samples(max(self.__samples) - min(self.__samples))
 
@@ -754,11 +931,11 @@ class SubCubeTools:
         # update bands info
         new_band_names = self.__source_header.band_names()
         if new_band_names is not None:
-            new_band_names = new_band_names[band_slicer]
+            new_band_names = SubCubeTools.__select_bands(new_band_names, band_slicer)
         new_wavelengths = self.__source_header.wavelengths()[band_slicer]
         new_bad_bands = self.__source_header.bad_band_list()
         if new_bad_bands is not None:
-            new_bad_bands = new_bad_bands[band_slicer]
+            new_bad_bands = SubCubeTools.__select_bands(new_bad_bands, band_slicer)
 
         self.__sub_cube_header.set_bands(band_count, new_band_names, new_wavelengths, new_bad_bands)
 
@@ -767,7 +944,7 @@ class SubCubeTools:
         unsupported_props = self.__source_header.unsupported_props()
         for key, value in unsupported_props.items():
             if isinstance(value, list) and len(value) == self.__source_header.band_count():
-                new_prop_value = value[band_slicer]
+                new_prop_value = SubCubeTools.__select_bands(value, band_slicer)
                 unsupported_props[key] = new_prop_value
 
         self.__sub_cube_header.set_unsupported_props(unsupported_props)
@@ -798,11 +975,32 @@ class SubCubeTools:
             self.__sub_cube_header.set_x_reference(new_x_ref + 1, new_coords[0])
             self.__sub_cube_header.set_y_reference(new_y_ref + 1, new_coords[1])
 
-    def create_sub_cube(self):
+    @staticmethod
+    def __select_bands(values:Union[list, np.ndarray], band_slicer:Union[slice, List[int]]) -> Union[list, np.ndarray]:
+        # plain lists can't be indexed with a list of bands
+        if isinstance(band_slicer, list) and isinstance(values, list):
+            return [values[band] for band in band_slicer]
+
+        return values[band_slicer]
+
+    def create_sub_cube(self, streaming:bool=None):
+        """Create the sub cube in memory, or when streaming is True only its header so save
+        copies the data block by block from the source with bounded memory.  When streaming
+        is None sub cubes larger than SubCubeMemoryLimit in openspectra.properties are streamed"""
         # validate params
         self.__validate()
         SubCubeTools.__LOG.debug("create_sub_cube validation passed...")
 
+        if streaming is None:
+            streaming = self.__sub_cube_bytes() > OpenSpectraProperties.get_property("SubCubeMemoryLimit", 1073741824)
+
+        self.__is_streaming = streaming
+        if streaming:
+            self.__sub_cube = None
+            self.__create_header()
+            SubCubeTools.__LOG.debug("create_sub_cube header created for streaming: {0}", self.__sub_cube_header.dump())
+            return
+
         # slice out the sub cube
         self.__sub_cube = self.__source_file.cube(self.__lines, self.__samples, self.__bands)
         self.__sub_cube = self.__sub_cube.astype(self.__source_header.data_type())
@@ -816,20 +1014,175 @@ class SubCubeTools:
         self.__create_header()
         SubCubeTools.__LOG.debug("create_sub_cube header created: {0}", self.__sub_cube_header.dump())
 
-    def save(self, file_name:str):
+    def is_streaming(self) -> bool:
+        return self.__is_streaming
+
+    def sub_cube_header(self) -> MutableOpenSpectraHeader:
+        """The new sub cube's header once create_sub_cube has been called, otherwise None"""
+        return self.__sub_cube_header
+
+    def save(self, file_name:str, memory_limit:int=None):
+        """Write the sub cube to file_name and its header to file_name.hdr.  When the sub cube
+        has the source's interleave and byte order, is not from a compressed file and its
+        rows in the file are whole, the bytes are copied file to file without passing
+        through Python.  Otherwise it's written in contiguous blocks of at most memory_limit
+        bytes, which defaults to BlockMemoryLimit in openspectra.properties, or when streaming
+        read from the source and written in blocks of at most memory_limit bytes together,
+        which defaults to SubCubeBlockLimit"""
         SubCubeTools.__LOG.debug("save sub cube called for: {}", file_name)
-        if self.__sub_cube  is not None and self.__sub_cube_header is not None:
-            # write data file
-            flat_iterator = self.__sub_cube.flat
-            with open(file_name, "wb") as out_file:
-                for item in flat_iterator:
-                    out_file.write(item)
+        if self.__is_streaming and self.__sub_cube_header is not None:
+            if not self.__copy_raw(file_name):
+                self.__stream_blocks(file_name, memory_limit)
+            else:
+                self.__sub_cube_header.save(file_name)
 
-                out_file.flush()
+        elif self.__sub_cube  is not None and self.__sub_cube_header is not None:
+            # write data file
+            if not self.__copy_raw(file_name):
+                self.__write_blocks(file_name, memory_limit)
 
             # write header
             self.__sub_cube_header.save(file_name)
 
+    def __sub_cube_bytes(self) -> int:
+        band_count = len(self.__bands) if isinstance(self.__bands, list) else max(self.__bands) - min(self.__bands)
+        return (max(self.__lines) - min(self.__lines)) * (max(self.__samples) - min(self.__samples)) * \
+            band_count * np.dtype(self.__source_header.data_type()).itemsize
+
+    def __stream_blocks(self, file_name:str, memory_limit:int=None):
+        if memory_limit is None:
+            memory_limit = OpenSpectraProperties.get_property("SubCubeBlockLimit", 67108864)
+
+        bands = self.__bands if isinstance(self.__bands, list) else list(range(*self.__bands))
+        lines = (min(self.__lines), max(self.__lines))
+        samples = (min(self.__samples), max(self.__samples))
+        sample_count = samples[1] - samples[0]
+        item_size = np.dtype(self.__source_header.data_type()).itemsize
+
+        # the block read, its converted copy and the reordered copy written can all be held at once
+        block_limit = max(1, memory_limit // 3)
+        line_bytes = sample_count * len(bands) * item_size
+        if line_bytes <= block_limit:
+            block_lines = max(1, block_limit // max(1, line_bytes))
+            block_bands = len(bands)
+        else:
+            block_lines = 1
+            block_bands = max(1, block_limit // (sample_count * item_size))
+
+        SubCubeTools.__LOG.debug("Streaming sub cube of {0} to {1} in blocks of {2} lines and {3} bands",
+            self.__source_file.name(), file_name, block_lines, block_bands)
+
+        source_axes = OpenSpectraHeader.interleave_axes(self.__source_header.interleave())
+        axes = OpenSpectraHeader.interleave_axes(self.__interleave)
+        self.__source_file.advise(AccessHint.SEQUENTIAL)
+        try:
+            with OpenSpectraFileWriter(file_name, self.__sub_cube_header) as writer:
+                for line in range(lines[0], lines[1], block_lines):
+                    line_end = min(line + block_lines, lines[1])
+                    for band in range(0, len(bands), block_bands):
+                        band_end = min(band + block_bands, len(bands))
+                        block_bands_selected = bands[band:band_end]
+                        if block_bands_selected == list(range(block_bands_selected[0], block_bands_selected[-1] + 1)):
+                            source_bands = (block_bands_selected[0], block_bands_selected[-1] + 1)
+                        else:
+                            source_bands = block_bands_selected
+
+                        block = self.__source_file.cube((line, line_end), samples, source_bands)
+                        block = block.astype(self.__source_header.data_type(), copy=False)
+
+                        # put the block in (lines, samples, bands) order then the output order
+                        block = block.transpose(np.argsort(source_axes)).transpose(axes)
+                        writer.write_block((line - lines[0], line_end - lines[0]), (0, sample_count),
+                            (band, band_end), block)
+        finally:
+            self.__source_file.advise(AccessHint.NORMAL)
+
+    def __write_blocks(self, file_name:str, memory_limit:int=None):
+        if memory_limit is None:
+            memory_limit = OpenSpectraProperties.get_property("BlockMemoryLimit", 67108864)
+
+        # the sub cube is already in the output's axis order, write whole planes of
+        # the first axis at a time, or rows of a plane when one plane is too big
+        sub_cube = self.__sub_cube
+        row_bytes = max(1, sub_cube[0, 0].nbytes) if sub_cube.size > 0 else 1
+        plane_rows = sub_cube.shape[1]
+        with open(file_name, "wb") as out_file:
+            if sub_cube.size > 0 and row_bytes * plane_rows <= memory_limit:
+                block_planes = max(1, memory_limit // (row_bytes * plane_rows))
+                for plane in range(0, sub_cube.shape[0], block_planes):
+                    out_file.write(np.ascontiguousarray(sub_cube[plane:plane + block_planes]).data)
+            elif sub_cube.size > 0:
+                block_rows = max(1, memory_limit // row_bytes)
+                for plane in range(sub_cube.shape[0]):
+                    for row in range(0, plane_rows, block_rows):
+                        out_file.write(np.ascontiguousarray(sub_cube[plane, row:row + block_rows]).data)
+
+            out_file.flush()
+
+    def __copy_raw(self, file_name:str) -> bool:
+        """Copy the sub cube's bytes straight from the source file when possible, returns
+        False if it isn't or the platform can't copy between files in which case nothing
+        useful has been written"""
+        raw_path = self.__source_file.raw_path()
+        bands = self.__bands
+        if isinstance(bands, list):
+            if bands != list(range(bands[0], bands[0] + len(bands))):
+                return False
+            bands = (bands[0], bands[0] + len(bands))
+
+        if raw_path is None or self.__interleave != self.__source_header.interleave() or \
+                self.__source_header.byte_order() != OpenSpectraHeader.NATIVE_BYTE_ORDER or \
+                (not hasattr(os, "copy_file_range") and not hasattr(os, "sendfile")):
+            return False
+
+        # each range in the file's axis order, only copy when the innermost axis is whole
+        # so every run of bytes is at least a full row
+        axes = OpenSpectraHeader.interleave_axes(self.__interleave)
+        source_dimensions = (self.__source_header.lines(), self.__source_header.samples(),
+            self.__source_header.band_count())
+        dimensions = tuple(source_dimensions[axis] for axis in axes)
+        ranges = tuple((self.__lines, self.__samples, bands)[axis] for axis in axes)
+        if ranges[2] != (0, dimensions[2]) or any(start >= end for start, end in ranges):
+            return False
+
+        item_size = np.dtype(self.__source_header.data_type()).itemsize
+        row_bytes = dimensions[2] * item_size
+        plane_bytes = dimensions[1] * row_bytes
+        start = self.__source_header.header_offset() + ranges[0][0] * plane_bytes + ranges[1][0] * row_bytes
+        run_bytes = (ranges[1][1] - ranges[1][0]) * row_bytes
+        if ranges[1] == (0, dimensions[1]):
+            # whole planes are one run
+            runs = [(start, (ranges[0][1] - ranges[0][0]) * plane_bytes)]
+        else:
+            runs = [(start + plane * plane_bytes, run_bytes) for plane in range(ranges[0][1] - ranges[0][0])]
+
+        SubCubeTools.__LOG.debug("Copying sub cube from {0} in {1} runs", raw_path, len(runs))
+        try:
+            with raw_path.open("rb") as source, open(file_name, "wb") as out_file:
+                for offset, count in runs:
+                    SubCubeTools.__copy_range(source.fileno(), out_file.fileno(), offset, count)
+        except OSError as e:
+            # for example copying across file systems on older kernels
+            SubCubeTools.__LOG.info("Could not copy {0} directly, writing blocks instead: {1}", raw_path, e)
+            return False
+
+        return True
+
+    @staticmethod
+    def __copy_range(source:int, destination:int, offset:int, count:int):
+        copy_file_range = getattr(os, "copy_file_range", None)
+        while count > 0:
+            if copy_file_range is not None:
+                copied = copy_file_range(source, destination, count, offset)
+            else:
+                copied = os.sendfile(destination, source, offset, count)
+
+            if copied == 0:
+                raise OSError("Unexpected end of file at byte {0}".format(offset))
+
+            offset += copied
+            count -= copied
+
     def interleave(self) -> str:
         return self.__interleave
 
@@ -857,3 +1210,1105 @@ class SubCubeTools:
     def set_bands(self, bands:Union[Tuple[int, int], List[int]]):
         self.__validate_bands(bands)
         self.__bands = bands
+
+
+class SubCubeBatchExtractor:
+    """Extracts many sub cubes from one source file in a single sequential pass.  The source
+    is read once in blocks in its own interleave, see OpenSpectraFile.block_ranges, blocks
+    that no sub cube overlaps aren't read and each block read is written to every sub cube
+    that overlaps it.  Sub cubes can have any interleave and a range or list of bands as with
+    SubCubeTools.  With more than one write thread the writes for a block are spread over
+    the threads and run while the next block is read, so up to two blocks are held at once.
+    If a progress_callback is supplied it's called after each block with the number of
+    blocks completed and the total"""
+
+    __LOG:Logger = LogHelper.logger("SubCubeBatchExtractor")
+
+    def __init__(self, source_file:OpenSpectraFile, cube_params:List[CubeParams], file_names:List[str],
+            memory_limit:int=None, write_threads:int=None, progress_callback:Callable[[int, int], None]=None):
+        if len(cube_params) != len(file_names):
+            raise ValueError("Expected a file name for each of the {0} sub cubes".format(len(cube_params)))
+
+        if len(set(file_names)) != len(file_names):
+            raise ValueError("Duplicate values detected in file names")
+
+        self.__source_file = source_file
+        self.__source_header = source_file.header()
+        self.__file_names = file_names
+        self.__progress_callback = progress_callback
+
+        # the sub cube tools validate each set of parameters and make the new headers
+        self.__sub_cube_tools:List[SubCubeTools] = list()
+        for params in cube_params:
+            sub_cube_tools = SubCubeTools(source_file, params)
+            sub_cube_tools.create_sub_cube(True)
+            self.__sub_cube_tools.append(sub_cube_tools)
+
+        self.__memory_limit = memory_limit
+        if self.__memory_limit is None:
+            self.__memory_limit = OpenSpectraProperties.get_property("SubCubeBlockLimit", 67108864)
+
+        self.__write_threads = write_threads
+        if self.__write_threads is None:
+            self.__write_threads = OpenSpectraProperties.get_property("SubCubeWriteThreads", 4)
+
+    def extract(self) -> List[MutableOpenSpectraHeader]:
+        """Write every sub cube and its header, returns the new headers in the same
+        order as the parameters.  If writing fails no headers are written"""
+        # each block read is held along with the copies cut from it
+        block_limit = max(1, self.__memory_limit // 4)
+        plan = list()
+        for block in self.__source_file.block_ranges(block_limit):
+            outputs = [(index, overlap) for index, overlap in
+                       ((index, self.__overlap(index, block)) for index in range(len(self.__sub_cube_tools)))
+                       if overlap is not None]
+            if len(outputs) > 0:
+                plan.append((block, outputs))
+
+        SubCubeBatchExtractor.__LOG.debug("Extracting {0} sub cubes from {1} reading {2} blocks",
+            len(self.__sub_cube_tools), self.__source_file.name(), len(plan))
+
+        writers = list()
+        source_axes = OpenSpectraHeader.interleave_axes(self.__source_header.interleave())
+        self.__source_file.advise(AccessHint.SEQUENTIAL)
+        try:
+            for file_name, sub_cube_tools in zip(self.__file_names, self.__sub_cube_tools):
+                writers.append(OpenSpectraFileWriter(file_name, sub_cube_tools.sub_cube_header()))
+
+            with ThreadPoolExecutor(max_workers=max(1, self.__write_threads)) as executor:
+                pending = list()
+                for completed, ((lines, samples, bands), outputs) in enumerate(plan, 1):
+                    # put the block in (lines, samples, bands) order
+                    block = self.__source_file.cube(lines, samples, bands).transpose(np.argsort(source_axes))
+                    writes = [(writers[index], index, overlap) for index, overlap in outputs]
+                    if self.__write_threads > 1:
+                        # wait for the previous block so only two are held at once
+                        for future in pending:
+                            future.result()
+                        pending = [executor.submit(self.__write, writer, index, overlap, block)
+                                   for writer, index, overlap in writes]
+                    else:
+                        for writer, index, overlap in writes:
+                            self.__write(writer, index, overlap, block)
+
+                    if self.__progress_callback is not None:
+                        self.__progress_callback(completed, len(plan))
+
+                for future in pending:
+                    future.result()
+
+        except:
+            for writer in writers:
+                writer.close(False)
+            raise
+
+        finally:
+            self.__source_file.advise(AccessHint.NORMAL)
+
+        for writer in writers:
+            writer.close()
+
+        return [sub_cube_tools.sub_cube_header() for sub_cube_tools in self.__sub_cube_tools]
+
+    def __overlap(self, index:int, block:Tuple[Tuple[int, int], Tuple[int, int], Tuple[int, int]]):
+        """Returns the part of the block in sub cube index as ranges relative to the block, ranges
+        relative to the sub cube and the runs of the sub cube's bands in the block, or None"""
+        sub_cube_tools = self.__sub_cube_tools[index]
+        ranges = list()
+        for (start, end), (block_start, block_end) in zip((sub_cube_tools.lines(), sub_cube_tools.samples()), block):
+            start, end = min(start, end), max(start, end)
+            overlap_start, overlap_end = max(start, block_start), min(end, block_end)
+            if overlap_start >= overlap_end:
+                return None
+            ranges.append(((overlap_start - block_start, overlap_end - block_start),
+                (overlap_start - start, overlap_end - start)))
+
+        bands = sub_cube_tools.bands()
+        if not isinstance(bands, list):
+            bands = list(range(min(bands), max(bands)))
+
+        # the sub cube's band positions and the matching bands of the block, split into
+        # runs of consecutive positions so each can be written as one block
+        block_start, block_end = block[2]
+        positions = [(position, band - block_start) for position, band in enumerate(bands)
+                     if block_start <= band < block_end]
+        if len(positions) == 0:
+            return None
+
+        band_runs = list()
+        for position, block_band in positions:
+            if len(band_runs) > 0 and band_runs[-1][1] == position:
+                band_runs[-1][1] = position + 1
+                band_runs[-1][2].append(block_band)
+            else:
+                band_runs.append([position, position + 1, [block_band]])
+
+        return ranges[0], ranges[1], band_runs
+
+    def __write(self, writer:OpenSpectraFileWriter, index:int, overlap, block:np.ndarray):
+        (block_lines, lines), (block_samples, samples), band_runs = overlap
+        axes = OpenSpectraHeader.interleave_axes(self.__sub_cube_tools[index].interleave())
+        for start, end, block_bands in band_runs:
+            if block_bands == list(range(block_bands[0], block_bands[-1] + 1)):
+                band_index = slice(block_bands[0], block_bands[-1] + 1)
+            else:
+                band_index = block_bands
+
+            data = block[slice(*block_lines), slice(*block_samples), band_index]
+            writer.write_block(lines, samples, (start, end), data.transpose(axes))
+
+
+class BlockAverager:
+    """Averages blocks of a cube the way CubeBinner and OverviewBuilder reduce them"""
+
+    @staticmethod
+    def average(block:np.ndarray, factors:Tuple[int, ...], ignore_value:Union[int, float],
+            data_type:np.dtype, used:np.ndarray=None) -> np.ndarray:
+        """Average each factors sized bin of block, only values that aren't NaN or ignore_value,
+        and where used, which must broadcast to block, is True are averaged.  Bins at the edges
+        average whatever is left, bins without any values are ignore_value, or NaN or 0 for
+        floating point or integer data_type without one.  Integer data is rounded"""
+        values = block.astype(np.float64)
+        valid = np.isfinite(values)
+        if ignore_value is not None:
+            valid &= values != ignore_value
+        if used is not None:
+            valid &= used
+
+        # pad partial bins with invalid values so what's left is averaged on its own
+        padding = tuple((0, -size % factor) for size, factor in zip(values.shape, factors))
+        values = np.pad(np.where(valid, values, 0), padding)
+        valid = np.pad(valid, padding)
+
+        shape = tuple(dimension for size, factor in zip(values.shape, factors) for dimension in (size // factor, factor))
+        axes = tuple(range(1, len(shape), 2))
+        sums = values.reshape(shape).sum(axes)
+        counts = valid.reshape(shape).sum(axes)
+
+        data_type = np.dtype(data_type)
+        if ignore_value is not None:
+            fill = ignore_value
+        else:
+            fill = np.nan if data_type.kind == "f" else 0
+
+        result = np.full(sums.shape, fill, np.float64)
+        np.divide(sums, counts, out=result, where=counts > 0)
+        if data_type.kind in "iu":
+            np.rint(result, out=result)
+
+        return result.astype(data_type)
+
+
+class CubeBinner:
+    """Writes a reduced copy of a file with each spatial_factor by spatial_factor block of pixels
+    and each spectral_factor adjacent bands averaged into one value.  Only values that aren't
+    NaN or the data ignore value are averaged, when there are none the result is the data
+    ignore value, or NaN or 0 for floating point or integer data without one.  Bad bands are
+    left out of the average for a bin unless all of its bands are bad, the new band is then
+    bad too.  Bins at the edges average whatever pixels or bands are left.  Wavelengths are
+    the average of the bands used, map info is updated for the larger pixels and integer data
+    is rounded.  The source is read in blocks of whole lines, or of bands within the lines
+    for one new line if that is too big, so about memory_limit bytes are used.  If a
+    progress_callback is supplied it's called with the number of new lines written and the total"""
+
+    __LOG:Logger = LogHelper.logger("CubeBinner")
+
+    def __init__(self, source_file:OpenSpectraFile, spatial_factor:int=2, spectral_factor:int=1,
+            interleave:str=None, memory_limit:int=None, progress_callback:Callable[[int, int], None]=None):
+        if spatial_factor < 1 or spectral_factor < 1:
+            raise ValueError("spatial_factor and spectral_factor must be 1 or more")
+
+        self.__source_file = source_file
+        self.__source_header = source_file.header()
+        self.__spatial_factor = spatial_factor
+        self.__spectral_factor = spectral_factor
+
+        self.__interleave = interleave
+        if self.__interleave is None:
+            self.__interleave = self.__source_header.interleave()
+        else:
+            # raises ValueError for an unknown interleave
+            OpenSpectraHeader.interleave_axes(self.__interleave)
+
+        self.__memory_limit = memory_limit
+        if self.__memory_limit is None:
+            self.__memory_limit = OpenSpectraProperties.get_property("BlockMemoryLimit", 67108864)
+
+        self.__progress_callback = progress_callback
+
+        # which bands are averaged, the good bands of each bin or all of them if none are good
+        band_count = self.__source_header.band_count()
+        bad_bands = self.__source_header.bad_band_list()
+        good_bands = np.ones(band_count, bool) if bad_bands is None else ~np.array(bad_bands, bool)
+        self.__bins = [(band, min(band + spectral_factor, band_count)) for band in range(0, band_count, spectral_factor)]
+        self.__used_bands = np.zeros(band_count, bool)
+        self.__bad_bins = list()
+        for start, end in self.__bins:
+            has_good = bool(good_bands[start:end].any())
+            self.__used_bands[start:end] = good_bands[start:end] if has_good else True
+            self.__bad_bins.append(not has_good)
+
+    def bin(self, file_name:str) -> MutableOpenSpectraHeader:
+        """Write the binned data to file_name and its header to file_name.hdr,
+        returns the new header"""
+        lines = self.__source_header.lines()
+        samples = self.__source_header.samples()
+        band_count = self.__source_header.band_count()
+        out_lines = math.ceil(lines / self.__spatial_factor)
+        header = self.__create_header()
+
+        # the float64 copies of the block, its mask and the sums dominate
+        bin_line_bytes = self.__spatial_factor * samples * 8 * 3
+        block_out_lines = max(1, self.__memory_limit // max(1, bin_line_bytes * band_count))
+        if block_out_lines > 1 or bin_line_bytes * band_count <= self.__memory_limit:
+            block_bins = len(self.__bins)
+        else:
+            block_bins = max(1, self.__memory_limit // max(1, bin_line_bytes * self.__spectral_factor))
+
+        CubeBinner.__LOG.debug("Binning {0} by {1} spatially and {2} spectrally in blocks of {3} lines and {4} bins",
+            self.__source_file.name(), self.__spatial_factor, self.__spectral_factor, block_out_lines, block_bins)
+
+        source_axes = OpenSpectraHeader.interleave_axes(self.__source_header.interleave())
+        axes = OpenSpectraHeader.interleave_axes(self.__interleave)
+        self.__source_file.advise(AccessHint.SEQUENTIAL)
+        try:
+            with OpenSpectraFileWriter(file_name, header) as writer:
+                for out_line in range(0, out_lines, block_out_lines):
+                    out_line_end = min(out_line + block_out_lines, out_lines)
+                    source_lines = (out_line * self.__spatial_factor, min(out_line_end * self.__spatial_factor, lines))
+                    for first_bin in range(0, len(self.__bins), block_bins):
+                        last_bin = min(first_bin + block_bins, len(self.__bins))
+                        bands = (self.__bins[first_bin][0], self.__bins[last_bin - 1][1])
+
+                        # put the block in (lines, samples, bands) order
+                        block = self.__source_file.cube(source_lines, (0, samples), bands).transpose(np.argsort(source_axes))
+                        binned = BlockAverager.average(block,
+                            (self.__spatial_factor, self.__spatial_factor, self.__spectral_factor),
+                            self.__source_header.data_ignore_value(), header.data_type(),
+                            self.__used_bands[bands[0]:bands[1]])
+                        writer.write_block((out_line, out_line_end), (0, binned.shape[1]), (first_bin, last_bin),
+                            binned.transpose(axes))
+
+                    if self.__progress_callback is not None:
+                        self.__progress_callback(out_line_end, out_lines)
+        finally:
+            self.__source_file.advise(AccessHint.NORMAL)
+
+        return header
+
+    def __create_header(self) -> MutableOpenSpectraHeader:
+        header = MutableOpenSpectraHeader(os_header=self.__source_header)
+        header.set_interleave(self.__interleave)
+        header.set_byte_order(OpenSpectraHeader.NATIVE_BYTE_ORDER)
+        header.set_header_offset(0)
+        header.set_lines(math.ceil(self.__source_header.lines() / self.__spatial_factor))
+        header.set_samples(math.ceil(self.__source_header.samples() / self.__spatial_factor))
+
+        wavelengths = self.__source_header.wavelengths()
+        new_wavelengths = np.array([wavelengths[start:end][self.__used_bands[start:end]].mean()
+                                    for start, end in self.__bins])
+
+        band_names = self.__source_header.band_names()
+        if band_names is not None:
+            band_names = [band_names[start] if end - start == 1 else "{0} - {1}".format(band_names[start], band_names[end - 1])
+                          for start, end in self.__bins]
+
+        bad_bands = self.__bad_bins if self.__source_header.bad_band_list() is not None else None
+        header.set_bands(len(self.__bins), band_names, new_wavelengths, bad_bands)
+
+        # other per band properties can't be averaged in general so they're dropped
+        unsupported_props = self.__source_header.unsupported_props()
+        for key, value in list(unsupported_props.items()):
+            if isinstance(value, list) and len(value) == self.__source_header.band_count() and self.__spectral_factor > 1:
+                CubeBinner.__LOG.debug("Dropping per band property {0} from binned header", key)
+                del unsupported_props[key]
+        header.set_unsupported_props(unsupported_props)
+
+        # the first new pixel starts where the first source pixel does
+        map_info = header.map_info()
+        if map_info is not None:
+            x, y = map_info.calculate_coordinates(0, 0)
+            header.set_x_reference(1, x)
+            header.set_y_reference(1, y)
+            header.set_pixel_size(map_info.x_pixel_size() * self.__spatial_factor,
+                map_info.y_pixel_size() * self.__spatial_factor)
+
+        return header
+
+
+class InterleaveTranscoder:
+    """Rewrites a file with a different interleave without holding the whole cube in memory.
+    The source is read in blocks of whole lines, or of bands within a single line if one line
+    is too big, sized so the block read plus its converted copy fit in memory_limit bytes.
+    Each block is written directly to the output file which is flushed before the next block
+    is read.  The output is always in native byte order.  If a progress_callback is supplied
+    it's called after each block with the number of bytes written so far and the total"""
+
+    __LOG:Logger = LogHelper.logger("InterleaveTranscoder")
+
+    def __init__(self, source_file:OpenSpectraFile, interleave:str, memory_limit:int=None,
+            progress_callback:Callable[[int, int], None]=None):
+        # raises ValueError for an unknown interleave
+        OpenSpectraHeader.interleave_axes(interleave)
+
+        self.__source_file = source_file
+        self.__source_header = source_file.header()
+        self.__interleave = interleave
+        self.__progress_callback = progress_callback
+
+        self.__memory_limit = memory_limit
+        if self.__memory_limit is None:
+            self.__memory_limit = OpenSpectraProperties.get_property("TranscoderMemoryLimit", 268435456)
+
+    def transcode(self, file_name:str, start_line:int=0,
+            block_callback:Callable[[int], bool]=None) -> MutableOpenSpectraHeader:
+        """Write the converted data to file_name and its header to file_name.hdr,
+        returns the new header.  To resume an earlier transcode that was stopped pass the
+        number of lines that were completed as start_line, file_name must then already exist.
+        If block_callback is supplied it's called after each block has been flushed with the
+        number of lines completed so far, if it returns False the transcode is stopped
+        without writing the header and None is returned"""
+        lines = self.__source_header.lines()
+        samples = self.__source_header.samples()
+        band_count = self.__source_header.band_count()
+        data_type = np.dtype(self.__source_header.data_type())
+        total_bytes = lines * samples * band_count * data_type.itemsize
+
+        # both the block read and the converted block are held at once
+        block_limit = max(1, self.__memory_limit // 2)
+        line_bytes = samples * band_count * data_type.itemsize
+        if line_bytes <= block_limit:
+            block_lines = block_limit // line_bytes
+            block_bands = band_count
+        else:
+            block_lines = 1
+            block_bands = max(1, block_limit // (samples * data_type.itemsize))
+
+        InterleaveTranscoder.__LOG.debug("Transcoding {0} from {1} to {2} in blocks of {3} lines and {4} bands",
+            self.__source_file.name(), self.__source_header.interleave(), self.__interleave,
+            block_lines, block_bands)
+
+        # create the output file at full size then write each block in place
+        with open(file_name, "r+b" if start_line > 0 else "wb") as out_file:
+            out_file.truncate(total_bytes)
+
+        axes = OpenSpectraHeader.interleave_axes(self.__interleave)
+        source_axes = OpenSpectraHeader.interleave_axes(self.__source_header.interleave())
+        out_shape = tuple((lines, samples, band_count)[axis] for axis in axes)
+
+        self.__source_file.advise(AccessHint.SEQUENTIAL)
+        bytes_written = start_line * line_bytes
+        try:
+            if total_bytes > 0:
+                output = np.memmap(file_name, dtype=data_type, mode="r+", shape=out_shape)
+                for line in range(start_line, lines, block_lines):
+                    line_end = min(line + block_lines, lines)
+                    for band in range(0, band_count, block_bands):
+                        band_end = min(band + block_bands, band_count)
+
+                        block = self.__source_file.cube((line, line_end), (0, samples), (band, band_end))
+
+                        # put the block in (lines, samples, bands) order then the output order
+                        block = block.transpose(np.argsort(source_axes)).transpose(axes)
+                        block_index = [slice(line, line_end), slice(None), slice(band, band_end)]
+                        output[tuple(block_index[axis] for axis in axes)] = block
+                        output.flush()
+
+                        bytes_written += block.nbytes
+                        if self.__progress_callback is not None:
+                            self.__progress_callback(bytes_written, total_bytes)
+
+                    if block_callback is not None and not block_callback(line_end):
+                        InterleaveTranscoder.__LOG.debug("Transcoding {0} stopped after {1} lines",
+                            self.__source_file.name(), line_end)
+                        return None
+
+                del output
+        finally:
+            self.__source_file.advise(AccessHint.NORMAL)
+
+        header = MutableOpenSpectraHeader(os_header=self.__source_header)
+        header.set_interleave(self.__interleave)
+        header.set_header_offset(0)
+        header.set_byte_order(OpenSpectraHeader.NATIVE_BYTE_ORDER)
+        header.save(file_name)
+        return header
+
+
+class ChunkedContainerWriter:
+    """Writes an OpenSpectraFile to a ChunkedContainer file, see ChunkedContainer.  chunk_shape
+    is the size of each chunk as (lines, samples, bands), chunks at the edges of the data may be
+    smaller.  codec is one of the keys in ChunkedContainer.CODECS and level is passed to the codec.
+    The data is read one chunk at a time so memory use is limited to a single chunk.  If a
+    progress_callback is supplied it's called after each chunk with the number of chunks written
+    so far and the total"""
+
+    __LOG:Logger = LogHelper.logger("ChunkedContainerWriter")
+
+    def __init__(self, source_file:OpenSpectraFile, chunk_shape:Tuple[int, int, int]=(64, 64, 32),
+            codec:str="zlib", level:int=None, progress_callback:Callable[[int, int], None]=None):
+        if codec not in ChunkedContainer.CODECS:
+            raise ValueError("Codec must be one of {0}".format(", ".join(ChunkedContainer.CODECS.keys())))
+
+        if len(chunk_shape) != 3 or min(chunk_shape) < 1:
+            raise ValueError("chunk_shape must be 3 values of 1 or more")
+
+        self.__source_file = source_file
+        self.__source_header = source_file.header()
+        self.__chunk_shape = chunk_shape
+        self.__codec = codec
+        self.__level = level
+        self.__progress_callback = progress_callback
+
+    def write(self, file_name:str) -> MutableOpenSpectraHeader:
+        """Write the chunked data to file_name and its header, with the file type
+        ChunkedContainer.FILE_TYPE, to file_name.hdr, returns the new header"""
+        axes = OpenSpectraHeader.interleave_axes(self.__source_header.interleave())
+        dimensions = (self.__source_header.lines(), self.__source_header.samples(), self.__source_header.band_count())
+        shape = tuple(dimensions[axis] for axis in axes)
+        chunk_shape = tuple(min(self.__chunk_shape[axis], dimensions[axis]) for axis in axes)
+        grid_shape = tuple(math.ceil(size / chunk_size) for size, chunk_size in zip(shape, chunk_shape))
+        chunk_count = int(np.prod(grid_shape))
+
+        ChunkedContainerWriter.__LOG.debug("Writing {0} chunks of {1} to {2} with {3}",
+            chunk_count, chunk_shape, file_name, self.__codec)
+
+        index = np.zeros((chunk_count, 2), "<u8")
+        with open(file_name, "wb") as out_file:
+            out_file.write(bytes(ChunkedContainer.HEADER.size))
+
+            for chunk_number, chunk in enumerate(np.ndindex(*grid_shape)):
+                # chunk ranges in axis order then in (lines, samples, bands) order for cube()
+                ranges = [(position * size, min((position + 1) * size, limit))
+                          for position, size, limit in zip(chunk, chunk_shape, shape)]
+                cube_ranges = [ranges[axes.index(dimension)] for dimension in range(3)]
+                data = self.__source_file.cube(cube_ranges[0], cube_ranges[1], cube_ranges[2])
+
+                compressed = ChunkedContainer.compress(self.__codec, np.ascontiguousarray(data).tobytes(), self.__level)
+                index[chunk_number] = (out_file.tell(), len(compressed))
+                out_file.write(compressed)
+
+                if self.__progress_callback is not None:
+                    self.__progress_callback(chunk_number + 1, chunk_count)
+
+            index_offset = out_file.tell()
+            out_file.write(index.tobytes())
+
+            out_file.seek(0)
+            out_file.write(ChunkedContainer.HEADER.pack(ChunkedContainer.MAGIC, ChunkedContainer.VERSION,
+                ChunkedContainer.CODECS[self.__codec], *chunk_shape, *shape, chunk_count, index_offset))
+
+        header = MutableOpenSpectraHeader(os_header=self.__source_header)
+        header.set_header_offset(0)
+        header.set_byte_order(OpenSpectraHeader.NATIVE_BYTE_ORDER)
+        header.set_file_type(ChunkedContainer.FILE_TYPE)
+        header.save(file_name)
+        return header
+
+
+class ShadowFileBuilder:
+    """Builds the shadow file for a data file, see ShadowFile.  Progress is saved after each
+    block so a build that is stopped, by cancel() or by the application exiting, picks up where
+    it left off the next time it's run as long as the source file hasn't changed.  If attach_to
+    is supplied the shadow is attached to it with set_shadow when the build completes.
+    progress_callback is called with the number of bytes written so far and the total"""
+
+    __LOG:Logger = LogHelper.logger("ShadowFileBuilder")
+
+    def __init__(self, source_file_name:str, attach_to:OpenSpectraFile=None, memory_limit:int=None,
+            progress_callback:Callable[[int, int], None]=None):
+        self.__source_file_name = source_file_name
+        self.__attach_to = attach_to
+        self.__memory_limit = memory_limit
+        self.__progress_callback = progress_callback
+        self.__cancelled = threading.Event()
+        self.__thread:threading.Thread = None
+
+    def start(self):
+        """Build the shadow in a background thread"""
+        self.__cancelled.clear()
+        self.__thread = threading.Thread(target=self.__run, name="ShadowFileBuilder", daemon=True)
+        self.__thread.start()
+
+    def cancel(self):
+        """Stop the build after the current block, it can be resumed later"""
+        self.__cancelled.set()
+
+    def wait(self, timeout:float=None) -> bool:
+        """Wait for a build started with start() to finish, returns False if it's still running"""
+        if self.__thread is not None:
+            self.__thread.join(timeout)
+            return not self.__thread.is_alive()
+
+        return True
+
+    def build(self) -> bool:
+        """Build the shadow in the calling thread, returns True if the shadow is complete"""
+        source_file = OpenSpectraFileFactory.create_open_spectra_file(self.__source_file_name, use_shadow=False)
+        source_header = source_file.header()
+        shadow_name = ShadowFile.file_name(self.__source_file_name, source_header.interleave())
+        progress_name = ShadowFile.progress_file_name(self.__source_file_name, source_header.interleave())
+
+        if not ShadowFile.is_valid(self.__source_file_name, source_header):
+            signature = ShadowFile.source_signature(self.__source_file_name)
+            start_line = self.__read_progress(progress_name, signature) if os.path.isfile(shadow_name) else 0
+            ShadowFileBuilder.__LOG.info("Building shadow file {0} starting at line {1}", shadow_name, start_line)
+            self.__write_progress(progress_name, signature, start_line)
+
+            transcoder = InterleaveTranscoder(source_file, ShadowFile.interleave(source_header.interleave()),
+                self.__memory_limit, self.__progress_callback)
+            shadow_header = transcoder.transcode(shadow_name, start_line,
+                lambda lines: self.__block_complete(progress_name, signature, lines))
+
+            if shadow_header is None:
+                ShadowFileBuilder.__LOG.info("Building shadow file {0} stopped", shadow_name)
+                return False
+
+            if ShadowFile.source_signature(self.__source_file_name) != signature:
+                ShadowFileBuilder.__LOG.warning("{0} changed while building its shadow file", self.__source_file_name)
+                os.remove(progress_name)
+                return False
+
+            props = shadow_header.unsupported_props()
+            props.update(signature)
+            shadow_header.set_unsupported_props(props)
+            shadow_header.save(shadow_name)
+            os.remove(progress_name)
+
+        if self.__attach_to is not None:
+            self.__attach_to.set_shadow(
+                OpenSpectraFileFactory.create_open_spectra_file(shadow_name, use_shadow=False))
+
+        return True
+
+    def __run(self):
+        try:
+            self.build()
+        except Exception:
+            ShadowFileBuilder.__LOG.exception("Failed to build shadow file for {0}", self.__source_file_name)
+
+    def __block_complete(self, progress_name:str, signature:Dict[str, str], lines:int) -> bool:
+        self.__write_progress(progress_name, signature, lines)
+        return not self.__cancelled.is_set()
+
+    @staticmethod
+    def __read_progress(progress_name:str, signature:Dict[str, str]) -> int:
+        """Returns the number of lines already built if the progress file matches the source"""
+        if os.path.isfile(progress_name):
+            with open(progress_name, "rt") as progress_file:
+                values = dict(line.rstrip("\n").split(" = ", 1) for line in progress_file if " = " in line)
+
+            if all(values.get(key) == value for key, value in signature.items()):
+                return int(values.get("lines", 0))
+
+        return 0
+
+    @staticmethod
+    def __write_progress(progress_name:str, signature:Dict[str, str], lines:int):
+        # write then rename so a crash never leaves a partial progress file
+        temp_name = progress_name + ".tmp"
+        with open(temp_name, "wt") as progress_file:
+            for key, value in signature.items():
+                progress_file.write("{0} = {1}\n".format(key, value))
+            progress_file.write("lines = {0}\n".format(lines))
+
+        os.replace(temp_name, progress_name)
+
+
+class BandStatisticsBuilder:
+    """Computes the statistics for every band of a data file in a single pass over the file
+    in the order it's stored and saves them as a BandStatisticsFile next to it.  The
+    histograms have a fixed number of bins, StatisticsBins in openspectra.properties by default,
+    their range starts at the first block's values and doubles as needed by merging pairs of
+    bins so nothing is read twice.  If attach_to is supplied the statistics are attached to
+    it with set_statistics.  NaN and infinite values are counted together and like values
+    equal to the data ignore value are left out of the statistics.  progress_callback is
+    called with the number of values read so far and the total"""
+
+    __LOG:Logger = LogHelper.logger("BandStatisticsBuilder")
+
+    # the index of the band axis in the cube returned for each interleave
+    __BAND_AXIS = {OpenSpectraHeader.BIL_INTERLEAVE: 1,
+                   OpenSpectraHeader.BSQ_INTERLEAVE: 0,
+                   OpenSpectraHeader.BIP_INTERLEAVE: 2}
+
+    def __init__(self, source_file_name:str, attach_to:OpenSpectraFile=None, bins:int=None,
+            memory_limit:int=None, progress_callback:Callable[[int, int], None]=None):
+        if bins is None:
+            bins = OpenSpectraProperties.get_property("StatisticsBins", 4096)
+
+        if bins < 2 or bins % 2 != 0:
+            raise ValueError("bins must be an even number of 2 or more")
+
+        self.__source_file_name = source_file_name
+        self.__attach_to = attach_to
+        self.__bins = bins
+        self.__memory_limit = memory_limit
+        self.__progress_callback = progress_callback
+
+    def build(self) -> BandStatisticsFile:
+        """Compute and save the statistics, returns None if the source file
+        changed while it was being read"""
+        signature = ShadowFile.source_signature(self.__source_file_name)
+        source_file = OpenSpectraFileFactory.create_open_spectra_file(self.__source_file_name, use_shadow=False)
+        header = source_file.header()
+        band_count = header.band_count()
+        band_axis = BandStatisticsBuilder.__BAND_AXIS[header.interleave()]
+        ignore_value = header.data_ignore_value()
+        is_integer = np.dtype(header.data_type()).kind in "iu"
+
+        minimum = np.full(band_count, np.inf)
+        maximum = np.full(band_count, -np.inf)
+        mean = np.zeros(band_count)
+        sum_squares = np.zeros(band_count)
+        valid_count = np.zeros(band_count, np.int64)
+        nan_count = np.zeros(band_count, np.int64)
+        ignore_count = np.zeros(band_count, np.int64)
+        counts = np.zeros((band_count, self.__bins), np.int64)
+        low = np.zeros(band_count)
+        width = np.zeros(band_count)
+
+        value_count = header.lines() * header.samples() * band_count
+        values_read = 0
+        BandStatisticsBuilder.__LOG.info("Computing statistics for {0}", self.__source_file_name)
+
+        source_file.advise(AccessHint.SEQUENTIAL)
+        try:
+            for lines, samples, bands, block in source_file.iter_blocks(self.__memory_limit, read_ahead=True):
+                for row, band in enumerate(range(bands[0], bands[1])):
+                    band_values = block.take(row, axis=band_axis).reshape(-1)
+                    if not is_integer:
+                        finite = np.isfinite(band_values)
+                        nan_count[band] += band_values.size - np.count_nonzero(finite)
+                        band_values = band_values[finite]
+
+                    if ignore_value is not None:
+                        ignored = band_values == ignore_value
+                        ignore_count[band] += np.count_nonzero(ignored)
+                        band_values = band_values[~ignored]
+
+                    if band_values.size > 0:
+                        band_values = band_values.astype(np.float64)
+
+                        # combine with the earlier blocks as in Chan et al.'s parallel variance
+                        block_mean = band_values.mean()
+                        block_sum_squares = np.square(band_values - block_mean).sum()
+                        total = valid_count[band] + band_values.size
+                        delta = block_mean - mean[band]
+                        mean[band] += delta * band_values.size / total
+                        sum_squares[band] += block_sum_squares + \
+                            delta * delta * valid_count[band] * band_values.size / total
+                        valid_count[band] = total
+
+                        minimum[band] = min(minimum[band], band_values.min())
+                        maximum[band] = max(maximum[band], band_values.max())
+                        self.__add_to_histogram(band_values, counts[band], low, width, band, is_integer)
+
+                values_read += block.size
+                if self.__progress_callback is not None:
+                    self.__progress_callback(values_read, value_count)
+        finally:
+            source_file.advise(AccessHint.NORMAL)
+
+        if ShadowFile.source_signature(self.__source_file_name) != signature:
+            BandStatisticsBuilder.__LOG.warning("{0} changed while computing its statistics", self.__source_file_name)
+            return None
+
+        empty = valid_count == 0
+        minimum[empty] = np.nan
+        maximum[empty] = np.nan
+        mean[empty] = np.nan
+        std = np.sqrt(sum_squares / np.maximum(valid_count, 1))
+        std[empty] = np.nan
+
+        statistics = BandStatisticsFile(minimum, maximum, mean, std, valid_count, nan_count, ignore_count,
+            counts, low, width, is_integer, signature)
+        statistics.save(self.__source_file_name)
+
+        if self.__attach_to is not None:
+            self.__attach_to.set_statistics(statistics)
+
+        return statistics
+
+    def __add_to_histogram(self, values:np.ndarray, counts:np.ndarray, low:np.ndarray, width:np.ndarray,
+            band:int, is_integer:bool):
+        value_min = values.min()
+        value_max = values.max()
+        if width[band] == 0:
+            # first values for the band, start with the narrowest bins that make sense
+            if is_integer:
+                low[band] = value_min
+                width[band] = 1
+            else:
+                span = value_max - value_min
+                low[band] = value_min
+                width[band] = (span if span > 0 else max(abs(value_min), 1.0)) / (self.__bins - 1)
+
+        # double the bin width until the values fit, growing toward them
+        half = self.__bins // 2
+        while value_min < low[band] or value_max >= low[band] + width[band] * self.__bins:
+            merged = counts.reshape(half, 2).sum(1)
+            width[band] *= 2
+            if value_min < low[band]:
+                low[band] -= width[band] * half
+                counts[:half] = 0
+                counts[half:] = merged
+            else:
+                counts[:half] = merged
+                counts[half:] = 0
+
+        indexes = np.floor((values - low[band]) / width[band]).astype(np.int64)
+        counts += np.bincount(np.clip(indexes, 0, self.__bins - 1), minlength=self.__bins)
+
+
+class OverviewBuilder:
+    """Builds the overviews for a data file and saves them as an OverviewFile next to it.  The
+    first level is read from the file in blocks of lines in the order it's stored, each later
+    level is made from the level before it.  With the AVERAGE method each pixel is the average
+    of the pixels it covers that aren't NaN or the data ignore value, or the data ignore value
+    if there are none, with DECIMATE it's the top left pixel.  Levels are added until the
+    larger side of a band is no more than min_size, OverviewMinSize in openspectra.properties by
+    default.  If attach_to is supplied the overviews are attached to it with set_overviews.
+    progress_callback is called with the number of lines read so far and the total"""
+
+    __LOG:Logger = LogHelper.logger("OverviewBuilder")
+
+    def __init__(self, source_file_name:str, attach_to:OpenSpectraFile=None, method:str=OverviewFile.AVERAGE,
+            min_size:int=None, memory_limit:int=None, progress_callback:Callable[[int, int], None]=None):
+        if method not in (OverviewFile.AVERAGE, OverviewFile.DECIMATE):
+            raise ValueError("method must be OverviewFile.AVERAGE or OverviewFile.DECIMATE")
+
+        if min_size is None:
+            min_size = OpenSpectraProperties.get_property("OverviewMinSize", 256)
+
+        if min_size < 1:
+            raise ValueError("min_size must be 1 or more")
+
+        if memory_limit is None:
+            memory_limit = OpenSpectraProperties.get_property("BlockMemoryLimit", 67108864)
+
+        self.__source_file_name = source_file_name
+        self.__attach_to = attach_to
+        self.__method = method
+        self.__min_size = min_size
+        self.__memory_limit = memory_limit
+        self.__progress_callback = progress_callback
+        self.__thread:threading.Thread = None
+
+    def start(self):
+        """Build the overviews in a background thread"""
+        self.__thread = threading.Thread(target=self.__run, name="OverviewBuilder", daemon=True)
+        self.__thread.start()
+
+    def wait(self, timeout:float=None) -> bool:
+        """Wait for a build started with start() to finish, returns False if it's still running"""
+        if self.__thread is not None:
+            self.__thread.join(timeout)
+            return not self.__thread.is_alive()
+
+        return True
+
+    def build(self) -> OverviewFile:
+        """Build and save the overviews, returns None if the source file
+        changed while it was being read"""
+        signature = ShadowFile.source_signature(self.__source_file_name)
+        source_file = OpenSpectraFileFactory.create_open_spectra_file(self.__source_file_name, use_shadow=False)
+        header = source_file.header()
+        ignore_value = header.data_ignore_value()
+        # the axes of the cube returned in bsq's (bands, lines, samples) order
+        axes = np.argsort(OpenSpectraHeader.interleave_axes(header.interleave()))[[2, 0, 1]]
+
+        file_name = OverviewFile.file_name(self.__source_file_name)
+        overviews = OverviewFile.create(file_name + ".tmp", header, self.__method, self.__min_size, signature)
+        OverviewBuilder.__LOG.info("Building {0} overview levels for {1}", len(overviews.factors()),
+            self.__source_file_name)
+
+        # each level is read from the one before it, the first from the source
+        input_lines = [header.lines()] + [overviews.level(index).shape[1] for index in range(len(overviews.factors()) - 1)]
+        total_lines = sum(input_lines)
+        lines_read = 0
+
+        source_file.advise(AccessHint.SEQUENTIAL)
+        try:
+            for index, lines in enumerate(input_lines):
+                level = overviews.level(index)
+                samples = header.samples() if index == 0 else overviews.level(index - 1).shape[2]
+                # float64 copies of the block and its mask dominate, keep an even number of lines
+                step = max(2, self.__memory_limit // max(1, header.band_count() * samples * 8 * 4) // 2 * 2)
+
+                for start in range(0, lines, step):
+                    end = min(start + step, lines)
+                    if index == 0:
+                        block = source_file.cube((start, end), (0, samples), (0, header.band_count())).transpose(axes)
+                    else:
+                        block = overviews.level(index - 1)[:, start:end, :]
+
+                    level[:, start // 2:(end + 1) // 2, :] = self.__reduce(block, ignore_value, level.dtype)
+
+                    lines_read += end - start
+                    if self.__progress_callback is not None:
+                        self.__progress_callback(lines_read, total_lines)
+        finally:
+            source_file.advise(AccessHint.NORMAL)
+            overviews.close()
+
+        if ShadowFile.source_signature(self.__source_file_name) != signature:
+            OverviewBuilder.__LOG.warning("{0} changed while building its overviews", self.__source_file_name)
+            os.remove(file_name + ".tmp")
+            return None
+
+        os.replace(file_name + ".tmp", file_name)
+        overviews = OverviewFile.open(self.__source_file_name, header)
+
+        if self.__attach_to is not None:
+            self.__attach_to.set_overviews(overviews)
+
+        return overviews
+
+    def __reduce(self, block:np.ndarray, ignore_value:Union[int, float], data_type:np.dtype) -> np.ndarray:
+        """Halve block, with shape (bands, lines, samples), in both directions"""
+        if self.__method == OverviewFile.DECIMATE:
+            return block[:, ::2, ::2]
+
+        return BlockAverager.average(block, (1, 2, 2), ignore_value, data_type)
+
+    def __run(self):
+        try:
+            self.build()
+        except Exception:
+            OverviewBuilder.__LOG.exception("Failed to build overviews for {0}", self.__source_file_name)
+
+
+class CatalogEntry:
+    """The header details recorded for a data file in a FileCatalog"""
+
+    def __init__(self, row:sqlite3.Row):
+        self.__row = row
+
+    def __str__(self):
+        return "{0}, lines: {1}, samples: {2}, bands: {3}, interleave: {4}".format(
+            self.file_name(), self.lines(), self.samples(), self.band_count(), self.interleave())
+
+    def file_name(self) -> str:
+        return self.__row["file_name"]
+
+    def lines(self) -> int:
+        return self.__row["lines"]
+
+    def samples(self) -> int:
+        return self.__row["samples"]
+
+    def band_count(self) -> int:
+        return self.__row["bands"]
+
+    def interleave(self) -> str:
+        return self.__row["interleave"]
+
+    def data_type(self) -> np.dtype:
+        return np.dtype(self.__row["data_type"])
+
+    def byte_order(self) -> int:
+        return self.__row["byte_order"]
+
+    def data_size(self) -> int:
+        return self.__row["data_size"]
+
+    def wavelength_range(self) -> Tuple[float, float]:
+        """The lowest and highest wavelength or None if the header has no wavelengths"""
+        if self.__row["min_wavelength"] is None:
+            return None
+
+        return self.__row["min_wavelength"], self.__row["max_wavelength"]
+
+    def wavelength_units(self) -> str:
+        return self.__row["wavelength_units"]
+
+    def bounds(self) -> Tuple[float, float, float, float]:
+        """The footprint of the file from its map info as (min x, min y, max x, max y)
+        or None if the header has no map info"""
+        if self.__row["min_x"] is None:
+            return None
+
+        return self.__row["min_x"], self.__row["min_y"], self.__row["max_x"], self.__row["max_y"]
+
+    def bad_band_count(self) -> int:
+        return self.__row["bad_bands"]
+
+
+class FileCatalog:
+    """A SQLite database of the headers of the data files under one or more directories so
+    files can be found by wavelength coverage, footprint or size without opening them.
+    scan() only parses headers that are new or whose header or data file has changed since
+    the last scan.  Shadow files are not cataloged.  A FileCatalog should only be used from
+    the thread that created it, to scan on another thread open a FileCatalog there on the
+    same catalog_file_name()"""
+
+    __LOG:Logger = LogHelper.logger("FileCatalog")
+
+    __SCHEMA = """
+        CREATE TABLE IF NOT EXISTS files (
+            file_name TEXT PRIMARY KEY,
+            header_mtime INTEGER NOT NULL,
+            data_mtime INTEGER NOT NULL,
+            data_size INTEGER NOT NULL,
+            lines INTEGER NOT NULL,
+            samples INTEGER NOT NULL,
+            bands INTEGER NOT NULL,
+            pixels INTEGER NOT NULL,
+            interleave TEXT NOT NULL,
+            data_type TEXT NOT NULL,
+            byte_order INTEGER NOT NULL,
+            wavelength_units TEXT,
+            min_wavelength REAL,
+            max_wavelength REAL,
+            min_x REAL,
+            min_y REAL,
+            max_x REAL,
+            max_y REAL,
+            bad_bands INTEGER NOT NULL);
+        CREATE TABLE IF NOT EXISTS bands (
+            file_name TEXT NOT NULL REFERENCES files(file_name) ON DELETE CASCADE,
+            band INTEGER NOT NULL,
+            name TEXT,
+            wavelength REAL,
+            bad INTEGER NOT NULL,
+            PRIMARY KEY (file_name, band));
+        CREATE INDEX IF NOT EXISTS files_wavelength ON files (min_wavelength, max_wavelength);
+        CREATE INDEX IF NOT EXISTS files_x ON files (min_x, max_x);
+        CREATE INDEX IF NOT EXISTS files_y ON files (min_y, max_y);
+        CREATE INDEX IF NOT EXISTS files_pixels ON files (pixels);
+        """
+
+    def __init__(self, catalog_file_name:str):
+        self.__catalog_file_name = catalog_file_name
+        self.__connection = sqlite3.connect(catalog_file_name)
+        self.__connection.row_factory = sqlite3.Row
+        self.__connection.execute("PRAGMA foreign_keys = ON")
+        self.__connection.executescript(FileCatalog.__SCHEMA)
+
+    def close(self):
+        self.__connection.close()
+
+    def catalog_file_name(self) -> str:
+        return self.__catalog_file_name
+
+    def scan(self, directory:str, progress_callback:Callable[[int, int], None]=None) -> int:
+        """Bring the catalog up to date with the data files under directory, returns the
+        number of files added or updated.  Files that were removed since the last scan are
+        dropped from the catalog.  progress_callback is called after each header with
+        the number of headers checked so far and the total"""
+        directory = os.path.abspath(directory)
+        header_names = list()
+        for path, dir_names, file_names in os.walk(directory):
+            header_names += [os.path.join(path, name) for name in file_names
+                             if name.endswith(".hdr") and ".shadow." not in name]
+
+        prefix = os.path.join(directory, "")
+        cataloged = {row["file_name"]: (row["header_mtime"], row["data_mtime"], row["data_size"])
+            for row in self.__connection.execute(
+                "SELECT file_name, header_mtime, data_mtime, data_size FROM files "
+                "WHERE substr(file_name, 1, ?) = ?", (len(prefix), prefix))}
+
+        updated = 0
+        with self.__connection:
+            for count, header_name in enumerate(header_names):
+                file_name = header_name[:-len(".hdr")]
+                if os.path.isfile(file_name):
+                    header_stat = os.stat(header_name)
+                    data_stat = os.stat(file_name)
+                    signature = (header_stat.st_mtime_ns, data_stat.st_mtime_ns, data_stat.st_size)
+                    if cataloged.pop(file_name, None) != signature:
+                        if self.__add(file_name, header_name, signature):
+                            updated += 1
+
+                if progress_callback is not None:
+                    progress_callback(count + 1, len(header_names))
+
+            # whatever is left is no longer on disk
+            self.__connection.executemany("DELETE FROM files WHERE file_name = ?",
+                [(file_name,) for file_name in cataloged])
+
+        FileCatalog.__LOG.info("Scanned {0} headers under {1}, {2} updated, {3} removed",
+            len(header_names), directory, updated, len(cataloged))
+        return updated
+
+    def query(self, wavelengths:Tuple[float, float]=None, bounds:Tuple[float, float, float, float]=None,
+            min_pixels:int=None, max_pixels:int=None) -> List[CatalogEntry]:
+        """Returns the files that cover the whole wavelength range wavelengths as (low, high),
+        have a footprint that overlaps bounds given as (min x, min y, max x, max y) and have
+        between min_pixels and max_pixels lines times samples.  Criteria that are None aren't
+        applied"""
+        conditions = list()
+        parameters = list()
+        if wavelengths is not None:
+            conditions.append("min_wavelength <= ? AND max_wavelength >= ?")
+            parameters += [min(wavelengths), max(wavelengths)]
+
+        if bounds is not None:
+            conditions.append("min_x <= ? AND max_x >= ? AND min_y <= ? AND max_y >= ?")
+            parameters += [bounds[2], bounds[0], bounds[3], bounds[1]]
+
+        if min_pixels is not None:
+            conditions.append("pixels >= ?")
+            parameters.append(min_pixels)
+
+        if max_pixels is not None:
+            conditions.append("pixels <= ?")
+            parameters.append(max_pixels)
+
+        statement = "SELECT * FROM files"
+        if len(conditions) > 0:
+            statement += " WHERE " + " AND ".join(conditions)
+
+        return [CatalogEntry(row) for row in
+                self.__connection.execute(statement + " ORDER BY file_name", parameters)]
+
+    def entry(self, file_name:str) -> CatalogEntry:
+        """Returns the entry for file_name or None if it isn't in the catalog"""
+        row = self.__connection.execute("SELECT * FROM files WHERE file_name = ?",
+            (os.path.abspath(file_name),)).fetchone()
+        return CatalogEntry(row) if row is not None else None
+
+    def band_labels(self, file_name:str) -> List[Tuple[str, float, bool]]:
+        """Returns the name, wavelength and bad band flag of each band in file_name"""
+        return [(row["name"], row["wavelength"], bool(row["bad"])) for row in self.__connection.execute(
+            "SELECT name, wavelength, bad FROM bands WHERE file_name = ? ORDER BY band",
+            (os.path.abspath(file_name),))]
+
+    def __add(self, file_name:str, header_name:str, signature:Tuple[int, int, int]) -> bool:
+        self.__connection.execute("DELETE FROM files WHERE file_name = ?", (file_name,))
+        try:
+            header = OpenSpectraHeader(header_name)
+            header.load()
+        except (OpenSpectraHeaderError, ValueError, TypeError, KeyError):
+            # missing required fields show up as TypeError or KeyError
+            FileCatalog.__LOG.warning("Skipping {0}, its header could not be read", header_name)
+            return False
+
+        wavelengths = header.wavelengths()
+        has_wavelengths = header.has_wavelengths()
+        bad_bands = header.bad_band_list()
+        if bad_bands is None:
+            bad_bands = [False] * header.band_count()
+
+        footprint = (None, None, None, None)
+        map_info = header.map_info()
+        if map_info is not None:
+            x_coords, y_coords = map_info.calculate_coordinates(
+                np.array([0, header.samples(), 0, header.samples()], np.float64),
+                np.array([0, 0, header.lines(), header.lines()], np.float64))
+            footprint = (x_coords.min(), y_coords.min(), x_coords.max(), y_coords.max())
+
+        self.__connection.execute("INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (file_name,) + signature + (header.lines(), header.samples(), header.band_count(),
+            header.lines() * header.samples(), header.interleave(), np.dtype(header.data_type()).name,
+            header.byte_order(), header.wavelength_units(),
+            float(wavelengths.min()) if has_wavelengths else None,
+            float(wavelengths.max()) if has_wavelengths else None) +
+            tuple(float(value) if value is not None else None for value in footprint) + (sum(bad_bands),))
+
+        self.__connection.executemany("INSERT INTO bands VALUES (?, ?, ?, ?, ?)",
+            [(file_name, band, label[0], float(wavelengths[band]) if has_wavelengths else None, int(bad_bands[band]))
+             for band, label in enumerate(header.band_labels())])
+
+        return True
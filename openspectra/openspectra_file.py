@@ -1,18 +1,33 @@
 #  Developed by Joseph M. Conti and Joseph W. Boardman on 1/21/19 6:29 PM.
 #  Last modified 1/21/19 6:29 PM
 #  Copyright (c) 2019. All rights reserved.
+import bisect
+import bz2
 import copy
+import ctypes
+import ctypes.util
+import json
 import logging
+import lzma
 import math
+import mmap
+import os
 import re
+import struct
+import sys
+import threading
+import weakref
+import zlib
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
 from math import cos, sin
 from pathlib import Path
-from typing import List, Union, Tuple, Dict, Callable
+from typing import List, Union, Tuple, Dict, Callable, Iterator
 
 import numpy as np
 
-from openspectra.utils import LogHelper, Logger
+from openspectra.utils import LogHelper, Logger, OpenSpectraProperties, TileCache, MemoryAccountant
 
 
 class LinearImageStretch(ABC):
@@ -91,7 +106,7 @@ class OpenSpectraHeader:
 
     _BAND_NAMES = "band names"
     _BANDS = "bands"
-    __DATA_TYPE = "data type"
+    _DATA_TYPE = "data type"
     _HEADER_OFFSET = "header offset"
     _INTERLEAVE = "interleave"
     _LINES = "lines"
@@ -101,8 +116,8 @@ class OpenSpectraHeader:
     __WAVELENGTH_UNITS = "wavelength units"
     _MAP_INFO = "map info"
     __SENSOR_TYPE = "sensor type"
-    __BYTE_ORDER = "byte order"
-    __FILE_TYPE = "file type"
+    _BYTE_ORDER = "byte order"
+    _FILE_TYPE = "file type"
     __DESCRIPTION = "description"
     __DATA_IGNORE_VALUE = "data ignore value"
     __DEFAULT_STRETCH = "default stretch"
@@ -110,9 +125,9 @@ class OpenSpectraHeader:
     __COORD_SYSTEM_STR = "coordinate system string"
 
     __READ_AS_STRING = [__DESCRIPTION, __COORD_SYSTEM_STR]
-    __SUPPORTED_FIELDS = [_BAND_NAMES, _BANDS, __DATA_TYPE, _HEADER_OFFSET, _INTERLEAVE, _LINES,
+    __SUPPORTED_FIELDS = [_BAND_NAMES, _BANDS, _DATA_TYPE, _HEADER_OFFSET, _INTERLEAVE, _LINES,
                           __REFLECTANCE_SCALE_FACTOR, _SAMPLES, _WAVELENGTHS, __WAVELENGTH_UNITS,
-                          _MAP_INFO, __SENSOR_TYPE, __BYTE_ORDER, __FILE_TYPE, __DESCRIPTION,
+                          _MAP_INFO, __SENSOR_TYPE, _BYTE_ORDER, _FILE_TYPE, __DESCRIPTION,
                           __DATA_IGNORE_VALUE, __DEFAULT_STRETCH, _BAD_BAND_LIST, __COORD_SYSTEM_STR]
 
     _DATA_TYPE_DIC:Dict[str, type] = {
@@ -132,6 +147,15 @@ class OpenSpectraHeader:
     BSQ_INTERLEAVE:str = "bsq"
     BIP_INTERLEAVE:str = "bip"
 
+    LITTLE_ENDIAN:int = 0
+    BIG_ENDIAN:int = 1
+    NATIVE_BYTE_ORDER:int = LITTLE_ENDIAN if sys.byteorder == "little" else BIG_ENDIAN
+
+    # the axis order each interleave stores its data in given a (lines, samples, bands) tuple
+    __INTERLEAVE_AXES:Dict[str, Tuple[int, int, int]] = {BIL_INTERLEAVE: (0, 2, 1),
+                                                         BSQ_INTERLEAVE: (2, 0, 1),
+                                                         BIP_INTERLEAVE: (0, 1, 2)}
+
     class MapInfo:
         """"A simple class for holding map info from a header file"""
 
@@ -382,30 +406,14 @@ class OpenSpectraHeader:
             if self.__path.exists() and self.__path.is_file():
                 OpenSpectraHeader.__LOG.info("Opening file {0} with mode {1}", self.__path.name, self.__path.stat().st_mode)
 
-                with self.__path.open() as headerFile:
-                    for line in headerFile:
-                        line = line.rstrip()
-                        if re.search("=", line) is not None:
-                            line_pair:List[str] = re.split("=", line, 1)
-                            key = line_pair[0].strip()
-                            value = line_pair[1].lstrip()
-
-                            if key in OpenSpectraHeader.__SUPPORTED_FIELDS:
-                                if re.search("{", value):
-                                    if key in OpenSpectraHeader.__READ_AS_STRING:
-                                        str_val = self.__read_bracket_str(value, headerFile)
-                                        self.__props[key] = str_val
-                                    else:
-                                        list_value = self.__read_bracket_list(value, headerFile)
-                                        self.__props[key] = list_value
-                                else:
-                                    self.__props[key] = value
-                            else:
-                                if re.search("{", value):
-                                    list_value = self.__read_bracket_list(value, headerFile)
-                                    self.__unsupported_props[key] = list_value
-                                else:
-                                    self.__unsupported_props[key] = value
+                with self.__path.open() as header_file:
+                    lines = header_file.read().split("\n")
+
+                # a trailing new line doesn't start another line
+                if lines[-1] == "":
+                    lines.pop()
+
+                self.__parse(lines)
             else:
                 raise OpenSpectraHeaderError("File {0} not found".format(self.__path.name))
 
@@ -446,7 +454,7 @@ class OpenSpectraHeader:
         return self.__data_ignore_value
 
     def data_type(self) -> np.dtype.type:
-        data_type = self.__props.get(OpenSpectraHeader.__DATA_TYPE)
+        data_type = self.__props.get(OpenSpectraHeader._DATA_TYPE)
         return self._DATA_TYPE_DIC.get(data_type)
 
     def default_stretch(self) -> LinearImageStretch:
@@ -465,17 +473,33 @@ class OpenSpectraHeader:
         return self.__band_count
 
     def file_type(self) -> str:
-        return self.__props.get(OpenSpectraHeader.__FILE_TYPE)
+        return self.__props.get(OpenSpectraHeader._FILE_TYPE)
 
     def wavelengths(self) -> np.array:
         return self.__wavelengths
 
+    def has_wavelengths(self) -> bool:
+        """False when the header has no wavelengths and wavelengths() are just the band numbers"""
+        return OpenSpectraHeader._WAVELENGTHS in self.__props
+
     def wavelength_units(self) -> str:
         return self.__props.get(OpenSpectraHeader.__WAVELENGTH_UNITS)
 
     def interleave(self) -> str:
         return self.__interleave
 
+    @staticmethod
+    def interleave_axes(interleave:str) -> Tuple[int, int, int]:
+        """The transpose that takes data with axis order (lines, samples, bands) to the axis
+        order interleave stores it in, np.argsort of it goes the other way.  Raises
+        ValueError if interleave isn't one of bil, bsq or bip"""
+        if interleave not in OpenSpectraHeader.__INTERLEAVE_AXES:
+            raise ValueError("Interleave must be one of {}, {}, or {}".
+                format(OpenSpectraHeader.BIL_INTERLEAVE, OpenSpectraHeader.BIP_INTERLEAVE,
+                    OpenSpectraHeader.BSQ_INTERLEAVE))
+
+        return OpenSpectraHeader.__INTERLEAVE_AXES[interleave]
+
     def header_offset(self) -> int:
         return self.__header_offset
 
@@ -491,64 +515,88 @@ class OpenSpectraHeader:
     def unsupported_props(self) -> Dict[str, str]:
         return copy.deepcopy(self.__unsupported_props)
 
+    def __parse(self, lines:List[str]):
+        """Tokenize the header in a single pass over its lines.  A line without
+        an '=' is skipped, a value starting with '{' continues until the line
+        holding the closing '}' and is read as a list unless the key is in
+        __READ_AS_STRING"""
+        index = 0
+        while index < len(lines):
+            key, separator, value = lines[index].rstrip().partition("=")
+            index += 1
+            if not separator:
+                continue
+
+            key = key.strip()
+            value = value.lstrip()
+            if key in OpenSpectraHeader.__SUPPORTED_FIELDS:
+                props = self.__props
+            else:
+                props = self.__unsupported_props
+
+            if "{" not in value:
+                props[key] = value
+            elif props is self.__props and key in OpenSpectraHeader.__READ_AS_STRING:
+                props[key], index = OpenSpectraHeader.__read_bracket_str(value, lines, index)
+            else:
+                props[key], index = OpenSpectraHeader.__read_bracket_list(value, lines, index)
+
     @staticmethod
-    def __read_bracket_str(value, header_file, strip_bracket:bool=True) -> str:
-        str_val = value
-        if strip_bracket:
-            str_val = value.strip("{").strip()
+    def __read_bracket_str(value:str, lines:List[str], index:int) -> Tuple[str, int]:
+        """Returns the text between the brackets, keeping the line breaks,
+        and the index of the line following the closing bracket"""
+        str_val = value.strip("{").strip()
 
         # check for closing } on same line
-        if re.search("}", str_val):
-            if strip_bracket:
-                str_val = str_val.strip("}").strip()
-        else:
-            str_val += "\n"
-            for line in header_file:
-                str_val += line.rstrip()
-                if re.search("}", str_val):
-                    if strip_bracket:
-                        str_val = str_val.rstrip("}").rstrip()
-                    break
-                else:
-                    str_val += "\n"
+        if "}" in str_val:
+            return str_val.strip("}").strip(), index
+
+        section = [str_val]
+        while index < len(lines):
+            line = lines[index].rstrip()
+            index += 1
+            section.append(line)
+            if "}" in line:
+                return "\n".join(section).rstrip("}").rstrip(), index
 
-        return str_val
+        # never closed, keep everything to the end of the file
+        section.append("")
+        return "\n".join(section), index
 
     @staticmethod
-    def __read_bracket_list(value, header_file) -> List[str]:
-        done = False
+    def __read_bracket_list(value:str, lines:List[str], index:int) -> Tuple[List[str], int]:
+        """Returns the comma separated items between the brackets and the
+        index of the line following the closing bracket.  Continuation lines
+        are joined without a separator"""
         line = value.strip("{").strip()
-        list_value = list()
+        done = "}" in line
 
         # check for closing } on same line
-        if re.search("}", line):
+        if done:
             line = line.strip("}").strip()
-            done = True
 
         # if there are any entries on the first line handle them
-        if line:
-            elements = line.split(",")
-            if len(elements) > 0:
-                list_value = elements
+        list_value = line.split(",") if line else list()
 
         if not done:
-            section = ""
-            for line in header_file:
-                section += line.rstrip()
-                if re.search("}", line):
-                    section = section.rstrip("}").rstrip()
+            section = list()
+            while index < len(lines):
+                line = lines[index]
+                index += 1
+                section.append(line.rstrip())
+                if "}" in line:
+                    section[-1] = section[-1].rstrip("}").rstrip()
                     break
 
-            list_value += section.split(",")
+            list_value += "".join(section).split(",")
 
-        list_value = [str.strip(item) for item in list_value]
-        return list_value
+        return [item.strip() for item in list_value], index
 
     def __validate(self):
-        self.__byte_order = int(self.__props.get(OpenSpectraHeader.__BYTE_ORDER))
+        self.__byte_order = int(self.__props.get(OpenSpectraHeader._BYTE_ORDER))
         if self.__byte_order != 1 and self.__byte_order != 0:
             raise OpenSpectraHeaderError("Valid values for byte order in header are '0' or '1'.  Value is: {0}".
-                format(self.__props.get(OpenSpectraHeader.__BYTE_ORDER)))
+                format(self.__props.get(OpenSpectraHeader._BYTE_ORDER)))
 
         interleave:str = self.__props.get(OpenSpectraHeader._INTERLEAVE)
         if interleave is None or len(interleave) != 3:
@@ -622,7 +670,7 @@ class OpenSpectraHeader:
         else:
             OpenSpectraHeader.__LOG.debug("Optional map info section not found")
 
-        data_type = self.__props.get(OpenSpectraHeader.__DATA_TYPE)
+        data_type = self.__props.get(OpenSpectraHeader._DATA_TYPE)
         if data_type not in OpenSpectraHeader._DATA_TYPE_DIC:
             raise OpenSpectraHeaderError("Specified 'data type' not recognized, value was: {0}".format(data_type))
 
@@ -781,9 +829,18 @@ class MutableOpenSpectraHeader(OpenSpectraHeader):
     def set_interleave(self, interleave:str):
         self._update_prop(self._INTERLEAVE, interleave)
 
+    def set_byte_order(self, byte_order:int):
+        self._update_prop(self._BYTE_ORDER, byte_order)
+
+    def set_data_type(self, data_type:type):
+        self._update_prop(self._DATA_TYPE, MutableOpenSpectraHeader.__convert_data_type(data_type))
+
     def set_header_offset(self, offset:int):
         self._update_prop(self._HEADER_OFFSET, offset)
 
+    def set_file_type(self, file_type:str):
+        self._update_prop(self._FILE_TYPE, file_type)
+
     def set_x_reference(self, x_pixel:float, x_cooridinate:float):
         map_info = self.map_info()
         if map_info is not None:
@@ -800,6 +857,14 @@ class MutableOpenSpectraHeader(OpenSpectraHeader):
             map_info_list[4] = str(y_cooridinate)
             self._update_prop(self._MAP_INFO, map_info_list)
 
+    def set_pixel_size(self, x_pixel_size:float, y_pixel_size:float):
+        map_info = self.map_info()
+        if map_info is not None:
+            map_info_list = self._get_prop(self._MAP_INFO)
+            map_info_list[5] = str(x_pixel_size)
+            map_info_list[6] = str(y_pixel_size)
+            self._update_prop(self._MAP_INFO, map_info_list)
+
     def set_unsupported_props(self, props:Dict[str, Union[str, List[str]]]):
         self._set_unsupported_props(props)
 
@@ -840,6 +905,9 @@ class BILShape(Shape):
     def bands(self) -> int:
         return self.shape()[1]
 
+    def interleave(self) -> str:
+        return OpenSpectraHeader.BIL_INTERLEAVE
+
 
 class BQSShape(Shape):
 
@@ -855,6 +923,9 @@ class BQSShape(Shape):
     def bands(self) -> int:
         return self.shape()[0]
 
+    def interleave(self) -> str:
+        return OpenSpectraHeader.BSQ_INTERLEAVE
+
 
 class BIPShape(Shape):
 
@@ -870,6 +941,18 @@ class BIPShape(Shape):
     def bands(self) -> int:
         return self.shape()[2]
 
+    def interleave(self) -> str:
+        return OpenSpectraHeader.BIP_INTERLEAVE
+
+
+class AccessHint(Enum):
+    """Hints about how a range of the data will be accessed, see OpenSpectraFile.advise"""
+    NORMAL = "MADV_NORMAL"
+    SEQUENTIAL = "MADV_SEQUENTIAL"
+    RANDOM = "MADV_RANDOM"
+    WILL_NEED = "MADV_WILLNEED"
+    DONT_NEED = "MADV_DONTNEED"
+
 
 class FileModel:
 
@@ -878,12 +961,9 @@ class FileModel:
         self._path = path
         self._offset:int = header.header_offset()
 
-        # size in bytes of each data element in the file
-        self._data_type = np.dtype(header.data_type())
-
-        # TODO set based on byte_order from header but doesn't seem to make a difference
-        self._data_type.newbyteorder("L")
-        # data_type.newbyteorder("B")
+        # the data type as it is stored in the file including the byte order
+        self._data_type = np.dtype(header.data_type()).newbyteorder(
+            "<" if header.byte_order() == OpenSpectraHeader.LITTLE_ENDIAN else ">")
 
     def load(self, shape:Shape):
         pass
@@ -894,9 +974,58 @@ class FileModel:
     def name(self):
         return self._path.name
 
+    def path(self) -> Path:
+        return self._path
+
+    def raw_path(self) -> Path:
+        """The path of the data file when the data is stored in it uncompressed starting
+        at the header offset so its bytes can be copied directly, otherwise None"""
+        return None
+
     def data_type(self):
         return self._file.dtype
 
+    def is_native_byte_order(self) -> bool:
+        """Returns True if the data in file() can be used without byte swapping"""
+        return self._file.dtype.isnative
+
+    def indexes_points(self) -> bool:
+        """Returns True if file() is fast with index arrays for several points, the
+        delegates then use it directly rather than gathering the data in file order"""
+        return isinstance(self._file, np.ndarray) and not isinstance(self._file, np.memmap)
+
+    def read_flat(self, start:int, end:int) -> np.ndarray:
+        """Returns the data elements from start to end in the order they are stored"""
+        if isinstance(self._file, FileArray):
+            return self._file.read_flat(start, end)
+        else:
+            return self._file.reshape(-1)[start:end]
+
+    def advise(self, hint:AccessHint, ranges:List[Tuple[int, int]]):
+        """Pass an access hint for the given ranges of data elements on to the
+        operating system.  ranges are (start, end) element offsets into file() in
+        the order they are stored.  Models that don't support hints ignore them"""
+        pass
+
+    def _byte_ranges(self, ranges:List[Tuple[int, int]], start:int, alignment:int,
+            limit:int) -> List[Tuple[int, int]]:
+        """Convert element ranges to sorted, merged byte ranges with the data starting at
+        byte start, rounded out to alignment and clipped to limit"""
+        item_size = self._data_type.itemsize
+        byte_ranges = list()
+        for range_start, range_end in sorted(ranges):
+            if range_end <= range_start:
+                continue
+
+            byte_start = (start + range_start * item_size) // alignment * alignment
+            byte_end = min(math.ceil((start + range_end * item_size) / alignment) * alignment, limit)
+            if len(byte_ranges) > 0 and byte_start <= byte_ranges[-1][1]:
+                byte_ranges[-1][1] = max(byte_ranges[-1][1], byte_end)
+            else:
+                byte_ranges.append([byte_start, byte_end])
+
+        return [(byte_start, byte_end) for byte_start, byte_end in byte_ranges]
+
     def _validate(self, shape:Shape):
         if self._file.size != shape.size():
             raise OpenSpectraFileError("Expected {0} data points but found {1}".
@@ -926,10 +1055,21 @@ class CubeSliceArgs():
 
 
 class FileTypeDelegate:
+    """Subclasses select data from the file model in the order their interleave stores it.
+    Band values for many pixels at once are gathered rather than selected with numpy's
+    fancy indexing which reads the file in the order the pixels are given.  The pixels are
+    sorted by where they are in the file, merged into runs with gaps of GatherMaxGap bytes
+    or less and no longer than GatherMaxRead bytes, each run is read once in file order and
+    the values are put back in the order requested.  Requests for fewer than GatherMinPoints
+    pixels, or for file models that index points well themselves such as data held in
+    memory, use fancy indexing"""
 
     def __init__(self, shape:Shape, file_model:FileModel):
         self.__shape = shape
         self._file_model = file_model
+        self.__gather_min_points = OpenSpectraProperties.get_property("GatherMinPoints", 64)
+        self.__gather_max_gap = OpenSpectraProperties.get_property("GatherMaxGap", 65536)
+        self.__gather_max_read = OpenSpectraProperties.get_property("GatherMaxRead", 16777216)
 
     def image(self, band:Union[int, tuple]) -> np.ndarray:
         """bands are zero based here with a max value of len(band) - 1
@@ -963,9 +1103,98 @@ class FileTypeDelegate:
         https://docs.scipy.org/doc/numpy/reference/arrays.indexing.html for more information"""
         pass
 
+    def data_ranges(self, lines:Tuple[int, int], bands:Tuple[int, int]) -> List[Tuple[int, int]]:
+        """Returns the (start, end) element offsets into the file of the data for
+        the given range of lines and bands, including all samples, in file order"""
+        pass
+
     def shape(self) -> Shape:
         return self.__shape
 
+    def tile_cache(self) -> TileCache:
+        """Returns the cache used by the delegate or None if it doesn't cache data"""
+        return None
+
+    def is_cached(self, band:int) -> bool:
+        """Returns True if the image for band can be returned without reading the file"""
+        return False
+
+    def is_cacheable(self) -> bool:
+        """Returns True if reading a band's image keeps it in the delegate's cache"""
+        return False
+
+    def _use_gather(self, line:Union[int, tuple, np.ndarray], sample:Union[int, tuple, np.ndarray]) -> bool:
+        return not self._file_model.indexes_points() and not isinstance(line, (int, np.integer)) and \
+            np.size(line) >= self.__gather_min_points
+
+    def _gather_bands(self, line:Union[tuple, np.ndarray], sample:Union[tuple, np.ndarray],
+            line_stride:int, sample_stride:int, band_stride:int) -> np.ndarray:
+        """Returns the bands for each pixel with shape (pixels, bands), the strides are
+        the distance in elements between neighbouring lines, samples and bands in the file"""
+        lines = self.__check_indices(line, self.__shape.lines())
+        samples = self.__check_indices(sample, self.__shape.samples())
+        if lines.shape != samples.shape:
+            raise IndexError("line and sample index arrays must have the same shape")
+
+        bases, inverse = np.unique(lines * line_stride + samples * sample_stride, return_inverse=True)
+        band_offsets = np.arange(self.__shape.bands(), dtype=np.int64) * band_stride
+        item_size = self._file_model.file().dtype.itemsize
+        max_gap = self.__gather_max_gap // item_size
+        max_read = max(1, self.__gather_max_read // item_size)
+
+        dtype = self._file_model.file().dtype
+        if bases.size == 0:
+            return np.empty((0, band_offsets.size), dtype)
+
+        # the extent of one pixel's band values in the file
+        span = int(band_offsets[-1]) + 1
+        if span <= max_gap:
+            result = np.empty((bases.size, band_offsets.size), dtype)
+            # each pixel's bands are close together so read all bands of a run of pixels at once
+            for first, last in FileTypeDelegate.__runs(bases, span, max_gap, max_read):
+                start = int(bases[first])
+                data = self._file_model.read_flat(start, int(bases[last - 1]) + span)
+                result[first:last] = data[(bases[first:last] - start)[:, np.newaxis] + band_offsets]
+        else:
+            # read a run of pixels one band at a time, in file order, filling
+            # the result a band at a time too
+            band_result = np.empty((band_offsets.size, bases.size), dtype)
+            result = band_result.transpose()
+            runs = FileTypeDelegate.__runs(bases, 1, max_gap, max_read)
+            run_starts = bases[[first for first, last in runs]]
+            read_starts = run_starts[:, np.newaxis] + band_offsets
+            for read in np.argsort(read_starts, axis=None, kind="stable"):
+                run, band = divmod(int(read), band_offsets.size)
+                first, last = runs[run]
+                start = int(read_starts[run, band])
+                data = self._file_model.read_flat(start, start + int(bases[last - 1] - bases[first]) + 1)
+                band_result[band, first:last] = data[bases[first:last] - bases[first]]
+
+        return result[inverse]
+
+    @staticmethod
+    def __runs(bases:np.ndarray, span:int, max_gap:int, max_read:int) -> List[Tuple[int, int]]:
+        """Group the sorted bases into (first, last) runs, each covering span elements from each base"""
+        breaks = np.append(np.flatnonzero(bases[1:] - bases[:-1] - span > max_gap) + 1, bases.size)
+        runs = list()
+        first = 0
+        while first < bases.size:
+            next_break = int(breaks[np.searchsorted(breaks, first, "right")])
+            last = max(first + 1, min(next_break,
+                int(np.searchsorted(bases, bases[first] + max_read - span, "right"))))
+            runs.append((first, last))
+            first = last
+
+        return runs
+
+    @staticmethod
+    def __check_indices(index:Union[tuple, np.ndarray], size:int) -> np.ndarray:
+        indices = np.asarray(index, dtype=np.int64).reshape(-1)
+        if np.any(indices >= size) or np.any(indices < -size):
+            raise IndexError("index out of bounds for axis with size {0}".format(size))
+
+        return np.where(indices < 0, indices + size, indices)
+
 
 class BILFileDelegate(FileTypeDelegate):
     """An 'interleave': 'bil' file"""
@@ -991,6 +1220,10 @@ class BILFileDelegate(FileTypeDelegate):
         returns a view of the underlying data while using a tuple or ndarray returns a copy.
         See https://docs.scipy.org/doc/numpy/reference/arrays.indexing.html
         for more details"""
+        if self._use_gather(line, sample):
+            shape = self.shape()
+            return self._gather_bands(line, sample, shape.bands() * shape.samples(), 1, shape.samples())
+
         return self._file_model.file()[line, :, sample]
 
     def cube(self, lines:Tuple[int, int], samples:Tuple[int, int],
@@ -998,6 +1231,15 @@ class BILFileDelegate(FileTypeDelegate):
         args = CubeSliceArgs(lines, samples, bands)
         return self._file_model.file()[args.line_arg(), args.band_arg(), args.sample_arg()]
 
+    def data_ranges(self, lines:Tuple[int, int], bands:Tuple[int, int]) -> List[Tuple[int, int]]:
+        shape = self.shape()
+        line_size = shape.bands() * shape.samples()
+        if bands[0] == 0 and bands[1] == shape.bands():
+            return [(lines[0] * line_size, lines[1] * line_size)]
+        else:
+            return [(line * line_size + bands[0] * shape.samples(), line * line_size + bands[1] * shape.samples())
+                    for line in range(lines[0], lines[1])]
+
 
 class BQSFileDelegate(FileTypeDelegate):
     """An 'interleave': 'bsq' file"""
@@ -1023,13 +1265,29 @@ class BQSFileDelegate(FileTypeDelegate):
         returns a view of the underlying data while using a tuple or ndarray returns a copy.
         See https://docs.scipy.org/doc/numpy/reference/arrays.indexing.html
         for more details"""
-        return self._file_model.file()[:, line, sample]
+        if self._use_gather(line, sample):
+            shape = self.shape()
+            return self._gather_bands(line, sample, shape.samples(), 1, shape.lines() * shape.samples())
+
+        # numpy puts the pixels after the bands here since the index arrays are next to
+        # each other, move the bands last so the result matches the other interleaves
+        bands = self._file_model.file()[:, line, sample]
+        return np.moveaxis(bands, 0, -1) if bands.ndim > 1 else bands
 
     def cube(self, lines:Tuple[int, int], samples:Tuple[int, int],
             bands:Union[Tuple[int, int], List[int]]) -> np.ndarray:
         args = CubeSliceArgs(lines, samples, bands)
         return self._file_model.file()[args.band_arg(), args.line_arg(), args.sample_arg()]
 
+    def data_ranges(self, lines:Tuple[int, int], bands:Tuple[int, int]) -> List[Tuple[int, int]]:
+        shape = self.shape()
+        band_size = shape.lines() * shape.samples()
+        if lines[0] == 0 and lines[1] == shape.lines():
+            return [(bands[0] * band_size, bands[1] * band_size)]
+        else:
+            return [(band * band_size + lines[0] * shape.samples(), band * band_size + lines[1] * shape.samples())
+                    for band in range(bands[0], bands[1])]
+
 
 class BIPFileDelegate(FileTypeDelegate):
     """An 'interleave': 'bip' file"""
@@ -1055,6 +1313,10 @@ class BIPFileDelegate(FileTypeDelegate):
         returns a view of the underlying data while using a tuple or ndarray returns a copy.
         See https://docs.scipy.org/doc/numpy/reference/arrays.indexing.html
         for more details"""
+        if self._use_gather(line, sample):
+            shape = self.shape()
+            return self._gather_bands(line, sample, shape.samples() * shape.bands(), shape.bands(), 1)
+
         return self._file_model.file()[line, sample, :]
 
     def cube(self, lines:Tuple[int, int], samples:Tuple[int, int],
@@ -1062,47 +1324,1551 @@ class BIPFileDelegate(FileTypeDelegate):
         args = CubeSliceArgs(lines, samples, bands)
         return self._file_model.file()[args.line_arg(), args.sample_arg(), args.band_arg()]
 
+    def data_ranges(self, lines:Tuple[int, int], bands:Tuple[int, int]) -> List[Tuple[int, int]]:
+        # the bands for each pixel are stored together so a range of bands
+        # always touches every sample of each line
+        line_size = self.shape().samples() * self.shape().bands()
+        return [(lines[0] * line_size, lines[1] * line_size)]
 
-class MemoryModel(FileModel):
 
-    def __init__(self, path:Path, header: OpenSpectraHeader):
+class CachedFileDelegate(FileTypeDelegate):
+    """Wraps one of the interleave specific delegates and keeps native byte order copies
+    of whole bands in a TileCache.  An image selected with an int index is put in the cache
+    the first time and the cached array itself is returned after that.  Bands bigger
+    than a quarter of the cache are never cached and always come from the wrapped delegate
+    so a band that won't stay in the cache isn't copied on every call.  Bands for a single
+    pixel are taken from the cache if every band is already cached, everything else is passed
+    through to the wrapped delegate.  Arrays returned from the cache are read only"""
+
+    def __init__(self, delegate:FileTypeDelegate, cache:TileCache):
+        super().__init__(delegate.shape(), delegate._file_model)
+        self.__delegate = delegate
+        self.__cache = cache
+
+    def image(self, band:Union[int, tuple]) -> np.ndarray:
+        if isinstance(band, (int, np.integer)) and self.is_cacheable():
+            band = self.__normalize(band, self.shape().bands())
+            return self.__cache.get_or_load(band, lambda: self.__load_band(band))
+        else:
+            return self.__delegate.image(band)
+
+    def bands(self, line:Union[int, tuple, np.ndarray], sample:Union[int, tuple, np.ndarray]) -> np.ndarray:
+        if isinstance(line, (int, np.integer)) and isinstance(sample, (int, np.integer)):
+            band_count = self.shape().bands()
+
+            # Only use the cache if all of the bands needed are already there, loading
+            # every band to get a single pixel would cost much more than reading the
+            # pixel directly
+            if all(self.__cache.contains(band) for band in range(band_count)):
+                images = [self.__cache.get(band) for band in range(band_count)]
+
+                # a band may have been evicted after we checked
+                if all(image is not None for image in images):
+                    return np.array([image[line, sample] for image in images])
+
+        return self.__delegate.bands(line, sample)
+
+    def cube(self, lines:Tuple[int, int], samples:Tuple[int, int],
+            bands:Union[Tuple[int, int], List[int]]) -> np.ndarray:
+        return self.__delegate.cube(lines, samples, bands)
+
+    def data_ranges(self, lines:Tuple[int, int], bands:Tuple[int, int]) -> List[Tuple[int, int]]:
+        return self.__delegate.data_ranges(lines, bands)
+
+    def tile_cache(self) -> TileCache:
+        return self.__cache
+
+    def is_cached(self, band:int) -> bool:
+        return self.__cache.contains(int(band) % self.shape().bands())
+
+    def is_cacheable(self) -> bool:
+        """True if a band is small enough to be cached, at most a quarter of the cache so
+        the band being looked at isn't pushed out by loading the few around it"""
+        band_bytes = self.shape().lines() * self.shape().samples() * self._file_model.file().dtype.itemsize
+        return band_bytes <= self.__cache.max_size() // 4
+
+    def __load_band(self, band:int) -> np.ndarray:
+        data = self.__delegate.image(band)
+        # data that's already contiguous in native byte order, a band of a bsq file
+        # for example, isn't copied, the cache then holds the view of the file
+        image = np.ascontiguousarray(data, dtype=data.dtype.newbyteorder("="))
+        image.flags.writeable = False
+        return image
+
+    @staticmethod
+    def __normalize(index:int, size:int) -> int:
+        index = int(index)
+        if not -size <= index < size:
+            raise IndexError("index {0} is out of bounds for size {1}".format(index, size))
+
+        return index + size if index < 0 else index
+
+
+class PinnedFileDelegate(FileTypeDelegate):
+    """Wraps another delegate and holds chosen bands, and optionally one range of lines,
+    in memory as contiguous native byte order arrays while everything else is passed
+    through to the wrapped delegate.  Images for a pinned band, band values for pixels in
+    the pinned lines and cubes within the pinned lines or of only pinned bands are served
+    from memory.  Bands can be pinned or unpinned at any time from any thread, pinning stops
+    once the pinned data would be more than memory_limit bytes, PinnedMemoryLimit in
+    openspectra.properties by default.  Pinned data is registered with the MemoryAccountant
+    as releasable, each pinned band and the pinned lines are unpinned least recently used
+    first when the accountant's ceiling is reached.  Arrays returned from the pinned data
+    are read only"""
+
+    __LOG:Logger = LogHelper.logger("PinnedFileDelegate")
+
+    def __init__(self, delegate:FileTypeDelegate, owner:str, memory_limit:int=None):
+        super().__init__(delegate.shape(), delegate._file_model)
+        self.__delegate = delegate
+        self.__owner = owner
+        self.__axes = OpenSpectraHeader.interleave_axes(delegate.shape().interleave())
+
+        self.__memory_limit = memory_limit
+        if self.__memory_limit is None:
+            self.__memory_limit = OpenSpectraProperties.get_property("PinnedMemoryLimit", 536870912)
+
+        self.__lock = threading.Lock()
+        self.__bands:Dict[int, np.ndarray] = dict()
+        self.__band_keys:Dict[int, int] = dict()
+        # the (start, end) of the pinned lines and their data in (lines, samples, bands) order,
+        # always replaced as a whole so readers that take it once see a consistent pair
+        self.__lines:Tuple[Tuple[int, int], np.ndarray] = None
+        self.__line_key:int = None
+
+    def image(self, band:Union[int, tuple]) -> np.ndarray:
+        if isinstance(band, (int, np.integer)):
+            band = int(band) + self.shape().bands() if band < 0 else int(band)
+            pinned = self.__bands.get(band)
+            if pinned is not None:
+                self.__touch(self.__band_keys.get(band))
+                return pinned
+
+            pinned_lines = self.__lines
+            if pinned_lines is not None and pinned_lines[0] == (0, self.shape().lines()):
+                self.__touch(self.__line_key)
+                return pinned_lines[1][:, :, band]
+
+        return self.__delegate.image(band)
+
+    def bands(self, line:Union[int, tuple, np.ndarray], sample:Union[int, tuple, np.ndarray]) -> np.ndarray:
+        pinned_lines = self.__lines
+        if pinned_lines is not None:
+            (start, end), line_data = pinned_lines
+            line_index = np.asarray(line)
+            if line_index.size > 0 and np.all((start <= line_index) & (line_index < end)):
+                self.__touch(self.__line_key)
+                return line_data[line_index - start, sample]
+
+        return self.__delegate.bands(line, sample)
+
+    def cube(self, lines:Tuple[int, int], samples:Tuple[int, int],
+            bands:Union[Tuple[int, int], List[int]]) -> np.ndarray:
+        args = CubeSliceArgs(lines, samples, bands)
+        pinned_lines = self.__lines
+        if pinned_lines is not None and pinned_lines[0][0] <= lines[0] and lines[1] <= pinned_lines[0][1]:
+            (start, end), line_data = pinned_lines
+            line_arg = slice(args.line_arg().start - start, args.line_arg().stop - start)
+            self.__touch(self.__line_key)
+            return line_data[line_arg, args.sample_arg(), args.band_arg()].transpose(self.__axes)
+
+        band_list = bands if isinstance(bands, list) else list(range(bands[0], bands[1]))
+        pinned = [self.__bands.get(band) for band in band_list]
+        if len(pinned) > 0 and all(image is not None for image in pinned):
+            for band in band_list:
+                self.__touch(self.__band_keys.get(band))
+            return np.stack([image[args.line_arg(), args.sample_arg()] for image in pinned], 2).transpose(self.__axes)
+
+        return self.__delegate.cube(lines, samples, bands)
+
+    def data_ranges(self, lines:Tuple[int, int], bands:Tuple[int, int]) -> List[Tuple[int, int]]:
+        return self.__delegate.data_ranges(lines, bands)
+
+    def tile_cache(self) -> TileCache:
+        return self.__delegate.tile_cache()
+
+    def is_cacheable(self) -> bool:
+        return self.__delegate.is_cacheable()
+
+    def is_cached(self, band:int) -> bool:
+        pinned_lines = self.__lines
+        return band in self.__bands or (pinned_lines is not None and pinned_lines[0] == (0, self.shape().lines())) \
+            or self.__delegate.is_cached(band)
+
+    def pinned_bands(self) -> List[int]:
+        return sorted(self.__bands.keys())
+
+    def pinned_lines(self) -> Tuple[int, int]:
+        pinned_lines = self.__lines
+        return pinned_lines[0] if pinned_lines is not None else None
+
+    def pinned_bytes(self) -> int:
+        with self.__lock:
+            return self.__pinned_bytes()
+
+    def pin_bands(self, bands:List[int]) -> List[int]:
+        """Read the bands not already pinned into memory, returns the bands that are
+        pinned afterwards.  Bands that would take the pinned data over the memory limit
+        aren't pinned"""
+        shape = self.shape()
+        band_bytes = shape.lines() * shape.samples() * self._file_model.data_type().itemsize
+        with self.__lock:
+            available = self.__memory_limit - self.__pinned_bytes()
+
+        new_bands = list()
+        for band in dict.fromkeys(bands):
+            band = int(band)
+            if not 0 <= band < shape.bands():
+                raise IndexError("band {0} is out of bounds for size {1}".format(band, shape.bands()))
+
+            if band not in self.__bands:
+                if available < band_bytes:
+                    PinnedFileDelegate.__LOG.info("Not pinning band {0} of {1}, the pinned memory limit was reached",
+                        band, self.__owner)
+                    continue
+                new_bands.append(band)
+                available -= band_bytes
+
+        # read all the new bands in blocks of lines, so each block is a single pass in file order
+        images = self.__read_bands(new_bands)
+        with self.__lock:
+            images = {band: image for band, image in images.items() if band not in self.__bands}
+            self.__bands.update(images)
+
+        # register without holding the lock, reaching the ceiling may call __release_band
+        delegate = weakref.ref(self)
+        for band, image in images.items():
+            key = MemoryAccountant().register(self.__owner, "pinned bands", image.nbytes,
+                lambda band=band, image=image: PinnedFileDelegate.__release_band(delegate, band, image), self)
+            with self.__lock:
+                if self.__bands.get(band) is image:
+                    self.__band_keys[band] = key
+                    key = None
+
+            # already unpinned or released
+            if key is not None:
+                MemoryAccountant().unregister(key)
+
+        pinned = [int(band) for band in dict.fromkeys(bands) if int(band) in self.__bands]
+
+        if len(new_bands) > 0:
+            PinnedFileDelegate.__LOG.debug("Pinned bands {0} of {1}", new_bands, self.__owner)
+        return pinned
+
+    def unpin_bands(self, bands:List[int]):
+        with self.__lock:
+            for band in bands:
+                self.__bands.pop(band, None)
+                key = self.__band_keys.pop(band, None)
+                if key is not None:
+                    MemoryAccountant().unregister(key)
+
+    def pin_lines(self, lines:Tuple[int, int]) -> bool:
+        """Read the lines from lines[0] to lines[1] - 1 into memory replacing any lines already
+        pinned, returns False if they'd take the pinned data over the memory limit"""
+        shape = self.shape()
+        start, end = min(lines), max(lines)
+        if start < 0 or end > shape.lines() or start == end:
+            raise ValueError("Lines must be a range within 0 to {0}".format(shape.lines()))
+
+        line_bytes = (end - start) * shape.samples() * shape.bands() * self._file_model.data_type().itemsize
+        self.unpin_lines()
+        with self.__lock:
+            if self.__pinned_bytes() + line_bytes > self.__memory_limit:
+                PinnedFileDelegate.__LOG.info("Not pinning lines {0} of {1}, the pinned memory limit was reached",
+                    (start, end), self.__owner)
+                return False
+
+        data = self.__delegate.cube((start, end), (0, shape.samples()), (0, shape.bands())).\
+            transpose(np.argsort(self.__axes))
+        line_data = np.ascontiguousarray(data, dtype=data.dtype.newbyteorder("="))
+        line_data.flags.writeable = False
+
+        pinned_lines = ((start, end), line_data)
+        with self.__lock:
+            self.__lines = pinned_lines
+
+        delegate = weakref.ref(self)
+        key = MemoryAccountant().register(self.__owner, "pinned lines", line_data.nbytes,
+            lambda: PinnedFileDelegate.__release_lines(delegate, pinned_lines), self)
+        with self.__lock:
+            if self.__lines is pinned_lines:
+                self.__line_key = key
+                key = None
+
+        if key is not None:
+            MemoryAccountant().unregister(key)
+
+        return self.__lines is pinned_lines
+
+    def unpin_lines(self):
+        with self.__lock:
+            self.__lines = None
+            if self.__line_key is not None:
+                MemoryAccountant().unregister(self.__line_key)
+                self.__line_key = None
+
+    @staticmethod
+    def __touch(key:int):
+        if key is not None:
+            MemoryAccountant().touch(key)
+
+    @staticmethod
+    def __release_band(delegate:"weakref.ref", band:int, image:np.ndarray):
+        delegate = delegate()
+        if delegate is not None:
+            with delegate.__lock:
+                # the band may have been unpinned and pinned again since it was registered
+                if delegate.__bands.get(band) is image:
+                    del delegate.__bands[band]
+                    delegate.__band_keys.pop(band, None)
+
+    @staticmethod
+    def __release_lines(delegate:"weakref.ref", pinned_lines:Tuple[Tuple[int, int], np.ndarray]):
+        delegate = delegate()
+        if delegate is not None:
+            with delegate.__lock:
+                if delegate.__lines is pinned_lines:
+                    delegate.__lines = None
+                    delegate.__line_key = None
+
+    def __pinned_bytes(self) -> int:
+        line_bytes = self.__lines[1].nbytes if self.__lines is not None else 0
+        return line_bytes + sum(image.nbytes for image in self.__bands.values())
+
+    def __read_bands(self, bands:List[int]) -> Dict[int, np.ndarray]:
+        if len(bands) == 0:
+            return dict()
+
+        shape = self.shape()
+        data_type = self._file_model.data_type().newbyteorder("=")
+        images = {band: np.empty((shape.lines(), shape.samples()), data_type) for band in bands}
+
+        memory_limit = OpenSpectraProperties.get_property("BlockMemoryLimit", 67108864)
+        step = max(1, memory_limit // max(1, shape.samples() * len(bands) * data_type.itemsize))
+        band_arg = bands if len(bands) > 1 else (bands[0], bands[0] + 1)
+        for start in range(0, shape.lines(), step):
+            end = min(start + step, shape.lines())
+            block = self.__delegate.cube((start, end), (0, shape.samples()), band_arg).\
+                transpose(np.argsort(self.__axes))
+            for index, band in enumerate(bands):
+                images[band][start:end] = block[:, :, index]
+
+        for image in images.values():
+            image.flags.writeable = False
+
+        return images
+
+
+class MemoryModel(FileModel):
+    """Loads the entire data file into memory.  The array is allocated once from the
+    header's shape and filled in place, files larger than the chunk size are read in
+    parallel by several threads each working on a disjoint byte range of the file.
+    If a progress_callback is supplied it is called with the number of bytes read so far
+    and the total number of bytes to read.  Note that it may be called from a thread
+    other than the one that called load().  If it raises an exception, for example
+    OpenSpectraFileCancelled, every thread stops reading and load() raises it"""
+
+    __LOG:Logger = LogHelper.logger("MemoryModel")
+
+    def __init__(self, path:Path, header: OpenSpectraHeader,
+            progress_callback:Callable[[int, int], None]=None, read_threads:int=None, chunk_size:int=None):
         super().__init__(path, header)
+        self.__progress_callback = progress_callback
+
+        self.__read_threads = read_threads
+        if self.__read_threads is None:
+            self.__read_threads = OpenSpectraProperties.get_property("MemoryModelReadThreads", 4)
+
+        self.__chunk_size = chunk_size
+        if self.__chunk_size is None:
+            self.__chunk_size = OpenSpectraProperties.get_property("MemoryModelChunkSize", 67108864)
+
+        self.__total_bytes:int = 0
+        self.__bytes_read:int = 0
+        self.__progress_lock = threading.Lock()
+        # set when any reader fails so the others stop too
+        self.__stop = threading.Event()
 
     def load(self, shape:Shape):
-        self._file = np.array([], self._data_type)
-        with self._path.open("rb") as file:
-            file.seek(self._offset)
-            bytes_in = file.read()
-            while bytes_in:
-                self._file = np.append(self._file, np.frombuffer(bytes_in, self._data_type))
-                bytes_in = file.read()
+        self.__total_bytes = shape.size() * self._data_type.itemsize
+        self.__bytes_read = 0
+        self.__stop.clear()
+
+        available_bytes = self._path.stat().st_size - self._offset
+        if available_bytes != self.__total_bytes:
+            raise OpenSpectraFileError("Expected {0} data points but found {1}".
+                format(shape.size(), available_bytes // self._data_type.itemsize))
+
+        self._file = np.empty(shape.shape(), self._data_type)
+        buffer = memoryview(self._file.reshape(-1).view(np.uint8))
+
+        worker_count = min(self.__read_threads, math.ceil(self.__total_bytes / self.__chunk_size))
+        if worker_count > 1:
+            MemoryModel.__LOG.debug("Loading {0} bytes from {1} using {2} threads",
+                self.__total_bytes, self.name(), worker_count)
+
+            range_size = math.ceil(self.__total_bytes / worker_count)
+            with ThreadPoolExecutor(max_workers=worker_count) as executor:
+                futures = [executor.submit(self.__read_range, buffer, start, min(start + range_size, self.__total_bytes))
+                           for start in range(0, self.__total_bytes, range_size)]
+
+                # result() re-raises any error that occurred in the worker
+                for future in futures:
+                    future.result()
+        else:
+            self.__read_range(buffer, 0, self.__total_bytes)
+
+        # we own this copy of the data so swap it to native byte order in place
+        if not self._file.dtype.isnative:
+            self._file = self._file.byteswap(inplace=True).view(self._data_type.newbyteorder("="))
 
         self._validate(shape)
-        self._file = self._file.reshape(shape.shape())
+
+    def raw_path(self) -> Path:
+        return self._path
+
+    def __read_range(self, buffer:memoryview, start:int, end:int):
+        try:
+            with self._path.open("rb", buffering=0) as file:
+                file.seek(self._offset + start)
+                position = start
+                while position < end and not self.__stop.is_set():
+                    chunk_end = min(position + self.__chunk_size, end)
+                    count = file.readinto(buffer[position:chunk_end])
+                    if not count:
+                        raise OpenSpectraFileError("Unexpected end of file {0} at byte {1}".
+                            format(self.name(), self._offset + position))
+
+                    position += count
+                    self.__report_progress(count)
+        except BaseException:
+            self.__stop.set()
+            raise
+
+    def __report_progress(self, count:int):
+        with self.__progress_lock:
+            self.__bytes_read += count
+            bytes_read = self.__bytes_read
+
+        if self.__progress_callback is not None:
+            self.__progress_callback(bytes_read, self.__total_bytes)
 
 
 class MappedModel(FileModel):
 
+    __LOG:Logger = LogHelper.logger("MappedModel")
+
     def __init__(self, path:Path, header:OpenSpectraHeader):
         super().__init__(path, header)
+        self.__mapped:mmap.mmap = None
+
+    def load(self, shape:Shape):
+        # map the whole file ourselves rather than with np.memmap so
+        # the mapping is at hand for access hints, see advise
+        with open(self._path, "rb") as data_file:
+            self.__mapped = mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self.__mapped) < self._offset + shape.size() * self._data_type.itemsize:
+            raise OpenSpectraFileError("Expected {0} data points but the file {1} is too short".
+                format(shape.size(), self._path.name))
+
+        self._file = np.ndarray(shape.shape(), self._data_type, buffer=self.__mapped, offset=self._offset)
+        self._validate(shape)
+
+    def indexes_points(self) -> bool:
+        # the data is read from the file as it's indexed
+        return False
+
+    def raw_path(self) -> Path:
+        return self._path
+
+    def advise(self, hint:AccessHint, ranges:List[Tuple[int, int]]):
+        option = getattr(mmap, hint.value, None)
+        if self.__mapped is None or option is None or not hasattr(self.__mapped, "madvise"):
+            MappedModel.__LOG.debug("Access hint {0} not supported, ignoring", hint)
+            return
+
+        # the mapping starts at the beginning of the file
+        for page_start, page_end in self._byte_ranges(ranges, self._offset, mmap.PAGESIZE, len(self.__mapped)):
+            self.__mapped.madvise(option, page_start, page_end - page_start)
+
+
+class FileArray:
+    """A read only, array like view of a data cube that isn't held in memory.  Indexing
+    supports what the FileTypeDelegates need, any combination of ints, slices and sequences
+    or one dimensional arrays of ints, with the same result numpy would give.  Each index
+    request is reduced to the sorted unique indices needed along each axis which are passed
+    to _read, subclasses implement _read to fetch that block of data"""
+
+    def __init__(self, shape:Tuple[int, ...], dtype:np.dtype):
+        self.__shape = tuple(shape)
+        self.__dtype = np.dtype(dtype)
+        self.__size = int(np.prod(self.__shape))
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self.__shape
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.__dtype
+
+    @property
+    def ndim(self) -> int:
+        return len(self.__shape)
+
+    @property
+    def size(self) -> int:
+        return self.__size
+
+    def __len__(self) -> int:
+        return self.__shape[0]
+
+    def __getitem__(self, key) -> np.ndarray:
+        if not isinstance(key, tuple):
+            key = (key,)
+
+        if len(key) > self.ndim:
+            raise IndexError("too many indices for array, array is {0}-dimensional but {1} were indexed".
+                format(self.ndim, len(key)))
+
+        key = [self.__normalize(index, size) for index, size in zip(key, self.__shape)] + \
+              [slice(None)] * (self.ndim - len(key))
+
+        # numpy pairs up multiple index arrays element by element rather than
+        # taking their outer product so read those one point at a time
+        if sum(isinstance(index, np.ndarray) for index in key) > 1:
+            return self.__read_points(key)
+        else:
+            return self.__read_block(key)
+
+    def read_flat(self, start:int, end:int) -> np.ndarray:
+        """Returns the data elements from start to end in the order they are stored,
+        only supported for three dimensional arrays"""
+        # read whole rows along the last axis, a partial plane at each
+        # end and any whole planes between them, then trim to the range
+        plane_rows, row_length = self.__shape[1], self.__shape[2]
+        first_row, end_row = start // row_length, min(self.__size // row_length, math.ceil(end / row_length))
+
+        blocks = list()
+        row = first_row
+        while row < end_row:
+            plane, plane_row = divmod(row, plane_rows)
+            if plane_row == 0 and end_row - row >= plane_rows:
+                block_end = row + (end_row - row) // plane_rows * plane_rows
+                block = self[plane:block_end // plane_rows]
+            else:
+                block_end = min(end_row, (plane + 1) * plane_rows)
+                block = self._read([np.array([plane]), np.arange(plane_row, plane_row + block_end - row),
+                    np.arange(row_length)])
+
+            blocks.append(block.reshape(-1))
+            row = block_end
+
+        data = np.concatenate(blocks) if len(blocks) > 0 else np.empty(0, self.__dtype)
+        return data[start - first_row * row_length:end - first_row * row_length]
+
+    def _read(self, indices:List[np.ndarray]) -> np.ndarray:
+        """Return an array with the data at the outer product of indices, one
+        array of sorted, unique indices per axis, none of them are empty"""
+        pass
+
+    def __read_block(self, key:List[Union[int, slice, np.ndarray]]) -> np.ndarray:
+        indices = list()
+        block_key = list()
+        for index, size in zip(key, self.__shape):
+            if isinstance(index, int):
+                indices.append(np.array([index]))
+                block_key.append(0)
+            elif isinstance(index, slice):
+                selected = np.arange(*index.indices(size))
+                if index.step is not None and index.step < 0:
+                    indices.append(selected[::-1])
+                    block_key.append(slice(None, None, -1))
+                else:
+                    indices.append(selected)
+                    block_key.append(slice(None))
+            else:
+                unique, inverse = np.unique(index, return_inverse=True)
+                indices.append(unique)
+                block_key.append(inverse.reshape(index.shape))
+
+        if any(axis_indices.size == 0 for axis_indices in indices):
+            block = np.empty(tuple(axis_indices.size for axis_indices in indices), self.__dtype)
+        else:
+            block = self._read(indices)
+
+        return block[tuple(block_key)]
+
+    def __read_points(self, key:List[Union[int, slice, np.ndarray]]) -> np.ndarray:
+        # ints count as index arrays when they are mixed with arrays
+        point_axes = [axis for axis, index in enumerate(key) if not isinstance(index, slice)]
+        points = np.broadcast_arrays(*[np.asarray(key[axis]) for axis in point_axes])
+        point_shape = points[0].shape
+
+        point_key = list(key)
+        values = list()
+        for point in zip(*[axis_points.reshape(-1) for axis_points in points]):
+            for axis, index in zip(point_axes, point):
+                point_key[axis] = int(index)
+            values.append(self.__read_block(point_key))
+
+        slice_shape = tuple(len(range(*index.indices(size))) for index, size in zip(key, self.__shape)
+                            if isinstance(index, slice))
+        result = np.stack(values) if len(values) > 0 else np.empty((0,) + slice_shape, self.__dtype)
+        result = result.reshape(point_shape + slice_shape)
+
+        # when the index arrays are next to each other numpy puts the
+        # result's point dimensions where they were, otherwise first
+        if point_axes == list(range(point_axes[0], point_axes[-1] + 1)) and point_axes[0] > 0:
+            point_dims = range(len(point_shape))
+            result = np.moveaxis(result, point_dims, [point_axes[0] + dim for dim in point_dims])
+
+        return result
+
+    @staticmethod
+    def __normalize(index, size:int) -> Union[int, slice, np.ndarray]:
+        if isinstance(index, slice):
+            return index
+        elif isinstance(index, (int, np.integer)):
+            index = int(index)
+            if not -size <= index < size:
+                raise IndexError("index {0} is out of bounds for axis with size {1}".format(index, size))
+            return index + size if index < 0 else index
+        else:
+            array = np.asarray(index)
+            if array.size == 0:
+                array = array.astype(np.intp)
+
+            if array.ndim == 0 or not np.issubdtype(array.dtype, np.integer):
+                raise IndexError("only integers, slices and integer arrays are valid indices")
+
+            if np.any(array >= size) or np.any(array < -size):
+                raise IndexError("index out of bounds for axis with size {0}".format(size))
+            return np.where(array < 0, array + size, array)
+
+
+class RunFileArray(FileArray):
+    """A FileArray that breaks requests into runs of file contiguous data, runs separated
+    by gaps of max_gap bytes or less are read together with a single call up to max_read
+    bytes.  Where the data for a run is contiguous in the result it's read directly into
+    the result, otherwise it's read into a buffer kept by each thread and reused.
+    Subclasses implement _read_into to fetch a run"""
+
+    def __init__(self, shape:Tuple[int, ...], dtype:np.dtype, max_gap:int, max_read:int):
+        super().__init__(shape, dtype)
+        self.__max_gap = max_gap // self.dtype.itemsize
+        self.__max_read = max(1, max_read // self.dtype.itemsize)
+        self.__buffers = threading.local()
+
+    def _read(self, indices:List[np.ndarray]) -> np.ndarray:
+        result = np.empty(tuple(axis_indices.size for axis_indices in indices), self.dtype)
+        rows = result.reshape(-1, result.shape[-1])
+
+        # the element offset of the start of each row of data needed, in file order
+        row_starts = np.zeros(1, np.int64)
+        for axis, axis_indices in enumerate(indices[:-1]):
+            row_starts = (row_starts[:, np.newaxis] * self.shape[axis] + axis_indices).reshape(-1)
+        row_starts = row_starts * self.shape[-1]
+
+        columns = indices[-1]
+        first_column = int(columns[0])
+        column_span = int(columns[-1]) - first_column + 1
+        full_rows = column_span == columns.size
+
+        starts = row_starts + first_column
+        ends = starts + column_span
+
+        # rows that must start a new run because the gap before them is too big
+        breaks = np.append(np.flatnonzero(starts[1:] - ends[:-1] > self.__max_gap) + 1, rows.shape[0])
+
+        row = 0
+        while row < rows.shape[0]:
+            # extend the run up to the next big gap or as far as fits in max_read
+            next_break = int(breaks[np.searchsorted(breaks, row, "right")])
+            end_row = max(row + 1, min(next_break, int(np.searchsorted(ends, starts[row] + self.__max_read, "right"))))
+
+            run_start = int(starts[row])
+            run_length = int(starts[end_row - 1]) + column_span - run_start
+            if full_rows and run_length == (end_row - row) * column_span:
+                self._read_into(memoryview(rows[row:end_row].reshape(-1).view(np.uint8)), run_start)
+            else:
+                buffer = self.__buffer(run_length)
+                self._read_into(memoryview(buffer)[:run_length * self.dtype.itemsize], run_start)
+                data = np.frombuffer(buffer, self.dtype, run_length)
+                rows[row:end_row] = data[(starts[row:end_row] - run_start)[:, np.newaxis] +
+                                         (columns - first_column)[np.newaxis, :]]
+
+            row = end_row
+
+        return result
+
+    def __buffer(self, length:int) -> bytearray:
+        buffer = getattr(self.__buffers, "buffer", None)
+        if buffer is None or len(buffer) < length * self.dtype.itemsize:
+            buffer = bytearray(length * self.dtype.itemsize)
+            self.__buffers.buffer = buffer
+
+        return buffer
+
+    def read_flat(self, start:int, end:int) -> np.ndarray:
+        data = np.empty(max(0, min(end, self.size) - start), self.dtype)
+        if data.size > 0:
+            self._read_into(memoryview(data.view(np.uint8)), start)
+        return data
+
+    def _read_into(self, buffer:memoryview, start:int):
+        """Fill buffer with the data starting at element offset start"""
+        pass
+
+
+class PreadFileArray(RunFileArray):
+    """A RunFileArray that reads with os.preadv.  Any number of threads can read at
+    the same time since pread doesn't share a file position"""
+
+    def __init__(self, fd:int, offset:int, shape:Tuple[int, ...], dtype:np.dtype, max_gap:int, max_read:int):
+        super().__init__(shape, dtype, max_gap, max_read)
+        self.__fd = fd
+        self.__offset = offset
+
+    def _read_into(self, buffer:memoryview, start:int):
+        file_offset = self.__offset + start * self.dtype.itemsize
+        position = 0
+        while position < len(buffer):
+            count = os.preadv(self.__fd, [buffer[position:]], file_offset + position)
+            if count == 0:
+                raise OpenSpectraFileError("Unexpected end of file at byte {0}".format(file_offset + position))
+            position += count
+
+
+class PreadModel(FileModel):
+    """Reads the data for each request from the file with os.preadv rather than mapping
+    or loading the whole file.  Memory use is limited to the data requested plus a read
+    buffer for each thread and reads never block on page faults so several threads can
+    read at the same time.  Only available on platforms that support preadv"""
+
+    __LOG:Logger = LogHelper.logger("PreadModel")
+
+    def __init__(self, path:Path, header:OpenSpectraHeader, max_gap:int=None, max_read:int=None):
+        super().__init__(path, header)
+        self.__fd:int = None
+        if not hasattr(os, "preadv"):
+            raise OpenSpectraFileError("The pread model is not supported on this platform")
+
+        self.__max_gap = max_gap
+        if self.__max_gap is None:
+            self.__max_gap = OpenSpectraProperties.get_property("PreadMaxGap", 65536)
+
+        self.__max_read = max_read
+        if self.__max_read is None:
+            self.__max_read = OpenSpectraProperties.get_property("PreadMaxRead", 16777216)
+
+    def __del__(self):
+        if self.__fd is not None:
+            os.close(self.__fd)
 
     def load(self, shape:Shape):
-        self._file = np.memmap(self._path, dtype = self._data_type, mode = 'r',
-            offset=self._offset, shape = shape.shape())
+        data_size = shape.size() * self._data_type.itemsize
+        available_bytes = self._path.stat().st_size - self._offset
+        if available_bytes < data_size:
+            raise OpenSpectraFileError("Expected {0} data points but found {1}".
+                format(shape.size(), available_bytes // self._data_type.itemsize))
+
+        self.__fd = os.open(str(self._path), os.O_RDONLY)
+        self._file = PreadFileArray(self.__fd, self._offset, shape.shape(), self._data_type,
+            self.__max_gap, self.__max_read)
+        self._validate(shape)
+
+    def raw_path(self) -> Path:
+        return self._path
+
+    def advise(self, hint:AccessHint, ranges:List[Tuple[int, int]]):
+        option = getattr(os, hint.value.replace("MADV_", "POSIX_FADV_"), None)
+        if option is None or not hasattr(os, "posix_fadvise"):
+            PreadModel.__LOG.debug("Access hint {0} not supported, ignoring", hint)
+            return
+
+        for start, end in self._byte_ranges(ranges, self._offset, 1, self._path.stat().st_size):
+            os.posix_fadvise(self.__fd, start, end - start, option)
+
+
+class ChunkedContainer:
+    """Describes the chunked container format.  The data is split into fixed size chunks in the
+    file's interleave axis order, each compressed on its own with a standard library codec.
+    The file starts with a fixed size header holding MAGIC, the format version, the codec, the
+    chunk shape, the data shape, the number of chunks and the offset of the chunk index.  The
+    index is a list of little endian uint64 (offset, length) pairs, one for each chunk in C order
+    of the chunk grid.  An ordinary OpenSpectra header describes the data with the file type set
+    to FILE_TYPE so other readers of the header don't take the data for raw values"""
+
+    MAGIC:bytes = b"OSCHUNK1"
+    FILE_TYPE:str = "OpenSpectra Chunked"
+    VERSION:int = 1
+
+    # magic, version, codec, chunk shape, data shape, chunk count, index offset
+    HEADER = struct.Struct("<8sII3I3IQQ")
+
+    CODECS:Dict[str, int] = {"none": 0, "zlib": 1, "lzma": 2, "bz2": 3}
+
+    __DECOMPRESSORS:Dict[int, Callable[[bytes], bytes]] = {
+        0: bytes,
+        1: zlib.decompress,
+        2: lzma.decompress,
+        3: bz2.decompress}
+
+    @staticmethod
+    def compress(codec:str, data:bytes, level:int=None) -> bytes:
+        if codec == "zlib":
+            return zlib.compress(data, 6 if level is None else level)
+        elif codec == "lzma":
+            return lzma.compress(data, preset=level)
+        elif codec == "bz2":
+            return bz2.compress(data, 9 if level is None else level)
+        elif codec == "none":
+            return bytes(data)
+        else:
+            raise ValueError("Codec must be one of {0}".format(", ".join(ChunkedContainer.CODECS.keys())))
+
+    @staticmethod
+    def decompress(codec_id:int, data:bytes) -> bytes:
+        decompressor = ChunkedContainer.__DECOMPRESSORS.get(codec_id)
+        if decompressor is None:
+            raise OpenSpectraFileError("Unknown chunk codec {0}".format(codec_id))
+
+        return decompressor(data)
+
+    @staticmethod
+    def is_chunked(path:Path) -> bool:
+        with path.open("rb") as file:
+            return file.read(len(ChunkedContainer.MAGIC)) == ChunkedContainer.MAGIC
+
+
+class ChunkedFileArray(FileArray):
+    """A FileArray that reads a ChunkedContainer.  Only the chunks that hold data for a request
+    are read and decompressed, decompressed chunks are held in a TileCache"""
+
+    def __init__(self, path:Path, codec:int, chunk_shape:Tuple[int, int, int], shape:Tuple[int, int, int],
+            index:np.ndarray, dtype:np.dtype, cache:TileCache):
+        super().__init__(shape, dtype)
+        self.__path = path
+        self.__codec = codec
+        self.__chunk_shape = chunk_shape
+        self.__grid_shape = tuple(math.ceil(size / chunk_size) for size, chunk_size in zip(shape, chunk_shape))
+        self.__index = index
+        self.__cache = cache
+
+        self.__file = path.open("rb")
+        self.__file_lock = threading.Lock()
+
+    def __del__(self):
+        self.__file.close()
+
+    def cache(self) -> TileCache:
+        return self.__cache
+
+    def _read(self, indices:List[np.ndarray]) -> np.ndarray:
+        result = np.empty(tuple(axis_indices.size for axis_indices in indices), self.dtype)
+
+        # for each chunk along each axis the positions in the result and in the chunk
+        axis_chunks = list()
+        for axis_indices, chunk_size in zip(indices, self.__chunk_shape):
+            chunk_numbers = axis_indices // chunk_size
+            boundaries = np.flatnonzero(np.diff(chunk_numbers)) + 1
+            starts = np.concatenate(([0], boundaries))
+            ends = np.concatenate((boundaries, [axis_indices.size]))
+            axis_chunks.append([(int(chunk_numbers[start]), slice(start, end),
+                                 axis_indices[start:end] - chunk_numbers[start] * chunk_size)
+                                for start, end in zip(starts, ends)])
+
+        for chunk_0, result_0, local_0 in axis_chunks[0]:
+            for chunk_1, result_1, local_1 in axis_chunks[1]:
+                for chunk_2, result_2, local_2 in axis_chunks[2]:
+                    chunk = self.__cache.get_or_load((chunk_0, chunk_1, chunk_2),
+                        lambda: self.__load_chunk(chunk_0, chunk_1, chunk_2))
+                    result[result_0, result_1, result_2] = chunk[np.ix_(local_0, local_1, local_2)]
+
+        return result
+
+    def __load_chunk(self, chunk_0:int, chunk_1:int, chunk_2:int) -> np.ndarray:
+        offset, length = self.__index[np.ravel_multi_index((chunk_0, chunk_1, chunk_2), self.__grid_shape)]
+        with self.__file_lock:
+            self.__file.seek(int(offset))
+            data = self.__file.read(int(length))
+
+        if len(data) != length:
+            raise OpenSpectraFileError("Unexpected end of file {0} reading chunk {1}".
+                format(self.__path.name, (chunk_0, chunk_1, chunk_2)))
+
+        chunk_shape = tuple(min(chunk_size, size - chunk * chunk_size) for chunk, chunk_size, size in
+                            zip((chunk_0, chunk_1, chunk_2), self.__chunk_shape, self.shape))
+        chunk = np.frombuffer(ChunkedContainer.decompress(self.__codec, data), self.dtype).reshape(chunk_shape)
+        return chunk
+
+
+class ChunkedModel(FileModel):
+    """Reads a file stored in the ChunkedContainer format, see ChunkedContainerWriter
+    in openspecrtra_tools for creating one.  Decompressed chunks are held in a cache
+    limited to ChunkCacheSize bytes"""
+
+    def __init__(self, path:Path, header:OpenSpectraHeader, cache_size:int=None):
+        super().__init__(path, header)
+        self.__cache_size = cache_size
+        if self.__cache_size is None:
+            self.__cache_size = OpenSpectraProperties.get_property("ChunkCacheSize", 268435456)
+
+    def load(self, shape:Shape):
+        with self._path.open("rb") as file:
+            header_data = file.read(ChunkedContainer.HEADER.size)
+            if len(header_data) != ChunkedContainer.HEADER.size:
+                raise OpenSpectraFileError("File {0} is too short to be a chunked file".format(self._path.name))
+
+            magic, version, codec, chunk_0, chunk_1, chunk_2, shape_0, shape_1, shape_2, chunk_count, index_offset = \
+                ChunkedContainer.HEADER.unpack(header_data)
+
+            if magic != ChunkedContainer.MAGIC or version != ChunkedContainer.VERSION:
+                raise OpenSpectraFileError("File {0} is not a supported chunked file".format(self._path.name))
+
+            if (shape_0, shape_1, shape_2) != shape.shape():
+                raise OpenSpectraFileError("Chunked file shape {0} does not match header shape {1}".
+                    format((shape_0, shape_1, shape_2), shape.shape()))
+
+            file.seek(index_offset)
+            index = np.frombuffer(file.read(chunk_count * 16), "<u8")
+            if index.size != chunk_count * 2:
+                raise OpenSpectraFileError("Chunk index in {0} is truncated".format(self._path.name))
+
+        self._file = ChunkedFileArray(self._path, codec, (chunk_0, chunk_1, chunk_2), shape.shape(),
+            index.reshape(chunk_count, 2), self._data_type, TileCache(self.__cache_size, self._path.name, "chunks"))
+        self._validate(shape)
+
+
+class ZlibInflater:
+    """A small ctypes binding to the zlib library's inflate for what the zlib module
+    doesn't expose, stopping at the end of each deflate block and starting part way
+    through a deflate stream from a bit offset and dictionary.  window_bits has the
+    same meaning as for zlib.decompressobj"""
+
+    Z_OK:int = 0
+    Z_STREAM_END:int = 1
+    Z_NEED_DICT:int = 2
+    Z_BUF_ERROR:int = -5
+    Z_NO_FLUSH:int = 0
+    Z_BLOCK:int = 5
+
+    RAW_WINDOW_BITS:int = -15
+    GZIP_WINDOW_BITS:int = 31
+    WINDOW_SIZE:int = 32768
+
+    __LOG:Logger = LogHelper.logger("ZlibInflater")
+    __zlib = None
+
+    class ZStream(ctypes.Structure):
+        _fields_ = [("next_in", ctypes.c_void_p), ("avail_in", ctypes.c_uint), ("total_in", ctypes.c_ulong),
+                    ("next_out", ctypes.c_void_p), ("avail_out", ctypes.c_uint), ("total_out", ctypes.c_ulong),
+                    ("msg", ctypes.c_char_p), ("state", ctypes.c_void_p),
+                    ("zalloc", ctypes.c_void_p), ("zfree", ctypes.c_void_p), ("opaque", ctypes.c_void_p),
+                    ("data_type", ctypes.c_int), ("adler", ctypes.c_ulong), ("reserved", ctypes.c_ulong)]
+
+    @staticmethod
+    def is_available() -> bool:
+        return ZlibInflater.__load() is not None
+
+    @staticmethod
+    def __load():
+        if ZlibInflater.__zlib is None:
+            ZlibInflater.__zlib = False
+            for name in ["z", "zlib1", "zlib"]:
+                library_name = ctypes.util.find_library(name)
+                if library_name is not None:
+                    try:
+                        library = ctypes.CDLL(library_name)
+                        stream = ctypes.POINTER(ZlibInflater.ZStream)
+                        library.zlibVersion.restype = ctypes.c_char_p
+                        library.inflateInit2_.argtypes = [stream, ctypes.c_int, ctypes.c_char_p, ctypes.c_int]
+                        library.inflate.argtypes = [stream, ctypes.c_int]
+                        library.inflateEnd.argtypes = [stream]
+                        library.inflateReset2.argtypes = [stream, ctypes.c_int]
+                        library.inflatePrime.argtypes = [stream, ctypes.c_int, ctypes.c_int]
+                        library.inflateSetDictionary.argtypes = [stream, ctypes.c_char_p, ctypes.c_uint]
+                        ZlibInflater.__zlib = library
+                        break
+                    except (OSError, AttributeError):
+                        ZlibInflater.__LOG.debug("Could not use zlib library {0}", library_name)
+
+        return ZlibInflater.__zlib or None
+
+    def __init__(self, window_bits:int):
+        self.__stream = None
+        self.__library = ZlibInflater.__load()
+        if self.__library is None:
+            raise OpenSpectraFileError("The zlib library could not be loaded")
+
+        self.__input = None
+        self.__stream = ZlibInflater.ZStream()
+        self.__check(self.__library.inflateInit2_(ctypes.byref(self.__stream), window_bits,
+            self.__library.zlibVersion(), ctypes.sizeof(self.__stream)))
+
+    def __del__(self):
+        if self.__stream is not None:
+            self.__library.inflateEnd(ctypes.byref(self.__stream))
+
+    def reset(self, window_bits:int):
+        self.__check(self.__library.inflateReset2(ctypes.byref(self.__stream), window_bits))
+
+    def prime(self, bits:int, value:int):
+        self.__check(self.__library.inflatePrime(ctypes.byref(self.__stream), bits, value))
+
+    def set_dictionary(self, window:bytes):
+        self.__check(self.__library.inflateSetDictionary(ctypes.byref(self.__stream), window, len(window)))
+
+    def set_input(self, data:bytes):
+        """Replaces any input not yet used"""
+        self.__input = ctypes.create_string_buffer(data, len(data))
+        self.__stream.next_in = ctypes.addressof(self.__input)
+        self.__stream.avail_in = len(data)
+
+    def remaining_input(self) -> bytes:
+        return ctypes.string_at(self.__stream.next_in, self.__stream.avail_in) if self.__stream.avail_in > 0 else b""
+
+    def available_input(self) -> int:
+        return self.__stream.avail_in
+
+    def data_type(self) -> int:
+        return self.__stream.data_type
+
+    def inflate(self, output:memoryview, flush:int) -> Tuple[int, int]:
+        """Inflate into output, returns the zlib result code and the number of bytes written"""
+        if len(output) == 0:
+            return ZlibInflater.Z_OK, 0
+
+        output_buffer = (ctypes.c_char * len(output)).from_buffer(output)
+        self.__stream.next_out = ctypes.addressof(output_buffer)
+        self.__stream.avail_out = len(output)
+        result = self.__library.inflate(ctypes.byref(self.__stream), flush)
+        written = len(output) - self.__stream.avail_out
+        del output_buffer
+
+        if result < 0 or result == ZlibInflater.Z_NEED_DICT:
+            # Z_BUF_ERROR only means no progress was possible
+            if result != ZlibInflater.Z_BUF_ERROR or written > 0:
+                self.__check(result)
+        return result, written
+
+    def __check(self, result:int):
+        if result < 0 or result == ZlibInflater.Z_NEED_DICT:
+            message = self.__stream.msg.decode() if self.__stream.msg is not None else "error " + str(result)
+            raise OpenSpectraFileError("Inflate failed, {0}".format(message))
+
+
+class GzipStream:
+    """Inflates a gzip file forward from a GzipIndex.Checkpoint, or from the start of
+    the file using the zlib module if there's no checkpoint"""
+
+    READ_SIZE:int = 65536
+
+    def __init__(self, path:Path, checkpoint:"GzipIndex.Checkpoint"):
+        self.__file = path.open("rb")
+        self.__inflater:ZlibInflater = None
+        self.__decompressor = None
+        self.__pending:bytes = b""
+        self.__raw:bool = checkpoint is not None
+
+        if checkpoint is None:
+            self.__position = 0
+            self.__decompressor = zlib.decompressobj(ZlibInflater.GZIP_WINDOW_BITS)
+        else:
+            self.__position = checkpoint.uncompressed_offset
+            self.__inflater = ZlibInflater(ZlibInflater.RAW_WINDOW_BITS)
+            self.__file.seek(checkpoint.compressed_offset - (1 if checkpoint.bits > 0 else 0))
+            if checkpoint.bits > 0:
+                self.__inflater.prime(checkpoint.bits, self.__file.read(1)[0] >> (8 - checkpoint.bits))
+            self.__inflater.set_dictionary(zlib.decompress(checkpoint.window))
+
+    def __del__(self):
+        self.__file.close()
+
+    def position(self) -> int:
+        return self.__position
+
+    def skip(self, count:int) -> int:
+        """Inflate and discard up to count bytes, returns the number skipped"""
+        scratch = memoryview(bytearray(min(count, 1048576)))
+        skipped = 0
+        while skipped < count:
+            read = self.read(scratch[:min(count - skipped, len(scratch))])
+            if read == 0:
+                break
+            skipped += read
+
+        return skipped
+
+    def read(self, buffer:memoryview) -> int:
+        """Fill as much of buffer as possible, returns the number of bytes read"""
+        if self.__inflater is not None:
+            read = self.__inflate(buffer)
+        else:
+            read = self.__decompress(buffer)
+
+        self.__position += read
+        return read
+
+    def __inflate(self, buffer:memoryview) -> int:
+        read = 0
+        while read < len(buffer):
+            if self.__inflater.available_input() == 0:
+                data = self.__file.read(GzipStream.READ_SIZE)
+                if len(data) == 0:
+                    break
+                self.__inflater.set_input(data)
+
+            result, written = self.__inflater.inflate(buffer[read:], ZlibInflater.Z_NO_FLUSH)
+            read += written
+            if result == ZlibInflater.Z_STREAM_END:
+                remaining = self.__inflater.remaining_input()
+                if self.__raw:
+                    # a raw stream leaves the gzip trailer behind
+                    remaining += self.__file.read(max(0, 8 - len(remaining)))
+                    remaining = remaining[8:]
+                    self.__raw = False
+
+                self.__inflater.reset(ZlibInflater.GZIP_WINDOW_BITS)
+                self.__inflater.set_input(remaining)
+
+        return read
+
+    def __decompress(self, buffer:memoryview) -> int:
+        read = 0
+        while read < len(buffer):
+            if len(self.__pending) == 0:
+                self.__pending = self.__file.read(GzipStream.READ_SIZE)
+                if len(self.__pending) == 0:
+                    break
+
+            data = self.__decompressor.decompress(self.__pending, len(buffer) - read)
+            buffer[read:read + len(data)] = data
+            read += len(data)
+
+            if self.__decompressor.eof:
+                # another gzip member may follow
+                self.__pending = self.__decompressor.unused_data
+                self.__decompressor = zlib.decompressobj(ZlibInflater.GZIP_WINDOW_BITS)
+            else:
+                self.__pending = self.__decompressor.unconsumed_tail
+
+        return read
+
+
+class GzipIndex:
+    """A seek point index for a gzip file in the style of zlib's zran example.  While
+    the file is decompressed once a checkpoint is recorded at the end of a deflate block
+    about every spacing bytes of uncompressed data, holding the compressed and uncompressed
+    offsets, the bit offset and the last 32KB of uncompressed data.  Reading at any offset
+    then only inflates from the nearest checkpoint before it.  The index is saved next
+    to the data file, see file_name, and reused until the data file changes.  Reads that
+    move forward continue from where the last read stopped.  If the zlib library can't be
+    loaded with ctypes the index has no checkpoints and reads inflate from the start of
+    the file.  See is_gzip for how gzip data files are recognized"""
+
+    __LOG:Logger = LogHelper.logger("GzipIndex")
+
+    MAGIC:bytes = b"OSGZIDX1"
+    VERSION:int = 1
+
+    FILE_TYPE:str = "OpenSpectra Gzip"
+    FILE_SUFFIX:str = ".gz"
+    # gzip id bytes and the deflate compression method
+    __GZIP_MAGIC:bytes = b"\x1f\x8b\x08"
+    # enough of the file to check that it inflates
+    __SNIFF_SIZE:int = 65536
+
+    # magic, version, source mtime_ns, source size, uncompressed size, checkpoint count
+    __HEADER = struct.Struct("<8sIqQQI")
+    # compressed offset, uncompressed offset, bits, compressed window size
+    __CHECKPOINT = struct.Struct("<QQBI")
+
+    class Checkpoint:
+
+        def __init__(self, compressed_offset:int, uncompressed_offset:int, bits:int, window:bytes):
+            self.compressed_offset = compressed_offset
+            self.uncompressed_offset = uncompressed_offset
+            self.bits = bits
+            # held compressed
+            self.window = window
+
+    @staticmethod
+    def is_gzip(path:Path, header:OpenSpectraHeader) -> bool:
+        """A data file is only read as gzip if it's marked as one, either its name ends
+        with FILE_SUFFIX or its header's file type is FILE_TYPE, and the start of it
+        inflates.  Raw data can start with the gzip id bytes too"""
+        if path.suffix.lower() != GzipIndex.FILE_SUFFIX and header.file_type() != GzipIndex.FILE_TYPE:
+            return False
+
+        with path.open("rb") as file:
+            start = file.read(GzipIndex.__SNIFF_SIZE)
+
+        try:
+            is_gzip = start.startswith(GzipIndex.__GZIP_MAGIC)
+            if is_gzip:
+                zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(start, GzipIndex.__SNIFF_SIZE * 16)
+        except zlib.error:
+            is_gzip = False
+
+        if not is_gzip:
+            GzipIndex.__LOG.warning("{0} is marked as gzip but isn't a gzip file, reading it as raw data",
+                path.name)
+
+        return is_gzip
+
+    @staticmethod
+    def file_name(data_file_name:str) -> str:
+        return data_file_name + ".gzidx"
+
+    @staticmethod
+    def open(path:Path, spacing:int=None, progress_callback:Callable[[int, int], None]=None) -> "GzipIndex":
+        """Load the saved index for path if it's still valid, otherwise build and save one.
+        spacing defaults to GzipCheckpointSpacing, progress_callback is called while building
+        with the number of compressed bytes read and the file size"""
+        index = GzipIndex(path)
+        if not index.__load():
+            if spacing is None:
+                spacing = OpenSpectraProperties.get_property("GzipCheckpointSpacing", 1048576)
+
+            index.__build(spacing, progress_callback)
+            index.__save()
+
+        return index
+
+    def __init__(self, path:Path):
+        self.__path = path
+        self.__checkpoints:List[GzipIndex.Checkpoint] = list()
+        self.__uncompressed_offsets:List[int] = list()
+        self.__uncompressed_size:int = 0
+        self.__lock = threading.Lock()
+        self.__stream:GzipStream = None
+
+    def uncompressed_size(self) -> int:
+        return self.__uncompressed_size
+
+    def checkpoint_count(self) -> int:
+        return len(self.__checkpoints)
+
+    def read_into(self, buffer:memoryview, offset:int):
+        """Fill buffer with the uncompressed data starting at offset"""
+        if offset + len(buffer) > self.__uncompressed_size:
+            raise OpenSpectraFileError("Unexpected end of file at byte {0}".format(self.__uncompressed_size))
+
+        with self.__lock:
+            checkpoint_number = bisect.bisect_right(self.__uncompressed_offsets, offset) - 1
+            checkpoint = self.__checkpoints[checkpoint_number] if checkpoint_number >= 0 else None
+            checkpoint_offset = checkpoint.uncompressed_offset if checkpoint is not None else 0
+
+            # carry on from the last read when that's closer than the checkpoint
+            if self.__stream is None or not checkpoint_offset <= self.__stream.position() <= offset:
+                self.__stream = GzipStream(self.__path, checkpoint)
+
+            self.__stream.skip(offset - self.__stream.position())
+            if self.__stream.read(buffer) != len(buffer):
+                raise OpenSpectraFileError("Unexpected end of file at byte {0}".format(self.__stream.position()))
+
+    def __build(self, spacing:int, progress_callback:Callable[[int, int], None]):
+        GzipIndex.__LOG.info("Building index for {0} with checkpoints every {1} bytes", self.__path.name, spacing)
+        if not ZlibInflater.is_available():
+            GzipIndex.__LOG.warning("zlib library not available, reads from {0} will inflate from the start",
+                self.__path.name)
+            self.__uncompressed_size = GzipStream(self.__path, None).skip(sys.maxsize)
+            return
+
+        file_size = self.__path.stat().st_size
+        inflater = ZlibInflater(ZlibInflater.GZIP_WINDOW_BITS)
+        window = bytearray(ZlibInflater.WINDOW_SIZE)
+        window_view = memoryview(window)
+        window_left = 0
+        total_in, total_out, last_out = 0, 0, None
+
+        with self.__path.open("rb") as file:
+            while True:
+                data = file.read(GzipStream.READ_SIZE)
+                if len(data) == 0:
+                    break
+
+                inflater.set_input(data)
+                while inflater.available_input() > 0:
+                    if window_left == 0:
+                        window_left = ZlibInflater.WINDOW_SIZE
+
+                    available = inflater.available_input()
+                    result, written = inflater.inflate(window_view[ZlibInflater.WINDOW_SIZE - window_left:],
+                        ZlibInflater.Z_BLOCK)
+                    total_in += available - inflater.available_input()
+                    total_out += written
+                    window_left -= written
+
+                    if result == ZlibInflater.Z_STREAM_END:
+                        # another gzip member may follow
+                        inflater.reset(ZlibInflater.GZIP_WINDOW_BITS)
+                    elif inflater.data_type() & 128 and not inflater.data_type() & 64 and \
+                            (last_out is None or total_out - last_out > spacing):
+                        # at the end of a block that isn't the last, the window is circular
+                        split = ZlibInflater.WINDOW_SIZE - window_left
+                        self.__checkpoints.append(GzipIndex.Checkpoint(total_in, total_out,
+                            inflater.data_type() & 7, zlib.compress(window[split:] + window[:split], 1)))
+                        last_out = total_out
+
+                if progress_callback is not None:
+                    progress_callback(total_in, file_size)
+
+        self.__uncompressed_size = total_out
+        self.__uncompressed_offsets = [checkpoint.uncompressed_offset for checkpoint in self.__checkpoints]
+        GzipIndex.__LOG.info("Built index for {0} with {1} checkpoints", self.__path.name, len(self.__checkpoints))
+
+    def __load(self) -> bool:
+        index_path = Path(GzipIndex.file_name(str(self.__path)))
+        if not index_path.exists():
+            return False
+
+        stat = self.__path.stat()
+        try:
+            with index_path.open("rb") as file:
+                magic, version, mtime_ns, size, uncompressed_size, count = \
+                    GzipIndex.__HEADER.unpack(file.read(GzipIndex.__HEADER.size))
+                if magic != GzipIndex.MAGIC or version != GzipIndex.VERSION or \
+                        mtime_ns != stat.st_mtime_ns or size != stat.st_size:
+                    GzipIndex.__LOG.info("Index for {0} is out of date", self.__path.name)
+                    return False
+
+                checkpoints = list()
+                for _ in range(count):
+                    compressed_offset, uncompressed_offset, bits, window_size = \
+                        GzipIndex.__CHECKPOINT.unpack(file.read(GzipIndex.__CHECKPOINT.size))
+                    window = file.read(window_size)
+                    if len(window) != window_size:
+                        raise struct.error("truncated window")
+                    checkpoints.append(GzipIndex.Checkpoint(compressed_offset, uncompressed_offset, bits, window))
+        except struct.error:
+            GzipIndex.__LOG.warning("Ignoring damaged index for {0}", self.__path.name)
+            return False
+
+        self.__checkpoints = checkpoints
+        self.__uncompressed_offsets = [checkpoint.uncompressed_offset for checkpoint in checkpoints]
+        self.__uncompressed_size = uncompressed_size
+        return True
+
+    def __save(self):
+        index_name = GzipIndex.file_name(str(self.__path))
+        stat = self.__path.stat()
+        try:
+            with open(index_name + ".tmp", "wb") as file:
+                file.write(GzipIndex.__HEADER.pack(GzipIndex.MAGIC, GzipIndex.VERSION, stat.st_mtime_ns,
+                    stat.st_size, self.__uncompressed_size, len(self.__checkpoints)))
+                for checkpoint in self.__checkpoints:
+                    file.write(GzipIndex.__CHECKPOINT.pack(checkpoint.compressed_offset,
+                        checkpoint.uncompressed_offset, checkpoint.bits, len(checkpoint.window)))
+                    file.write(checkpoint.window)
+
+            os.replace(index_name + ".tmp", index_name)
+        except OSError as e:
+            GzipIndex.__LOG.warning("Could not save index {0}, {1}", index_name, e)
+
+
+class GzipFileArray(RunFileArray):
+    """A RunFileArray that reads from a gzip file using a GzipIndex"""
+
+    def __init__(self, index:GzipIndex, offset:int, shape:Tuple[int, ...], dtype:np.dtype, max_gap:int, max_read:int):
+        super().__init__(shape, dtype, max_gap, max_read)
+        self.__index = index
+        self.__offset = offset
+
+    def _read_into(self, buffer:memoryview, start:int):
+        self.__index.read_into(buffer, self.__offset + start * self.dtype.itemsize)
+
+
+class GzipModel(FileModel):
+    """Reads a gzip compressed data file in place using a GzipIndex, the header describes
+    the uncompressed data.  Opening a file the first time decompresses it once to build
+    the index, progress_callback is called as that happens, see GzipIndex.open.  Runs of
+    data less than a checkpoint spacing apart are inflated together since the gap has to
+    be inflated anyway"""
+
+    def __init__(self, path:Path, header:OpenSpectraHeader, progress_callback:Callable[[int, int], None]=None,
+            spacing:int=None, max_read:int=None):
+        super().__init__(path, header)
+        self.__progress_callback = progress_callback
+        self.__index:GzipIndex = None
+
+        self.__spacing = spacing
+        if self.__spacing is None:
+            self.__spacing = OpenSpectraProperties.get_property("GzipCheckpointSpacing", 1048576)
+
+        self.__max_read = max_read
+        if self.__max_read is None:
+            self.__max_read = OpenSpectraProperties.get_property("PreadMaxRead", 16777216)
+
+    def index(self) -> GzipIndex:
+        return self.__index
+
+    def load(self, shape:Shape):
+        self.__index = GzipIndex.open(self._path, self.__spacing, self.__progress_callback)
+
+        data_size = shape.size() * self._data_type.itemsize
+        available_bytes = self.__index.uncompressed_size() - self._offset
+        if available_bytes < data_size:
+            raise OpenSpectraFileError("Expected {0} data points but found {1}".
+                format(shape.size(), available_bytes // self._data_type.itemsize))
+
+        self._file = GzipFileArray(self.__index, self._offset, shape.shape(), self._data_type,
+            self.__spacing, self.__max_read)
+        self._validate(shape)
+
+
+class MosaicFileArray(FileArray):
+    """A FileArray in bsq order made up of several OpenSpectraFiles, each placed at a
+    (line, sample) offset.  Only the sources that overlap a request are read, where sources
+    overlap the later one wins and where there is no source the data is fill_value"""
+
+    def __init__(self, sources:List["OpenSpectraFile"], placements:List[Tuple[int, int]],
+            shape:Tuple[int, int, int], dtype:np.dtype, fill_value:Union[int, float]):
+        super().__init__(shape, dtype)
+        self.__sources = sources
+        self.__placements = placements
+        self.__fill_value = fill_value
+
+    def __getitem__(self, key) -> np.ndarray:
+        # the bsq delegate asks for the bands for several pixels with an index array for
+        # lines and samples, pass those on to the sources so they can read them their way
+        if isinstance(key, tuple) and len(key) == 3 and key[0] == slice(None) and \
+                not isinstance(key[1], (int, np.integer)) and not isinstance(key[2], (int, np.integer)):
+            lines = self.__check_indices(key[1], self.shape[1])
+            samples = self.__check_indices(key[2], self.shape[2])
+            if lines.ndim == 1 and lines.shape == samples.shape:
+                return self.__read_pixels(lines, samples)
+
+        return super().__getitem__(key)
+
+    def _read(self, indices:List[np.ndarray]) -> np.ndarray:
+        bands, lines, samples = indices
+        result = np.full((bands.size, lines.size, samples.size), self.__fill_value, self.dtype)
+        band_arg = (int(bands[0]), int(bands[-1]) + 1) if bands[-1] - bands[0] + 1 == bands.size else bands.tolist()
+
+        for source, (line_offset, sample_offset) in zip(self.__sources, self.__placements):
+            source_header = source.header()
+            line_positions = np.flatnonzero((lines >= line_offset) & (lines < line_offset + source_header.lines()))
+            sample_positions = np.flatnonzero((samples >= sample_offset) &
+                                              (samples < sample_offset + source_header.samples()))
+            if line_positions.size == 0 or sample_positions.size == 0:
+                continue
+
+            source_lines = lines[line_positions] - line_offset
+            source_samples = samples[sample_positions] - sample_offset
+            if bands.size == 1 and source_lines.size == source_header.lines() and \
+                    source_samples.size == source_header.samples():
+                # a whole band image, the source may have it cached
+                data = source.raw_image(int(bands[0]))[np.newaxis, :, :]
+            else:
+                line_range = (int(source_lines[0]), int(source_lines[-1]) + 1)
+                sample_range = (int(source_samples[0]), int(source_samples[-1]) + 1)
+                data = MosaicFileArray.__to_bsq(source.cube(line_range, sample_range, band_arg),
+                    source_header.interleave())
+                data = data[np.ix_(np.arange(bands.size), source_lines - line_range[0],
+                    source_samples - sample_range[0])]
+
+            result[np.ix_(np.arange(bands.size), line_positions, sample_positions)] = data
+
+        return result
+
+    def __read_pixels(self, lines:np.ndarray, samples:np.ndarray) -> np.ndarray:
+        result = np.full((self.shape[0], lines.size), self.__fill_value, self.dtype)
+
+        # the last source covering each pixel
+        owners = np.full(lines.size, -1)
+        for index, (source, (line_offset, sample_offset)) in enumerate(zip(self.__sources, self.__placements)):
+            owners[(lines >= line_offset) & (lines < line_offset + source.header().lines()) &
+                   (samples >= sample_offset) & (samples < sample_offset + source.header().samples())] = index
+
+        for index in np.unique(owners[owners >= 0]):
+            positions = np.flatnonzero(owners == index)
+            line_offset, sample_offset = self.__placements[index]
+            result[:, positions] = self.__sources[index].bands(
+                lines[positions] - line_offset, samples[positions] - sample_offset).transpose()
+
+        return result
+
+    @staticmethod
+    def __to_bsq(data:np.ndarray, interleave:str) -> np.ndarray:
+        # back to (lines, samples, bands) then on to bsq's (bands, lines, samples)
+        return data.transpose(np.argsort(OpenSpectraHeader.interleave_axes(interleave))[[2, 0, 1]])
+
+    @staticmethod
+    def __check_indices(index, size:int) -> np.ndarray:
+        indices = np.asarray(index, dtype=np.int64)
+        if np.any(indices >= size) or np.any(indices < -size):
+            raise IndexError("index out of bounds for axis with size {0}".format(size))
+
+        return np.where(indices < 0, indices + size, indices)
+
+
+class MosaicModel(FileModel):
+    """A virtual file model made up of other OpenSpectraFiles, see VirtualMosaic"""
+
+    def __init__(self, path:Path, header:OpenSpectraHeader, sources:List["OpenSpectraFile"],
+            placements:List[Tuple[int, int]]):
+        super().__init__(path, header)
+        self.__sources = sources
+        self.__placements = placements
+        self.__fill_value = header.data_ignore_value() if header.data_ignore_value() is not None else 0
+
+    def sources(self) -> List["OpenSpectraFile"]:
+        return self.__sources
+
+    def indexes_points(self) -> bool:
+        return True
+
+    def load(self, shape:Shape):
+        self._file = MosaicFileArray(self.__sources, self.__placements, shape.shape(), self._data_type,
+            self.__fill_value)
         self._validate(shape)
 
 
 class OpenSpectraFile:
+    """When the file's byte order is not the native byte order the data is still mapped
+    without copying but the arrays returned are converted to native byte order.  When the
+    file delegate caches data images returned by raw_image for a single band are converted
+    once and held in the delegate's tile cache.  Bands that aren't cached, because caching is
+    off or they're too big for the cache, are converted again on every call except for the
+    last one, which is kept until another band is read or the memory ceiling releases it.
+    bands and cube always convert what they read.  If the file has a shadow copy, see ShadowFile,
+    images for a single band and bands are read from whichever copy stores them contiguously"""
 
     __LOG:Logger = LogHelper.logger("OpenSpectraFile")
 
     def __init__(self, header:OpenSpectraHeader, file_delegate:FileTypeDelegate,
-            memory_model:FileModel):
+            memory_model:FileModel, shadow:"OpenSpectraFile"=None, statistics:"BandStatisticsFile"=None,
+            overviews:"OverviewFile"=None):
         self.__header = header
         self.__memory_model = memory_model
         self.__file_delegate = file_delegate
         self.__validate()
 
+        self.__shadow:OpenSpectraFile = None
+        if shadow is not None:
+            self.set_shadow(shadow)
+
+        self.__statistics:BandStatisticsFile = statistics
+
+        self.__overviews:OverviewFile = None
+        if overviews is not None:
+            self.set_overviews(overviews)
+
+        self.__hints_enabled:bool = OpenSpectraProperties.get_property("AccessHintsEnabled", True)
+        # the hint currently applied to the whole file, if any
+        self.__file_hint:AccessHint = None
+
+        # the last band converted to native byte order outside the tile cache as
+        # (band, image), replaced as a whole so readers see a consistent tuple
+        self.__lock = threading.Lock()
+        self.__native_image:Tuple[int, np.ndarray] = None
+        self.__native_key:int = None
+
         if OpenSpectraFile.__LOG.isEnabledFor(logging.DEBUG):
             OpenSpectraFile.__LOG.debug("Shape: {0}", self.__memory_model.file().shape)
             OpenSpectraFile.__LOG.debug("NDim: {0}", self.__memory_model.file().ndim)
@@ -1114,8 +2880,23 @@ class OpenSpectraFile:
         It's important to understand that selecting images with an int index
         returns a view of the underlying data while using a tuple returns a copy.
         See https://docs.scipy.org/doc/numpy-1.16.0/user/basics.indexing.html
-        for more details"""
-        return self.__file_delegate.image(band)
+        for more details.  If the data is cached or not in native byte order a copy is
+        returned for int arguments, copies returned from the cache or kept after converting
+        the byte order are read only"""
+        shadow = self.__shadow
+        if shadow is not None and shadow.header().interleave() == OpenSpectraHeader.BSQ_INTERLEAVE and \
+                isinstance(band, (int, np.integer)) and not self.__file_delegate.is_cached(band):
+            return shadow.raw_image(band)
+
+        if self.__hints_enabled and isinstance(band, (int, np.integer)) and not self.__file_delegate.is_cached(band):
+            band = int(band) % self.__file_delegate.shape().bands()
+            self.__advise_read((0, self.__file_delegate.shape().lines()), (band, band + 1))
+
+        if isinstance(band, (int, np.integer)) and not self.__memory_model.data_type().isnative and \
+                not self.__file_delegate.is_cacheable() and not self.__file_delegate.is_cached(band):
+            return self.__native_band(band)
+
+        return self.__to_native(self.__file_delegate.image(band))
 
     def bands(self, line:Union[int, tuple, np.ndarray], sample:Union[int, tuple, np.ndarray]) -> np.ndarray:
         """Return all of the band values for a given pixel.  The number of lines and samples passed needs
@@ -1125,7 +2906,14 @@ class OpenSpectraFile:
         See https://docs.scipy.org/doc/numpy-1.16.0/user/basics.indexing.html
         for more details"""
         self.__validate_band_args(line, sample)
-        bands = self.__file_delegate.bands(line, sample)
+
+        shadow = self.__shadow
+        if shadow is not None and shadow.header().interleave() == OpenSpectraHeader.BIP_INTERLEAVE:
+            return shadow.bands(line, sample)
+
+        # No automatic hint here, measurements showed the per pixel cost of the hint
+        # was more than the kernel's default read ahead saved even with bsq files
+        bands = self.__to_native(self.__file_delegate.bands(line, sample))
 
         # If the arguments were single ints the array of bands will be one
         # dimensional so reshape it so it's consistent with multi-point results
@@ -1135,16 +2923,305 @@ class OpenSpectraFile:
 
     def cube(self, lines:Tuple[int, int], samples:Tuple[int, int],
             bands:Union[Tuple[int, int], List[int]]) -> np.ndarray:
-        return self.__file_delegate.cube(lines, samples, bands)
+        if self.__hints_enabled:
+            self.__advise_read(lines, (min(bands), max(bands) + 1) if isinstance(bands, list) else bands)
+
+        return self.__to_native(self.__file_delegate.cube(lines, samples, bands))
+
+    def iter_blocks(self, memory_limit:int=None, read_ahead:bool=False) -> \
+            Iterator[Tuple[Tuple[int, int], Tuple[int, int], Tuple[int, int], np.ndarray]]:
+        """Iterate over the whole cube in blocks of at most memory_limit bytes, which defaults to
+        BlockMemoryLimit in openspectra.properties, in the order the file stores them so each
+        block is a single contiguous read.  Yields the (start, end) lines, samples and bands of
+        each block followed by its data, with the same axis order cube returns.  bil and bip
+        files are read in blocks of whole lines, bsq files in blocks of whole bands, when one of
+        those is too big blocks are part of a single line or band instead.  With read_ahead the
+        next block is read on a background thread while the current one is in use, blocks are
+        then always copies so the reading really happens in the background and two blocks are
+        held at once"""
+        if memory_limit is None:
+            memory_limit = OpenSpectraProperties.get_property("BlockMemoryLimit", 67108864)
+
+        if not read_ahead:
+            for lines, samples, bands in self.__block_ranges(memory_limit):
+                yield lines, samples, bands, self.cube(lines, samples, bands)
+            return
+
+        def read_block(lines:Tuple[int, int], samples:Tuple[int, int], bands:Tuple[int, int]) -> np.ndarray:
+            return np.array(self.cube(lines, samples, bands))
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            block_ranges = self.__block_ranges(memory_limit)
+            ranges = next(block_ranges, None)
+            future = executor.submit(read_block, *ranges) if ranges is not None else None
+            while future is not None:
+                next_ranges = next(block_ranges, None)
+                data = future.result()
+                future = executor.submit(read_block, *next_ranges) if next_ranges is not None else None
+                yield ranges + (data,)
+                ranges = next_ranges
+
+    def block_ranges(self, memory_limit:int=None) -> Iterator[Tuple[Tuple[int, int], Tuple[int, int], Tuple[int, int]]]:
+        """The (start, end) lines, samples and bands of each block iter_blocks would yield
+        without reading any data, so callers can plan which blocks to read"""
+        if memory_limit is None:
+            memory_limit = OpenSpectraProperties.get_property("BlockMemoryLimit", 67108864)
+
+        return self.__block_ranges(memory_limit)
+
+    def advise(self, hint:AccessHint, lines:Tuple[int, int]=None, bands:Tuple[int, int]=None):
+        """Tell the operating system how the data for the given range of lines and bands
+        will be accessed.  lines and bands are (start, end) tuples like those passed to cube,
+        if either is None the full range is used.  This is only a hint and is ignored for
+        files that are not memory mapped or on platforms that don't support madvise.
+        Long running jobs that read through the file once should call this with
+        AccessHint.SEQUENTIAL before starting and AccessHint.NORMAL when done.
+        raw_image and cube will provide their own hints unless AccessHintsEnabled
+        is set to False in openspectra.properties or enable_access_hints(False) is called"""
+        shape = self.__file_delegate.shape()
+        if lines is None:
+            lines = (0, shape.lines())
+
+        if bands is None:
+            bands = (0, shape.bands())
+
+        ranges = self.__file_delegate.data_ranges(lines, bands)
+        self.__memory_model.advise(hint, ranges)
+
+        if hint in (AccessHint.NORMAL, AccessHint.SEQUENTIAL, AccessHint.RANDOM):
+            self.__file_hint = hint if ranges == [(0, shape.size())] else None
+
+    def enable_access_hints(self, enabled:bool):
+        """Turn the automatic access hints given by raw_image and cube on or off"""
+        self.__hints_enabled = enabled
+
+    def prefetch_band(self, band:int):
+        """Warm the data for band's image so a later raw_image doesn't wait on the file.
+        When the data is cached it's loaded into the cache, otherwise for bsq files the
+        operating system is asked to read it ahead, which returns without waiting.  A band
+        of a bil or bip file is spread across the whole file so it isn't read ahead.  Data
+        already cached, pinned or in memory is left alone"""
+        shadow = self.__shadow
+        if shadow is not None and shadow.header().interleave() == OpenSpectraHeader.BSQ_INTERLEAVE and \
+                not self.__file_delegate.is_cached(band):
+            shadow.prefetch_band(band)
+        elif self.__file_delegate.is_cached(band) or isinstance(self.__memory_model, MemoryModel):
+            return
+        elif self.__file_delegate.is_cacheable():
+            self.raw_image(band)
+        elif self.__header.interleave() == OpenSpectraHeader.BSQ_INTERLEAVE:
+            self.advise(AccessHint.WILL_NEED, bands=(band, band + 1))
+
+    def prefetch_limit(self) -> int:
+        """The most bands prefetch_band can warm around the band being looked at without
+        pushing that band out of the cache"""
+        band_count = self.__header.band_count()
+        if self.__file_delegate.is_cacheable():
+            band_bytes = self.__header.lines() * self.__header.samples() * \
+                self.__memory_model.data_type().itemsize
+            return max(0, min(band_count, self.__file_delegate.tile_cache().max_size() // band_bytes - 1))
+
+        return band_count
 
     def name(self) -> str:
         return self.__memory_model.name()
 
+    def path(self) -> Path:
+        """Returns the path the file was opened from"""
+        return self.__memory_model.path()
+
     def header(self) -> OpenSpectraHeader:
         return self.__header
 
+    def raw_path(self) -> Path:
+        """Returns the path of the data file if its bytes can be copied directly, that
+        is it's not compressed, chunked or a mosaic, otherwise None"""
+        return self.__memory_model.raw_path()
+
+    def tile_cache(self) -> TileCache:
+        """Returns the tile cache used for this file or None if data isn't cached"""
+        return self.__file_delegate.tile_cache()
+
+    def can_pin(self) -> bool:
+        """Returns True if bands or lines can be pinned in memory, that is the
+        file was opened with the PINNED_MODEL, see PinnedFileDelegate"""
+        return isinstance(self.__file_delegate, PinnedFileDelegate)
+
+    def pin_bands(self, bands:List[int]) -> List[int]:
+        """Hold the bands in memory, returns the bands that are pinned afterwards
+        which is none of them if the file can't pin bands"""
+        if not self.can_pin():
+            return list()
+
+        return self.__file_delegate.pin_bands(bands)
+
+    def unpin_bands(self, bands:List[int]):
+        if self.can_pin():
+            self.__file_delegate.unpin_bands(bands)
+
+    def pinned_bands(self) -> List[int]:
+        return self.__file_delegate.pinned_bands() if self.can_pin() else list()
+
+    def pin_lines(self, lines:Tuple[int, int]) -> bool:
+        """Hold the lines from lines[0] to lines[1] - 1 in memory replacing any pinned
+        before, returns False if they couldn't be pinned"""
+        if not self.can_pin():
+            return False
+
+        return self.__file_delegate.pin_lines(lines)
+
+    def unpin_lines(self):
+        if self.can_pin():
+            self.__file_delegate.unpin_lines()
+
+    def pinned_lines(self) -> Tuple[int, int]:
+        return self.__file_delegate.pinned_lines() if self.can_pin() else None
+
+    def shadow(self) -> "OpenSpectraFile":
+        """Returns the shadow copy of this file in use or None"""
+        return self.__shadow
+
+    def set_shadow(self, shadow:"OpenSpectraFile"):
+        """Start using shadow, or stop using a shadow if None.  The shadow must have the
+        same dimensions and data type as this file and the interleave returned
+        by ShadowFile.interleave for this file's interleave"""
+        if shadow is not None:
+            shadow_header = shadow.header()
+            if shadow_header.interleave() != ShadowFile.interleave(self.__header.interleave()) or \
+                    shadow_header.lines() != self.__header.lines() or \
+                    shadow_header.samples() != self.__header.samples() or \
+                    shadow_header.band_count() != self.__header.band_count() or \
+                    shadow_header.data_type() != self.__header.data_type():
+                raise OpenSpectraFileError("Shadow file {0} does not match {1}".format(shadow.name(), self.name()))
+
+        self.__shadow = shadow
+
+    def statistics(self) -> "BandStatisticsFile":
+        """Returns the per band statistics for this file or None, see BandStatisticsFile"""
+        return self.__statistics
+
+    def set_statistics(self, statistics:"BandStatisticsFile"):
+        if statistics is not None and statistics.band_count() != self.__header.band_count():
+            raise OpenSpectraFileError("Statistics do not match {0}".format(self.name()))
+
+        self.__statistics = statistics
+
+    def overviews(self) -> "OverviewFile":
+        """Returns the reduced resolution copies of this file's bands or None, see OverviewFile"""
+        return self.__overviews
+
+    def set_overviews(self, overviews:"OverviewFile"):
+        if overviews is not None and (overviews.band_count() != self.__header.band_count() or
+                overviews.lines() != self.__header.lines() or overviews.samples() != self.__header.samples()):
+            raise OpenSpectraFileError("Overviews do not match {0}".format(self.name()))
+
+        self.__overviews = overviews
+
+    def overview_image(self, band:int, width:int, height:int) -> Tuple[np.ndarray, int]:
+        """Returns the image for band reduced to the smallest size that still fills width by
+        height when fitted to it keeping the aspect ratio and the factor it was reduced by.
+        The coarsest suitable level of the file's overviews is used if it has them, otherwise
+        a view of the band decimated by a power of 2 is returned so only the pixels used are
+        read.  Returns the full image with a factor of 1 if the band already fits"""
+        overviews = self.__overviews
+        if overviews is not None:
+            factor = overviews.factor_for_size(width, height)
+            if factor > 1:
+                return overviews.band(band, factor), factor
+            return self.raw_image(band), 1
+
+        factor = 2 ** int(math.log2(OverviewFile.fit_factor(self.__header.lines(), self.__header.samples(), width, height)))
+        if factor > 1:
+            return self.raw_image(band)[::factor, ::factor], factor
+        return self.raw_image(band), 1
+
+    def __block_ranges(self, memory_limit:int) -> Iterator[Tuple[Tuple[int, int], Tuple[int, int], Tuple[int, int]]]:
+        # work in the file's axis order, taking whole planes, rows or runs of elements
+        # within a row, whichever is the largest that fits in memory_limit
+        axes = OpenSpectraHeader.interleave_axes(self.__header.interleave())
+        sizes = (self.__header.lines(), self.__header.samples(), self.__header.band_count())
+        shape = [sizes[axis] for axis in axes]
+        item_size = np.dtype(self.__header.data_type()).itemsize
+
+        plane_bytes = shape[1] * shape[2] * item_size
+        row_bytes = shape[2] * item_size
+        if plane_bytes <= memory_limit:
+            steps = (max(1, memory_limit // max(1, plane_bytes)), shape[1], shape[2])
+        elif row_bytes <= memory_limit:
+            steps = (1, memory_limit // row_bytes, shape[2])
+        else:
+            steps = (1, 1, max(1, memory_limit // item_size))
+
+        for plane in range(0, shape[0], steps[0]):
+            for row in range(0, shape[1], steps[1]):
+                for element in range(0, shape[2], steps[2]):
+                    block = ((plane, min(plane + steps[0], shape[0])), (row, min(row + steps[1], shape[1])),
+                             (element, min(element + steps[2], shape[2])))
+                    yield tuple(block[axes.index(axis)] for axis in range(3))
+
+    def __advise_read(self, lines:Tuple[int, int], bands:Tuple[int, int]):
+        ranges = self.__file_delegate.data_ranges(lines, bands)
+        if ranges == [(0, self.__file_delegate.shape().size())]:
+            # we'll touch every page in the file so let the read ahead run
+            if self.__file_hint != AccessHint.SEQUENTIAL:
+                self.advise(AccessHint.SEQUENTIAL)
+        else:
+            self.__memory_model.advise(AccessHint.WILL_NEED, ranges)
+
+    def __native_band(self, band:int) -> np.ndarray:
+        band_count = self.__file_delegate.shape().bands()
+        if not -band_count <= band < band_count:
+            raise IndexError("index {0} is out of bounds for size {1}".format(band, band_count))
+
+        band = int(band) % band_count
+        native_image = self.__native_image
+        if native_image is not None and native_image[0] == band:
+            MemoryAccountant().touch(self.__native_key)
+            return native_image[1]
+
+        image = self.__to_native(self.__file_delegate.image(band))
+        image.flags.writeable = False
+
+        native_image = (band, image)
+        with self.__lock:
+            self.__native_image = native_image
+            replaced_key, self.__native_key = self.__native_key, None
+
+        # talk to the accountant without holding the lock, it may call __release_native
+        accountant = MemoryAccountant()
+        if replaced_key is not None:
+            accountant.unregister(replaced_key)
+
+        os_file = weakref.ref(self)
+        key = accountant.register(self.name(), "native band", image.nbytes,
+            lambda: OpenSpectraFile.__release_native(os_file, native_image), self)
+        with self.__lock:
+            if self.__native_image is native_image:
+                self.__native_key, key = key, self.__native_key
+
+        # already replaced or released, or a key another thread registered for this band
+        if key is not None:
+            accountant.unregister(key)
+
+        return image
+
+    @staticmethod
+    def __release_native(os_file:"weakref.ref", native_image:Tuple[int, np.ndarray]):
+        os_file = os_file()
+        if os_file is not None:
+            with os_file.__lock:
+                if os_file.__native_image is native_image:
+                    os_file.__native_image = None
+                    os_file.__native_key = None
+
+    def __to_native(self, data:np.ndarray) -> np.ndarray:
+        if data.dtype.isnative:
+            return data
+        else:
+            return data.astype(data.dtype.newbyteorder("="))
+
     def __validate(self):
-        if self.__memory_model.data_type() != self.__header.data_type():
+        if self.__memory_model.data_type().newbyteorder("=") != self.__header.data_type():
             raise TypeError("Header file type {0}, does not match actually data type {1}",
                 self.__header.data_type(), self.__memory_model.data_type())
 
@@ -1166,6 +3243,635 @@ class OpenSpectraFile:
             raise TypeError("'line' and 'sample' arguments must have the same type")
 
 
+class ShadowFile:
+    """A shadow file is a copy of a data file in the layout that reads contiguously where the
+    source's layout doesn't.  Spectra are slow from bsq and bil files so their shadow is bip,
+    band images are slow from bip files so their shadow is bsq.  The shadow is stored next to
+    the source as <file>.shadow.<interleave> with its own header which records the source's
+    size and modification time, a shadow that no longer matches its source is ignored.  While
+    a shadow is being built a .progress file is kept next to it.  See ShadowFileBuilder in
+    openspecrtra_tools for building shadow files"""
+
+    SOURCE_MTIME:str = "shadow source mtime"
+    SOURCE_SIZE:str = "shadow source size"
+
+    @staticmethod
+    def interleave(source_interleave:str) -> str:
+        if source_interleave == OpenSpectraHeader.BIP_INTERLEAVE:
+            return OpenSpectraHeader.BSQ_INTERLEAVE
+        else:
+            return OpenSpectraHeader.BIP_INTERLEAVE
+
+    @staticmethod
+    def file_name(source_file_name:str, source_interleave:str) -> str:
+        return "{0}.shadow.{1}".format(source_file_name, ShadowFile.interleave(source_interleave))
+
+    @staticmethod
+    def progress_file_name(source_file_name:str, source_interleave:str) -> str:
+        return ShadowFile.file_name(source_file_name, source_interleave) + ".progress"
+
+    @staticmethod
+    def source_signature(source_file_name:str) -> Dict[str, str]:
+        """The properties recorded in the shadow's header to identify the source"""
+        stat = os.stat(source_file_name)
+        return {ShadowFile.SOURCE_MTIME: str(stat.st_mtime_ns), ShadowFile.SOURCE_SIZE: str(stat.st_size)}
+
+    @staticmethod
+    def is_valid(source_file_name:str, source_header:OpenSpectraHeader) -> bool:
+        """Returns True if there is a complete shadow for the source file that matches it"""
+        shadow_name = ShadowFile.file_name(source_file_name, source_header.interleave())
+        if not os.path.isfile(shadow_name) or not os.path.isfile(shadow_name + ".hdr") or \
+                os.path.exists(ShadowFile.progress_file_name(source_file_name, source_header.interleave())):
+            return False
+
+        try:
+            shadow_header = OpenSpectraHeader(shadow_name + ".hdr")
+            shadow_header.load()
+        except OpenSpectraHeaderError:
+            return False
+
+        shadow_props = shadow_header.unsupported_props()
+        expected_size = source_header.lines() * source_header.samples() * source_header.band_count() * \
+            np.dtype(source_header.data_type()).itemsize
+        return all(shadow_props.get(key) == value for key, value in ShadowFile.source_signature(source_file_name).items()) and \
+            shadow_header.interleave() == ShadowFile.interleave(source_header.interleave()) and \
+            shadow_header.lines() == source_header.lines() and \
+            shadow_header.samples() == source_header.samples() and \
+            shadow_header.band_count() == source_header.band_count() and \
+            shadow_header.data_type() == source_header.data_type() and \
+            os.path.getsize(shadow_name) == shadow_header.header_offset() + expected_size
+
+
+class BandSummary:
+    """The statistics for a single band from a BandStatisticsFile.  Values that are NaN or
+    equal to the data ignore value are not included in the statistics or the histogram, they
+    are only counted.  The histogram has a fixed number of equal width bins, for integer data
+    the bin width is a power of 2 so bins hold whole values"""
+
+    def __init__(self, minimum:float, maximum:float, mean:float, std:float, valid_count:int,
+            nan_count:int, ignore_count:int, counts:np.ndarray, low:float, width:float, is_integer:bool):
+        self.__minimum = minimum
+        self.__maximum = maximum
+        self.__mean = mean
+        self.__std = std
+        self.__valid_count = valid_count
+        self.__nan_count = nan_count
+        self.__ignore_count = ignore_count
+        self.__counts = counts
+        self.__low = low
+        self.__width = width
+        self.__is_integer = is_integer
+
+    def min(self) -> float:
+        return self.__minimum
+
+    def max(self) -> float:
+        return self.__maximum
+
+    def mean(self) -> float:
+        return self.__mean
+
+    def std(self) -> float:
+        return self.__std
+
+    def valid_count(self) -> int:
+        return self.__valid_count
+
+    def nan_count(self) -> int:
+        return self.__nan_count
+
+    def ignore_count(self) -> int:
+        return self.__ignore_count
+
+    def histogram(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns the counts and the bin edges, like numpy.histogram"""
+        return self.__counts, self.__low + np.arange(self.__counts.size + 1) * self.__width
+
+    def percentile(self, percentages:Union[float, Tuple[float, ...]]) -> Union[float, np.ndarray]:
+        """Estimate percentiles of the band from the histogram, each is interpolated within
+        its bin.  For integer data in bins 1 value wide the result is within 1 of numpy.percentile"""
+        percentages = np.asarray(percentages, np.float64)
+        if self.__valid_count == 0:
+            return np.full(percentages.shape, np.nan) if percentages.ndim > 0 else np.nan
+
+        # the position in the sorted values, as numpy.percentile uses
+        positions = percentages / 100 * (self.__valid_count - 1)
+        cumulative = np.cumsum(self.__counts)
+        bins = np.searchsorted(cumulative, positions, side="right")
+        bins = np.minimum(bins, self.__counts.size - 1)
+        before = cumulative[bins] - self.__counts[bins]
+        values = self.__low + self.__width * (bins + (positions - before) / np.maximum(self.__counts[bins], 1))
+
+        if self.__is_integer:
+            values = np.floor(values)
+
+        return np.clip(values, self.__minimum, self.__maximum)
+
+
+class BandStatisticsFile:
+    """Per band statistics for a data file, min, max, mean, standard deviation, NaN and data
+    ignore value counts and a histogram, stored next to the file as <file>.stats.  Like a
+    ShadowFile it records the source's size and modification time and is ignored once it
+    no longer matches.  See BandStatisticsBuilder in openspecrtra_tools for building one"""
+
+    __LOG:Logger = LogHelper.logger("BandStatisticsFile")
+
+    __VERSION:int = 1
+
+    def __init__(self, minimum:np.ndarray, maximum:np.ndarray, mean:np.ndarray, std:np.ndarray,
+            valid_count:np.ndarray, nan_count:np.ndarray, ignore_count:np.ndarray, counts:np.ndarray,
+            low:np.ndarray, width:np.ndarray, is_integer:bool, signature:Dict[str, str]=None):
+        """Each argument but is_integer and signature has one value per band, counts is the
+        histogram and has shape (bands, bins), low and width are the lower edge and the
+        width of the bins of each band's histogram"""
+        self.__minimum = minimum
+        self.__maximum = maximum
+        self.__mean = mean
+        self.__std = std
+        self.__valid_count = valid_count
+        self.__nan_count = nan_count
+        self.__ignore_count = ignore_count
+        self.__counts = counts
+        self.__low = low
+        self.__width = width
+        self.__is_integer = is_integer
+        self.__signature = signature
+
+    @staticmethod
+    def file_name(source_file_name:str) -> str:
+        return source_file_name + ".stats"
+
+    @staticmethod
+    def open(source_file_name:str, source_header:OpenSpectraHeader) -> "BandStatisticsFile":
+        """Returns the statistics for the source file or None if there aren't any
+        or they no longer match the source"""
+        file_name = BandStatisticsFile.file_name(source_file_name)
+        if not os.path.isfile(file_name):
+            return None
+
+        try:
+            with np.load(file_name, allow_pickle=False) as stats:
+                arrays = {key: stats[key] for key in stats.files}
+        except (OSError, ValueError):
+            BandStatisticsFile.__LOG.warning("Could not read statistics file {0}", file_name)
+            return None
+
+        signature = ShadowFile.source_signature(source_file_name)
+        if int(arrays.get("version", 0)) != BandStatisticsFile.__VERSION or \
+                any(str(arrays.get(key)) != value for key, value in signature.items()) or \
+                arrays["minimum"].size != source_header.band_count():
+            BandStatisticsFile.__LOG.info("Ignoring out of date statistics file {0}", file_name)
+            return None
+
+        return BandStatisticsFile(arrays["minimum"], arrays["maximum"], arrays["mean"], arrays["std"],
+            arrays["valid_count"], arrays["nan_count"], arrays["ignore_count"], arrays["counts"],
+            arrays["low"], arrays["width"], bool(arrays["is_integer"]), signature)
+
+    def save(self, source_file_name:str):
+        """Save the statistics for source_file_name, recording its current size and
+        modification time unless a signature was given when this was created"""
+        signature = self.__signature
+        if signature is None:
+            signature = ShadowFile.source_signature(source_file_name)
+
+        # write then rename so readers never see a partial file
+        file_name = BandStatisticsFile.file_name(source_file_name)
+        with open(file_name + ".tmp", "wb") as stats_file:
+            np.savez(stats_file, version=BandStatisticsFile.__VERSION, minimum=self.__minimum,
+                maximum=self.__maximum, mean=self.__mean, std=self.__std, valid_count=self.__valid_count,
+                nan_count=self.__nan_count, ignore_count=self.__ignore_count, counts=self.__counts,
+                low=self.__low, width=self.__width, is_integer=self.__is_integer, **signature)
+
+        os.replace(file_name + ".tmp", file_name)
+
+    def band_count(self) -> int:
+        return self.__minimum.size
+
+    def band(self, index:int) -> BandSummary:
+        return BandSummary(self.__minimum[index], self.__maximum[index], self.__mean[index],
+            self.__std[index], int(self.__valid_count[index]), int(self.__nan_count[index]),
+            int(self.__ignore_count[index]), self.__counts[index], self.__low[index],
+            self.__width[index], self.__is_integer)
+
+    def min(self) -> np.ndarray:
+        return self.__minimum
+
+    def max(self) -> np.ndarray:
+        return self.__maximum
+
+    def mean(self) -> np.ndarray:
+        return self.__mean
+
+    def std(self) -> np.ndarray:
+        return self.__std
+
+    def valid_counts(self) -> np.ndarray:
+        return self.__valid_count
+
+    def nan_counts(self) -> np.ndarray:
+        return self.__nan_count
+
+    def ignore_counts(self) -> np.ndarray:
+        return self.__ignore_count
+
+
+class OverviewFile:
+    """Reduced resolution copies of every band of a data file used to display large bands
+    without reading all of their data.  Level n is smaller by a factor of 2 ** (n + 1) in
+    each direction, each of its pixels is either the average of the valid pixels it covers
+    or the top left one of them.  Stored next to the file as <file>.ovr, a fixed size header
+    holding MAGIC, the format version, the source's modification time and size, its shape,
+    the method and data type, followed by a table of (factor, lines, samples, offset) for
+    each level.  Each level is stored bsq in native byte order and is memory mapped when
+    read.  Like a ShadowFile an overview file that no longer matches its source is ignored.
+    See OverviewBuilder in openspecrtra_tools for building one"""
+
+    __LOG:Logger = LogHelper.logger("OverviewFile")
+
+    MAGIC:bytes = b"OSOVRVW1"
+    VERSION:int = 1
+
+    AVERAGE:str = "average"
+    DECIMATE:str = "decimate"
+
+    __METHODS:Dict[str, int] = {AVERAGE: 0, DECIMATE: 1}
+
+    # magic, version, source mtime_ns, source size, lines, samples, bands, method, data type, level count
+    __HEADER = struct.Struct("<8sIqQIIII8sI")
+    # factor, lines, samples, offset
+    __LEVEL = struct.Struct("<IIIQ")
+    __ALIGNMENT:int = 4096
+
+    def __init__(self, file_name:str, lines:int, samples:int, band_count:int, method:str,
+            data_type:np.dtype, levels:List[Tuple[int, int, int, int]], mode:str="r"):
+        self.__file_name = file_name
+        self.__lines = lines
+        self.__samples = samples
+        self.__band_count = band_count
+        self.__method = method
+        self.__levels = levels
+        self.__data = [np.memmap(file_name, data_type, mode, offset,
+            (band_count, level_lines, level_samples)) for factor, level_lines, level_samples, offset in levels]
+
+    @staticmethod
+    def file_name(source_file_name:str) -> str:
+        return source_file_name + ".ovr"
+
+    @staticmethod
+    def level_shapes(lines:int, samples:int, min_size:int) -> List[Tuple[int, int, int]]:
+        """The factor, lines and samples of each level for a band of the given size, levels
+        are added until the larger side is no more than min_size"""
+        shapes = list()
+        factor = 1
+        while max(math.ceil(lines / factor), math.ceil(samples / factor)) > min_size:
+            factor *= 2
+            shapes.append((factor, math.ceil(lines / factor), math.ceil(samples / factor)))
+        return shapes
+
+    @staticmethod
+    def create(file_name:str, source_header:OpenSpectraHeader, method:str, min_size:int,
+            signature:Dict[str, str]) -> "OverviewFile":
+        """Create an empty overview file for the source and return it open for writing,
+        signature is the source's signature from ShadowFile.source_signature"""
+        if method not in OverviewFile.__METHODS:
+            raise ValueError("Method must be one of {0}".format(", ".join(OverviewFile.__METHODS.keys())))
+
+        lines, samples, band_count = source_header.lines(), source_header.samples(), source_header.band_count()
+        data_type = np.dtype(source_header.data_type()).newbyteorder("=")
+        shapes = OverviewFile.level_shapes(lines, samples, min_size)
+
+        levels = list()
+        offset = OverviewFile.__HEADER.size + OverviewFile.__LEVEL.size * len(shapes)
+        for factor, level_lines, level_samples in shapes:
+            offset = -(-offset // OverviewFile.__ALIGNMENT) * OverviewFile.__ALIGNMENT
+            levels.append((factor, level_lines, level_samples, offset))
+            offset += band_count * level_lines * level_samples * data_type.itemsize
+
+        with open(file_name, "wb") as file:
+            file.write(OverviewFile.__HEADER.pack(OverviewFile.MAGIC, OverviewFile.VERSION,
+                int(signature[ShadowFile.SOURCE_MTIME]), int(signature[ShadowFile.SOURCE_SIZE]),
+                lines, samples, band_count, OverviewFile.__METHODS[method], data_type.str.encode(), len(levels)))
+            for level in levels:
+                file.write(OverviewFile.__LEVEL.pack(*level))
+            file.truncate(offset)
+
+        return OverviewFile(file_name, lines, samples, band_count, method, data_type, levels, "r+")
+
+    @staticmethod
+    def open(source_file_name:str, source_header:OpenSpectraHeader) -> "OverviewFile":
+        """Returns the overviews for the source file or None if there aren't any
+        or they no longer match the source"""
+        file_name = OverviewFile.file_name(source_file_name)
+        if not os.path.isfile(file_name):
+            return None
+
+        with open(file_name, "rb") as file:
+            header_data = file.read(OverviewFile.__HEADER.size)
+            if len(header_data) != OverviewFile.__HEADER.size:
+                OverviewFile.__LOG.warning("Could not read overview file {0}", file_name)
+                return None
+
+            magic, version, mtime, size, lines, samples, band_count, method, data_type, level_count = \
+                OverviewFile.__HEADER.unpack(header_data)
+            levels = [OverviewFile.__LEVEL.unpack(file.read(OverviewFile.__LEVEL.size)) for _ in range(level_count)]
+
+        signature = ShadowFile.source_signature(source_file_name)
+        if magic != OverviewFile.MAGIC or version != OverviewFile.VERSION or \
+                str(mtime) != signature[ShadowFile.SOURCE_MTIME] or str(size) != signature[ShadowFile.SOURCE_SIZE] or \
+                (lines, samples, band_count) != (source_header.lines(), source_header.samples(), source_header.band_count()):
+            OverviewFile.__LOG.info("Ignoring out of date overview file {0}", file_name)
+            return None
+
+        data_type = np.dtype(data_type.rstrip(b"\x00").decode())
+        if len(levels) > 0:
+            factor, level_lines, level_samples, offset = levels[-1]
+            if os.path.getsize(file_name) < offset + band_count * level_lines * level_samples * data_type.itemsize:
+                OverviewFile.__LOG.warning("Overview file {0} is truncated", file_name)
+                return None
+
+        method = [name for name, value in OverviewFile.__METHODS.items() if value == method][0]
+        return OverviewFile(file_name, lines, samples, band_count, method, data_type, levels)
+
+    def name(self) -> str:
+        return self.__file_name
+
+    def method(self) -> str:
+        return self.__method
+
+    def band_count(self) -> int:
+        return self.__band_count
+
+    def lines(self) -> int:
+        return self.__lines
+
+    def samples(self) -> int:
+        return self.__samples
+
+    def factors(self) -> List[int]:
+        return [level[0] for level in self.__levels]
+
+    def level(self, index:int) -> np.ndarray:
+        """Returns level index for all bands with shape (bands, lines, samples)"""
+        return self.__data[index]
+
+    def band(self, band:int, factor:int) -> np.ndarray:
+        """Returns the image for band from the level with the given factor"""
+        return self.__data[self.factors().index(factor)][band]
+
+    def factor_for_size(self, width:int, height:int) -> int:
+        """Returns the factor of the coarsest level that still fills width by height
+        when the band is scaled to fit keeping its aspect ratio, 1 if the full band is needed"""
+        return max([factor for factor in self.factors() if factor <= OverviewFile.fit_factor(
+            self.__lines, self.__samples, width, height)], default=1)
+
+    @staticmethod
+    def fit_factor(lines:int, samples:int, width:int, height:int) -> float:
+        """How many times larger than width by height a band of lines by samples is when
+        fitted to it keeping the aspect ratio"""
+        return max(1.0, samples / width, lines / height)
+
+    def flush(self):
+        for data in self.__data:
+            data.flush()
+
+    def close(self):
+        self.flush()
+        self.__data = list()
+
+
+class VirtualMosaic:
+    """A virtual mosaic is a small JSON file listing source files that share the same
+    bands, data type and map projection, similar to a GDAL VRT.  Opening one with
+    OpenSpectraFileFactory gives an OpenSpectraFile covering all of the sources, each placed
+    using its map info, that reads only from the sources overlapping each request.  The
+    mosaic is always bsq, where sources overlap the one listed later is used and areas
+    without a source are filled with the first source's data ignore value or 0.  Source
+    file names are stored relative to the mosaic file"""
+
+    __LOG:Logger = LogHelper.logger("VirtualMosaic")
+
+    FORMAT_KEY:str = "openspectra_mosaic"
+    VERSION:int = 1
+
+    # how close to a whole pixel a source's position must be
+    __PIXEL_TOLERANCE:float = 0.01
+
+    @staticmethod
+    def save(file_name:str, source_file_names:List[str]):
+        directory = os.path.dirname(os.path.abspath(file_name))
+        description = {VirtualMosaic.FORMAT_KEY: VirtualMosaic.VERSION,
+                       "sources": [os.path.relpath(os.path.abspath(source), directory) for source in source_file_names]}
+        with open(file_name, "wt") as mosaic_file:
+            json.dump(description, mosaic_file, indent=2)
+
+    @staticmethod
+    def is_mosaic(path:Path) -> bool:
+        with path.open("rb") as mosaic_file:
+            start = mosaic_file.read(64).lstrip()
+
+        return start.startswith(b"{") and VirtualMosaic.FORMAT_KEY.encode() in start
+
+    @staticmethod
+    def source_file_names(path:Path) -> List[str]:
+        try:
+            with path.open("rt") as mosaic_file:
+                description = json.load(mosaic_file)
+        except ValueError as e:
+            raise OpenSpectraFileError("Could not read mosaic file {0}, {1}".format(path.name, e))
+
+        if description.get(VirtualMosaic.FORMAT_KEY) != VirtualMosaic.VERSION or \
+                len(description.get("sources", [])) == 0:
+            raise OpenSpectraFileError("Mosaic file {0} is not a supported version or has no sources".
+                format(path.name))
+
+        return [os.path.join(str(path.parent), source) for source in description["sources"]]
+
+    @staticmethod
+    def open(path:Path, sources:List["OpenSpectraFile"], cache_size:int=None) -> "OpenSpectraFile":
+        """Create the mosaic for path from its already opened source files.  The mosaic keeps
+        a tile cache of cache_size bytes, TileCacheSize by default, the sources should be
+        opened without caches of their own so the data isn't cached twice"""
+        headers = [source.header() for source in sources]
+        first = headers[0]
+        first_map_info = first.map_info()
+
+        for source, header in zip(sources, headers):
+            map_info = header.map_info()
+            if map_info is None:
+                raise OpenSpectraFileError("Mosaic source {0} has no map info".format(source.name()))
+
+            same_wavelengths = (header.wavelengths() is None) == (first.wavelengths() is None) and \
+                (header.wavelengths() is None or np.allclose(header.wavelengths(), first.wavelengths()))
+            if header.band_count() != first.band_count() or header.data_type() != first.data_type() or \
+                    not same_wavelengths:
+                raise OpenSpectraFileError("Mosaic source {0} has different bands or data type than {1}".
+                    format(source.name(), sources[0].name()))
+
+            if map_info.projection_name() != first_map_info.projection_name() or \
+                    map_info.projection_zone() != first_map_info.projection_zone() or \
+                    map_info.projection_area() != first_map_info.projection_area() or \
+                    not math.isclose(map_info.x_pixel_size(), first_map_info.x_pixel_size()) or \
+                    not math.isclose(map_info.y_pixel_size(), first_map_info.y_pixel_size()) or \
+                    (map_info.rotation() or 0.0) != (first_map_info.rotation() or 0.0):
+                raise OpenSpectraFileError("Mosaic source {0} has a different projection or pixel size than {1}".
+                    format(source.name(), sources[0].name()))
+
+        # position each source relative to the first in pixels, undoing the rotation if any
+        rotation = first_map_info.rotation() or 0.0
+        first_x, first_y = first_map_info.calculate_coordinates(0, 0)
+        positions = list()
+        for source, header in zip(sources, headers):
+            x, y = header.map_info().calculate_coordinates(0, 0)
+            x_rotated, y_rotated = x - first_x, first_y - y
+            sample = (x_rotated * cos(rotation) - y_rotated * sin(rotation)) / first_map_info.x_pixel_size()
+            line = (x_rotated * sin(rotation) + y_rotated * cos(rotation)) / first_map_info.y_pixel_size()
+            if abs(sample - round(sample)) > VirtualMosaic.__PIXEL_TOLERANCE or \
+                    abs(line - round(line)) > VirtualMosaic.__PIXEL_TOLERANCE:
+                raise OpenSpectraFileError("Mosaic source {0} is not on the same pixel grid as {1}".
+                    format(source.name(), sources[0].name()))
+            positions.append((int(round(line)), int(round(sample))))
+
+        top = min(line for line, sample in positions)
+        left = min(sample for line, sample in positions)
+        placements = [(line - top, sample - left) for line, sample in positions]
+        lines = max(line + header.lines() for (line, sample), header in zip(placements, headers))
+        samples = max(sample + header.samples() for (line, sample), header in zip(placements, headers))
+
+        header = MutableOpenSpectraHeader(os_header=first)
+        header.set_lines(lines)
+        header.set_samples(samples)
+        header.set_interleave(OpenSpectraHeader.BSQ_INTERLEAVE)
+        header.set_header_offset(0)
+        header.set_byte_order(OpenSpectraHeader.NATIVE_BYTE_ORDER)
+        x, y = first_map_info.calculate_coordinates(left, top)
+        header.set_x_reference(1, x)
+        header.set_y_reference(1, y)
+
+        VirtualMosaic.__LOG.info("Mosaic {0} of {1} files is {2} lines by {3} samples",
+            path.name, len(sources), lines, samples)
+
+        model = MosaicModel(path, header, sources, placements)
+        delegate:FileTypeDelegate = BQSFileDelegate(header, model)
+        if cache_size is None:
+            cache_size = OpenSpectraProperties.get_property("TileCacheSize", 268435456)
+
+        if cache_size > 0:
+            delegate = CachedFileDelegate(delegate, TileCache(cache_size, path.name))
+
+        model.load(delegate.shape())
+        return OpenSpectraFile(header, delegate, model)
+
+
+class OpenSpectraFileWriter:
+    """Writes a new data file a piece at a time so derived products can be built without
+    holding the whole cube in memory.  The data file is preallocated, sparse where the file
+    system supports it, and mapped so lines, bands or blocks can be written in any order.
+    Parts never written read as zero.  The data is stored with the header's interleave, data
+    type, byte order and header offset.  The header file is only written by close() so a
+    partly written file can't be opened as a finished one"""
+
+    __LOG:Logger = LogHelper.logger("OpenSpectraFileWriter")
+
+    def __init__(self, file_name:str, header:MutableOpenSpectraHeader):
+        interleave = header.interleave()
+        try:
+            axes = OpenSpectraHeader.interleave_axes(interleave)
+        except ValueError:
+            raise OpenSpectraFileError("Unsupported interleave {0} for {1}".format(interleave, file_name))
+
+        if header.lines() <= 0 or header.samples() <= 0 or header.band_count() <= 0:
+            raise ValueError("Lines, samples and bands must all be greater than 0")
+
+        self.__file_name = file_name
+        self.__header = header
+        self.__dimensions = (header.lines(), header.samples(), header.band_count())
+        self.__axes = axes
+
+        data_type = np.dtype(header.data_type()).newbyteorder(
+            "<" if header.byte_order() == OpenSpectraHeader.LITTLE_ENDIAN else ">")
+        offset = header.header_offset()
+        shape = tuple(self.__dimensions[axis] for axis in self.__axes)
+
+        # truncate rather than write so the file system can leave the space unallocated until used
+        with open(file_name, "wb") as data_file:
+            data_file.truncate(offset + int(np.prod(shape)) * data_type.itemsize)
+
+        self.__file = np.memmap(file_name, dtype=data_type, mode="r+", offset=offset, shape=shape)
+        self.__cube = self.__file.transpose(np.argsort(self.__axes))
+        OpenSpectraFileWriter.__LOG.debug("Writing {0} with shape {1} and data type {2}",
+            file_name, shape, data_type)
+
+    def __enter__(self) -> "OpenSpectraFileWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, trace_back):
+        # don't leave a header for a file that failed part way
+        self.close(exc_type is None)
+
+    def file_name(self) -> str:
+        return self.__file_name
+
+    def header(self) -> MutableOpenSpectraHeader:
+        return self.__header
+
+    def is_closed(self) -> bool:
+        return self.__file is None
+
+    def write_line(self, line:int, data:np.ndarray):
+        """Write all the samples and bands of a line, data is (samples, bands) as returned
+        by OpenSpectraFile.bands for a whole line"""
+        self.__check_open()
+        self.__validate_index(line, 0)
+        self.__cube[line] = data
+
+    def write_band(self, band:int, data:np.ndarray):
+        """Write all the lines and samples of a band, data is (lines, samples) as returned
+        by OpenSpectraFile.raw_image"""
+        self.__check_open()
+        self.__validate_index(band, 2)
+        self.__cube[:, :, band] = data
+
+    def write_block(self, lines:Tuple[int, int], samples:Tuple[int, int], bands:Tuple[int, int],
+            data:np.ndarray):
+        """Write a block of the cube, the ranges are (start, end) as with OpenSpectraFile.cube
+        and data has the axis order of this file's interleave, the same as OpenSpectraFile.cube
+        returns.  So blocks from OpenSpectraFile.iter_blocks of a file with the same interleave
+        can be written unchanged"""
+        self.__check_open()
+        ranges = (lines, samples, bands)
+        for axis, (start, end) in enumerate(ranges):
+            if not 0 <= start < end <= self.__dimensions[axis]:
+                raise ValueError("Range {0} is outside of 0 to {1}".format((start, end), self.__dimensions[axis]))
+
+        self.__file[tuple(slice(*ranges[axis]) for axis in self.__axes)] = data
+
+    def flush(self):
+        if self.__file is not None:
+            self.__file.flush()
+
+    def close(self, write_header:bool=True):
+        """Flush the data and write the header, or just release the data file
+        when write_header is False.  Closing more than once does nothing"""
+        if self.__file is None:
+            return
+
+        self.__file.flush()
+        self.__file = None
+        self.__cube = None
+
+        if write_header:
+            self.__header.save(self.__file_name)
+            OpenSpectraFileWriter.__LOG.info("Finished writing {0}", self.__file_name)
+
+    def __check_open(self):
+        if self.__file is None:
+            raise OpenSpectraFileError("File {0} has already been closed".format(self.__file_name))
+
+    def __validate_index(self, index:int, axis:int):
+        if not 0 <= index < self.__dimensions[axis]:
+            raise ValueError("Index {0} is outside of 0 to {1}".format(index, self.__dimensions[axis] - 1))
+
+
 class OpenSpectraFileFactory:
     """An object oriented way to create an OpenSpectra file"""
 
@@ -1173,21 +3879,57 @@ class OpenSpectraFileFactory:
 
     MEMORY_MODEL:int = 0
     MAPPED_MODEL:int = 1
+    PREAD_MODEL:int = 2
+    PINNED_MODEL:int = 3
 
     @staticmethod
-    def create_open_spectra_file(file_name, model=MAPPED_MODEL) -> OpenSpectraFile:
+    def create_open_spectra_file(file_name, model=MAPPED_MODEL,
+            progress_callback:Callable[[int, int], None]=None, use_shadow:bool=None,
+            cache_size:int=None) -> OpenSpectraFile:
+        """progress_callback is only used with the MEMORY_MODEL, see MemoryModel for details.
+        If use_shadow is True, or None and ShadowFilesEnabled is True in openspectra.properties, and
+        there is a valid shadow file for file_name it's opened too, see ShadowFile.  Shadow files
+        aren't used with the MEMORY_MODEL.  Files in the ChunkedContainer format are recognized
+        automatically and always opened with a ChunkedModel, gzip compressed files, see
+        GzipIndex.is_gzip, are opened with a GzipModel which also uses progress_callback while
+        indexing the file.  VirtualMosaic files are recognized too and their sources opened with
+        model and without caches, the mosaic caches the data for all of them.  cache_size is the size in bytes of the file's
+        tile cache, or chunk cache for chunked files, TileCacheSize or ChunkCacheSize in
+        openspectra.properties by default, 0 turns caching off.  If there is an up to date
+        BandStatisticsFile or OverviewFile for file_name it's loaded too.  The PINNED_MODEL maps
+        the file like the MAPPED_MODEL but bands and lines can be held in memory too, see
+        PinnedFileDelegate, the header's default bands are pinned when the file is opened"""
         path = Path(file_name)
 
         if path.exists() and path.is_file():
             OpenSpectraFileFactory.__LOG.info("Opening {0} with mode {1}", path.name, path.stat().st_mode)
 
+            if VirtualMosaic.is_mosaic(path):
+                sources = [OpenSpectraFileFactory.create_open_spectra_file(source, model, use_shadow=use_shadow,
+                           cache_size=0) for source in VirtualMosaic.source_file_names(path)]
+                return VirtualMosaic.open(path, sources, cache_size)
+
             header = OpenSpectraHeader(file_name + ".hdr")
             header.load()
             file_type = header.interleave()
 
             memory_model = None
-            if model == OpenSpectraFileFactory.MEMORY_MODEL:
-                memory_model = MemoryModel(path, header)
+            is_chunked = ChunkedContainer.is_chunked(path)
+            is_gzip = not is_chunked and GzipIndex.is_gzip(path, header)
+            if not is_chunked and not is_gzip:
+                OpenSpectraFileFactory.__validate_size(path, header)
+
+            if is_chunked:
+                # chunked files hold their own cache of decompressed chunks
+                OpenSpectraFileFactory.__LOG.info("Opening {0} as a chunked file", path.name)
+                memory_model = ChunkedModel(path, header, cache_size)
+            elif is_gzip:
+                OpenSpectraFileFactory.__LOG.info("Opening {0} as a gzip file", path.name)
+                memory_model = GzipModel(path, header, progress_callback)
+            elif model == OpenSpectraFileFactory.MEMORY_MODEL:
+                memory_model = MemoryModel(path, header, progress_callback)
+            elif model == OpenSpectraFileFactory.PREAD_MODEL:
+                memory_model = PreadModel(path, header)
             else:
                 memory_model:FileModel = MappedModel(path, header)
 
@@ -1200,17 +3942,119 @@ class OpenSpectraFileFactory:
             else:
                 raise OpenSpectraHeaderError("Unexpected file type: {0}".format(file_type))
 
+            # the memory model already holds everything in native byte order and
+            # the chunked model has its own cache so only cache data for the others
+            if cache_size is None:
+                cache_size = OpenSpectraProperties.get_property("TileCacheSize", 268435456)
+
+            if cache_size > 0 and not isinstance(memory_model, (MemoryModel, ChunkedModel)):
+                file_delegate = CachedFileDelegate(file_delegate, TileCache(cache_size, path.name))
+
+            if model == OpenSpectraFileFactory.PINNED_MODEL:
+                file_delegate = PinnedFileDelegate(file_delegate, path.name)
+
             memory_model.load(file_delegate.shape())
-            return OpenSpectraFile(header, file_delegate, memory_model)
+
+            if isinstance(file_delegate, PinnedFileDelegate):
+                default_bands = OpenSpectraFileFactory.__default_bands(header)
+                if len(default_bands) > 0:
+                    file_delegate.pin_bands(default_bands)
+
+            if use_shadow is None:
+                use_shadow = OpenSpectraProperties.get_property("ShadowFilesEnabled", True)
+
+            shadow = None
+            if use_shadow and model != OpenSpectraFileFactory.MEMORY_MODEL and \
+                    ShadowFile.is_valid(file_name, header):
+                OpenSpectraFileFactory.__LOG.info("Using shadow file for {0}", path.name)
+                shadow = OpenSpectraFileFactory.create_open_spectra_file(
+                    ShadowFile.file_name(file_name, header.interleave()), model, use_shadow=False,
+                    cache_size=cache_size)
+
+            statistics = BandStatisticsFile.open(file_name, header)
+            if statistics is not None:
+                OpenSpectraFileFactory.__LOG.info("Using statistics file for {0}", path.name)
+
+            overviews = OverviewFile.open(file_name, header)
+            if overviews is not None:
+                OpenSpectraFileFactory.__LOG.info("Using overview file for {0}", path.name)
+
+            return OpenSpectraFile(header, file_delegate, memory_model, shadow, statistics, overviews)
 
         else:
             raise OpenSpectraFileError("File {0} not found".format(path))
 
+    @staticmethod
+    def __default_bands(header:OpenSpectraHeader) -> List[int]:
+        # default bands are one based in the header
+        default_bands = header.unsupported_props().get("default bands")
+        if not isinstance(default_bands, list):
+            return list()
+
+        try:
+            return [int(band) - 1 for band in default_bands if 0 < int(band) <= header.band_count()]
+        except ValueError:
+            OpenSpectraFileFactory.__LOG.warning("Ignoring unexpected default bands {0}", default_bands)
+            return list()
 
-def create_open_spectra_file(file_name, model=OpenSpectraFileFactory.MAPPED_MODEL) -> OpenSpectraFile:
+    @staticmethod
+    def __validate_size(path:Path, header:OpenSpectraHeader):
+        # check before mapping or reading anything, a short file usually means a copy is still in progress
+        expected_size = header.header_offset() + header.lines() * header.samples() * header.band_count() * \
+            np.dtype(header.data_type()).itemsize
+        file_size = path.stat().st_size
+        if file_size < expected_size:
+            raise OpenSpectraFileError("File {0} is {1} bytes but its header describes {2} bytes".
+                format(path.name, file_size, expected_size))
+
+
+class FileOpenRequest:
+    """Opens a file with OpenSpectraFileFactory in a way that can be cancelled from another
+    thread, open() is expected to be called on a worker thread and cancel() from any other.
+    Reading stops at the next progress report after cancel() is called, which is only
+    while the data is being read by a MEMORY_MODEL or a gzip file is being indexed, otherwise
+    the file is opened and open() raises OpenSpectraFileCancelled.  progress_callback is
+    called with the number of bytes read so far and the total, possibly from several threads"""
+
+    def __init__(self, file_name:str, model:int=OpenSpectraFileFactory.MAPPED_MODEL,
+            progress_callback:Callable[[int, int], None]=None, use_shadow:bool=None):
+        self.__file_name = file_name
+        self.__model = model
+        self.__progress_callback = progress_callback
+        self.__use_shadow = use_shadow
+        self.__cancelled = threading.Event()
+
+    def file_name(self) -> str:
+        return self.__file_name
+
+    def cancel(self):
+        self.__cancelled.set()
+
+    def is_cancelled(self) -> bool:
+        return self.__cancelled.is_set()
+
+    def open(self) -> OpenSpectraFile:
+        self.__check_cancelled()
+        file = OpenSpectraFileFactory.create_open_spectra_file(self.__file_name, self.__model,
+            self.__report_progress, self.__use_shadow)
+        self.__check_cancelled()
+        return file
+
+    def __report_progress(self, done:int, total:int):
+        self.__check_cancelled()
+        if self.__progress_callback is not None:
+            self.__progress_callback(done, total)
+
+    def __check_cancelled(self):
+        if self.__cancelled.is_set():
+            raise OpenSpectraFileCancelled("Opening {0} was cancelled".format(self.__file_name))
+
+
+def create_open_spectra_file(file_name, model=OpenSpectraFileFactory.MAPPED_MODEL,
+        progress_callback:Callable[[int, int], None]=None, use_shadow:bool=None) -> OpenSpectraFile:
     """A function based way to create an OpenSpectra file"""
 
-    return OpenSpectraFileFactory.create_open_spectra_file(file_name, model)
+    return OpenSpectraFileFactory.create_open_spectra_file(file_name, model, progress_callback, use_shadow)
 
 
 class OpenSpectraHeaderError(Exception):
@@ -1222,3 +4066,8 @@ class OpenSpectraFileError(Exception):
     """Raised when there's a problem with the data file"""
     pass
 
+
+class OpenSpectraFileCancelled(OpenSpectraFileError):
+    """Raised when opening a file is cancelled, see FileOpenRequest"""
+    pass
+
@@ -109,6 +109,7 @@ class BandList(QWidget):
     __LOG:Logger = LogHelper.logger("BandList")
 
     bandSelected = pyqtSignal(QTreeWidgetItem)
+    bandHighlighted = pyqtSignal(QTreeWidgetItem)
     rgbSelected = pyqtSignal(RGBSelectedBands)
 
     def __init__(self, parent:QWidget):
@@ -267,6 +268,7 @@ class BandList(QWidget):
             # grey scale is selected
             if len(selected_items) == 1 and selected_items[0].parent() is not None:
                 self.__type_selector.open_enabled(True)
+                self.bandHighlighted.emit(selected_items[0])
             else:
                 self.__type_selector.open_enabled(False)
 
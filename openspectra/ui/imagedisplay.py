@@ -20,7 +20,7 @@ from numpy import ma
 from openspectra.image import Image, BandDescriptor
 from openspectra.openspecrtra_tools import RegionOfInterest
 from openspectra.openspectra_file import OpenSpectraHeader
-from openspectra.utils import LogHelper, Logger, Singleton
+from openspectra.utils import LogHelper, Logger, Singleton, MemoryAccountant
 
 
 class ColorPicker(metaclass=Singleton):
@@ -811,15 +811,25 @@ class ImageDisplay(QScrollArea):
     viewport_scrolled = pyqtSignal(ViewLocationChangeEvent)
 
     def __init__(self, image:Image, qimage_format:QImage.Format=QImage.Format_Grayscale8,
-            location_rect:bool=True, pixel_select:bool=False, parent=None):
+            location_rect:bool=True, pixel_select:bool=False, parent=None, fitted:bool=False):
+        """If fitted and the image has an overview it's first displayed from the overview, the
+        full resolution image is only made when it's shown 1 to 1 or zoomed"""
         super().__init__(parent)
 
+        self.__is_fitted = fitted
+        self.__pix_map:QPixmap = None
+
         self.__margin_width = 4
         self.__margin_height = 4
 
         self.__image = image
         self.__qimage_format = qimage_format
 
+        descriptor = self.__image.descriptor()
+        if isinstance(descriptor, dict):
+            descriptor = next(iter(descriptor.values()))
+        self.__accounting_key = MemoryAccountant().register(descriptor.file_name(), "pixmap", 0, holder=self)
+
         self.__image_label = ImageLabel(self.__image.descriptor(), location_rect, pixel_select, self)
         self.__image_label.setBackgroundRole(QPalette.Base)
         self.__image_label.setSizePolicy(QSizePolicy.Ignored, QSizePolicy.Ignored)
@@ -870,12 +880,23 @@ class ImageDisplay(QScrollArea):
         image_height, image_width = self.__image.image_shape()
         self.__image_size = QSize(image_width, image_height)
 
-        self.__qimage:QImage = QImage(self.__image.image_data(), self.__image_size.width(),
-            self.__image_size.height(), self.__image.bytes_per_line(), self.__qimage_format)
+        # scaling down starts from the image's overview when it has one rather than the full image,
+        # the full resolution image is only made when it's shown 1 to 1 or zoomed
+        self.__overview:Image = self.__image.overview()
+
+        if self.__is_fitted and self.__overview is not None:
+            pix_map = self.__to_pixmap(self.__overview)
+            # keep the size it was fitted to when the image is refreshed
+            if self.__pix_map is not None:
+                pix_map = pix_map.scaled(self.__pix_map.size(), Qt.KeepAspectRatio, Qt.FastTransformation)
+            self.__pix_map = pix_map
+        else:
+            self.__is_fitted = False
+            self.__pix_map = self.__to_pixmap(self.__image)
 
-        self.__pix_map:QPixmap = QPixmap.fromImage(self.__qimage)
         self.__image_label.setPixmap(self.__pix_map)
         self.setWidget(self.__image_label)
+        self.__account_pixmap()
 
         # small margins to give a little extra room so the cursor doesn't change too soon.
         self.setViewportMargins(self.__margin_width, self.__margin_height,
@@ -889,8 +910,21 @@ class ImageDisplay(QScrollArea):
         ImageDisplay.__LOG.debug("Double clicked x: {0} y: {1}",
             event.pixel_x() + 1, event.pixel_y() + 1)
 
+    def __to_pixmap(self, image:Image) -> QPixmap:
+        # the QImage doesn't copy the image's data and the image's data may be released by the
+        # MemoryAccountant once it's done with, so hold on to it until the pixmap's copy is made
+        image_data = image.image_data()
+        image_height, image_width = image.image_shape()
+        qimage = QImage(image_data, image_width, image_height, image.bytes_per_line(), self.__qimage_format)
+        return QPixmap.fromImage(qimage)
+
+    def __account_pixmap(self):
+        MemoryAccountant().resize(self.__accounting_key,
+            self.__pix_map.width() * self.__pix_map.height() * self.__pix_map.depth() // 8)
+
     def __set_pixmap(self):
         self.__image_label.setPixmap(self.__pix_map)
+        self.__account_pixmap()
         new_size = self.__pix_map.size()
         ImageDisplay.__LOG.debug("setting image size: {0}", new_size)
         self.resize(new_size)
@@ -967,9 +1001,10 @@ class ImageDisplay(QScrollArea):
 
     def scale_image(self, factor:float):
         """Changes the scale relative to the original image size maintaining aspect ratio.
-        The image is reset from the original QImage each time to prevent degradation"""
+        The image is reset from the original image each time to prevent degradation"""
         ImageDisplay.__LOG.debug("scaling image by: {0}", factor)
-        pix_map = QPixmap.fromImage(self.__qimage)
+        self.__is_fitted = False
+        pix_map = self.__to_pixmap(self.__image)
         if factor != 1.0:
             new_size = self.__image_size * factor
             # Use Qt.FastTransformation so pixels can be distinguished when zoomed in
@@ -984,7 +1019,7 @@ class ImageDisplay(QScrollArea):
         Do not call repeatedly without a call to reset_size as image will blur with repeated scaling"""
 
         # Use Qt.FastTransformation so pixels can be distinguished when zoomed in
-        self.__pix_map = self.__pix_map.scaled(new_size, Qt.KeepAspectRatio, Qt.FastTransformation)
+        self.__pix_map = self.__scale_source().scaled(new_size, Qt.KeepAspectRatio, Qt.FastTransformation)
         ImageDisplay.__LOG.debug("scaling to size: {0}", new_size)
         self.__set_pixmap()
 
@@ -996,7 +1031,7 @@ class ImageDisplay(QScrollArea):
             ImageDisplay.__LOG.debug("scale_to_height locator size: {0}, pos: {1}", self.__image_label.locator_size(), self.__image_label.locator_position())
 
         # Use Qt.FastTransformation so pixels can be distinguished when zoomed in
-        self.__pix_map = self.__pix_map.scaledToHeight(height, Qt.FastTransformation)
+        self.__pix_map = self.__scale_source().scaledToHeight(height, Qt.FastTransformation)
         ImageDisplay.__LOG.debug("scaling to height: {0}", height)
         self.__set_pixmap()
 
@@ -1005,10 +1040,20 @@ class ImageDisplay(QScrollArea):
         Do not call repeatedly without a call to reset_size as image will blur with repeated scaling"""
 
         # Use Qt.FastTransformation so pixels can be distinguished when zoomed in
-        self.__pix_map = self.__pix_map.scaledToWidth(width, Qt.FastTransformation)
+        self.__pix_map = self.__scale_source().scaledToWidth(width, Qt.FastTransformation)
         ImageDisplay.__LOG.debug("scaling to width: {0}", width)
         self.__set_pixmap()
 
+    def __scale_source(self) -> QPixmap:
+        if self.__overview is not None:
+            self.__is_fitted = True
+            return self.__to_pixmap(self.__overview)
+        return self.__pix_map
+
+    def is_fitted(self) -> bool:
+        """Returns True if the image is currently displayed from its overview"""
+        return self.__is_fitted
+
     def reset_size(self):
         """reset the image size to 1 to 1"""
         # Reload the image, repeated scaling blurs the image
@@ -1016,7 +1061,8 @@ class ImageDisplay(QScrollArea):
             ImageDisplay.__LOG.debug("reset_size locator size: {0}, pos: {1}", self.__image_label.locator_size(),
                 self.__image_label.locator_position())
 
-        self.__pix_map = QPixmap.fromImage(self.__qimage)
+        self.__is_fitted = False
+        self.__pix_map = self.__to_pixmap(self.__image)
         self.__set_pixmap()
 
     def original_image_width(self) -> int:
@@ -1079,14 +1125,14 @@ class ImageDisplayWindow(QMainWindow):
 
     def __init__(self, image:Image, label:str, qimage_format:QImage.Format,
             screen_geometry:QRect, location_rect:bool=True, pixel_select:bool=False,
-            map_info:OpenSpectraHeader.MapInfo=None, parent=None):
+            map_info:OpenSpectraHeader.MapInfo=None, parent=None, fitted:bool=False):
         super().__init__(parent)
 
         self._map_info = map_info
 
         self.__image = image
         self.__image_label = label
-        self._image_display = ImageDisplay(self.__image, qimage_format, location_rect, pixel_select, self)
+        self._image_display = ImageDisplay(self.__image, qimage_format, location_rect, pixel_select, self, fitted)
         self.__init_ui()
 
         self._margin_width = self._image_display.margin_width()
@@ -1268,7 +1314,8 @@ class MainImageDisplayWindow(ImageDisplayWindow):
     def __init__(self, image:Image, label, qimage_format:QImage.Format,
             screen_geometry:QRect, map_info:OpenSpectraHeader.MapInfo=None,
             parent=None):
-        super().__init__(image, label, qimage_format, screen_geometry, True, False, map_info, parent)
+        # images with an overview start fitted to the screen so the full image isn't made until it's needed
+        super().__init__(image, label, qimage_format, screen_geometry, True, False, map_info, parent, True)
         self._image_display.right_clicked.connect(self.__handle_right_click)
         self._image_display.image_resized.connect(self.__handle_image_resize)
         self._image_display.locator_moved.connect(self.__handle_location_changed)
@@ -1305,6 +1352,17 @@ class MainImageDisplayWindow(ImageDisplayWindow):
         self.__set_for_image_size(QSize(self._image_display.original_image_width(), self._image_display.original_image_height()))
         self.__is_one_to_one = True
 
+        if self._image_display.is_fitted():
+            height = self._image_display.original_image_height()
+            width = self._image_display.original_image_width()
+            if height > self.__fit_to_size.height() and width > self.__fit_to_size.width():
+                self._image_display.scale_to_size(self.__fit_to_size)
+            elif height > self.__fit_to_size.height():
+                self._image_display.scale_to_height(self.__fit_to_size.height())
+            else:
+                self._image_display.scale_to_width(self.__fit_to_size.width())
+            self.__is_one_to_one = False
+
     def __set_for_image_size(self, size:QSize):
         MainImageDisplayWindow.__LOG.debug("Setting size for image size: {0}", size)
         self.__no_scroll_width = size.width() + self._frame_width * 2 + self._margin_width * 2
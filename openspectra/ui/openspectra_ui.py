@@ -44,6 +44,11 @@ class OpenSpectraUI(QMainWindow):
         self.__open_action.setStatusTip("Open file")
         self.__open_action.triggered.connect(self.__open)
 
+        self.__find_action = QAction("&Find", self)
+        self.__find_action.setShortcut("Ctrl+F")
+        self.__find_action.setStatusTip("Find files in the catalog")
+        self.__find_action.triggered.connect(self.__find)
+
         self.__save_action = QAction("&Save", self)
         self.__save_action.setShortcut("Ctrl+S")
         self.__save_action.setStatusTip("Save sub-cube")
@@ -83,6 +88,10 @@ class OpenSpectraUI(QMainWindow):
         self.__zoom_out_action.triggered.connect(self.__zoom_out)
         self.__zoom_out_action.setDisabled(True)
 
+        self.__memory_action = QAction("&Memory Usage", self)
+        self.__memory_action.setStatusTip("Show the memory used by each file")
+        self.__memory_action.triggered.connect(self.__memory_usage)
+
         self.__zoom_reset_action = QAction("&Zoom Reset")
         self.__zoom_reset_action.setShortcut("Ctrl+0")
         self.__zoom_reset_action.setStatusTip("Reset zoom to 1 to 1 for current zoom window")
@@ -93,6 +102,7 @@ class OpenSpectraUI(QMainWindow):
 
         file_menu = menu_bar.addMenu("&File")
         file_menu.addAction(self.__open_action)
+        file_menu.addAction(self.__find_action)
         file_menu.addAction(self.__save_action)
         file_menu.addAction(self.__close_action)
         # fileMenu.addAction(exitAct)
@@ -106,6 +116,7 @@ class OpenSpectraUI(QMainWindow):
         window_menu.addAction(self.__zoom_reset_action)
         window_menu.addAction(self.__zoom_in_action)
         window_menu.addAction(self.__zoom_out_action)
+        window_menu.addAction(self.__memory_action)
 
         self.__band_list = BandList(self)
         self.setCentralWidget(self.__band_list)
@@ -125,6 +136,10 @@ class OpenSpectraUI(QMainWindow):
     def __open(self):
         self.__fire_menu_event(MenuEvent.OPEN_EVENT)
 
+    @pyqtSlot()
+    def __find(self):
+        self.__fire_menu_event(MenuEvent.FIND_EVENT)
+
     @pyqtSlot()
     def __save(self):
         self.__fire_menu_event(MenuEvent.SAVE_EVENT)
@@ -157,6 +172,10 @@ class OpenSpectraUI(QMainWindow):
     def __zoom_out(self):
         self.__fire_menu_event(MenuEvent.ZOOM_OUT)
 
+    @pyqtSlot()
+    def __memory_usage(self):
+        self.__fire_menu_event(MenuEvent.MEMORY_EVENT)
+
     def __fire_menu_event(self, event_type:int):
         current_window:QWidget = QApplication.activeWindow()
         if current_window is not None:
@@ -169,7 +169,7 @@ class HistogramPlotCanvas(PlotCanvas):
         self.__band = band
 
     def plot(self, data:HistogramPlotData):
-        self._axes.hist(data.y_data, data.bins, data.x_data,
+        self._axes.hist(data.y_data, data.bins, data.x_data, weights=data.weights,
             color=data.color, linestyle=data.line_style)
         super().plot(data)
 
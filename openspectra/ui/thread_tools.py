@@ -1,9 +1,14 @@
+import threading
+import traceback
+from typing import Tuple, Dict, List, Callable
+
 from PyQt5.QtCore import QThreadPool, QRunnable, QMetaType, pyqtSignal, QObject
 
 from openspectra.image import BandDescriptor, GreyscaleImage, RGBImage, Image
-from openspectra.openspecrtra_tools import OpenSpectraImageTools
-from openspectra.openspectra_file import OpenSpectraFile
-from openspectra.utils import Logger, LogHelper
+from openspectra.openspecrtra_tools import OpenSpectraImageTools, BandPrefetcher, FileCatalog
+from openspectra.openspectra_file import OpenSpectraFile, OpenSpectraFileFactory, FileOpenRequest, \
+    OpenSpectraFileCancelled
+from openspectra.utils import Logger, LogHelper, OpenSpectraProperties
 
 
 class GreyscaleImageTask(QRunnable):
@@ -23,6 +28,8 @@ class GreyscaleImageTask(QRunnable):
     def run(self):
         GreyscaleImageTask.__LOG.debug("Task creating image...")
         image = self.__image_tools.greyscale_image(self.__band, self.__band_descriptor)
+        # stretch the full image here rather than on the UI thread, the zoom window shows it 1 to 1
+        image.image_data()
         GreyscaleImageTask.__LOG.debug("Task calling call back...")
         self.__call_back(image)
 
@@ -47,9 +54,75 @@ class RGBImageTask(QRunnable):
     def run(self):
         image = self.__image_tools.rgb_image(self.__red, self.__green, self.__blue,
             self.__red_descriptor, self.__green_descriptor, self.__blue_descriptor)
+        image.image_data()
         self.__call_back(image)
 
 
+class BandPinTask(QRunnable):
+    """Pins bands of a file in memory on a worker thread, see OpenSpectraFile.pin_bands"""
+
+    __LOG:Logger = LogHelper.logger("BandPinTask")
+
+    def __init__(self, file:OpenSpectraFile, bands:List[int]):
+        super().__init__()
+        self.__file = file
+        self.__bands = bands
+
+    def run(self):
+        try:
+            pinned = self.__file.pin_bands(self.__bands)
+            BandPinTask.__LOG.debug("Bands {0} of {1} pinned", pinned, self.__file.name())
+        except Exception:
+            # pinning only speeds things up, the bands are still read from the file without it
+            BandPinTask.__LOG.error("Failed to pin bands {0} of {1}\n{2}", self.__bands,
+                self.__file.name(), traceback.format_exc())
+
+
+class BandPrefetchTask(QRunnable):
+    """Warms the bands around a band on a worker thread, see BandPrefetcher"""
+
+    __LOG:Logger = LogHelper.logger("BandPrefetchTask")
+
+    def __init__(self, prefetcher:BandPrefetcher, band:int, generation:int):
+        super().__init__()
+        self.__prefetcher = prefetcher
+        self.__band = band
+        self.__generation = generation
+
+    def run(self):
+        try:
+            warmed = self.__prefetcher.run(self.__band, self.__generation)
+            BandPrefetchTask.__LOG.debug("Bands {0} around band {1} prefetched", warmed, self.__band)
+        except Exception:
+            # prefetching only speeds things up, the bands are still read when they're opened
+            BandPrefetchTask.__LOG.error("Failed to prefetch bands around band {0}\n{1}",
+                self.__band, traceback.format_exc())
+
+
+class ReleaseDispatcher(QObject):
+    """Runs the releases the MemoryAccountant hands it on the thread the dispatcher was
+    created on, the UI thread, so buffers the UI uses are never released from under it.
+    See MemoryAccountant.set_dispatcher"""
+
+    __LOG:Logger = LogHelper.logger("ReleaseDispatcher")
+
+    release_requested = pyqtSignal(object)
+
+    def __init__(self):
+        super().__init__()
+        self.release_requested.connect(self.__handle_release)
+
+    def dispatch(self, release:Callable[[], None]):
+        # queued when emitted from another thread, called directly on the UI thread
+        self.release_requested.emit(release)
+
+    def __handle_release(self, release:Callable[[], None]):
+        try:
+            release()
+        except:
+            ReleaseDispatcher.__LOG.error("Failed to release memory\n{0}", traceback.format_exc())
+
+
 class ThreadedImageTools(QObject):
     """A wrapper for OpenSpectraImageTools that allows Images to be created
     from data in a separate thread in a QT application.  This allows the UI to keep
@@ -58,16 +131,28 @@ class ThreadedImageTools(QObject):
 
     image_created = pyqtSignal(Image)
 
-    def __init__(self, file:OpenSpectraFile):
+    def __init__(self, file:OpenSpectraFile, fit_size:Tuple[int, int]=None):
         super().__init__()
-        self.__image_tools = OpenSpectraImageTools(file)
+        self.__image_tools = OpenSpectraImageTools(file, fit_size)
         self.__thread_pool = QThreadPool.globalInstance()
+        self.__prefetcher = BandPrefetcher(file,
+            self.__image_tools if OpenSpectraProperties.get_property("PrefetchImages", False) else None)
 
     def greyscale_image(self, band:int, band_descriptor:BandDescriptor):
         task = GreyscaleImageTask(self.__image_tools, band, band_descriptor, self.__handle_image_complete)
         task.setAutoDelete(True)
         self.__thread_pool.start(task)
 
+    def prefetch(self, band:int):
+        """Warm the bands around band on a low priority worker, any prefetch
+        still running for an earlier band is abandoned"""
+        task = BandPrefetchTask(self.__prefetcher, band, self.__prefetcher.start(band))
+        task.setAutoDelete(True)
+        self.__thread_pool.start(task, -1)
+
+    def cancel_prefetch(self):
+        self.__prefetcher.cancel()
+
     def rgb_image(self, red:int, green:int, blue:int,
             red_descriptor:BandDescriptor, green_descriptor:BandDescriptor,
             blue_descriptor:BandDescriptor):
@@ -78,3 +163,173 @@ class ThreadedImageTools(QObject):
 
     def __handle_image_complete(self, image:Image):
         self.image_created.emit(image)
+
+
+class FileOpenTask(QRunnable):
+
+    __LOG:Logger = LogHelper.logger("FileOpenTask")
+
+    def __init__(self, request:FileOpenRequest, call_back, error_call_back):
+        super().__init__()
+        self.__request = request
+        self.__call_back = call_back
+        self.__error_call_back = error_call_back
+
+    def run(self):
+        FileOpenTask.__LOG.debug("Task opening {0}...", self.__request.file_name())
+        try:
+            file = self.__request.open()
+        except Exception as error:
+            self.__error_call_back(self.__request, error, traceback.format_exc())
+        else:
+            self.__call_back(self.__request, file)
+
+
+class ThreadedFileOpener(QObject):
+    """Opens files on worker threads so the UI keeps working while large files load,
+    particularly with the MEMORY_MODEL or from slow network mounts.  Several files can be
+    opening at once, each can be cancelled.  The signals are delivered on the thread that
+    created the opener"""
+
+    __LOG:Logger = LogHelper.logger("ThreadedFileOpener")
+
+    # file name, the open file
+    file_opened = pyqtSignal(str, OpenSpectraFile)
+    # file name, bytes read, total bytes
+    open_progress = pyqtSignal(str, int, int)
+    # file name, error message, trace back
+    open_failed = pyqtSignal(str, str, str)
+    open_cancelled = pyqtSignal(str)
+
+    def __init__(self):
+        super().__init__()
+        self.__thread_pool = QThreadPool.globalInstance()
+        self.__requests:Dict[str, FileOpenRequest] = dict()
+        self.__lock = threading.Lock()
+
+    def open(self, file_name:str, model:int=OpenSpectraFileFactory.MAPPED_MODEL) -> bool:
+        """Start opening file_name, returns False if it's already being opened"""
+        with self.__lock:
+            if file_name in self.__requests:
+                return False
+
+            request = FileOpenRequest(file_name, model,
+                lambda done, total: self.open_progress.emit(file_name, done, total))
+            self.__requests[file_name] = request
+
+        task = FileOpenTask(request, self.__handle_opened, self.__handle_failed)
+        task.setAutoDelete(True)
+        self.__thread_pool.start(task)
+        return True
+
+    def cancel(self, file_name:str):
+        with self.__lock:
+            request = self.__requests.get(file_name)
+
+        if request is not None:
+            ThreadedFileOpener.__LOG.debug("Cancelling open of {0}", file_name)
+            request.cancel()
+
+    def is_opening(self, file_name:str) -> bool:
+        with self.__lock:
+            return file_name in self.__requests
+
+    def __handle_opened(self, request:FileOpenRequest, file:OpenSpectraFile):
+        self.__remove(request)
+        if request.is_cancelled():
+            self.open_cancelled.emit(request.file_name())
+        else:
+            self.file_opened.emit(request.file_name(), file)
+
+    def __handle_failed(self, request:FileOpenRequest, error:Exception, trace_back:str):
+        self.__remove(request)
+        if isinstance(error, OpenSpectraFileCancelled):
+            self.open_cancelled.emit(request.file_name())
+        else:
+            self.open_failed.emit(request.file_name(), "{0}: {1}".format(type(error).__name__, error), trace_back)
+
+    def __remove(self, request:FileOpenRequest):
+        with self.__lock:
+            self.__requests.pop(request.file_name(), None)
+
+
+class CatalogScanTask(QRunnable):
+    """Scans a directory into a FileCatalog of its own on the catalog file since
+    a FileCatalog can only be used on the thread that created it"""
+
+    __LOG:Logger = LogHelper.logger("CatalogScanTask")
+
+    def __init__(self, catalog_file_name:str, directory:str, progress_call_back, call_back, error_call_back):
+        super().__init__()
+        self.__catalog_file_name = catalog_file_name
+        self.__directory = directory
+        self.__progress_call_back = progress_call_back
+        self.__call_back = call_back
+        self.__error_call_back = error_call_back
+
+    def run(self):
+        CatalogScanTask.__LOG.debug("Task scanning {0}...", self.__directory)
+        try:
+            catalog = FileCatalog(self.__catalog_file_name)
+            try:
+                updated = catalog.scan(self.__directory, self.__progress_call_back)
+            finally:
+                catalog.close()
+        except Exception as error:
+            self.__error_call_back(self.__directory, error, traceback.format_exc())
+        else:
+            self.__call_back(self.__directory, updated)
+
+
+class ThreadedCatalogScanner(QObject):
+    """Scans directories into a FileCatalog on a worker thread so the UI keeps working
+    while large directory trees are scanned.  One scan runs at a time.  The signals are
+    delivered on the thread that created the scanner"""
+
+    __LOG:Logger = LogHelper.logger("ThreadedCatalogScanner")
+
+    # directory, headers checked, total headers
+    scan_progress = pyqtSignal(str, int, int)
+    # directory, number of files added or updated
+    scan_complete = pyqtSignal(str, int)
+    # directory, error message, trace back
+    scan_failed = pyqtSignal(str, str, str)
+
+    def __init__(self, catalog:FileCatalog):
+        super().__init__()
+        self.__catalog_file_name = catalog.catalog_file_name()
+        self.__thread_pool = QThreadPool.globalInstance()
+        self.__directory:str = None
+        self.__lock = threading.Lock()
+
+    def scan(self, directory:str) -> bool:
+        """Start scanning directory, returns False if a scan is already running"""
+        with self.__lock:
+            if self.__directory is not None:
+                return False
+
+            self.__directory = directory
+
+        task = CatalogScanTask(self.__catalog_file_name, directory,
+            lambda done, total: self.scan_progress.emit(directory, done, total),
+            self.__handle_complete, self.__handle_failed)
+        task.setAutoDelete(True)
+        self.__thread_pool.start(task)
+        return True
+
+    def is_scanning(self) -> bool:
+        with self.__lock:
+            return self.__directory is not None
+
+    def __handle_complete(self, directory:str, updated:int):
+        self.__finished()
+        self.scan_complete.emit(directory, updated)
+
+    def __handle_failed(self, directory:str, error:Exception, trace_back:str):
+        self.__finished()
+        ThreadedCatalogScanner.__LOG.error("Scan of {0} failed\n{1}", directory, trace_back)
+        self.scan_failed.emit(directory, "{0}: {1}".format(type(error).__name__, error), trace_back)
+
+    def __finished(self):
+        with self.__lock:
+            self.__directory = None
@@ -4,15 +4,17 @@
 from itertools import chain
 from typing import Dict, List, Tuple, Union
 
-from PyQt5.QtCore import Qt, pyqtSignal, QObject, QPoint, pyqtSlot, QRegExp
-from PyQt5.QtGui import QColor, QBrush, QCloseEvent, QFont, QResizeEvent, QRegExpValidator, QValidator
+from PyQt5.QtCore import Qt, pyqtSignal, QObject, QPoint, pyqtSlot, QRegExp, QTimer
+from PyQt5.QtGui import QColor, QBrush, QCloseEvent, QFont, QResizeEvent, QRegExpValidator, QValidator, QShowEvent, \
+    QHideEvent
 from PyQt5.QtWidgets import QMainWindow, QWidget, QVBoxLayout, \
     QTableWidget, QTableWidgetItem, QApplication, QStyle, QMenu, QAction, QHBoxLayout, QLabel, QComboBox, QFormLayout, \
-    QLineEdit, QPushButton, QMessageBox, QSlider
+    QLineEdit, QPushButton, QMessageBox, QSlider, QFileDialog, QProgressDialog
 
-from openspectra.openspecrtra_tools import RegionOfInterest, CubeParams
+from openspectra.openspecrtra_tools import RegionOfInterest, CubeParams, FileCatalog, CatalogEntry
 from openspectra.openspectra_file import OpenSpectraHeader
-from openspectra.utils import Logger, LogHelper
+from openspectra.ui.thread_tools import ThreadedCatalogScanner
+from openspectra.utils import Logger, LogHelper, MemoryAccountant, OpenSpectraProperties
 
 
 class RegionEvent(QObject):
@@ -712,4 +714,234 @@ class ZoomSetWindow(QMainWindow):
         self.setCentralWidget(self.__zoom_set_control)
 
     def zoom_factor(self) -> float:
-        return self.__zoom_set_control.zoom_factor()
\ No newline at end of file
+        return self.__zoom_set_control.zoom_factor()
+
+
+class CatalogControl(QWidget):
+    """Scans directories into a FileCatalog and searches it, see FileCatalog.  When threading
+    is enabled scans run on a worker thread, see ThreadedCatalogScanner"""
+
+    __LOG:Logger = LogHelper.logger("CatalogControl")
+
+    open_file = pyqtSignal(str)
+
+    __COLUMNS = ["File", "Lines", "Samples", "Bands", "Interleave", "Wavelengths"]
+
+    def __init__(self, catalog:FileCatalog, default_dir:str, parent=None):
+        super().__init__(parent)
+        self.__catalog = catalog
+        self.__default_dir = default_dir
+        self.__entries:List[CatalogEntry] = list()
+
+        self.__scanner:ThreadedCatalogScanner = None
+        self.__scan_dialog:QProgressDialog = None
+        if OpenSpectraProperties.get_property("ThreadingEnabled", True):
+            self.__scanner = ThreadedCatalogScanner(catalog)
+            self.__scanner.scan_progress.connect(self.__handle_scan_progress)
+            self.__scanner.scan_complete.connect(self.__handle_scan_complete)
+            self.__scanner.scan_failed.connect(self.__handle_scan_failed)
+
+        layout = QVBoxLayout()
+
+        self.__scan_button = QPushButton("Scan Directory...")
+        self.__scan_button.clicked.connect(self.__handle_scan)
+        layout.addWidget(self.__scan_button)
+
+        form_layout = QFormLayout()
+        self.__wavelength_from = CatalogControl.__number_field(self)
+        self.__wavelength_to = CatalogControl.__number_field(self)
+        form_layout.addRow("Wavelengths from:", self.__wavelength_from)
+        form_layout.addRow("Wavelengths to:", self.__wavelength_to)
+
+        bounds_layout = QHBoxLayout()
+        self.__bounds = [CatalogControl.__number_field(self) for _ in range(4)]
+        for field, tip in zip(self.__bounds, ["min x", "min y", "max x", "max y"]):
+            field.setPlaceholderText(tip)
+            bounds_layout.addWidget(field)
+        form_layout.addRow("Overlaps:", bounds_layout)
+
+        pixels_layout = QHBoxLayout()
+        self.__min_pixels = CatalogControl.__number_field(self)
+        self.__min_pixels.setPlaceholderText("min")
+        self.__max_pixels = CatalogControl.__number_field(self)
+        self.__max_pixels.setPlaceholderText("max")
+        pixels_layout.addWidget(self.__min_pixels)
+        pixels_layout.addWidget(self.__max_pixels)
+        form_layout.addRow("Pixels:", pixels_layout)
+        layout.addLayout(form_layout)
+
+        search_button = QPushButton("Search")
+        search_button.clicked.connect(self.__handle_search)
+        layout.addWidget(search_button)
+
+        self.__table = QTableWidget(0, len(CatalogControl.__COLUMNS), self)
+        self.__table.setHorizontalHeaderLabels(CatalogControl.__COLUMNS)
+        self.__table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.__table.setSelectionBehavior(QTableWidget.SelectRows)
+        self.__table.cellDoubleClicked.connect(self.__handle_double_click)
+        layout.addWidget(self.__table)
+
+        self.setLayout(layout)
+
+    @pyqtSlot()
+    def __handle_scan(self):
+        directory = QFileDialog.getExistingDirectory(self, "Scan directory", self.__default_dir)
+        if not directory:
+            return
+
+        self.__default_dir = directory
+        if self.__scanner is not None:
+            if self.__scanner.scan(directory):
+                self.__scan_button.setDisabled(True)
+                self.__scan_dialog = QProgressDialog("Scanning {0}...".format(directory), None, 0, 0, self)
+                self.__scan_dialog.setWindowTitle("Scan Directory")
+                self.__scan_dialog.setModal(False)
+                self.__scan_dialog.setMinimumDuration(500)
+        else:
+            QApplication.setOverrideCursor(Qt.WaitCursor)
+            try:
+                self.__catalog.scan(directory)
+            finally:
+                QApplication.restoreOverrideCursor()
+
+            self.__handle_search()
+
+    @pyqtSlot(str, int, int)
+    def __handle_scan_progress(self, directory:str, done:int, total:int):
+        if self.__scan_dialog is not None and total > 0:
+            self.__scan_dialog.setMaximum(total)
+            self.__scan_dialog.setValue(done)
+
+    @pyqtSlot(str, int)
+    def __handle_scan_complete(self, directory:str, updated:int):
+        CatalogControl.__LOG.debug("Scan of {0} updated {1} files", directory, updated)
+        self.__end_scan()
+        self.__handle_search()
+
+    @pyqtSlot(str, str, str)
+    def __handle_scan_failed(self, directory:str, message:str, trace_back:str):
+        self.__end_scan()
+        QMessageBox.critical(self, "Scan Failed", "Failed to scan {0} with error: {1}".format(directory, message))
+
+    def __end_scan(self):
+        self.__scan_button.setDisabled(False)
+        if self.__scan_dialog is not None:
+            self.__scan_dialog.close()
+            self.__scan_dialog = None
+
+    @pyqtSlot()
+    def __handle_search(self):
+        wavelengths = None
+        low = CatalogControl.__value(self.__wavelength_from)
+        high = CatalogControl.__value(self.__wavelength_to)
+        if low is not None or high is not None:
+            wavelengths = (low if low is not None else high, high if high is not None else low)
+
+        bounds = [CatalogControl.__value(field) for field in self.__bounds]
+        bounds = tuple(bounds) if all(value is not None for value in bounds) else None
+
+        min_pixels = CatalogControl.__value(self.__min_pixels)
+        max_pixels = CatalogControl.__value(self.__max_pixels)
+
+        self.__entries = self.__catalog.query(wavelengths, bounds, min_pixels, max_pixels)
+        CatalogControl.__LOG.debug("Search found {0} files", len(self.__entries))
+
+        self.__table.setRowCount(len(self.__entries))
+        for row, entry in enumerate(self.__entries):
+            wavelength_range = entry.wavelength_range()
+            values = [entry.file_name(), str(entry.lines()), str(entry.samples()), str(entry.band_count()),
+                entry.interleave(), "" if wavelength_range is None else "{0} - {1}".format(*wavelength_range)]
+            for column, value in enumerate(values):
+                self.__table.setItem(row, column, QTableWidgetItem(value))
+
+        self.__table.resizeColumnsToContents()
+
+    @pyqtSlot(int, int)
+    def __handle_double_click(self, row:int, column:int):
+        self.open_file.emit(self.__entries[row].file_name())
+
+    @staticmethod
+    def __number_field(parent:QWidget) -> QLineEdit:
+        field = QLineEdit(parent)
+        field.setValidator(QRegExpValidator(QRegExp("[+-]?[0-9]*[.]?[0-9]*([eE][+-]?[0-9]+)?")))
+        return field
+
+    @staticmethod
+    def __value(field:QLineEdit) -> float:
+        try:
+            return float(field.text())
+        except ValueError:
+            return None
+
+
+class CatalogWindow(QMainWindow):
+
+    __LOG:Logger = LogHelper.logger("CatalogWindow")
+
+    open_file = pyqtSignal(str)
+
+    def __init__(self, catalog:FileCatalog, default_dir:str, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Find Files")
+
+        catalog_control = CatalogControl(catalog, default_dir, self)
+        catalog_control.open_file.connect(self.open_file)
+        self.setCentralWidget(catalog_control)
+
+        self.setMinimumWidth(600)
+        self.setMinimumHeight(400)
+
+
+class MemoryUsageWindow(QMainWindow):
+    """Shows what the MemoryAccountant is counting for each file, refreshed while it's visible"""
+
+    __COLUMNS = ["File", "Kind", "Bytes"]
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Memory Usage")
+
+        widget = QWidget(self)
+        layout = QVBoxLayout()
+        self.__total_label = QLabel(widget)
+        layout.addWidget(self.__total_label)
+
+        self.__table = QTableWidget(0, len(MemoryUsageWindow.__COLUMNS), widget)
+        self.__table.setHorizontalHeaderLabels(MemoryUsageWindow.__COLUMNS)
+        self.__table.setEditTriggers(QTableWidget.NoEditTriggers)
+        layout.addWidget(self.__table)
+        widget.setLayout(layout)
+        self.setCentralWidget(widget)
+
+        self.__timer = QTimer(self)
+        self.__timer.timeout.connect(self.__refresh)
+
+        self.setMinimumWidth(500)
+        self.setMinimumHeight(300)
+
+    def showEvent(self, event:QShowEvent):
+        self.__refresh()
+        self.__timer.start(1000)
+        super().showEvent(event)
+
+    def hideEvent(self, event:QHideEvent):
+        self.__timer.stop()
+        super().hideEvent(event)
+
+    @pyqtSlot()
+    def __refresh(self):
+        accountant = MemoryAccountant()
+        self.__total_label.setText("{0:,} of {1:,} bytes, {2:,} released".format(
+            accountant.total(), accountant.ceiling(), accountant.released()))
+
+        rows = [(owner, kind, size) for owner, kinds in sorted(accountant.usage().items())
+                for kind, size in sorted(kinds.items())]
+        self.__table.setRowCount(len(rows))
+        for row, (owner, kind, size) in enumerate(rows):
+            self.__table.setItem(row, 0, QTableWidgetItem(owner))
+            self.__table.setItem(row, 1, QTableWidgetItem(kind))
+            item = QTableWidgetItem("{0:,}".format(size))
+            item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+            self.__table.setItem(row, 2, item)
+
+        self.__table.resizeColumnsToContents()
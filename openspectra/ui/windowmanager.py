@@ -8,24 +8,24 @@ import sys
 import traceback
 from typing import Dict, Tuple, List
 
-from PyQt5.QtCore import pyqtSlot, QObject, QRect, pyqtSignal, QChildEvent, Qt, QStandardPaths
+from PyQt5.QtCore import pyqtSlot, QObject, QRect, pyqtSignal, QChildEvent, Qt, QStandardPaths, QThreadPool
 from PyQt5.QtGui import QGuiApplication, QScreen, QImage
-from PyQt5.QtWidgets import QTreeWidgetItem, QFileDialog, QMessageBox, QCheckBox, QMainWindow
+from PyQt5.QtWidgets import QTreeWidgetItem, QFileDialog, QMessageBox, QCheckBox, QMainWindow, QProgressDialog
 
 from openspectra.image import Image, GreyscaleImage, RGBImage, Band, BandDescriptor
 from openspectra.openspecrtra_tools import OpenSpectraHistogramTools, OpenSpectraBandTools, OpenSpectraImageTools, \
-    RegionOfInterest, OpenSpectraRegionTools, SubCubeTools
+    RegionOfInterest, OpenSpectraRegionTools, SubCubeTools, FileCatalog
 from openspectra.openspectra_file import OpenSpectraFile, OpenSpectraHeader, OpenSpectraFileFactory, \
     OpenSpectraFileError
 from openspectra.ui.bandlist import BandList, RGBSelectedBands
 from openspectra.ui.imagedisplay import MainImageDisplayWindow, AdjustedMouseEvent, AreaSelectedEvent, \
     ZoomImageDisplayWindow, RegionDisplayItem, WindowCloseEvent, ImageDisplayWindow
 from openspectra.ui.plotdisplay import LinePlotDisplayWindow, HistogramDisplayWindow, LimitChangeEvent, LimitResetEvent
-from openspectra.ui.thread_tools import ThreadedImageTools
+from openspectra.ui.thread_tools import ThreadedImageTools, ThreadedFileOpener, BandPinTask, ReleaseDispatcher
 from openspectra.ui.toolsdisplay import RegionOfInterestDisplayWindow, RegionStatsEvent, RegionToggleEvent, \
     RegionCloseEvent, RegionNameChangeEvent, RegionSaveEvent, SubCubeWindow, FileSubCubeParams, SaveSubCubeEvent, \
-    ZoomSetWindow
-from openspectra.utils import LogHelper, Logger, OpenSpectraProperties
+    ZoomSetWindow, CatalogWindow, MemoryUsageWindow
+from openspectra.utils import LogHelper, Logger, OpenSpectraProperties, MemoryAccountant
 
 
 class MenuEvent(QObject):
@@ -39,6 +39,8 @@ class MenuEvent(QObject):
     ZOOM_OUT:int = 6
     ZOOM_RESET:int = 7
     ZOOM_SET:int = 8
+    FIND_EVENT:int = 9
+    MEMORY_EVENT:int = 10
 
     def __init__(self, event_type:int, window:QMainWindow):
         super().__init__()
@@ -144,12 +146,34 @@ class WindowManager(ExceptionManager):
         self.__file_managers:Dict[str, FileManager] = dict()
         self.__band_list = band_list
         self.__band_list.bandSelected.connect(self.__handle_band_select)
+        self.__band_list.bandHighlighted.connect(self.__handle_band_highlight)
         self.__band_list.rgbSelected.connect(self.__handle_rgb_select)
 
         self.__default_open_dir = QStandardPaths.writableLocation(QStandardPaths.HomeLocation)
         self.__save_manager = SaveManager(QStandardPaths.writableLocation(QStandardPaths.DownloadLocation),
                                 "Save Data", "", "")
 
+        self.__catalog_window:CatalogWindow = None
+        self.__memory_window:MemoryUsageWindow = None
+
+        # images are released on the UI thread even when a worker thread takes memory over the ceiling
+        self.__release_dispatcher = ReleaseDispatcher()
+        MemoryAccountant().set_dispatcher(self.__release_dispatcher.dispatch)
+
+        # with the pinned model bands selected in the band list are held in memory
+        self.__open_model = OpenSpectraFileFactory.PINNED_MODEL \
+            if OpenSpectraProperties.get_property("PinSelectedBands", False) else OpenSpectraFileFactory.MAPPED_MODEL
+
+        # files are opened on worker threads when threading is enabled, each shows a progress dialog until it's done
+        self.__file_opener:ThreadedFileOpener = None
+        self.__open_dialogs:Dict[str, QProgressDialog] = dict()
+        if OpenSpectraProperties.get_property("ThreadingEnabled", True):
+            self.__file_opener = ThreadedFileOpener()
+            self.__file_opener.file_opened.connect(self.__handle_file_opened)
+            self.__file_opener.open_progress.connect(self.__handle_open_progress)
+            self.__file_opener.open_failed.connect(self.__handle_open_failed)
+            self.__file_opener.open_cancelled.connect(self.__handle_open_cancelled)
+
         self.__zoom_set_window:ZoomSetWindow = ZoomSetWindow()
         self.__zoom_set_window.zoom_factor_changed.connect(self.zoom_factor_changed)
         self.__zoom_set_window.move(self.__screen_geometry.width() - self.__zoom_set_window.width() - 5, 0)
@@ -159,21 +183,113 @@ class WindowManager(ExceptionManager):
         file_name = file_dialog[0]
 
         if len(file_name) > 0:
-            try:
-                file = OpenSpectraFileFactory.create_open_spectra_file(file_name)
-                self.add_file(file)
-
-                # save the last save location, default there next time
-                split_path = os.path.split(file_name)
-                if split_path[0]:
-                    self.__default_open_dir = split_path[0]
-
-            except:
-                self._handle_exception("Failed to open file {} with error".
-                    format(file_name), sys.exc_info(), traceback.format_exc())
+            self.__open_file_name(file_name)
         else:
             WindowManager.__LOG.debug("File open canceled...")
 
+    def find_file(self):
+        """Show the window for finding files in the catalog, see FileCatalog"""
+        if self.__catalog_window is None:
+            catalog_file_name = OpenSpectraProperties.get_property("CatalogFile", None)
+            if catalog_file_name is None:
+                catalog_dir = QStandardPaths.writableLocation(QStandardPaths.AppDataLocation)
+                os.makedirs(catalog_dir, exist_ok=True)
+                catalog_file_name = os.path.join(catalog_dir, "catalog.sqlite")
+
+            WindowManager.__LOG.debug("Using catalog {0}", catalog_file_name)
+            self.__catalog_window = CatalogWindow(FileCatalog(catalog_file_name), self.__default_open_dir)
+            self.__catalog_window.open_file.connect(self.__open_file_name)
+
+        self.__catalog_window.show()
+        self.__catalog_window.raise_()
+
+    def show_memory_usage(self):
+        """Show the memory counted for each open file, see MemoryAccountant"""
+        if self.__memory_window is None:
+            self.__memory_window = MemoryUsageWindow()
+
+        WindowManager.__LOG.debug("Memory usage:\n{0}", MemoryAccountant().report())
+        self.__memory_window.show()
+        self.__memory_window.raise_()
+
+    @pyqtSlot(str)
+    def __open_file_name(self, file_name:str):
+        if self.__file_opener is not None:
+            self.__open_file_async(file_name)
+            return
+
+        try:
+            file = OpenSpectraFileFactory.create_open_spectra_file(file_name, self.__open_model)
+            self.add_file(file)
+
+            # save the last save location, default there next time
+            split_path = os.path.split(file_name)
+            if split_path[0]:
+                self.__default_open_dir = split_path[0]
+
+        except:
+            self._handle_exception("Failed to open file {} with error".
+                format(file_name), sys.exc_info(), traceback.format_exc())
+
+    def __open_file_async(self, file_name:str):
+        if self.__file_opener.is_opening(file_name):
+            WindowManager.__LOG.debug("File {0} is already being opened", file_name)
+            return
+
+        if not self.__file_opener.open(file_name, self.__open_model):
+            return
+
+        dialog = QProgressDialog("Opening {0}...".format(os.path.basename(file_name)), "Cancel", 0, 0,
+            self.__parent_window)
+        dialog.setWindowTitle("Open File")
+        dialog.setModal(False)
+        dialog.setAutoClose(False)
+        dialog.setAutoReset(False)
+        dialog.setMinimumDuration(500)
+        dialog.canceled.connect(lambda: self.__file_opener.cancel(file_name))
+        self.__open_dialogs[file_name] = dialog
+
+    @pyqtSlot(str, int, int)
+    def __handle_open_progress(self, file_name:str, done:int, total:int):
+        dialog = self.__open_dialogs.get(file_name)
+        if dialog is not None and total > 0:
+            # scale so large files don't overflow the dialog's int range
+            dialog.setMaximum(1000)
+            dialog.setValue(int(done * 1000 / total))
+
+    @pyqtSlot(str, OpenSpectraFile)
+    def __handle_file_opened(self, file_name:str, file:OpenSpectraFile):
+        self.__close_open_dialog(file_name)
+        try:
+            self.add_file(file)
+
+            # save the last save location, default there next time
+            split_path = os.path.split(file_name)
+            if split_path[0]:
+                self.__default_open_dir = split_path[0]
+
+        except:
+            self._handle_exception("Failed to open file {} with error".
+                format(file_name), sys.exc_info(), traceback.format_exc())
+
+    @pyqtSlot(str, str, str)
+    def __handle_open_failed(self, file_name:str, message:str, trace_back:str):
+        self.__close_open_dialog(file_name)
+        error_msg = "Failed to open file {} with error: {}".format(file_name, message)
+        WindowManager.__LOG.error("{}\n{}".format(error_msg, trace_back))
+        self._error_prompt(error_msg, trace_back)
+
+    @pyqtSlot(str)
+    def __handle_open_cancelled(self, file_name:str):
+        WindowManager.__LOG.debug("Open of {0} cancelled", file_name)
+        self.__close_open_dialog(file_name)
+
+    def __close_open_dialog(self, file_name:str):
+        dialog = self.__open_dialogs.pop(file_name, None)
+        if dialog is not None:
+            dialog.close()
+            dialog.deleteLater()
+
     def add_file(self, file:OpenSpectraFile):
         file_manager = FileManager(file, self)
         file_name = file_manager.file_name()
@@ -252,6 +368,12 @@ class WindowManager(ExceptionManager):
             if event_type == MenuEvent.OPEN_EVENT:
                 self.open_file()
 
+            elif event_type == MenuEvent.FIND_EVENT:
+                self.find_file()
+
+            elif event_type == MenuEvent.MEMORY_EVENT:
+                self.show_memory_usage()
+
             elif event_type == MenuEvent.SAVE_EVENT:
                 if target_window == self.__parent_window:
                     self.open_save_subcube(self.__band_list.selected_file())
@@ -342,6 +464,8 @@ class WindowManager(ExceptionManager):
                 file_set = self.__file_managers[file_name]
                 file_set.add_grey_window_set(
                     parent_item.indexOfChild(item), band_descriptor)
+                file_set.pin_bands([parent_item.indexOfChild(item)])
+                file_set.prefetch_bands(parent_item.indexOfChild(item))
             else:
                 msg = "An interal error occurred.  Failed to find the bands' file in the open file list.  Looking for file named {}".\
                     format(file_name)
@@ -351,6 +475,13 @@ class WindowManager(ExceptionManager):
             self._handle_exception("Failed open image due to an error.",
                 sys.exc_info(), traceback.format_exc())
 
+    @pyqtSlot(QTreeWidgetItem)
+    def __handle_band_highlight(self, item:QTreeWidgetItem):
+        parent_item = item.parent()
+        file_name = parent_item.text(0)
+        if file_name in self.__file_managers:
+            self.__file_managers[file_name].prefetch_bands(parent_item.indexOfChild(item))
+
     @pyqtSlot(RGBSelectedBands)
     def __handle_rgb_select(self, bands:RGBSelectedBands):
         try:
@@ -358,6 +489,7 @@ class WindowManager(ExceptionManager):
             if file_name in self.__file_managers:
                 file_set = self.__file_managers[file_name]
                 file_set.add_rgb_window_set(bands)
+                file_set.pin_bands([bands.red_index(), bands.green_index(), bands.blue_index()])
             else:
                 msg = "An interal error occurred.  Failed to find the bands' file in the open file list.  Looking for file named {}".\
                     format(file_name)
@@ -382,13 +514,17 @@ class FileManager(QObject):
         self.__band_tools = OpenSpectraBandTools(self.__file)
         self.__is_threading_enabled = OpenSpectraProperties.get_property("ThreadingEnabled", True)
 
+        # images larger than the screen carry an overview for when they're fitted to it
+        screen_geometry = self.__window_manager.screen_geometry()
+        fit_size = (screen_geometry.width(), screen_geometry.height())
+
         if self.__is_threading_enabled:
             FileManager.__LOG.info("Threading enabled for Image Tools")
-            self.__image_tools = ThreadedImageTools(self.__file)
+            self.__image_tools = ThreadedImageTools(self.__file, fit_size)
             self.__image_tools.image_created.connect(self.__create_window_set)
         else:
             FileManager.__LOG.info("Threading not enabled for Image Tools")
-            self.__image_tools = OpenSpectraImageTools(self.__file)
+            self.__image_tools = OpenSpectraImageTools(self.__file, fit_size)
 
         self.__window_sets = list()
 
@@ -413,6 +549,24 @@ class FileManager(QObject):
             if image is not None:
                 self.__create_window_set(image)
 
+    def pin_bands(self, bands:List[int]):
+        """Promote the bands into the file's pinned set, in the background when threading is enabled"""
+        if not self.__file.can_pin():
+            return
+
+        if self.__is_threading_enabled:
+            task = BandPinTask(self.__file, bands)
+            task.setAutoDelete(True)
+            QThreadPool.globalInstance().start(task)
+        else:
+            self.__file.pin_bands(bands)
+
+    def prefetch_bands(self, band:int):
+        """Warm the bands around band in the background, only done when threading
+        is enabled since without it prefetching would hold up the UI"""
+        if self.__is_threading_enabled:
+            self.__image_tools.prefetch(band)
+
     def header(self) -> OpenSpectraHeader:
         return self.__file.header()
 
@@ -429,6 +583,9 @@ class FileManager(QObject):
         return self.__window_manager
 
     def close(self):
+        if self.__is_threading_enabled:
+            self.__image_tools.cancel_prefetch()
+
         while len(self.__window_sets) > 0:
             window_set = self.__window_sets.pop()
             window_set.close()
@@ -2,11 +2,15 @@
 #  Last modified 1/21/19 6:29 PM
 #  Copyright (c) 2019. All rights reserved.
 
+import itertools
 import logging
 import logging.config as lc
 import os
+import threading
+import weakref
+from collections import OrderedDict
 from pathlib import Path
-from typing import Union, Dict
+from typing import Union, Dict, Callable, Hashable
 
 import numpy as np
 from yaml import load
@@ -83,6 +87,278 @@ class LogHelper:
         return Logger(logging.getLogger("openSpectra").getChild(name))
 
 
+class MemoryAccountant(metaclass=Singleton):
+    """Process wide accounting of the memory held by caches and derived buffers, grouped by
+    the file they belong to and their kind.  Each buffer is registered with its size and, if
+    it can be rebuilt when it's needed again, a function that releases it.  When the total
+    goes over the ceiling, MemoryCeiling in openspectra.properties, releasable buffers are
+    released least recently used first, buffers without a release function are counted but
+    never released.  Release functions are called without holding the accountant's lock
+    after the buffer has been unregistered so they may register new buffers.  They're called
+    on whichever thread went over the ceiling, except for buffers registered with on_owner_thread
+    whose releases are handed to the dispatcher set with set_dispatcher, in the application it
+    runs them on the UI thread that uses those buffers"""
+
+    __LOG:Logger = LogHelper.logger("MemoryAccountant")
+
+    class Entry:
+
+        def __init__(self, owner:str, kind:str, size:int, release:Callable[[], None], on_owner_thread:bool):
+            self.owner = owner
+            self.kind = kind
+            self.size = size
+            self.release = release
+            self.on_owner_thread = on_owner_thread
+
+    def __init__(self):
+        self.__ceiling:int = OpenSpectraProperties.get_property("MemoryCeiling", 2147483648)
+        # least recently used first
+        self.__entries:OrderedDict = OrderedDict()
+        self.__next_key = itertools.count(1)
+        self.__total:int = 0
+        self.__released:int = 0
+        self.__dispatcher:Callable[[Callable[[], None]], None] = None
+        self.__lock = threading.Lock()
+
+    def register(self, owner:str, kind:str, size:int, release:Callable[[], None]=None,
+            holder:object=None, on_owner_thread:bool=False) -> int:
+        """Start counting a buffer of size bytes and return the key used to refer to it.
+        If holder is given the buffer is unregistered when holder is garbage collected,
+        release should not hold a reference to holder or it never will be.  If on_owner_thread
+        release is called through the dispatcher when there is one, see set_dispatcher"""
+        key = next(self.__next_key)
+        with self.__lock:
+            self.__entries[key] = MemoryAccountant.Entry(owner, kind, size, release, on_owner_thread)
+            self.__total += size
+
+        if holder is not None:
+            weakref.finalize(holder, self.unregister, key)
+
+        self.__enforce_ceiling()
+        return key
+
+    def resize(self, key:int, size:int):
+        """Change the size of a registered buffer, it becomes the most recently used"""
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None:
+                self.__total += size - entry.size
+                entry.size = size
+                self.__entries.move_to_end(key)
+
+        self.__enforce_ceiling()
+
+    def touch(self, key:int):
+        """Mark a buffer as the most recently used"""
+        with self.__lock:
+            if key in self.__entries:
+                self.__entries.move_to_end(key)
+
+    def unregister(self, key:int):
+        """Stop counting a buffer, unknown keys are ignored"""
+        with self.__lock:
+            entry = self.__entries.pop(key, None)
+            if entry is not None:
+                self.__total -= entry.size
+
+    def is_registered(self, key:int) -> bool:
+        with self.__lock:
+            return key in self.__entries
+
+    def set_dispatcher(self, dispatcher:Callable[[Callable[[], None]], None]):
+        """dispatcher is passed the release functions of buffers registered with on_owner_thread
+        and should call them on the thread that owns those buffers, None calls them directly"""
+        self.__dispatcher = dispatcher
+
+    def ceiling(self) -> int:
+        return self.__ceiling
+
+    def set_ceiling(self, ceiling:int):
+        self.__ceiling = ceiling
+        self.__enforce_ceiling()
+
+    def total(self) -> int:
+        """The number of bytes currently counted"""
+        return self.__total
+
+    def released(self) -> int:
+        """The number of bytes released to stay under the ceiling so far"""
+        return self.__released
+
+    def usage(self) -> Dict[str, Dict[str, int]]:
+        """The bytes counted for each owner by kind"""
+        usage = dict()
+        with self.__lock:
+            for entry in self.__entries.values():
+                kinds = usage.setdefault(entry.owner, dict())
+                kinds[entry.kind] = kinds.get(entry.kind, 0) + entry.size
+
+        return usage
+
+    def report(self) -> str:
+        """A readable summary of usage for debugging"""
+        lines = ["Total {0:,} of {1:,} bytes, {2:,} released".format(self.__total, self.__ceiling, self.__released)]
+        for owner, kinds in sorted(self.usage().items()):
+            lines.append("{0}: {1:,}".format(owner, sum(kinds.values())))
+            lines.extend("    {0}: {1:,}".format(kind, size) for kind, size in sorted(kinds.items()))
+        return "\n".join(lines)
+
+    def __enforce_ceiling(self):
+        releases = list()
+        with self.__lock:
+            if self.__total > self.__ceiling:
+                for key, entry in list(self.__entries.items()):
+                    if self.__total <= self.__ceiling:
+                        break
+
+                    if entry.release is not None:
+                        del self.__entries[key]
+                        self.__total -= entry.size
+                        self.__released += entry.size
+                        releases.append(entry)
+
+        dispatcher = self.__dispatcher
+        for entry in releases:
+            MemoryAccountant.__LOG.debug("Releasing {0} bytes of {1} for {2}", entry.size, entry.kind, entry.owner)
+            if entry.on_owner_thread and dispatcher is not None:
+                dispatcher(entry.release)
+            else:
+                entry.release()
+
+
+class TileCache:
+    """A thread safe least recently used cache of numpy arrays bounded by the
+    total number of bytes held.  Arrays larger than the budget are never stored.
+    Each array is registered with the MemoryAccountant under owner as releasable
+    so the cache can also shrink when the process as a whole needs memory"""
+
+    def __init__(self, max_bytes:int, owner:str=None, kind:str="tiles"):
+        self.__max_bytes = max_bytes
+        self.__owner = owner if owner is not None else "unknown"
+        self.__kind = kind
+        self.__tiles:OrderedDict = OrderedDict()
+        # the accountant's key for each tile
+        self.__accounting:Dict[Hashable, int] = dict()
+        self.__current_bytes:int = 0
+        self.__hits:int = 0
+        self.__misses:int = 0
+        self.__lock = threading.Lock()
+        weakref.finalize(self, TileCache.__unregister_all, self.__accounting)
+
+    def get(self, key:Hashable) -> np.ndarray:
+        """Returns the array for key or None, updates the hit and miss counts"""
+        with self.__lock:
+            tile = self.__tiles.get(key)
+            if tile is None:
+                self.__misses += 1
+            else:
+                self.__hits += 1
+                self.__tiles.move_to_end(key)
+                accounting_key = self.__accounting.get(key)
+
+        if tile is not None and accounting_key is not None:
+            MemoryAccountant().touch(accounting_key)
+
+        return tile
+
+    def get_or_load(self, key:Hashable, loader:Callable[[], np.ndarray]) -> np.ndarray:
+        """Returns the array for key, calling loader to create it if it's not cached.
+        The loader is called without holding the cache lock so two threads may load the
+        same tile at the same time, in which case the last one loaded is kept"""
+        tile = self.get(key)
+        if tile is None:
+            tile = loader()
+            self.put(key, tile)
+
+        return tile
+
+    def put(self, key:Hashable, tile:np.ndarray):
+        removed = list()
+        with self.__lock:
+            old_tile = self.__tiles.pop(key, None)
+            if old_tile is not None:
+                self.__current_bytes -= old_tile.nbytes
+                removed.append(self.__accounting.pop(key, None))
+
+            stored = tile.nbytes <= self.__max_bytes
+            if stored:
+                while self.__current_bytes + tile.nbytes > self.__max_bytes:
+                    evicted_key, evicted_tile = self.__tiles.popitem(last=False)
+                    self.__current_bytes -= evicted_tile.nbytes
+                    removed.append(self.__accounting.pop(evicted_key, None))
+
+                self.__tiles[key] = tile
+                self.__current_bytes += tile.nbytes
+
+        # talk to the accountant without holding the lock, it may call __release
+        accountant = MemoryAccountant()
+        for accounting_key in removed:
+            if accounting_key is not None:
+                accountant.unregister(accounting_key)
+
+        if stored:
+            cache = weakref.ref(self)
+            accounting_key = accountant.register(self.__owner, self.__kind, tile.nbytes,
+                lambda: TileCache.__release(cache, key, tile))
+            with self.__lock:
+                if self.__tiles.get(key) is tile:
+                    self.__accounting[key] = accounting_key
+                    accounting_key = None
+
+            # already evicted or released
+            if accounting_key is not None:
+                accountant.unregister(accounting_key)
+
+    def contains(self, key:Hashable) -> bool:
+        """Check for key without changing the hit and miss counts or the eviction order"""
+        with self.__lock:
+            return key in self.__tiles
+
+    def clear(self):
+        with self.__lock:
+            self.__tiles.clear()
+            self.__current_bytes = 0
+            removed = list(self.__accounting.values())
+            self.__accounting.clear()
+
+        accountant = MemoryAccountant()
+        for accounting_key in removed:
+            accountant.unregister(accounting_key)
+
+    def hits(self) -> int:
+        return self.__hits
+
+    def misses(self) -> int:
+        return self.__misses
+
+    def size(self) -> int:
+        """The number of bytes currently held"""
+        return self.__current_bytes
+
+    def max_size(self) -> int:
+        return self.__max_bytes
+
+    def __len__(self) -> int:
+        return len(self.__tiles)
+
+    @staticmethod
+    def __unregister_all(accounting:Dict[Hashable, int]):
+        accountant = MemoryAccountant()
+        for accounting_key in list(accounting.values()):
+            accountant.unregister(accounting_key)
+
+    @staticmethod
+    def __release(cache:"weakref.ref", key:Hashable, tile:np.ndarray):
+        cache = cache()
+        if cache is not None:
+            with cache.__lock:
+                # the tile may have been replaced since it was registered
+                if cache.__tiles.get(key) is tile:
+                    del cache.__tiles[key]
+                    cache.__current_bytes -= tile.nbytes
+                    cache.__accounting.pop(key, None)
+
+
 class OpenSpectraDataTypes:
 
     Floats = (np.float32, np.float64,)
@@ -0,0 +1,91 @@
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from openspectra.openspectra_file import OpenSpectraFileFactory, OpenSpectraHeader, OpenSpectraFile
+
+
+def create_cube(directory:str, interleave:str, lines:int, samples:int, bands:int) -> str:
+    """Write an int16 cube filled with random values and a minimal header"""
+    file_name = os.path.join(directory, "benchmark_" + interleave)
+    if interleave == OpenSpectraHeader.BIL_INTERLEAVE:
+        shape = (lines, bands, samples)
+    elif interleave == OpenSpectraHeader.BSQ_INTERLEAVE:
+        shape = (bands, lines, samples)
+    else:
+        shape = (lines, samples, bands)
+
+    data = np.memmap(file_name, dtype=np.int16, mode="w+", shape=shape)
+    for index in range(shape[0]):
+        data[index] = np.random.randint(0, 10000, shape[1:], np.int16)
+    data.flush()
+    del data
+
+    with open(file_name + ".hdr", "wt") as header_file:
+        header_file.write("ENVI\n")
+        header_file.write("samples = {0}\n".format(samples))
+        header_file.write("lines = {0}\n".format(lines))
+        header_file.write("bands = {0}\n".format(bands))
+        header_file.write("header offset = 0\n")
+        header_file.write("file type = ENVI Standard\n")
+        header_file.write("data type = 2\n")
+        header_file.write("interleave = {0}\n".format(interleave))
+        header_file.write("byte order = {0}\n".format(OpenSpectraHeader.NATIVE_BYTE_ORDER))
+
+    return file_name
+
+
+def drop_page_cache(file_name:str):
+    """Ask the kernel to forget the file's cached pages so each run starts cold"""
+    with open(file_name, "rb") as data_file:
+        os.fsync(data_file.fileno())
+        os.posix_fadvise(data_file.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def open_file(file_name:str, hints:bool) -> OpenSpectraFile:
+    drop_page_cache(file_name)
+    os_file = OpenSpectraFileFactory.create_open_spectra_file(file_name)
+    os_file.enable_access_hints(hints)
+    return os_file
+
+
+def read_band_images(file_name:str, hints:bool, band_count:int) -> float:
+    os_file = open_file(file_name, hints)
+    start = time.perf_counter()
+    for band in np.linspace(0, os_file.header().band_count() - 1, band_count).astype(int):
+        np.sum(os_file.raw_image(int(band)))
+    return time.perf_counter() - start
+
+
+def read_cube(file_name:str, hints:bool, line_count:int) -> float:
+    os_file = open_file(file_name, hints)
+    start = time.perf_counter()
+    np.sum(os_file.cube((0, line_count), (0, os_file.header().samples()), (0, 10)))
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    """Compare reading with and without the automatic access hints given to
+    the operating system by OpenSpectraFile.  Each run starts with the file
+    dropped from the page cache.  Band images are read from bip and bil
+    files and a sub cube with a few bands from a bsq file, access patterns
+    that make the kernel's default read ahead guess wrong.  Pass the number of
+    lines, samples and bands to use, the default creates files of about 400MB.
+    Results vary widely with the storage device, the effect is most visible
+    on spinning disks and network file systems"""
+    lines, samples, bands = (1000, 1000, 200) if len(sys.argv) < 4 else [int(arg) for arg in sys.argv[1:4]]
+
+    with tempfile.TemporaryDirectory() as directory:
+        for interleave in [OpenSpectraHeader.BIP_INTERLEAVE, OpenSpectraHeader.BIL_INTERLEAVE]:
+            file_name = create_cube(directory, interleave, lines, samples, bands)
+            for hints in [False, True]:
+                print("{0} band images, hints {1}: {2:.3f}s".format(
+                    interleave, hints, read_band_images(file_name, hints, 10)))
+            os.remove(file_name)
+
+        file_name = create_cube(directory, OpenSpectraHeader.BSQ_INTERLEAVE, lines, samples, bands)
+        for hints in [False, True]:
+            print("bsq sub cube, hints {0}: {1:.3f}s".format(hints, read_cube(file_name, hints, lines // 2)))
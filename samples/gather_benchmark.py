@@ -0,0 +1,45 @@
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from openspectra.openspectra_file import OpenSpectraFileFactory, OpenSpectraHeader
+from samples.access_hint_benchmark import create_cube, drop_page_cache
+
+
+def read_region(file_name:str, lines:np.ndarray, samples:np.ndarray, gather:bool) -> float:
+    drop_page_cache(file_name)
+    os_file = OpenSpectraFileFactory.create_open_spectra_file(file_name, use_shadow=False)
+    start = time.perf_counter()
+    if gather:
+        os_file.bands(lines, samples)
+    else:
+        # what bands did before the gather engine, fancy indexing on the memory map
+        header = os_file.header()
+        data = np.memmap(file_name, np.int16, "r", shape=(header.band_count(), header.lines(), header.samples()))
+        np.moveaxis(data[:, lines, samples], 0, -1)
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    """Compare reading the bands for a 50,000 pixel region of interest from a bsq file
+    with numpy fancy indexing on a memory map and with the gather engine used by
+    OpenSpectraFile.bands.  Each run starts with the file dropped from the page cache.
+    Pass the number of lines, samples and bands to use, the default creates a file of
+    about 200MB.  Results vary widely with the storage device"""
+    lines, samples, bands = (1000, 1000, 100) if len(sys.argv) < 4 else [int(arg) for arg in sys.argv[1:4]]
+
+    # a 250 x 200 pixel block, in the scattered order a polygon region produces
+    region_lines, region_samples = np.meshgrid(np.arange(lines // 4, lines // 4 + 250),
+        np.arange(samples // 3, samples // 3 + 200), indexing="ij")
+    order = np.random.permutation(region_lines.size)
+    region_lines, region_samples = region_lines.reshape(-1)[order], region_samples.reshape(-1)[order]
+
+    with tempfile.TemporaryDirectory() as directory:
+        file_name = create_cube(directory, OpenSpectraHeader.BSQ_INTERLEAVE, lines, samples, bands)
+        for gather in [False, True]:
+            print("bsq region of {0} pixels, gather {1}: {2:.3f}s".format(
+                region_lines.size, gather, read_region(file_name, region_lines, region_samples, gather)))
+        os.remove(file_name)
@@ -0,0 +1,28 @@
+import glob
+import logging
+import os
+import sys
+import time
+
+from openspectra.openspectra_file import OpenSpectraHeader
+
+
+if __name__ == '__main__':
+    """Time OpenSpectraHeader.load for each of the headers in the test resources.
+    Run from the top of the project, optionally pass the number of times to
+    load each header, the default is 200"""
+    # the header logs each open
+    logging.disable(logging.INFO)
+    repeat = 200 if len(sys.argv) < 2 else int(sys.argv[1])
+
+    total = 0.0
+    for header_name in sorted(glob.glob(os.path.join("test", "unit_tests", "resources", "*.hdr"))):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            OpenSpectraHeader(header_name).load()
+        elapsed = time.perf_counter() - start
+        total += elapsed
+        print("{0}, {1} bytes: {2:.3f}ms per load".format(
+            os.path.basename(header_name), os.path.getsize(header_name), elapsed / repeat * 1000))
+
+    print("all headers: {0:.3f}s for {1} loads each".format(total, repeat))
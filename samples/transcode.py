@@ -0,0 +1,18 @@
+import sys
+
+from openspectra.openspecrtra_tools import InterleaveTranscoder
+from openspectra.openspectra_file import OpenSpectraFileFactory
+
+
+def transcode(file_name:str, out_file_name:str, interleave:str):
+    source_file = OpenSpectraFileFactory.create_open_spectra_file(file_name)
+    transcoder = InterleaveTranscoder(source_file, interleave,
+        progress_callback=lambda written, total: print("\r{0:.0%}".format(written / total), end=""))
+    transcoder.transcode(out_file_name)
+    print()
+
+
+if __name__ == '__main__':
+    """Convert a file to a different interleave without loading it into memory.
+    Usage: transcode.py <file> <new file> <bil|bsq|bip>"""
+    transcode(sys.argv[1], sys.argv[2], sys.argv[3])
@@ -0,0 +1,42 @@
+import os
+from typing import Tuple
+
+import numpy as np
+
+from openspectra.openspectra_file import OpenSpectraHeader, MutableOpenSpectraHeader
+
+
+def cube_to_interleave(cube:np.ndarray, interleave:str) -> np.ndarray:
+    """Convert a cube with axis order (lines, samples, bands) to the axis order used by interleave"""
+    return cube.transpose(OpenSpectraHeader.interleave_axes(interleave))
+
+
+def create_test_cube(directory:str, interleave:str=OpenSpectraHeader.BIL_INTERLEAVE,
+        lines:int=12, samples:int=10, bands:int=6, header_offset:int=0,
+        name:str="test_cube", byte_order:int=OpenSpectraHeader.LITTLE_ENDIAN) -> Tuple[str, np.ndarray]:
+    """Write a small int16 data cube and matching header to directory.  The header is
+    based on sample_header_1.hdr.  Returns the data file name and the data written with
+    axis order (lines, samples, bands)"""
+
+    source_header = OpenSpectraHeader("test/unit_tests/resources/sample_header_1.hdr")
+    source_header.load()
+
+    header = MutableOpenSpectraHeader(os_header=source_header)
+    header.set_lines(lines)
+    header.set_samples(samples)
+    header.set_bands(bands, source_header.band_names()[0:bands],
+        source_header.wavelengths()[0:bands], source_header.bad_band_list()[0:bands])
+    header.set_interleave(interleave)
+    header.set_header_offset(header_offset)
+    header.set_byte_order(byte_order)
+
+    cube = (np.arange(lines * samples * bands) % 30000).astype(np.int16).reshape(lines, samples, bands)
+
+    file_name = os.path.join(directory, name)
+    with open(file_name, "wb") as out_file:
+        out_file.write(bytes(header_offset))
+        file_type = cube.dtype.newbyteorder("<" if byte_order == OpenSpectraHeader.LITTLE_ENDIAN else ">")
+        out_file.write(np.ascontiguousarray(cube_to_interleave(cube, interleave), file_type).tobytes())
+
+    header.save(file_name)
+    return file_name, cube
@@ -5,8 +5,9 @@ import unittest
 
 import numpy as np
 
-from openspectra.image import BandDescriptor, BandImageAdjuster
-from openspectra.openspectra_file import OpenSpectraFileFactory
+from openspectra.image import BandDescriptor, BandImageAdjuster, GreyscaleImage
+from openspectra.openspectra_file import OpenSpectraFileFactory, BandSummary
+from openspectra.utils import MemoryAccountant
 
 
 class BandDescriptorTest(unittest.TestCase):
@@ -59,14 +60,81 @@ class BandImageAdjusterTest(unittest.TestCase):
         self.assertEqual(adjust_image[181, 326], 0)
 
 
+class BandSummaryStretchTest(unittest.TestCase):
+
+    def test_percentage_stretch(self):
+        band = np.arange(200, dtype=np.int16).reshape(10, 20) // 2
+        counts = np.zeros(128, np.int64)
+        counts[:100] = 2
+        summary = BandSummary(0, 99, band.mean(), band.std(), 200, 0, 0, counts, 0.0, 1.0, True)
+
+        adjuster = BandImageAdjuster(band, summary=summary)
+        expected_low, expected_high = np.percentile(band, (2, 98))
+        self.assertEqual(np.floor(expected_low), adjuster.low_cutoff())
+        self.assertEqual(np.floor(expected_high), adjuster.high_cutoff())
+        self.assertEqual(band.shape, adjuster.adjusted_data().shape)
+
+        descriptor = BandDescriptor("file_name", "band_name", "wavelength_label", summary=summary)
+        self.assertIs(summary, descriptor.summary())
+
+
 class RGBImageAdjusterTest(unittest.TestCase):
     # TODO
     pass
 
 
 class GreyscaleImageTest(unittest.TestCase):
-    # TODO
-    pass
+
+    def test_overview(self):
+        band = np.arange(400, dtype=np.int16).reshape(20, 20)
+        overview = band[::2, ::2].copy()
+        descriptor = BandDescriptor("file_name", "band_name", "wavelength_label")
+
+        # the stretch still comes from the full band unless OverviewStretch is set
+        image = GreyscaleImage(band, descriptor, overview)
+        self.assertEqual(np.percentile(band, 2), image.low_cutoff())
+        self.assertEqual(np.percentile(band, 98), image.high_cutoff())
+        self.assertEqual((20, 20), image.image_shape())
+
+        # and the overview image follows the full image's stretch
+        image.adjust_by_value(100, 300)
+        overview_image = image.overview()
+        self.assertEqual((10, 10), overview_image.image_shape())
+        self.assertEqual(100, overview_image.low_cutoff())
+        self.assertEqual(300, overview_image.high_cutoff())
+        self.assertTrue(np.array_equal(image.image_data()[::2, ::2], overview_image.image_data()))
+
+        self.assertIsNone(GreyscaleImage(band, descriptor).overview())
+
+    def test_image_released(self):
+        band = np.arange(400, dtype=np.int16).reshape(20, 20)
+        image = GreyscaleImage(band, BandDescriptor("released_image", "band_name", "wavelength_label"))
+        expected = image.image_data().copy()
+
+        ceiling = MemoryAccountant().ceiling()
+        try:
+            MemoryAccountant().set_ceiling(0)
+        finally:
+            MemoryAccountant().set_ceiling(ceiling)
+
+        self.assertFalse("released_image" in MemoryAccountant().usage())
+        self.assertTrue(np.array_equal(expected, image.image_data()))
+
+    def test_released_data_rebuilt(self):
+        band = np.arange(400, dtype=np.int16).reshape(20, 20)
+        adjuster = BandImageAdjuster(band, owner="released_file")
+        expected = adjuster.adjusted_data().copy()
+        self.assertEqual(expected.nbytes, MemoryAccountant().usage()["released_file"]["adjusted image"])
+
+        ceiling = MemoryAccountant().ceiling()
+        try:
+            MemoryAccountant().set_ceiling(0)
+        finally:
+            MemoryAccountant().set_ceiling(ceiling)
+
+        self.assertFalse("released_file" in MemoryAccountant().usage())
+        self.assertTrue(np.array_equal(expected, adjuster.adjusted_data()))
+        self.assertEqual(expected.nbytes, MemoryAccountant().usage()["released_file"]["adjusted image"])
 
 
 class RGBImageTest(unittest.TestCase):
@@ -1,16 +1,25 @@
 #  Developed by Joseph M. Conti and Joseph W. Boardman on 2/2/19 6:12 PM.
 #  Last modified 2/2/19 6:12 PM
 #  Copyright (c) 2019. All rights reserved.
+import gzip
 import math
 import os
+import tempfile
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from typing import List, Tuple
 
 import numpy as np
 
 from openspectra.openspectra_file import OpenSpectraHeader, OpenSpectraFileFactory, PercentageStretch, \
     LinearImageStretch, \
-    ValueStretch, OpenSpectraHeaderError, MutableOpenSpectraHeader
+    ValueStretch, OpenSpectraHeaderError, MutableOpenSpectraHeader, MemoryModel, BILShape, OpenSpectraFileError, \
+    CachedFileDelegate, BIPFileDelegate, MappedModel, BIPShape, AccessHint, BILFileDelegate, BQSFileDelegate, \
+    BQSShape, PreadModel, GzipIndex, ZlibInflater, FileArray, VirtualMosaic, FileOpenRequest, OpenSpectraFileCancelled, \
+    OpenSpectraFileWriter, PinnedFileDelegate
+from openspectra.utils import MemoryAccountant, TileCache
+from test.unit_tests.openspectra.cube_builder import create_test_cube, cube_to_interleave
 
 
 class OpenSpectraHeaderTest(unittest.TestCase):
@@ -168,6 +177,45 @@ class OpenSpectraHeaderTest(unittest.TestCase):
         expected_str = "{UTM, 1.000, 1.000, 50000.000, 4000000.000, 2.0000000000e+001, 2.0000000000e+001, 12, North, WGS-84, units=Meters, rotation=30.00000000}"
         self.assertEqual(expected_str, str(header.map_info()))
 
+    def test_bracket_values(self):
+        header_text = "ENVI\r\n" \
+            "description = {\r\n  first line  \r\n second line}\r\n" \
+            "samples = 3\r\nlines= 2\r\nbands =2\r\nheader offset = 0\r\n" \
+            "file type = ENVI Standard\r\ndata type = 2\r\ninterleave = bsq\r\nbyte order = 0\r\n" \
+            "band names = {\r\n red,\r\n green}\r\n" \
+            "wavelength = {\r\n 1.5,\r\n 2.5\r\n}\r\n" \
+            "not a property\r\n" \
+            "custom list = {a, b}\r\n" \
+            "custom value = x = y\r\n"
+
+        with tempfile.TemporaryDirectory() as directory:
+            test_file = os.path.join(directory, "brackets.hdr")
+            with open(test_file, "w", newline="") as header_file:
+                header_file.write(header_text)
+
+            header = OpenSpectraHeader(test_file)
+            header.load()
+
+        self.assertEqual("\n  first line\n second line", header.description())
+        self.assertEqual(3, header.samples())
+        self.assertEqual(2, header.lines())
+        self.assertEqual(["red", "green"], header.band_names())
+        self.assertTrue(np.array_equal(np.array([1.5, 2.5]), header.wavelengths()))
+        self.assertEqual({"custom list": ["a", "b"], "custom value": "x = y"}, header.unsupported_props())
+
+    def test_interleave_axes(self):
+        cube = np.arange(24).reshape(2, 3, 4)
+        self.assertEqual((2, 4, 3), cube.transpose(OpenSpectraHeader.interleave_axes("bil")).shape)
+        self.assertEqual((4, 2, 3), cube.transpose(OpenSpectraHeader.interleave_axes("bsq")).shape)
+        self.assertEqual((2, 3, 4), cube.transpose(OpenSpectraHeader.interleave_axes("bip")).shape)
+
+        for interleave in ["bil", "bsq", "bip"]:
+            axes = OpenSpectraHeader.interleave_axes(interleave)
+            self.assertTrue(np.array_equal(cube, cube.transpose(axes).transpose(np.argsort(axes))))
+
+        with self.assertRaises(ValueError):
+            OpenSpectraHeader.interleave_axes("abc")
+
 
 class MapInfoTest(unittest.TestCase):
 
@@ -329,6 +377,144 @@ class OpenSpectraFileTest(unittest.TestCase):
 # TODO validate OpenSpectraFileFactory switches work...
 
 
+class MemoryModelTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.__temp_dir = tempfile.TemporaryDirectory()
+        self.__file_name, self.__cube = create_test_cube(self.__temp_dir.name, header_offset=128)
+        self.__header = OpenSpectraHeader(self.__file_name + ".hdr")
+        self.__header.load()
+        self.__shape = BILShape(self.__header.lines(), self.__header.samples(), self.__header.band_count())
+
+    def tearDown(self) -> None:
+        self.__temp_dir.cleanup()
+
+    def test_load(self):
+        memory_model = MemoryModel(Path(self.__file_name), self.__header)
+        memory_model.load(self.__shape)
+        self.assertTrue(np.array_equal(cube_to_interleave(self.__cube, OpenSpectraHeader.BIL_INTERLEAVE),
+            memory_model.file()))
+
+    def test_parallel_load(self):
+        progress = list()
+        memory_model = MemoryModel(Path(self.__file_name), self.__header,
+            lambda bytes_read, total: progress.append((bytes_read, total)), read_threads=3, chunk_size=100)
+        memory_model.load(self.__shape)
+        self.assertTrue(np.array_equal(cube_to_interleave(self.__cube, OpenSpectraHeader.BIL_INTERLEAVE),
+            memory_model.file()))
+
+        total_bytes = self.__cube.nbytes
+        self.assertTrue(len(progress) >= math.ceil(total_bytes / 100))
+        self.assertEqual((total_bytes, total_bytes), max(progress))
+
+    def test_factory(self):
+        mapped_file = OpenSpectraFileFactory.create_open_spectra_file(self.__file_name)
+        memory_file = OpenSpectraFileFactory.create_open_spectra_file(self.__file_name,
+            OpenSpectraFileFactory.MEMORY_MODEL)
+        self.assertTrue(np.array_equal(mapped_file.raw_image(3), memory_file.raw_image(3)))
+        self.assertTrue(np.array_equal(mapped_file.bands(5, 7), memory_file.bands(5, 7)))
+
+    def test_size_mismatch(self):
+        with open(self.__file_name, "ab") as data_file:
+            data_file.write(bytes(2))
+
+        memory_model = MemoryModel(Path(self.__file_name), self.__header)
+        with self.assertRaises(OpenSpectraFileError):
+            memory_model.load(self.__shape)
+
+    def test_short_file(self):
+        with open(self.__file_name, "r+b") as data_file:
+            data_file.truncate(os.path.getsize(self.__file_name) - 2)
+
+        with self.assertRaises(OpenSpectraFileError):
+            OpenSpectraFileFactory.create_open_spectra_file(self.__file_name)
+
+    def test_open_request(self):
+        progress = list()
+        request = FileOpenRequest(self.__file_name, OpenSpectraFileFactory.MEMORY_MODEL,
+            lambda bytes_read, total: progress.append((bytes_read, total)))
+        file = request.open()
+        self.assertEqual(self.__cube.nbytes, max(progress)[0])
+        self.assertTrue(np.array_equal(self.__cube[:, :, 3], file.raw_image(3)))
+
+        request = FileOpenRequest(self.__file_name)
+        request.cancel()
+        with self.assertRaises(OpenSpectraFileCancelled):
+            request.open()
+
+    def test_open_request_cancelled(self):
+        request = FileOpenRequest(self.__file_name, OpenSpectraFileFactory.MEMORY_MODEL,
+            lambda bytes_read, total: request.cancel())
+        with self.assertRaises(OpenSpectraFileCancelled):
+            request.open()
+        self.assertTrue(request.is_cancelled())
+
+
+class ByteOrderTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.__temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.__temp_dir.cleanup()
+
+    def test_big_endian(self):
+        for interleave in [OpenSpectraHeader.BIL_INTERLEAVE, OpenSpectraHeader.BSQ_INTERLEAVE,
+                OpenSpectraHeader.BIP_INTERLEAVE]:
+            file_name, cube = create_test_cube(self.__temp_dir.name, interleave,
+                name=interleave, byte_order=OpenSpectraHeader.BIG_ENDIAN)
+
+            for model in [OpenSpectraFileFactory.MAPPED_MODEL, OpenSpectraFileFactory.MEMORY_MODEL]:
+                os_file = OpenSpectraFileFactory.create_open_spectra_file(file_name, model)
+                self.assertEqual(OpenSpectraHeader.BIG_ENDIAN, os_file.header().byte_order())
+
+                image = os_file.raw_image(2)
+                self.assertTrue(image.dtype.isnative)
+                self.assertTrue(np.array_equal(cube[:, :, 2], image))
+                self.assertTrue(os_file.raw_image((2, 3)).dtype.isnative)
+
+                bands = os_file.bands(3, 4)
+                self.assertTrue(bands.dtype.isnative)
+                self.assertTrue(np.array_equal(cube[3, 4, :].reshape(1, cube.shape[2]), bands))
+
+                sub_cube = os_file.cube((1, 5), (2, 6), (0, 3))
+                self.assertTrue(sub_cube.dtype.isnative)
+                self.assertTrue(np.array_equal(cube_to_interleave(cube[1:5, 2:6, 0:3], interleave), sub_cube))
+
+    def test_big_endian_image_cache(self):
+        file_name, cube = create_test_cube(self.__temp_dir.name, byte_order=OpenSpectraHeader.BIG_ENDIAN)
+        os_file = OpenSpectraFileFactory.create_open_spectra_file(file_name)
+
+        image = os_file.raw_image(1)
+        self.assertIs(image, os_file.raw_image(1))
+        self.assertFalse(image.flags.writeable)
+
+    def test_big_endian_without_cache(self):
+        file_name, cube = create_test_cube(self.__temp_dir.name, byte_order=OpenSpectraHeader.BIG_ENDIAN)
+        os_file = OpenSpectraFileFactory.create_open_spectra_file(file_name, cache_size=0)
+
+        # the last band converted is kept
+        image = os_file.raw_image(1)
+        self.assertIs(image, os_file.raw_image(1))
+        self.assertIs(image, os_file.raw_image(-5))
+        self.assertFalse(image.flags.writeable)
+        self.assertTrue(np.array_equal(cube[:, :, 1], image))
+
+        other = os_file.raw_image(2)
+        self.assertTrue(np.array_equal(cube[:, :, 2], other))
+        self.assertIsNot(image, os_file.raw_image(1))
+
+        # and can be released
+        ceiling = MemoryAccountant().ceiling()
+        try:
+            MemoryAccountant().set_ceiling(1)
+            image = os_file.raw_image(3)
+            self.assertTrue(np.array_equal(cube[:, :, 3], image))
+            self.assertIsNot(image, os_file.raw_image(3))
+        finally:
+            MemoryAccountant().set_ceiling(ceiling)
+
+
 class MutableOpenSpectraHeaderTest(unittest.TestCase):
 
     def setUp(self) -> None:
@@ -600,4 +786,673 @@ class ImageStretchTest(unittest.TestCase):
 
     def test_base_class(self):
         with self.assertRaises(TypeError):
-            test = LinearImageStretch()
\ No newline at end of file
+            test = LinearImageStretch()
+
+
+class CachedFileDelegateTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.__temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.__temp_dir.cleanup()
+
+    def test_factory_cache(self):
+        for interleave in [OpenSpectraHeader.BIL_INTERLEAVE, OpenSpectraHeader.BSQ_INTERLEAVE,
+                OpenSpectraHeader.BIP_INTERLEAVE]:
+            file_name, cube = create_test_cube(self.__temp_dir.name, interleave, name=interleave)
+            os_file = OpenSpectraFileFactory.create_open_spectra_file(file_name)
+            self.assertIsNotNone(os_file.tile_cache())
+
+            self.assertTrue(np.array_equal(cube[:, :, 4], os_file.raw_image(4)))
+            self.assertTrue(np.array_equal(cube[:, :, -1], os_file.raw_image(-1)))
+            self.assertEqual(2, os_file.tile_cache().misses())
+            self.assertTrue(np.array_equal(cube[:, :, 4], os_file.raw_image(4)))
+            self.assertEqual(1, os_file.tile_cache().hits())
+
+            memory_file = OpenSpectraFileFactory.create_open_spectra_file(file_name,
+                OpenSpectraFileFactory.MEMORY_MODEL)
+            self.assertIsNone(memory_file.tile_cache())
+
+    def test_bands(self):
+        file_name, cube = create_test_cube(self.__temp_dir.name, OpenSpectraHeader.BIP_INTERLEAVE,
+            lines=25, byte_order=OpenSpectraHeader.BIG_ENDIAN)
+        header = OpenSpectraHeader(file_name + ".hdr")
+        header.load()
+
+        file_model = MappedModel(Path(file_name), header)
+        file_model.load(BIPShape(header.lines(), header.samples(), header.band_count()))
+        cache = TileCache(4 * 25 * 10 * 2)
+        delegate = CachedFileDelegate(BIPFileDelegate(header, file_model), cache)
+        self.assertTrue(delegate.is_cacheable())
+
+        # each band is one entry and the cached array is returned without copying again
+        image = delegate.image(2)
+        self.assertTrue(image.dtype.isnative)
+        self.assertFalse(image.flags.writeable)
+        self.assertTrue(np.array_equal(cube[:, :, 2], image))
+        self.assertEqual(1, cache.misses())
+        self.assertIs(image, delegate.image(2))
+        self.assertIs(image, delegate.image(2 - header.band_count()))
+        self.assertTrue(delegate.is_cached(-4))
+
+        # not all bands for the pixel are cached so read from the file
+        self.assertTrue(np.array_equal(cube[13, 7, :], delegate.bands(13, 7)))
+
+        # only 4 bands fit so the first ones are evicted
+        for band in range(header.band_count()):
+            delegate.image(band)
+        self.assertEqual(4, len(cache))
+        self.assertFalse(delegate.is_cached(0))
+        self.assertTrue(np.array_equal(cube[13, 7, :], delegate.bands(13, 7)))
+
+        self.assertTrue(np.array_equal(cube[[1, 4], [2, 5], :], delegate.bands(np.array([1, 4]), np.array([2, 5]))))
+        self.assertTrue(np.array_equal(cube[1:5, 2:6, 0:3], delegate.cube((1, 5), (2, 6), (0, 3))))
+
+        with self.assertRaises(IndexError):
+            delegate.image(header.band_count())
+
+    def test_large_bands(self):
+        file_name, cube = create_test_cube(self.__temp_dir.name, OpenSpectraHeader.BSQ_INTERLEAVE)
+        header = OpenSpectraHeader(file_name + ".hdr")
+        header.load()
+
+        file_model = MappedModel(Path(file_name), header)
+        file_model.load(BQSShape(header.lines(), header.samples(), header.band_count()))
+        # bands that fill more than a quarter of the cache come straight from the file
+        cache = TileCache(4 * 12 * 10 * 2 - 1)
+        delegate = CachedFileDelegate(BQSFileDelegate(header, file_model), cache)
+        self.assertFalse(delegate.is_cacheable())
+        self.assertTrue(np.array_equal(cube[:, :, 3], delegate.image(3)))
+        self.assertEqual(0, len(cache))
+        self.assertFalse(delegate.is_cached(3))
+
+
+class AccessHintTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.__temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.__temp_dir.cleanup()
+
+    def test_data_ranges(self):
+        delegates = {OpenSpectraHeader.BIL_INTERLEAVE: (BILFileDelegate, BILShape),
+                     OpenSpectraHeader.BSQ_INTERLEAVE: (BQSFileDelegate, BQSShape),
+                     OpenSpectraHeader.BIP_INTERLEAVE: (BIPFileDelegate, BIPShape)}
+
+        for interleave, (delegate_type, shape_type) in delegates.items():
+            file_name, cube = create_test_cube(self.__temp_dir.name, interleave, name=interleave)
+            header = OpenSpectraHeader(file_name + ".hdr")
+            header.load()
+            file_model = MappedModel(Path(file_name), header)
+            file_model.load(shape_type(header.lines(), header.samples(), header.band_count()))
+            delegate = delegate_type(header, file_model)
+
+            flat = file_model.file().reshape(-1)
+            for lines, bands in [((2, 5), (1, 3)), ((0, 12), (4, 5)), ((3, 4), (0, 6)), ((0, 12), (0, 6))]:
+                values = np.concatenate([flat[start:end] for start, end in delegate.data_ranges(lines, bands)])
+
+                # bip ranges include all of the bands in each line
+                expected_bands = (0, 6) if interleave == OpenSpectraHeader.BIP_INTERLEAVE else bands
+                expected = cube[lines[0]:lines[1], :, expected_bands[0]:expected_bands[1]]
+                self.assertTrue(np.array_equal(np.sort(expected, axis=None), np.sort(values)))
+
+    def test_advise(self):
+        for interleave in [OpenSpectraHeader.BIL_INTERLEAVE, OpenSpectraHeader.BSQ_INTERLEAVE,
+                OpenSpectraHeader.BIP_INTERLEAVE]:
+            file_name, cube = create_test_cube(self.__temp_dir.name, interleave, lines=200, samples=300,
+                header_offset=5000, name=interleave)
+
+            for model in [OpenSpectraFileFactory.MAPPED_MODEL, OpenSpectraFileFactory.MEMORY_MODEL]:
+                os_file = OpenSpectraFileFactory.create_open_spectra_file(file_name, model)
+                for hint in AccessHint:
+                    os_file.advise(hint)
+                    os_file.advise(hint, (10, 120), (2, 4))
+
+                # data is unchanged by the hints
+                self.assertTrue(np.array_equal(cube[:, :, 3], os_file.raw_image(3)))
+                self.assertTrue(np.array_equal(cube[17, 33, :], os_file.bands(17, 33)[0]))
+                self.assertTrue(np.array_equal(cube_to_interleave(cube[10:50, 5:25, [1, 4]], interleave),
+                    os_file.cube((10, 50), (5, 25), [1, 4])))
+
+                os_file.enable_access_hints(False)
+                self.assertTrue(np.array_equal(cube[:, :, 2], os_file.raw_image(2)))
+
+
+class PreadModelTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.__temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.__temp_dir.cleanup()
+
+    def __create_model(self, interleave:str, max_gap:int, max_read:int, byte_order:int) -> Tuple[PreadModel, np.ndarray]:
+        shapes = {OpenSpectraHeader.BIL_INTERLEAVE: BILShape, OpenSpectraHeader.BSQ_INTERLEAVE: BQSShape,
+                  OpenSpectraHeader.BIP_INTERLEAVE: BIPShape}
+
+        file_name, cube = create_test_cube(self.__temp_dir.name, interleave, header_offset=100,
+            name=interleave + str(byte_order), byte_order=byte_order)
+        header = OpenSpectraHeader(file_name + ".hdr")
+        header.load()
+        model = PreadModel(Path(file_name), header, max_gap, max_read)
+        model.load(shapes[interleave](header.lines(), header.samples(), header.band_count()))
+        return model, cube_to_interleave(cube, interleave)
+
+    def test_indexing(self):
+        keys = [(1, 2, 3), (-1, -2, -3), (slice(None), 2, slice(None)), (2, slice(None), slice(None)),
+                (slice(None), slice(None), 4), (slice(1, 9, 3), slice(None, None, -2), slice(2, 5)),
+                (slice(None), (1, 3), slice(None)), (slice(None), np.array([4, 0, 4]), slice(None)),
+                (np.array([3, 1, 5]), slice(None), np.array([0, 5, 2])),
+                (slice(None), np.array([1, 3]), np.array([2, 2])), (4, slice(None), np.array([1, 5, 1])),
+                (np.array([[1, 2], [3, 4]]), slice(None), 2), (np.array([], np.intp), slice(None), slice(None)),
+                (slice(3, 3), 0, slice(None)), (slice(2, 7), [0, 2, 3], slice(1, 8)), 3]
+
+        for max_gap, max_read in [(65536, 16777216), (0, 16777216), (8, 64), (0, 2)]:
+            for byte_order in [OpenSpectraHeader.LITTLE_ENDIAN, OpenSpectraHeader.BIG_ENDIAN]:
+                for interleave in [OpenSpectraHeader.BIL_INTERLEAVE, OpenSpectraHeader.BSQ_INTERLEAVE,
+                        OpenSpectraHeader.BIP_INTERLEAVE]:
+                    model, data = self.__create_model(interleave, max_gap, max_read, byte_order)
+                    for key in keys:
+                        expected = data[key]
+                        result = model.file()[key]
+                        self.assertEqual(expected.shape, result.shape, "{0} {1}".format(interleave, key))
+                        self.assertTrue(np.array_equal(expected, result), "{0} {1}".format(interleave, key))
+
+                    with self.assertRaises(IndexError):
+                        model.file()[data.shape[0], 0, 0]
+
+                    with self.assertRaises(IndexError):
+                        model.file()[0, 0, 0, 0]
+
+    def test_factory(self):
+        for interleave in [OpenSpectraHeader.BIL_INTERLEAVE, OpenSpectraHeader.BSQ_INTERLEAVE,
+                OpenSpectraHeader.BIP_INTERLEAVE]:
+            file_name, cube = create_test_cube(self.__temp_dir.name, interleave, name=interleave,
+                byte_order=OpenSpectraHeader.BIG_ENDIAN)
+            mapped_file = OpenSpectraFileFactory.create_open_spectra_file(file_name)
+            pread_file = OpenSpectraFileFactory.create_open_spectra_file(file_name, OpenSpectraFileFactory.PREAD_MODEL)
+            self.assertIsNotNone(pread_file.tile_cache())
+
+            for band in range(cube.shape[2]):
+                self.assertTrue(np.array_equal(mapped_file.raw_image(band), pread_file.raw_image(band)))
+
+            self.assertTrue(np.array_equal(mapped_file.raw_image((1, 4)), pread_file.raw_image((1, 4))))
+            self.assertTrue(np.array_equal(mapped_file.bands(3, 7), pread_file.bands(3, 7)))
+            lines = np.array([0, 5, 11, 5])
+            samples = np.array([9, 2, 0, 2])
+            self.assertTrue(np.array_equal(mapped_file.bands(lines, samples), pread_file.bands(lines, samples)))
+            self.assertTrue(np.array_equal(mapped_file.cube((2, 9), (1, 8), [0, 3, 5]),
+                pread_file.cube((2, 9), (1, 8), [0, 3, 5])))
+            pread_file.advise(AccessHint.WILL_NEED, (2, 5), (1, 3))
+
+    def test_threads(self):
+        file_name, cube = create_test_cube(self.__temp_dir.name, OpenSpectraHeader.BIP_INTERLEAVE,
+            lines=60, samples=50, bands=20)
+        pread_file = OpenSpectraFileFactory.create_open_spectra_file(file_name, OpenSpectraFileFactory.PREAD_MODEL)
+
+        def check(line:int) -> bool:
+            return np.array_equal(cube[line, :, :], pread_file.cube((line, line + 1), (0, 50), (0, 20))[0]) and \
+                np.array_equal(cube[:, :, line % 20], pread_file.raw_image(line % 20))
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            self.assertTrue(all(executor.map(check, range(60))))
+
+
+class GzipModelTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.__temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.__temp_dir.cleanup()
+
+    def __compress(self, file_name:str, members:int=1) -> bytes:
+        with open(file_name, "rb") as data_file:
+            data = data_file.read()
+
+        with open(file_name, "wb") as out_file:
+            step = math.ceil(len(data) / members)
+            for start in range(0, len(data), step):
+                out_file.write(gzip.compress(data[start:start + step]))
+
+        return data
+
+    def __mark(self, file_name:str):
+        header = MutableOpenSpectraHeader(file_name + ".hdr")
+        header.set_file_type(GzipIndex.FILE_TYPE)
+        header.save(file_name)
+
+    def test_index(self):
+        # noisy data so the deflate stream has many blocks
+        data = np.random.RandomState(7).randint(0, 2000, 200000).astype(np.int16).tobytes()
+        file_name = os.path.join(self.__temp_dir.name, "data")
+        for members in [1, 3]:
+            with open(file_name, "wb") as out_file:
+                out_file.write(data)
+            self.__compress(file_name, members)
+            if os.path.exists(GzipIndex.file_name(file_name)):
+                os.remove(GzipIndex.file_name(file_name))
+
+            index = GzipIndex.open(Path(file_name), 16384)
+            self.assertEqual(len(data), index.uncompressed_size())
+            self.assertTrue(os.path.exists(GzipIndex.file_name(file_name)))
+            if ZlibInflater.is_available():
+                self.assertGreater(index.checkpoint_count(), 10)
+
+            # reused from the saved file
+            self.assertEqual(index.checkpoint_count(), GzipIndex.open(Path(file_name), 1000000).checkpoint_count())
+
+            for offset, length in [(0, 10), (350000, 1000), (123457, 70000), (17, 5), (len(data) - 3, 3),
+                    (200000, 1), (199999, 100)]:
+                buffer = bytearray(length)
+                index.read_into(memoryview(buffer), offset)
+                self.assertEqual(data[offset:offset + length], bytes(buffer), "{0} {1}".format(offset, length))
+
+            with self.assertRaises(OpenSpectraFileError):
+                index.read_into(memoryview(bytearray(10)), len(data) - 5)
+
+    def test_factory(self):
+        for interleave in [OpenSpectraHeader.BIL_INTERLEAVE, OpenSpectraHeader.BSQ_INTERLEAVE,
+                OpenSpectraHeader.BIP_INTERLEAVE]:
+            # bsq is marked by its name, the others by their header's file type
+            name = interleave + GzipIndex.FILE_SUFFIX if interleave == OpenSpectraHeader.BSQ_INTERLEAVE \
+                else interleave
+            file_name, cube = create_test_cube(self.__temp_dir.name, interleave, header_offset=20,
+                name=name, byte_order=OpenSpectraHeader.BIG_ENDIAN)
+            lines = np.array([0, 5, 11, 5])
+            samples = np.array([9, 2, 0, 2])
+            mapped_file = OpenSpectraFileFactory.create_open_spectra_file(file_name, use_shadow=False)
+            expected_bands = mapped_file.bands(lines, samples)
+            expected_cube = mapped_file.cube((2, 9), (1, 8), [0, 3, 5])
+            del mapped_file
+
+            self.__compress(file_name, 2)
+            if interleave != OpenSpectraHeader.BSQ_INTERLEAVE:
+                self.__mark(file_name)
+            gzip_file = OpenSpectraFileFactory.create_open_spectra_file(file_name)
+            self.assertTrue(os.path.exists(GzipIndex.file_name(file_name)))
+            self.assertIsNotNone(gzip_file.tile_cache())
+            for band in range(cube.shape[2]):
+                self.assertTrue(np.array_equal(cube[:, :, band], gzip_file.raw_image(band)))
+
+            self.assertTrue(np.array_equal(expected_bands, gzip_file.bands(lines, samples)))
+            self.assertTrue(np.array_equal(expected_cube, gzip_file.cube((2, 9), (1, 8), [0, 3, 5])))
+
+    def test_raw_gzip_bytes(self):
+        # raw data that happens to start with the gzip id bytes isn't gzip
+        for header_offset in [0, 20]:
+            file_name, cube = create_test_cube(self.__temp_dir.name, OpenSpectraHeader.BSQ_INTERLEAVE,
+                header_offset=header_offset, name="raw{0}".format(header_offset))
+            with open(file_name, "r+b") as data_file:
+                data_file.write(b"\x1f\x8b\x08\x00")
+            if header_offset == 0:
+                cube[0, 0, 0] = np.frombuffer(b"\x1f\x8b", "<i2")[0]
+                cube[0, 1, 0] = np.frombuffer(b"\x08\x00", "<i2")[0]
+
+            raw_file = OpenSpectraFileFactory.create_open_spectra_file(file_name, use_shadow=False)
+            self.assertFalse(os.path.exists(GzipIndex.file_name(file_name)))
+            self.assertTrue(np.array_equal(cube[:, :, 0], raw_file.raw_image(0)))
+
+            # even when it's marked as gzip
+            self.__mark(file_name)
+            raw_file = OpenSpectraFileFactory.create_open_spectra_file(file_name, use_shadow=False)
+            self.assertFalse(os.path.exists(GzipIndex.file_name(file_name)))
+            self.assertTrue(np.array_equal(cube[:, :, 0], raw_file.raw_image(0)))
+
+    def test_changed_file(self):
+        file_name, cube = create_test_cube(self.__temp_dir.name, OpenSpectraHeader.BSQ_INTERLEAVE)
+        data = self.__compress(file_name)
+        GzipIndex.open(Path(file_name), 100)
+
+        with open(file_name, "wb") as out_file:
+            out_file.write(gzip.compress(data[::-1]))
+        os.utime(file_name, ns=(0, 0))
+
+        index = GzipIndex.open(Path(file_name), 100)
+        buffer = bytearray(50)
+        index.read_into(memoryview(buffer), 1000)
+        self.assertEqual(data[::-1][1000:1050], bytes(buffer))
+
+
+class GatherBandsTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.__temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.__temp_dir.cleanup()
+
+    def test_gather(self):
+        rng = np.random.RandomState(3)
+        # pixels from far apart parts of the file so they fall in several runs,
+        # plus duplicates and negative indexes
+        lines = np.concatenate((rng.randint(0, 300, 500), [0, 299, 150, 150, -1]))
+        samples = np.concatenate((rng.randint(0, 300, 500), [0, 299, 7, 7, -300]))
+
+        for interleave in [OpenSpectraHeader.BIL_INTERLEAVE, OpenSpectraHeader.BSQ_INTERLEAVE,
+                OpenSpectraHeader.BIP_INTERLEAVE]:
+            file_name, cube = create_test_cube(self.__temp_dir.name, interleave, lines=300, samples=300,
+                bands=4, name=interleave, byte_order=OpenSpectraHeader.BIG_ENDIAN)
+            expected = cube[lines, samples, :]
+
+            for model in [OpenSpectraFileFactory.MAPPED_MODEL, OpenSpectraFileFactory.MEMORY_MODEL,
+                    OpenSpectraFileFactory.PREAD_MODEL]:
+                os_file = OpenSpectraFileFactory.create_open_spectra_file(file_name, model, use_shadow=False)
+                self.assertTrue(np.array_equal(expected, os_file.bands(lines, samples)), interleave)
+                self.assertTrue(np.array_equal(expected[:100], os_file.bands(tuple(lines[:100]), tuple(samples[:100]))))
+
+                # too few points to gather
+                self.assertTrue(np.array_equal(expected[:3], os_file.bands(lines[:3], samples[:3])))
+                self.assertEqual((0, 4), os_file.bands(np.array([], int), np.array([], int)).shape)
+
+                with self.assertRaises(IndexError):
+                    os_file.bands(np.append(lines, 300), np.append(samples, 0))
+
+    def test_read_flat(self):
+        for interleave in [OpenSpectraHeader.BIL_INTERLEAVE, OpenSpectraHeader.BSQ_INTERLEAVE,
+                OpenSpectraHeader.BIP_INTERLEAVE]:
+            file_name, cube = create_test_cube(self.__temp_dir.name, interleave, name=interleave)
+            data = cube_to_interleave(cube, interleave).reshape(-1)
+            header = OpenSpectraHeader(file_name + ".hdr")
+            header.load()
+
+            shapes = {OpenSpectraHeader.BIL_INTERLEAVE: BILShape, OpenSpectraHeader.BSQ_INTERLEAVE: BQSShape,
+                      OpenSpectraHeader.BIP_INTERLEAVE: BIPShape}
+            model = PreadModel(Path(file_name), header)
+            model.load(shapes[interleave](header.lines(), header.samples(), header.band_count()))
+
+            for start, end in [(0, 720), (5, 6), (13, 457), (120, 240), (0, 0), (700, 800)]:
+                self.assertTrue(np.array_equal(data[start:end], model.read_flat(start, end)))
+                # the generic FileArray version used by other models
+                self.assertTrue(np.array_equal(data[start:end], FileArray.read_flat(model.file(), start, end)))
+
+
+class IterBlocksTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.__temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.__temp_dir.cleanup()
+
+    def test_blocks(self):
+        # whole cube, several planes, rows within a plane, elements within a row
+        for memory_limit in [2**30, 300, 50, 6]:
+            for interleave in [OpenSpectraHeader.BIL_INTERLEAVE, OpenSpectraHeader.BSQ_INTERLEAVE,
+                    OpenSpectraHeader.BIP_INTERLEAVE]:
+                file_name, cube = create_test_cube(self.__temp_dir.name, interleave, name=interleave,
+                    byte_order=OpenSpectraHeader.BIG_ENDIAN)
+                os_file = OpenSpectraFileFactory.create_open_spectra_file(file_name)
+                axes = OpenSpectraHeader.interleave_axes(interleave)
+                offsets = np.arange(cube.size).reshape(cube_to_interleave(cube, interleave).shape)
+
+                for read_ahead in [False, True]:
+                    result = np.zeros_like(cube)
+                    next_offset = 0
+                    for lines, samples, bands, data in os_file.iter_blocks(memory_limit, read_ahead):
+                        self.assertLessEqual(data.nbytes, max(memory_limit, data.itemsize))
+                        block = (slice(*lines), slice(*samples), slice(*bands))
+                        result[block] = data.transpose(np.argsort(axes))
+
+                        # each block is the next contiguous piece of the file
+                        block_offsets = offsets[tuple(block[axis] for axis in axes)].reshape(-1)
+                        self.assertTrue(np.array_equal(np.arange(next_offset, next_offset + data.size), block_offsets))
+                        next_offset += data.size
+
+                    self.assertEqual(cube.size, next_offset)
+                    self.assertTrue(np.array_equal(cube, result), "{0} {1}".format(interleave, memory_limit))
+
+    def test_stop_early(self):
+        file_name, cube = create_test_cube(self.__temp_dir.name, OpenSpectraHeader.BSQ_INTERLEAVE)
+        os_file = OpenSpectraFileFactory.create_open_spectra_file(file_name)
+        for lines, samples, bands, data in os_file.iter_blocks(cube.shape[0] * cube.shape[1] * 2, True):
+            self.assertEqual((0, 1), bands)
+            self.assertTrue(np.array_equal(cube[:, :, 0], data[0]))
+            break
+
+
+class VirtualMosaicTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.__temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.__temp_dir.cleanup()
+
+    def __create_source(self, interleave:str, lines:int, samples:int, line:int, sample:int,
+            bands:int=6) -> Tuple[str, np.ndarray]:
+        """Create a cube whose upper left pixel is at line, sample on a 20m grid"""
+        file_name, cube = create_test_cube(self.__temp_dir.name, interleave, lines, samples, bands,
+            name="source_{0}_{1}".format(line, sample))
+        header = MutableOpenSpectraHeader(file_name + ".hdr")
+        header.load()
+        header.set_x_reference(1, 50000.0 + sample * 20)
+        header.set_y_reference(1, 4000000.0 - line * 20)
+        header.save(file_name)
+        return file_name, cube
+
+    def test_mosaic(self):
+        sources = [self.__create_source(OpenSpectraHeader.BIL_INTERLEAVE, 12, 10, 0, 0),
+                   self.__create_source(OpenSpectraHeader.BSQ_INTERLEAVE, 8, 14, 5, 7),
+                   self.__create_source(OpenSpectraHeader.BIP_INTERLEAVE, 10, 10, -3, 12)]
+
+        # the last source starts 3 lines above the first
+        expected = np.full((16, 22, 6), -9999, np.int16)
+        for (file_name, cube), (line, sample) in zip(sources, [(3, 0), (8, 7), (0, 12)]):
+            expected[line:line + cube.shape[0], sample:sample + cube.shape[1]] = cube
+
+        mosaic_name = os.path.join(self.__temp_dir.name, "mosaic.json")
+        VirtualMosaic.save(mosaic_name, [file_name for file_name, cube in sources])
+        mosaic = OpenSpectraFileFactory.create_open_spectra_file(mosaic_name)
+
+        # the mosaic caches the data, its sources are opened without caches
+        self.assertIsNotNone(mosaic.tile_cache())
+        self.assertIsNone(OpenSpectraFileFactory.create_open_spectra_file(sources[0][0], cache_size=0).tile_cache())
+
+        header = mosaic.header()
+        self.assertEqual((16, 22, 6), (header.lines(), header.samples(), header.band_count()))
+        self.assertEqual(OpenSpectraHeader.BSQ_INTERLEAVE, header.interleave())
+        self.assertEqual((50000.0, 4000060.0), header.map_info().calculate_coordinates(0, 0))
+
+        for band in range(6):
+            self.assertTrue(np.array_equal(expected[:, :, band], mosaic.raw_image(band)))
+
+        self.assertTrue(np.array_equal(expected[9, 8, :].reshape(1, 6), mosaic.bands(9, 8)))
+        rng = np.random.RandomState(5)
+        lines, samples = rng.randint(0, 16, 200), rng.randint(0, 22, 200)
+        self.assertTrue(np.array_equal(expected[lines, samples, :], mosaic.bands(lines, samples)))
+        self.assertTrue(np.array_equal(expected[2:11, 5:20, [1, 4]].transpose(2, 0, 1),
+            mosaic.cube((2, 11), (5, 20), [1, 4])))
+
+    def test_mismatched_sources(self):
+        first, cube = self.__create_source(OpenSpectraHeader.BIL_INTERLEAVE, 12, 10, 0, 0)
+        other_bands, cube = self.__create_source(OpenSpectraHeader.BIL_INTERLEAVE, 12, 10, 0, 10, bands=5)
+        off_grid, cube = self.__create_source(OpenSpectraHeader.BIL_INTERLEAVE, 12, 10, 0, 10)
+        header = MutableOpenSpectraHeader(off_grid + ".hdr")
+        header.load()
+        header.set_x_reference(1, 50205.0)
+        header.save(off_grid)
+
+        mosaic_name = os.path.join(self.__temp_dir.name, "mosaic.json")
+        for source in [other_bands, off_grid]:
+            VirtualMosaic.save(mosaic_name, [first, source])
+            with self.assertRaises(OpenSpectraFileError):
+                OpenSpectraFileFactory.create_open_spectra_file(mosaic_name)
+
+
+class OpenSpectraFileWriterTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.__temp_dir = tempfile.TemporaryDirectory()
+        self.__file_name, self.__cube = create_test_cube(self.__temp_dir.name, OpenSpectraHeader.BSQ_INTERLEAVE)
+        self.__source = OpenSpectraFileFactory.create_open_spectra_file(self.__file_name)
+
+    def tearDown(self) -> None:
+        self.__temp_dir.cleanup()
+
+    def __header(self, interleave:str, byte_order:int=OpenSpectraHeader.NATIVE_BYTE_ORDER) -> MutableOpenSpectraHeader:
+        header = MutableOpenSpectraHeader(os_header=self.__source.header())
+        header.set_interleave(interleave)
+        header.set_byte_order(byte_order)
+        return header
+
+    def test_write_any_order(self):
+        for interleave in [OpenSpectraHeader.BIL_INTERLEAVE, OpenSpectraHeader.BSQ_INTERLEAVE,
+                OpenSpectraHeader.BIP_INTERLEAVE]:
+            band_name = os.path.join(self.__temp_dir.name, "bands_" + interleave)
+            with OpenSpectraFileWriter(band_name, self.__header(interleave, OpenSpectraHeader.BIG_ENDIAN)) as writer:
+                for band in reversed(range(self.__cube.shape[2])):
+                    writer.write_band(band, self.__source.raw_image(band))
+                self.assertFalse(os.path.exists(band_name + ".hdr"))
+
+            line_name = os.path.join(self.__temp_dir.name, "lines_" + interleave)
+            with OpenSpectraFileWriter(line_name, self.__header(interleave)) as writer:
+                for line in [5, 0, 11, 3, 1, 2, 4, 6, 7, 8, 9, 10]:
+                    writer.write_line(line, self.__source.bands(np.full(10, line), np.arange(10)))
+
+            for file_name in [band_name, line_name]:
+                written = OpenSpectraFileFactory.create_open_spectra_file(file_name)
+                self.assertEqual(interleave, written.header().interleave())
+                self.assertTrue(np.array_equal(self.__cube[:, :, 1], written.raw_image(1)), file_name)
+                self.assertTrue(np.array_equal(self.__cube[7, 3, :].reshape(1, -1), written.bands(7, 3)), file_name)
+
+    def test_write_blocks(self):
+        file_name = os.path.join(self.__temp_dir.name, "blocks")
+        header = self.__header(OpenSpectraHeader.BSQ_INTERLEAVE)
+        header.set_header_offset(64)
+        writer = OpenSpectraFileWriter(file_name, header)
+        for lines, samples, bands, data in self.__source.iter_blocks(100):
+            writer.write_block(lines, samples, bands, data)
+
+        with self.assertRaises(ValueError):
+            writer.write_block((0, 13), (0, 10), (0, 1), np.zeros((1, 13, 10)))
+        writer.close()
+
+        with self.assertRaises(OpenSpectraFileError):
+            writer.write_band(0, self.__cube[:, :, 0])
+
+        written = OpenSpectraFileFactory.create_open_spectra_file(file_name)
+        self.assertTrue(np.array_equal(self.__source.cube((0, 12), (0, 10), (0, 6)), written.cube((0, 12), (0, 10), (0, 6))))
+
+    def test_abandoned(self):
+        file_name = os.path.join(self.__temp_dir.name, "abandoned")
+        with self.assertRaises(RuntimeError):
+            with OpenSpectraFileWriter(file_name, self.__header(OpenSpectraHeader.BIL_INTERLEAVE)) as writer:
+                writer.write_line(0, self.__source.bands(np.zeros(10, int), np.arange(10)))
+                raise RuntimeError("failed part way")
+
+        self.assertTrue(writer.is_closed())
+        self.assertFalse(os.path.exists(file_name + ".hdr"))
+
+
+class PinnedFileDelegateTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.__temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.__temp_dir.cleanup()
+
+    def test_pinned(self):
+        for interleave in [OpenSpectraHeader.BIL_INTERLEAVE, OpenSpectraHeader.BSQ_INTERLEAVE,
+                OpenSpectraHeader.BIP_INTERLEAVE]:
+            file_name, cube = create_test_cube(self.__temp_dir.name, interleave, name="cube_" + interleave,
+                byte_order=OpenSpectraHeader.BIG_ENDIAN)
+            os_file = OpenSpectraFileFactory.create_open_spectra_file(file_name, OpenSpectraFileFactory.PINNED_MODEL)
+            self.assertTrue(os_file.can_pin())
+            self.assertEqual([4, 1], os_file.pin_bands([4, 1, 4]))
+            self.assertEqual([1, 4], os_file.pinned_bands())
+
+            image = os_file.raw_image(4)
+            self.assertTrue(np.array_equal(cube[:, :, 4], image))
+            self.assertFalse(image.flags.writeable)
+            self.assertIs(image, os_file.raw_image(4))
+            self.assertTrue(np.array_equal(cube_to_interleave(cube[2:9, 3:7, [1, 4]], interleave),
+                os_file.cube((2, 9), (3, 7), [1, 4])))
+
+            self.assertTrue(os_file.pin_lines((3, 8)))
+            self.assertEqual((3, 8), os_file.pinned_lines())
+            self.assertTrue(np.array_equal(cube[5, 2, :].reshape(1, -1), os_file.bands(5, 2)))
+            lines, samples = np.array([3, 7, 4]), np.array([9, 0, 5])
+            self.assertTrue(np.array_equal(cube[lines, samples, :], os_file.bands(lines, samples)))
+            self.assertTrue(np.array_equal(cube[[0, 11], [1, 2], :], os_file.bands(np.array([0, 11]), np.array([1, 2]))))
+            self.assertTrue(np.array_equal(cube_to_interleave(cube[4:8, :, 2:5], interleave),
+                os_file.cube((4, 8), (0, 10), (2, 5))))
+            self.assertTrue(np.array_equal(cube_to_interleave(cube[0:12, :, 2:5], interleave),
+                os_file.cube((0, 12), (0, 10), (2, 5))))
+
+            os_file.unpin_bands([4])
+            os_file.unpin_lines()
+            self.assertEqual([1], os_file.pinned_bands())
+            self.assertIsNone(os_file.pinned_lines())
+            self.assertTrue(np.array_equal(cube[:, :, 4], os_file.raw_image(4)))
+
+    def test_memory_limit(self):
+        file_name, cube = create_test_cube(self.__temp_dir.name)
+        header = OpenSpectraHeader(file_name + ".hdr")
+        header.load()
+        model = MappedModel(Path(file_name), header)
+        delegate = BILFileDelegate(header, model)
+        model.load(delegate.shape())
+
+        # room for two bands
+        pinned = PinnedFileDelegate(delegate, "pinned_test", 12 * 10 * 2 * 2)
+        self.assertEqual([0, 1], pinned.pin_bands([0, 1, 2]))
+        self.assertFalse(pinned.pin_lines((0, 1)))
+        pinned.unpin_bands([0])
+        self.assertTrue(pinned.pin_lines((0, 1)))
+        self.assertEqual(12 * 10 * 2 + 10 * 6 * 2, pinned.pinned_bytes())
+
+    def test_released(self):
+        file_name, cube = create_test_cube(self.__temp_dir.name)
+        os_file = OpenSpectraFileFactory.create_open_spectra_file(file_name, OpenSpectraFileFactory.PINNED_MODEL)
+        band_bytes = 12 * 10 * 2
+        ceiling = MemoryAccountant().ceiling()
+        try:
+            # room for two more bands, the least recently used pinned band is unpinned
+            MemoryAccountant().set_ceiling(MemoryAccountant().total() + band_bytes * 2)
+            self.assertEqual([0, 1], os_file.pin_bands([0, 1]))
+            os_file.raw_image(0)
+            os_file.pin_bands([2])
+            self.assertEqual([0, 2], os_file.pinned_bands())
+
+            self.assertTrue(os_file.pin_lines((0, 1)))
+            self.assertEqual([2], os_file.pinned_bands())
+        finally:
+            MemoryAccountant().set_ceiling(ceiling)
+
+    def test_lines_across_threads(self):
+        file_name, cube = create_test_cube(self.__temp_dir.name)
+        os_file = OpenSpectraFileFactory.create_open_spectra_file(file_name, OpenSpectraFileFactory.PINNED_MODEL)
+
+        def repin():
+            for start in range(200):
+                os_file.pin_lines((start % 6, start % 6 + 6))
+                os_file.unpin_lines()
+
+        # whatever is pinned while they run, readers always get the right data
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(repin)
+            while not future.done():
+                self.assertTrue(np.array_equal(cube[5, 2, :].reshape(1, -1), os_file.bands(5, 2)))
+                self.assertTrue(np.array_equal(cube_to_interleave(cube[4:8, :, 2:5], OpenSpectraHeader.BIL_INTERLEAVE),
+                    os_file.cube((4, 8), (0, 10), (2, 5))))
+            future.result()
+
+    def test_default_bands(self):
+        file_name, cube = create_test_cube(self.__temp_dir.name)
+        header = MutableOpenSpectraHeader(file_name + ".hdr")
+        header.load()
+        props = header.unsupported_props()
+        props["default bands"] = ["6", "3", "1"]
+        header.set_unsupported_props(props)
+        header.save(file_name)
+
+        os_file = OpenSpectraFileFactory.create_open_spectra_file(file_name, OpenSpectraFileFactory.PINNED_MODEL)
+        self.assertEqual([0, 2, 5], os_file.pinned_bands())
+
+        mapped_file = OpenSpectraFileFactory.create_open_spectra_file(file_name)
+        self.assertFalse(mapped_file.can_pin())
+        self.assertEqual([], mapped_file.pin_bands([0]))
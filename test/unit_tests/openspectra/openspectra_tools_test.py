@@ -4,15 +4,20 @@
 import io
 import itertools
 import os
+import tempfile
 import unittest
-from typing import List
+from pathlib import Path
+from typing import List, Tuple
 
 import numpy as np
 
 from openspectra.image import BandDescriptor
 from openspectra.openspecrtra_tools import RegionOfInterest, OpenSpectraBandTools, OpenSpectraRegionTools, CubeParams, \
-    SubCubeTools
-from openspectra.openspectra_file import OpenSpectraHeader, OpenSpectraFileFactory
+    SubCubeTools, InterleaveTranscoder, ShadowFileBuilder, ChunkedContainerWriter, FileCatalog, BandStatisticsBuilder, \
+    OverviewBuilder, SubCubeBatchExtractor, CubeBinner, OpenSpectraImageTools, BandPrefetcher, BlockAverager
+from openspectra.openspectra_file import OpenSpectraHeader, OpenSpectraFileFactory, ShadowFile, ChunkedContainer, \
+    ChunkedModel, OpenSpectraFile, BQSFileDelegate, BQSShape, MutableOpenSpectraHeader, OverviewFile
+from test.unit_tests.openspectra.cube_builder import create_test_cube, cube_to_interleave
 
 
 class RegionOfInterestTest(unittest.TestCase):
@@ -433,3 +438,721 @@ class SubCubeToolsTest(unittest.TestCase):
         self.assertEqual(bsq_bip_file.header().interleave(), OpenSpectraHeader.BIP_INTERLEAVE)
         self.assertTrue(np.array_equal(bil_file.bands(35, 21), bsq_bip_file.bands(35, 21)))
         self.assertTrue(np.array_equal(bil_file.raw_image(8), bsq_bip_file.raw_image(8)))
+
+
+class SubCubeSaveTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.__temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.__temp_dir.cleanup()
+
+    def test_save(self):
+        subsets = [((0, 12), (0, 10), (0, 6)), ((2, 9), (0, 10), (1, 4)), ((3, 11), (2, 7), [0, 2, 5]),
+                   ((0, 12), (4, 10), [3, 4, 5])]
+        for interleave, byte_order in itertools.product([OpenSpectraHeader.BIL_INTERLEAVE,
+                OpenSpectraHeader.BSQ_INTERLEAVE, OpenSpectraHeader.BIP_INTERLEAVE],
+                [OpenSpectraHeader.LITTLE_ENDIAN, OpenSpectraHeader.BIG_ENDIAN]):
+            file_name, cube = create_test_cube(self.__temp_dir.name, interleave, header_offset=32,
+                name="cube_{0}_{1}".format(interleave, byte_order), byte_order=byte_order)
+            os_file = OpenSpectraFileFactory.create_open_spectra_file(file_name)
+
+            for (lines, samples, bands), out_interleave, memory_limit in itertools.product(subsets,
+                    [interleave, OpenSpectraHeader.BIP_INTERLEAVE], [None, 7]):
+                sub_cube_tools = SubCubeTools(os_file, CubeParams(out_interleave, lines, samples, bands))
+                sub_cube_tools.create_sub_cube()
+                sub_cube_name = os.path.join(self.__temp_dir.name, "sub_cube")
+                sub_cube_tools.save(sub_cube_name, memory_limit)
+
+                band_index = bands if isinstance(bands, list) else slice(*bands)
+                expected = cube[slice(*lines), slice(*samples), band_index]
+                sub_cube = OpenSpectraFileFactory.create_open_spectra_file(sub_cube_name)
+                header = sub_cube.header()
+                self.assertEqual(expected.shape, (header.lines(), header.samples(), header.band_count()))
+                self.assertEqual(out_interleave, header.interleave())
+                self.assertEqual(expected.nbytes, os.path.getsize(sub_cube_name))
+                for band in range(expected.shape[2]):
+                    self.assertTrue(np.array_equal(expected[:, :, band], sub_cube.raw_image(band)),
+                        "{0} {1} {2}".format(interleave, byte_order, (lines, samples, bands)))
+
+    def test_streaming(self):
+        file_name, cube = create_test_cube(self.__temp_dir.name, OpenSpectraHeader.BIL_INTERLEAVE,
+            byte_order=OpenSpectraHeader.BIG_ENDIAN)
+        os_file = OpenSpectraFileFactory.create_open_spectra_file(file_name)
+
+        for interleave, bands, memory_limit in itertools.product([OpenSpectraHeader.BIL_INTERLEAVE,
+                OpenSpectraHeader.BSQ_INTERLEAVE, OpenSpectraHeader.BIP_INTERLEAVE],
+                [(1, 5), [0, 1, 3, 4, 5]], [None, 90, 20]):
+            params = CubeParams(interleave, (2, 10), (3, 9), bands)
+            in_memory = SubCubeTools(os_file, params)
+            in_memory.create_sub_cube(False)
+            self.assertFalse(in_memory.is_streaming())
+            in_memory_name = os.path.join(self.__temp_dir.name, "in_memory")
+            in_memory.save(in_memory_name)
+
+            streamed = SubCubeTools(os_file, params)
+            streamed.create_sub_cube(True)
+            self.assertTrue(streamed.is_streaming())
+            streamed_name = os.path.join(self.__temp_dir.name, "streamed")
+            streamed.save(streamed_name, memory_limit)
+
+            with open(in_memory_name, "rb") as in_memory_file, open(streamed_name, "rb") as streamed_file:
+                self.assertEqual(in_memory_file.read(), streamed_file.read(), "{0} {1} {2}".
+                    format(interleave, bands, memory_limit))
+
+            header = OpenSpectraFileFactory.create_open_spectra_file(streamed_name).header()
+            band_list = bands if isinstance(bands, list) else list(range(*bands))
+            self.assertEqual([os_file.header().band_names()[band] for band in band_list], header.band_names())
+            self.assertTrue(np.array_equal(os_file.header().wavelengths()[band_list], header.wavelengths()))
+
+
+class SubCubeBatchExtractorTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.__temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.__temp_dir.cleanup()
+
+    def test_extract(self):
+        params = [CubeParams(OpenSpectraHeader.BIL_INTERLEAVE, (0, 12), (0, 10), (0, 6)),
+                  CubeParams(OpenSpectraHeader.BSQ_INTERLEAVE, (2, 9), (3, 8), (1, 4)),
+                  CubeParams(OpenSpectraHeader.BIP_INTERLEAVE, (5, 6), (0, 10), [5, 0, 3]),
+                  CubeParams(OpenSpectraHeader.BIL_INTERLEAVE, (10, 12), (9, 10), [2, 3, 4])]
+        for interleave, write_threads, memory_limit in itertools.product([OpenSpectraHeader.BIL_INTERLEAVE,
+                OpenSpectraHeader.BSQ_INTERLEAVE, OpenSpectraHeader.BIP_INTERLEAVE], [1, 3], [None, 100]):
+            file_name, cube = create_test_cube(self.__temp_dir.name, interleave, name="cube_" + interleave,
+                byte_order=OpenSpectraHeader.BIG_ENDIAN)
+            os_file = OpenSpectraFileFactory.create_open_spectra_file(file_name)
+            file_names = [os.path.join(self.__temp_dir.name, "chip_{0}".format(index)) for index in range(len(params))]
+
+            progress = list()
+            extractor = SubCubeBatchExtractor(os_file, params, file_names, memory_limit, write_threads,
+                lambda completed, total: progress.append((completed, total)))
+            headers = extractor.extract()
+            self.assertEqual(len(params), len(headers))
+            self.assertEqual(progress[-1][0], progress[-1][1])
+            if memory_limit is not None:
+                self.assertTrue(len(progress) > 1)
+
+            for chip_params, chip_name in zip(params, file_names):
+                bands = chip_params.bands()
+                band_index = bands if isinstance(bands, list) else slice(*bands)
+                expected = cube[slice(*chip_params.lines()), slice(*chip_params.samples()), band_index]
+                chip = OpenSpectraFileFactory.create_open_spectra_file(chip_name)
+                self.assertEqual(chip_params.interleave(), chip.header().interleave())
+                for band in range(expected.shape[2]):
+                    self.assertTrue(np.array_equal(expected[:, :, band], chip.raw_image(band)),
+                        "{0} {1} {2}".format(interleave, chip_name, band))
+
+    def test_bad_params(self):
+        file_name, cube = create_test_cube(self.__temp_dir.name)
+        os_file = OpenSpectraFileFactory.create_open_spectra_file(file_name)
+        params = [CubeParams(OpenSpectraHeader.BIL_INTERLEAVE, (0, 12), (0, 10), (0, 6))]
+        with self.assertRaises(ValueError):
+            SubCubeBatchExtractor(os_file, params, ["one", "two"])
+
+        with self.assertRaises(ValueError):
+            SubCubeBatchExtractor(os_file, params + [CubeParams(OpenSpectraHeader.BIL_INTERLEAVE, (0, 13),
+                (0, 10), (0, 6))], ["one", "two"])
+
+
+class BlockAveragerTest(unittest.TestCase):
+
+    def test_average(self):
+        block = np.array([[1, 2, 3], [4, -1, 6], [7, 8, 9]], np.int16).reshape(1, 3, 3)
+        expected = np.array([[[2, 4], [8, 9]]], np.int16)
+        self.assertTrue(np.array_equal(expected, BlockAverager.average(block, (1, 2, 2), -1, np.int16)))
+
+        block = np.array([[1.0, np.nan], [np.nan, np.nan]], np.float32).reshape(2, 2, 1)
+        result = BlockAverager.average(block, (2, 2, 1), None, np.float32, np.array([False]))
+        self.assertEqual((1, 1, 1), result.shape)
+        self.assertTrue(np.isnan(result[0, 0, 0]))
+
+
+class CubeBinnerTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.__temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.__temp_dir.cleanup()
+
+    def __create_source(self, interleave:str) -> Tuple[str, np.ndarray]:
+        file_name, cube = create_test_cube(self.__temp_dir.name, interleave, 7, 5, 6, name="cube_" + interleave)
+
+        # bands 1 to 3 are bad and a few pixels are ignored
+        header = MutableOpenSpectraHeader(file_name + ".hdr")
+        header.load()
+        header.set_bands(6, header.band_names(), header.wavelengths(), [False, True, True, True, False, False])
+        header.save(file_name)
+
+        cube[0, 0, :] = -9999
+        cube[2, 3, 0] = -9999
+        with open(file_name, "wb") as data_file:
+            data_file.write(cube_to_interleave(cube, interleave).tobytes())
+
+        return file_name, cube
+
+    @staticmethod
+    def __expected(cube:np.ndarray, used_bands:List[List[int]]) -> np.ndarray:
+        result = np.zeros((4, 3, len(used_bands)), np.int16)
+        for line, sample, band in itertools.product(range(4), range(3), range(len(used_bands))):
+            values = cube[line * 2:line * 2 + 2, sample * 2:sample * 2 + 2, used_bands[band]]
+            values = values[values != -9999]
+            result[line, sample, band] = np.rint(values.mean()) if values.size > 0 else -9999
+        return result
+
+    def test_bin(self):
+        used_bands = [[0], [2, 3], [4, 5]]
+        for interleave, out_interleave, memory_limit in itertools.product([OpenSpectraHeader.BIL_INTERLEAVE,
+                OpenSpectraHeader.BSQ_INTERLEAVE, OpenSpectraHeader.BIP_INTERLEAVE],
+                [None, OpenSpectraHeader.BSQ_INTERLEAVE], [None, 200]):
+            file_name, cube = self.__create_source(interleave)
+            os_file = OpenSpectraFileFactory.create_open_spectra_file(file_name)
+            progress = list()
+            binner = CubeBinner(os_file, 2, 2, out_interleave, memory_limit,
+                lambda lines, total: progress.append((lines, total)))
+            binned_name = os.path.join(self.__temp_dir.name, "binned")
+            binner.bin(binned_name)
+            self.assertEqual((4, 4), progress[-1])
+
+            binned = OpenSpectraFileFactory.create_open_spectra_file(binned_name)
+            header = binned.header()
+            self.assertEqual(out_interleave or interleave, header.interleave())
+            self.assertEqual((4, 3, 3), (header.lines(), header.samples(), header.band_count()))
+            self.assertEqual([False, True, False], header.bad_band_list())
+
+            source_header = os_file.header()
+            expected_wavelengths = [source_header.wavelengths()[bands].mean() for bands in used_bands]
+            self.assertTrue(np.allclose(expected_wavelengths, header.wavelengths()))
+            self.assertEqual(source_header.band_names()[0] + " - " + source_header.band_names()[1],
+                header.band_names()[0])
+
+            self.assertEqual(40.0, header.map_info().x_pixel_size())
+            self.assertEqual(source_header.map_info().calculate_coordinates(0, 0),
+                header.map_info().calculate_coordinates(0, 0))
+            self.assertEqual(source_header.map_info().calculate_coordinates(2, 4),
+                header.map_info().calculate_coordinates(1, 2))
+
+            expected = CubeBinnerTest.__expected(cube, used_bands)
+            for band in range(3):
+                self.assertTrue(np.array_equal(expected[:, :, band], binned.raw_image(band)),
+                    "{0} {1} {2}".format(interleave, memory_limit, band))
+
+    def test_spatial_only(self):
+        file_name, cube = self.__create_source(OpenSpectraHeader.BIL_INTERLEAVE)
+        os_file = OpenSpectraFileFactory.create_open_spectra_file(file_name)
+        binned_name = os.path.join(self.__temp_dir.name, "binned")
+        header = CubeBinner(os_file, 4).bin(binned_name)
+        self.assertEqual((2, 2, 6), (header.lines(), header.samples(), header.band_count()))
+        self.assertEqual(os_file.header().band_names(), header.band_names())
+
+        binned = OpenSpectraFileFactory.create_open_spectra_file(binned_name)
+        # the last line and sample bins only cover what's left of the source
+        self.assertEqual(int(np.rint(cube[4:7, 4:5, 5].mean())), binned.raw_image(5)[1, 1])
+
+        with self.assertRaises(ValueError):
+            CubeBinner(os_file, 0)
+
+
+class InterleaveTranscoderTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.__temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.__temp_dir.cleanup()
+
+    def test_transcode(self):
+        interleaves = [OpenSpectraHeader.BIL_INTERLEAVE, OpenSpectraHeader.BSQ_INTERLEAVE,
+                       OpenSpectraHeader.BIP_INTERLEAVE]
+
+        # no limit, blocks of lines, blocks of bands within a line
+        for memory_limit in [2**30, 1000, 30]:
+            for source_interleave, interleave in itertools.product(interleaves, interleaves):
+                file_name, cube = create_test_cube(self.__temp_dir.name, source_interleave, header_offset=64,
+                    name=source_interleave, byte_order=OpenSpectraHeader.BIG_ENDIAN)
+                source_file = OpenSpectraFileFactory.create_open_spectra_file(file_name)
+
+                progress = list()
+                out_file_name = os.path.join(self.__temp_dir.name, "out_" + interleave)
+                transcoder = InterleaveTranscoder(source_file, interleave, memory_limit,
+                    lambda written, total: progress.append((written, total)))
+                transcoder.transcode(out_file_name)
+                self.assertEqual((cube.nbytes, cube.nbytes), progress[-1])
+
+                out_file = OpenSpectraFileFactory.create_open_spectra_file(out_file_name)
+                header = out_file.header()
+                self.assertEqual(interleave, header.interleave())
+                self.assertEqual(0, header.header_offset())
+                self.assertEqual(OpenSpectraHeader.NATIVE_BYTE_ORDER, header.byte_order())
+                self.assertEqual(source_file.header().band_names(), header.band_names())
+                self.assertEqual(cube.nbytes, os.path.getsize(out_file_name))
+
+                for band in range(cube.shape[2]):
+                    self.assertTrue(np.array_equal(cube[:, :, band], out_file.raw_image(band)))
+
+    def test_bad_interleave(self):
+        file_name, cube = create_test_cube(self.__temp_dir.name)
+        with self.assertRaises(ValueError):
+            InterleaveTranscoder(OpenSpectraFileFactory.create_open_spectra_file(file_name), "abc")
+
+
+class ChunkedContainerWriterTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.__temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.__temp_dir.cleanup()
+
+    def test_round_trip(self):
+        interleaves = [OpenSpectraHeader.BIL_INTERLEAVE, OpenSpectraHeader.BSQ_INTERLEAVE,
+                       OpenSpectraHeader.BIP_INTERLEAVE]
+
+        for interleave, codec in itertools.product(interleaves, ChunkedContainer.CODECS.keys()):
+            file_name, cube = create_test_cube(self.__temp_dir.name, interleave, header_offset=32,
+                name=interleave, byte_order=OpenSpectraHeader.BIG_ENDIAN)
+            source_file = OpenSpectraFileFactory.create_open_spectra_file(file_name)
+
+            # chunks that don't divide the data evenly
+            progress = list()
+            out_file_name = os.path.join(self.__temp_dir.name, "chunked_" + interleave)
+            ChunkedContainerWriter(source_file, (5, 4, 4), codec,
+                progress_callback=lambda written, total: progress.append((written, total))).write(out_file_name)
+            self.assertEqual((3 * 3 * 2, 3 * 3 * 2), progress[-1])
+            self.assertTrue(ChunkedContainer.is_chunked(Path(out_file_name)))
+
+            out_file = OpenSpectraFileFactory.create_open_spectra_file(out_file_name)
+            self.assertEqual(interleave, out_file.header().interleave())
+            self.assertEqual(ChunkedContainer.FILE_TYPE, out_file.header().file_type())
+            for band in range(cube.shape[2]):
+                self.assertTrue(np.array_equal(cube[:, :, band], out_file.raw_image(band)))
+
+            self.assertTrue(np.array_equal(source_file.bands(7, 3), out_file.bands(7, 3)))
+            lines, samples = np.array([0, 11, 4]), np.array([9, 0, 5])
+            self.assertTrue(np.array_equal(source_file.bands(lines, samples), out_file.bands(lines, samples)))
+            self.assertTrue(np.array_equal(source_file.cube((2, 9), (1, 8), (1, 5)),
+                out_file.cube((2, 9), (1, 8), (1, 5))))
+
+    def test_reads_touched_chunks(self):
+        file_name, cube = create_test_cube(self.__temp_dir.name, OpenSpectraHeader.BSQ_INTERLEAVE)
+        out_file_name = os.path.join(self.__temp_dir.name, "chunked")
+        ChunkedContainerWriter(OpenSpectraFileFactory.create_open_spectra_file(file_name), (5, 4, 2)).write(out_file_name)
+
+        header = OpenSpectraHeader(out_file_name + ".hdr")
+        header.load()
+        model = ChunkedModel(Path(out_file_name), header)
+        model.load(BQSShape(header.lines(), header.samples(), header.band_count()))
+        out_file = OpenSpectraFile(header, BQSFileDelegate(header, model), model)
+        model_file = model.file()
+
+        # band 0 is covered by the first band of chunks, 3 chunks of lines by 3 of samples
+        self.assertTrue(np.array_equal(cube[:, :, 0], out_file.raw_image(0)))
+        self.assertEqual(9, model_file.cache().misses())
+        self.assertTrue(np.array_equal(cube[:, :, 1], out_file.raw_image(1)))
+        self.assertEqual(9, model_file.cache().misses())
+
+    def test_bad_arguments(self):
+        file_name, cube = create_test_cube(self.__temp_dir.name)
+        source_file = OpenSpectraFileFactory.create_open_spectra_file(file_name)
+        with self.assertRaises(ValueError):
+            ChunkedContainerWriter(source_file, codec="abc")
+
+        with self.assertRaises(ValueError):
+            ChunkedContainerWriter(source_file, (0, 4, 4))
+
+
+class ShadowFileBuilderTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.__temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.__temp_dir.cleanup()
+
+    def __check_file(self, os_file, cube:np.ndarray):
+        for band in range(cube.shape[2]):
+            self.assertTrue(np.array_equal(cube[:, :, band], os_file.raw_image(band)))
+
+        self.assertTrue(np.array_equal(cube[4, 7, :].reshape(1, cube.shape[2]), os_file.bands(4, 7)))
+
+    def test_build(self):
+        for interleave in [OpenSpectraHeader.BIL_INTERLEAVE, OpenSpectraHeader.BSQ_INTERLEAVE,
+                OpenSpectraHeader.BIP_INTERLEAVE]:
+            file_name, cube = create_test_cube(self.__temp_dir.name, interleave, name=interleave)
+            source_file = OpenSpectraFileFactory.create_open_spectra_file(file_name)
+            self.assertIsNone(source_file.shadow())
+
+            self.assertTrue(ShadowFileBuilder(file_name).build())
+            self.assertTrue(ShadowFile.is_valid(file_name, source_file.header()))
+            self.assertFalse(os.path.exists(ShadowFile.progress_file_name(file_name, interleave)))
+
+            os_file = OpenSpectraFileFactory.create_open_spectra_file(file_name)
+            shadow = os_file.shadow()
+            self.assertIsNotNone(shadow)
+            self.assertEqual(ShadowFile.interleave(interleave), shadow.header().interleave())
+            self.__check_file(os_file, cube)
+
+            # results match reading without the shadow
+            lines = np.array([1, 6, 11])
+            samples = np.array([0, 9, 3])
+            self.assertTrue(np.array_equal(source_file.bands(lines, samples), os_file.bands(lines, samples)))
+            self.assertTrue(np.array_equal(source_file.bands((2, 3), (4, 5)), os_file.bands((2, 3), (4, 5))))
+
+            # touching the source makes the shadow stale
+            stat = os.stat(file_name)
+            os.utime(file_name, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+            self.assertFalse(ShadowFile.is_valid(file_name, source_file.header()))
+            self.assertIsNone(OpenSpectraFileFactory.create_open_spectra_file(file_name).shadow())
+
+    def test_resume(self):
+        file_name, cube = create_test_cube(self.__temp_dir.name, OpenSpectraHeader.BSQ_INTERLEAVE)
+        line_bytes = cube.nbytes // cube.shape[0]
+        progress = list()
+
+        def cancel_after_first(written:int, total:int):
+            progress.append(written)
+            builder.cancel()
+
+        # blocks of 3 lines
+        builder = ShadowFileBuilder(file_name, memory_limit=line_bytes * 6, progress_callback=cancel_after_first)
+        self.assertFalse(builder.build())
+        self.assertEqual([3 * line_bytes], progress)
+        self.assertTrue(os.path.exists(ShadowFile.progress_file_name(file_name, OpenSpectraHeader.BSQ_INTERLEAVE)))
+        self.assertIsNone(OpenSpectraFileFactory.create_open_spectra_file(file_name).shadow())
+
+        progress.clear()
+        builder = ShadowFileBuilder(file_name, memory_limit=line_bytes * 6,
+            progress_callback=lambda written, total: progress.append(written))
+        self.assertTrue(builder.build())
+        self.assertEqual([6 * line_bytes, 9 * line_bytes, 12 * line_bytes], progress)
+        self.__check_file(OpenSpectraFileFactory.create_open_spectra_file(file_name), cube)
+
+    def test_background(self):
+        file_name, cube = create_test_cube(self.__temp_dir.name, OpenSpectraHeader.BIP_INTERLEAVE)
+        os_file = OpenSpectraFileFactory.create_open_spectra_file(file_name)
+
+        builder = ShadowFileBuilder(file_name, os_file)
+        builder.start()
+        self.assertTrue(builder.wait(30))
+        self.assertIsNotNone(os_file.shadow())
+        self.__check_file(os_file, cube)
+
+
+class FileCatalogTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.__temp_dir = tempfile.TemporaryDirectory()
+        self.__data_dir = os.path.join(self.__temp_dir.name, "data")
+        os.makedirs(os.path.join(self.__data_dir, "nested"))
+        self.__catalog = FileCatalog(os.path.join(self.__temp_dir.name, "catalog.sqlite"))
+
+    def tearDown(self) -> None:
+        self.__catalog.close()
+        self.__temp_dir.cleanup()
+
+    def test_scan_and_query(self):
+        small_name, _ = create_test_cube(self.__data_dir, name="small", bands=3)
+        large_name, _ = create_test_cube(os.path.join(self.__data_dir, "nested"),
+            OpenSpectraHeader.BIP_INTERLEAVE, lines=40, samples=30, bands=6, name="large")
+
+        # a shadow file and a header without data aren't cataloged
+        ShadowFileBuilder(large_name).build()
+        with open(os.path.join(self.__data_dir, "orphan.hdr"), "wt") as header_file:
+            header_file.write("ENVI\n")
+
+        progress = list()
+        self.assertEqual(2, self.__catalog.scan(self.__data_dir,
+            lambda count, total: progress.append((count, total))))
+        self.assertEqual((3, 3), progress[-1])
+        self.assertEqual([large_name, small_name], [entry.file_name() for entry in self.__catalog.query()])
+
+        large_header = OpenSpectraHeader(large_name + ".hdr")
+        large_header.load()
+        entry = self.__catalog.entry(large_name)
+        self.assertEqual((40, 30, 6), (entry.lines(), entry.samples(), entry.band_count()))
+        self.assertEqual(OpenSpectraHeader.BIP_INTERLEAVE, entry.interleave())
+        self.assertEqual(np.dtype(np.int16), entry.data_type())
+        self.assertEqual(40 * 30 * 6 * 2, entry.data_size())
+        self.assertEqual((large_header.wavelengths().min(), large_header.wavelengths().max()), entry.wavelength_range())
+        self.assertEqual((50000.0, 4000000.0 - 40 * 20, 50000.0 + 30 * 20, 4000000.0), entry.bounds())
+        self.assertEqual([(name, float(wavelength), False) for name, wavelength in large_header.band_labels()],
+            self.__catalog.band_labels(large_name))
+
+        small_range = self.__catalog.entry(small_name).wavelength_range()
+        self.assertEqual([large_name], [entry.file_name() for entry in
+            self.__catalog.query(wavelengths=(small_range[1], entry.wavelength_range()[1]))])
+        self.assertEqual(2, len(self.__catalog.query(wavelengths=small_range)))
+        self.assertEqual([large_name], [entry.file_name() for entry in
+            self.__catalog.query(bounds=(50300.0, 3999300.0, 50400.0, 3999400.0))])
+        self.assertEqual([small_name], [entry.file_name() for entry in self.__catalog.query(max_pixels=200)])
+        self.assertEqual([], self.__catalog.query(min_pixels=200, bounds=(0.0, 0.0, 10.0, 10.0)))
+
+        # only changed files are parsed again and removed files are dropped
+        self.assertEqual(0, self.__catalog.scan(self.__data_dir))
+        create_test_cube(self.__data_dir, name="small", bands=4)
+        os.remove(large_name)
+        self.assertEqual(1, self.__catalog.scan(self.__data_dir))
+        self.assertEqual([small_name], [entry.file_name() for entry in self.__catalog.query()])
+        self.assertEqual(4, self.__catalog.entry(small_name).band_count())
+        self.assertEqual(4, len(self.__catalog.band_labels(small_name)))
+        self.assertIsNone(self.__catalog.entry(large_name))
+
+    def test_malformed_header(self):
+        good_name, _ = create_test_cube(self.__data_dir, name="good")
+        nested_name, _ = create_test_cube(os.path.join(self.__data_dir, "nested"), name="nested")
+        bad_name, _ = create_test_cube(self.__data_dir, name="bad")
+        with open(bad_name + ".hdr", "rt") as header_file:
+            lines = [line for line in header_file if not line.startswith("byte order")]
+        with open(bad_name + ".hdr", "wt") as header_file:
+            header_file.writelines(lines)
+
+        # the bad file is skipped and the others are still cataloged
+        self.assertEqual(2, self.__catalog.scan(self.__data_dir))
+        self.assertEqual([good_name, nested_name], [entry.file_name() for entry in self.__catalog.query()])
+        self.assertIsNone(self.__catalog.entry(bad_name))
+
+
+class BandStatisticsBuilderTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.__temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.__temp_dir.cleanup()
+
+    def test_build(self):
+        for interleave in [OpenSpectraHeader.BIL_INTERLEAVE, OpenSpectraHeader.BSQ_INTERLEAVE,
+                           OpenSpectraHeader.BIP_INTERLEAVE]:
+            file_name, cube = create_test_cube(self.__temp_dir.name, interleave, lines=15, samples=9, bands=5,
+                name=interleave, byte_order=OpenSpectraHeader.BIG_ENDIAN)
+            values = cube.reshape(-1, 5).astype(np.float64)
+
+            # small blocks and few bins so the histogram range has to grow
+            progress = list()
+            statistics = BandStatisticsBuilder(file_name, bins=8, memory_limit=100,
+                progress_callback=lambda read, total: progress.append((read, total))).build()
+            self.assertEqual((cube.size, cube.size), progress[-1])
+            self.assertTrue(len(progress) > 1)
+
+            self.assertTrue(np.array_equal(values.min(0), statistics.min()))
+            self.assertTrue(np.array_equal(values.max(0), statistics.max()))
+            self.assertTrue(np.allclose(values.mean(0), statistics.mean()))
+            self.assertTrue(np.allclose(values.std(0), statistics.std()))
+            self.assertTrue(np.array_equal(np.zeros(5), statistics.nan_counts()))
+
+            for band in range(5):
+                summary = statistics.band(band)
+                counts, edges = summary.histogram()
+                self.assertEqual(8, counts.size)
+                self.assertTrue(np.array_equal(np.histogram(values[:, band], edges)[0], counts))
+                self.assertTrue(abs(np.percentile(values[:, band], 50) - summary.percentile(50)) <= edges[1] - edges[0])
+
+            # the factory loads it and band descriptors carry each band's summary
+            os_file = OpenSpectraFileFactory.create_open_spectra_file(file_name)
+            self.assertTrue(np.array_equal(values.max(0), os_file.statistics().max()))
+            self.assertEqual(values[:, 2].max(), OpenSpectraBandTools(os_file).band_descriptor(2).summary().max())
+
+            # and ignores it once the data changes
+            os.utime(file_name, ns=(os.stat(file_name).st_atime_ns, os.stat(file_name).st_mtime_ns + 10 ** 9))
+            self.assertIsNone(OpenSpectraFileFactory.create_open_spectra_file(file_name).statistics())
+
+    def test_invalid_values(self):
+        file_name, cube = create_test_cube(self.__temp_dir.name, OpenSpectraHeader.BIL_INTERLEAVE,
+            lines=6, samples=4, bands=3)
+        cube = cube.astype(np.float32) / 10
+        cube[0, 0, 0] = np.nan
+        cube[1, 1, 0] = np.inf
+        cube[2, 2, 1] = -1
+        cube[:, :, 2] = -1
+
+        header = MutableOpenSpectraHeader(file_name + ".hdr")
+        header.load()
+        header.set_data_type(np.float32)
+        header.save(file_name)
+        with open(file_name + ".hdr", "at") as header_file:
+            header_file.write("data ignore value = -1\n")
+        cube_to_interleave(cube, OpenSpectraHeader.BIL_INTERLEAVE).tofile(file_name)
+
+        statistics = BandStatisticsBuilder(file_name, bins=16).build()
+        self.assertTrue(np.array_equal([2, 0, 0], statistics.nan_counts()))
+        self.assertTrue(np.array_equal([0, 1, 24], statistics.ignore_counts()))
+        self.assertTrue(np.array_equal([22, 23, 0], statistics.valid_counts()))
+
+        band_zero = cube[:, :, 0][np.isfinite(cube[:, :, 0])]
+        self.assertAlmostEqual(band_zero.min(), statistics.min()[0], places=5)
+        self.assertAlmostEqual(band_zero.max(), statistics.max()[0], places=5)
+        self.assertAlmostEqual(float(np.mean(band_zero, dtype=np.float64)), statistics.mean()[0])
+        self.assertTrue(np.isnan(statistics.min()[2]))
+        self.assertTrue(np.isnan(statistics.band(2).percentile(50)))
+
+
+class OverviewBuilderTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.__temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.__temp_dir.cleanup()
+
+    def test_build(self):
+        for interleave in [OpenSpectraHeader.BIL_INTERLEAVE, OpenSpectraHeader.BSQ_INTERLEAVE,
+                           OpenSpectraHeader.BIP_INTERLEAVE]:
+            file_name, cube = create_test_cube(self.__temp_dir.name, interleave, lines=21, samples=13, bands=3,
+                name=interleave, byte_order=OpenSpectraHeader.BIG_ENDIAN)
+
+            # small blocks so levels are built from several reads
+            progress = list()
+            overviews = OverviewBuilder(file_name, min_size=4, memory_limit=1000,
+                progress_callback=lambda read, total: progress.append((read, total))).build()
+            self.assertEqual([2, 4, 8], overviews.factors())
+            self.assertEqual((21 + 11 + 6, 21 + 11 + 6), progress[-1])
+            self.assertTrue(len(progress) > 3)
+
+            # each pixel is the average of the pixels it covers, odd edges included
+            padded = np.pad(cube.astype(np.float64), ((0, 1), (0, 1), (0, 0)), constant_values=np.nan)
+            expected = np.rint(np.nanmean(padded.reshape(11, 2, 7, 2, 3), (1, 3)))
+            for band in range(3):
+                self.assertTrue(np.array_equal(expected[:, :, band], overviews.band(band, 2)))
+            self.assertEqual((3, 3, 2), overviews.level(2).shape)
+
+            # the factory loads it and overview images use the coarsest level that fills the size
+            os_file = OpenSpectraFileFactory.create_open_spectra_file(file_name)
+            self.assertEqual([2, 4, 8], os_file.overviews().factors())
+            image, factor = os_file.overview_image(1, 3, 5)
+            self.assertEqual(4, factor)
+            self.assertTrue(np.array_equal(overviews.band(1, 4), image))
+            self.assertEqual(1, os_file.overview_image(1, 13, 21)[1])
+
+            # and ignores it once the data changes
+            os.utime(file_name, ns=(os.stat(file_name).st_atime_ns, os.stat(file_name).st_mtime_ns + 10 ** 9))
+            os_file = OpenSpectraFileFactory.create_open_spectra_file(file_name)
+            self.assertIsNone(os_file.overviews())
+
+            # without overviews bands are decimated as they're read
+            image, factor = os_file.overview_image(1, 3, 5)
+            self.assertEqual(4, factor)
+            self.assertTrue(np.array_equal(cube[::4, ::4, 1], image))
+
+    def test_decimate_and_ignore(self):
+        file_name, cube = create_test_cube(self.__temp_dir.name, OpenSpectraHeader.BSQ_INTERLEAVE,
+            lines=8, samples=6, bands=2)
+        os_file = OpenSpectraFileFactory.create_open_spectra_file(file_name)
+
+        overviews = OverviewBuilder(file_name, os_file, OverviewFile.DECIMATE, min_size=4).build()
+        self.assertIs(overviews, os_file.overviews())
+        self.assertEqual([2], overviews.factors())
+        self.assertTrue(np.array_equal(cube[::2, ::2, 0], overviews.band(0, 2)))
+
+        cube[0:2, 0:2, 0] = -1
+        cube[2, 2, 0] = -1
+        cube_to_interleave(cube, OpenSpectraHeader.BSQ_INTERLEAVE).tofile(file_name)
+        with open(file_name + ".hdr", "at") as header_file:
+            header_file.write("data ignore value = -1\n")
+
+        overviews = OverviewBuilder(file_name, min_size=4).build()
+        band = overviews.band(0, 2)
+        self.assertEqual(-1, band[0, 0])
+        self.assertEqual(np.rint(cube[2:4, 2:4, 0].reshape(-1)[1:].mean()), band[1, 1])
+
+
+    def test_on_demand(self):
+        file_name, cube = create_test_cube(self.__temp_dir.name, OpenSpectraHeader.BSQ_INTERLEAVE,
+            lines=40, samples=30, bands=2)
+        os_file = OpenSpectraFileFactory.create_open_spectra_file(file_name)
+        band_tools = OpenSpectraBandTools(os_file)
+        image_tools = OpenSpectraImageTools(os_file, (8, 8))
+
+        # the first large image is shown decimated while the overviews are built in the background
+        image = image_tools.greyscale_image(0, band_tools.band_descriptor(0))
+        self.assertEqual((10, 8), image.overview().image_shape())
+        self.assertEqual((40, 30), image.image_shape())
+        self.assertTrue(image_tools.overview_builder().wait(10))
+        self.assertIsNotNone(os_file.overviews())
+        self.assertTrue(os.path.isfile(OverviewFile.file_name(file_name)))
+
+        # later images use them
+        builder = image_tools.overview_builder()
+        image = image_tools.greyscale_image(1, band_tools.band_descriptor(1))
+        self.assertIs(builder, image_tools.overview_builder())
+        self.assertTrue(np.array_equal(os_file.overviews().band(1, 4), image.overview().raw_data()))
+
+
+class BandPrefetcherTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.__temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.__temp_dir.cleanup()
+
+    def test_prefetch(self):
+        for interleave in [OpenSpectraHeader.BIL_INTERLEAVE, OpenSpectraHeader.BSQ_INTERLEAVE,
+                           OpenSpectraHeader.BIP_INTERLEAVE]:
+            file_name, cube = create_test_cube(self.__temp_dir.name, interleave, bands=8, name=interleave)
+            os_file = OpenSpectraFileFactory.create_open_spectra_file(file_name)
+            prefetcher = BandPrefetcher(os_file, radius=2)
+
+            # nearest first, clipped to the bands in the file
+            self.assertEqual([3, 1, 4, 0], prefetcher.bands_around(2))
+            self.assertEqual([1, 2], prefetcher.bands_around(0))
+            self.assertEqual([6, 5], prefetcher.bands_around(7))
+
+            generation = prefetcher.start(5)
+            self.assertTrue(prefetcher.is_current(generation))
+            self.assertEqual([6, 4, 7, 3], prefetcher.run(5, generation))
+            misses = os_file.tile_cache().misses()
+            for band in [3, 4, 6, 7]:
+                self.assertTrue(np.array_equal(cube[:, :, band], os_file.raw_image(band)))
+            self.assertEqual(misses, os_file.tile_cache().misses())
+
+            # a later start makes the earlier one stale
+            stale = prefetcher.start(1)
+            prefetcher.start(2)
+            self.assertFalse(prefetcher.is_current(stale))
+            self.assertEqual([], prefetcher.run(1, stale))
+
+    def test_cache_limit(self):
+        file_name, cube = create_test_cube(self.__temp_dir.name, bands=8)
+        band_bytes = 12 * 10 * 2
+
+        # room for the band being looked at and three around it
+        os_file = OpenSpectraFileFactory.create_open_spectra_file(file_name, cache_size=band_bytes * 4)
+        self.assertEqual(3, os_file.prefetch_limit())
+        prefetcher = BandPrefetcher(os_file, radius=2)
+        self.assertEqual([3, 1, 4], prefetcher.bands_around(2))
+
+        os_file.raw_image(2)
+        prefetcher.run(2, prefetcher.start(2))
+        self.assertTrue(os_file.tile_cache().contains(2))
+
+        # without a cache nothing but the radius limits it
+        os_file = OpenSpectraFileFactory.create_open_spectra_file(file_name, cache_size=0)
+        self.assertEqual(8, os_file.prefetch_limit())
+        self.assertEqual([3, 1, 4, 0], BandPrefetcher(os_file, radius=2).bands_around(2))
+
+    def test_prefetch_images(self):
+        file_name, cube = create_test_cube(self.__temp_dir.name, OpenSpectraHeader.BSQ_INTERLEAVE, bands=8)
+        os_file = OpenSpectraFileFactory.create_open_spectra_file(file_name)
+        image_tools = OpenSpectraImageTools(os_file)
+        band_tools = OpenSpectraBandTools(os_file)
+        prefetcher = BandPrefetcher(os_file, image_tools, 1)
+
+        prefetcher.run(3, prefetcher.start(3))
+        self.assertEqual([2, 4], image_tools.prefetched_bands())
+
+        # the prefetched image is handed over once
+        image = image_tools.greyscale_image(4, band_tools.band_descriptor(4))
+        self.assertTrue(np.array_equal(cube[:, :, 4], image.raw_data()))
+        self.assertEqual([2], image_tools.prefetched_bands())
+
+        # images outside the new window are dropped when the selection jumps
+        prefetcher.start(6)
+        self.assertEqual([], image_tools.prefetched_bands())
+        prefetcher.run(1, prefetcher.start(1))
+        self.assertEqual([0, 2], image_tools.prefetched_bands())
+        prefetcher.cancel()
+        self.assertEqual([], image_tools.prefetched_bands())
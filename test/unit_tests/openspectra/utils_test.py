@@ -1,8 +1,11 @@
+import gc
 import os
 import unittest
 from pathlib import Path
 
-from openspectra.utils import OpenSpectraProperties
+import numpy as np
+
+from openspectra.utils import OpenSpectraProperties, TileCache, MemoryAccountant
 
 
 class OpenSpectraPropertiesTestCase(unittest.TestCase):
@@ -42,4 +45,144 @@ class OpenSpectraPropertiesTestCase(unittest.TestCase):
         self.assertEqual(True, OpenSpectraProperties.get_property("TestBool", False))
         self.assertEqual(23.341, OpenSpectraProperties.get_property("TestFloat"), 5.5)
         self.assertEqual(1234, OpenSpectraProperties.get_property("TestInt"), 1)
-        self.assertEqual("A test string", OpenSpectraProperties.get_property("TestStr"), "another string")
\ No newline at end of file
+        self.assertEqual("A test string", OpenSpectraProperties.get_property("TestStr"), "another string")
+
+
+class TileCacheTestCase(unittest.TestCase):
+
+    def test_eviction(self):
+        cache = TileCache(300)
+        cache.put("a", np.zeros(100, np.uint8))
+        cache.put("b", np.zeros(100, np.uint8))
+        cache.put("c", np.zeros(100, np.uint8))
+        self.assertEqual(300, cache.size())
+
+        # touch "a" so "b" is the least recently used
+        self.assertIsNotNone(cache.get("a"))
+        cache.put("d", np.zeros(100, np.uint8))
+        self.assertFalse(cache.contains("b"))
+        self.assertTrue(cache.contains("a"))
+        self.assertEqual(3, len(cache))
+        self.assertEqual(300, cache.size())
+
+        # too big to ever be held
+        cache.put("e", np.zeros(301, np.uint8))
+        self.assertFalse(cache.contains("e"))
+        self.assertEqual(300, cache.size())
+
+        cache.clear()
+        self.assertEqual(0, cache.size())
+        self.assertEqual(0, len(cache))
+
+    def test_counts(self):
+        cache = TileCache(1000)
+        loads = list()
+
+        def loader():
+            loads.append(1)
+            return np.ones(10)
+
+        cache.get_or_load(1, loader)
+        cache.get_or_load(1, loader)
+        cache.get_or_load(1, loader)
+        self.assertEqual(1, len(loads))
+        self.assertEqual(1, cache.misses())
+        self.assertEqual(2, cache.hits())
+
+        # contains doesn't count
+        cache.contains(2)
+        self.assertEqual(1, cache.misses())
+
+
+class MemoryAccountantTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.__accountant = MemoryAccountant()
+        self.__ceiling = self.__accountant.ceiling()
+
+        # release anything left releasable by other tests so only what's counted here can be released
+        gc.collect()
+        self.__accountant.set_ceiling(0)
+        self.__base = self.__accountant.total()
+
+    def tearDown(self) -> None:
+        self.__accountant.set_ceiling(self.__ceiling)
+
+    def test_release(self):
+        self.__accountant.set_ceiling(self.__base + 300)
+        released = list()
+        first = self.__accountant.register("one", "adjusted image", 100, lambda: released.append("first"))
+        second = self.__accountant.register("one", "adjusted image", 100, lambda: released.append("second"))
+        fixed = self.__accountant.register("two", "pixmap", 100)
+        self.assertEqual({"adjusted image": 200}, self.__accountant.usage()["one"])
+        self.assertEqual(self.__base + 300, self.__accountant.total())
+
+        # touch first so second is the least recently used
+        self.__accountant.touch(first)
+        self.__accountant.register("two", "tiles", 50, lambda: released.append("third"))
+        self.assertEqual(["second"], released)
+        self.assertFalse(self.__accountant.is_registered(second))
+        self.assertEqual(self.__base + 250, self.__accountant.total())
+
+        # buffers without a release function are never released
+        self.__accountant.resize(fixed, 400)
+        self.assertEqual(["second", "first", "third"], released)
+        self.assertEqual(self.__base + 400, self.__accountant.total())
+        self.assertTrue("two" in self.__accountant.report())
+
+        self.__accountant.unregister(fixed)
+        self.__accountant.unregister(fixed)
+        self.assertEqual(self.__base, self.__accountant.total())
+
+    def test_dispatcher(self):
+        dispatched = list()
+        released = list()
+        self.__accountant.set_dispatcher(dispatched.append)
+        try:
+            self.__accountant.register("one", "adjusted image", 100, lambda: released.append("owned"),
+                on_owner_thread=True)
+            self.__accountant.register("one", "tiles", 100, lambda: released.append("tiles"))
+            self.__accountant.set_ceiling(self.__base)
+
+            # only the release bound to its owner's thread is handed over
+            self.assertEqual(["tiles"], released)
+            self.assertEqual(1, len(dispatched))
+            dispatched[0]()
+            self.assertEqual(["tiles", "owned"], released)
+            self.assertEqual(self.__base, self.__accountant.total())
+        finally:
+            self.__accountant.set_dispatcher(None)
+
+    def test_holder(self):
+        class Holder:
+            pass
+
+        holder = Holder()
+        key = self.__accountant.register("one", "histogram", 100, holder=holder)
+        self.assertTrue(self.__accountant.is_registered(key))
+        del holder
+        gc.collect()
+        self.assertFalse(self.__accountant.is_registered(key))
+
+    def test_tile_caches(self):
+        self.__accountant.set_ceiling(self.__base + 250)
+        first = TileCache(1000, "first")
+        second = TileCache(1000, "second")
+        first.put("a", np.zeros(100, np.uint8))
+        second.put("a", np.zeros(100, np.uint8))
+        self.assertEqual({"tiles": 100}, self.__accountant.usage()["second"])
+
+        # the least recently used tile of either cache goes first
+        first.get("a")
+        second.put("b", np.zeros(100, np.uint8))
+        self.assertFalse(second.contains("a"))
+        self.assertTrue(first.contains("a"))
+        self.assertEqual(100, second.size())
+
+        # tiles the cache evicts itself aren't counted anymore
+        first.clear()
+        self.assertFalse("first" in self.__accountant.usage())
+        del second
+        gc.collect()
+        self.assertEqual(self.__base, self.__accountant.total())
+